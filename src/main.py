@@ -1,64 +1,319 @@
-from notion.client import NotionClient
-from safe.transaction import SafeTransactionHandler
-from safe.api import SafeAPI
+from notion.client import STATUS_EXECUTED, STATUS_FAILED, STATUS_INCOMPLETE, STATUS_PROPOSED, NotionClient
+from notion.writeback import NotionWriteback, writeback_enabled
+from orchestrator import SafeOrchestrator
+from safe.history import PayoutLedger, SafeHistorySync, month_range
+from safe.logs import TransferLogIndexer, confirm_batch
+from safe.plan import DEFAULT_PLAN_FILE, PlanFile, PlanWriter, load_signatures, sign_plan, signatures_path
+from safe.reconcile import reconcile, usdt_contract
+from safe.rpc import create_web3
+from safe.transaction import load_private_keys
+from utils.journal import RunJournal, snapshot_hash
 from dotenv import load_dotenv
 from utils.logger import logger
+from utils.metrics import metrics
+from utils.profiler import profile
+from decimal import Decimal
+from typing import Dict, List
+import argparse
 import os
 import sys
-import traceback
+
+# --profile时按这些函数归类内存分配，内层函数优先；与流水线阶段同名，和CPU采样的阶段一致
+PROFILE_STAGES = {
+    "fetch": NotionClient.iter_approved_pages,
+    "ingest": SafeOrchestrator._ingest,
+    "resolve": SafeOrchestrator._resolve,
+    "validate": SafeOrchestrator._validate,
+    "encode": SafeOrchestrator._encode,
+    "plan": SafeOrchestrator._plan,
+    "build": SafeOrchestrator._build,
+    "estimate": SafeOrchestrator._estimate,
+    "sign": SafeOrchestrator._sign,
+    "propose": SafeOrchestrator._propose,
+    "sign_plan": sign_plan,
+}
+
+
+def fetch_transactions(journal: RunJournal):
+    """
+    逐页拉取Notion中已审核的交易，每页落盘到运行日志
+    
+    续跑时先重放已记录的页，再从最后记录的游标继续拉取；
+    每页记录到该页为止的快照哈希
+    """
+    page = 0
+    cursor = None
+    digest = ""
+    while True:
+        record = journal.get("fetch", f"page-{page}")
+        if record is None:
+            break
+        if page == 0:
+            logger.info("复用运行日志中的Notion快照")
+        yield from record["rows"]
+        cursor, digest = record["next_cursor"], record["snapshot_hash"]
+        page += 1
+        if cursor is None:
+            logger.info(f"Notion快照: {digest[:16]}")
+            return
+    
+    notion_client = NotionClient()
+    for rows, cursor in notion_client.iter_approved_pages(cursor):
+        digest = snapshot_hash([digest, rows])
+        journal.record("fetch", f"page-{page}", {
+            "rows": rows,
+            "next_cursor": cursor,
+            "snapshot_hash": digest,
+        })
+        page += 1
+        yield from rows
+    logger.info(f"Notion快照: {digest[:16]}")
+
+
+def report_results(results: List[Dict]):
+    """多组时汇总各组结果，有组失败时抛出异常"""
+    failed = [result for result in results if result["error"]]
+    if len(results) > 1:
+        logger.section("处理结果")
+        for result in results:
+            status = f"失败: {result['error']}" if result["error"] else f"完成 {len(result['tx_hashes'])} 笔Safe交易"
+            logger.info(f"{result['network']} {result['safe']} ({result['count']} 行): {status}")
+    if failed:
+        raise Exception(f"{len(failed)} 个Safe处理失败")
+
+
+def plan_command(plan_path: str):
+    """只构建Safe交易并写入计划文件，不需要私钥，不签名也不提议"""
+    logger.section("从Notion获取交易并生成计划")
+    notion_client = NotionClient()
+    rows = (row for page, _ in notion_client.iter_approved_pages() for row in page)
+    
+    writer = PlanWriter(plan_path)
+    try:
+        results = SafeOrchestrator().plan(rows, writer)
+        report_results(results)
+    except Exception:
+        writer.abort()
+        raise
+    end = writer.close()
+    logger.info(f"计划已写入 {plan_path}: {end['rows']} 行, {end['safe_txs']} 笔Safe交易, 快照 {end['snapshot_hash'][:16]}")
+
+
+def sign_command(plan_path: str):
+    """使用本地私钥离线签名计划文件，不访问网络"""
+    logger.section("签名计划")
+    count = sign_plan(plan_path, load_private_keys())
+    logger.info(f"新增 {count} 个签名: {signatures_path(plan_path)}")
+
+
+def propose_command(plan_path: str):
+    """把计划文件中已签名的Safe交易提议到交易服务"""
+    logger.section("提议计划")
+    plan = PlanFile(plan_path)
+    plan.verify()
+    results = SafeOrchestrator().propose_plan(plan, load_signatures(plan_path))
+    write_back_plan(plan, {tx_hash: {"status": STATUS_PROPOSED}
+                           for result in results for tx_hash in result["tx_hashes"]})
+    report_results(results)
+    logger.info("请在Safe钱包中查看和确认交易")
+
+
+def write_back_plan(plan: PlanFile, updates: Dict[str, Dict]):
+    """
+    把计划中各Safe交易的状态写回其包含的Notion页面（NOTION_WRITEBACK为true时）
+
+    Args:
+        updates: {safeTxHash: 写回的字段（status、tx_hash）}
+    """
+    if not updates or not writeback_enabled():
+        return
+    nonces = {record["tx"]["safe_tx_hash"]: record["tx"]["nonce"] for record in plan.safe_txs()}
+    with NotionWriteback() as writeback:
+        for row in plan.rows():
+            fields = updates.get(row.get("safe_tx_hash"))
+            if fields:
+                writeback.submit(row.get("page_id"), safe_tx_hash=row["safe_tx_hash"],
+                                 nonce=nonces.get(row["safe_tx_hash"]), **fields)
+
+
+def sync_command(safe_address: str = None, network: str = None):
+    """把Safe的转账和已执行交易增量同步到本地账本"""
+    logger.section("同步Safe历史")
+    with PayoutLedger() as ledger:
+        result = SafeHistorySync(network, safe_address, ledger).sync()
+    logger.info(f"账本: {ledger.path} (区块水位 {result['watermark']})")
+
+
+def history_command(to: str = None, safe_address: str = None, month: str = None, since: str = None,
+                    until: str = None, token: str = None):
+    """离线查询本地账本中的转出记录"""
+    if month:
+        since, until = month_range(month)
+    with PayoutLedger() as ledger:
+        rows = ledger.payments(to=to, safe=safe_address, token=token, since=since, until=until)
+    for row in rows:
+        amount = Decimal(int(row["value"] or 0)).scaleb(-(row["decimals"] or 0))
+        logger.info(f"{row['execution_date']} {row['safe']} -> {row['recipient']} "
+                    f"{amount:,f} {row['symbol'] or ''} nonce={row['nonce']} {row['tx_hash']}")
+    logger.info(f"共 {len(rows)} 笔转账")
+    if to and rows:
+        total = Decimal(sum(int(row["value"] or 0) for row in rows)).scaleb(-(rows[0]["decimals"] or 0))
+        logger.info(f"合计转给 {to}: {total:,f} {rows[0]['symbol'] or ''}")
+
+
+def reconcile_command(safe_address: str = None, network: str = None, since: str = None, token: str = None,
+                      output: str = None, sync: bool = True):
+    """把Notion中已审核的行与账本中的转出记录对账，结果逐行写入报告"""
+    logger.section("对账")
+    network = network or os.getenv("NETWORK", "sepolia")
+    with PayoutLedger() as ledger:
+        if sync:
+            SafeHistorySync(network, safe_address, ledger).sync()
+        transfers = ledger.iter_payments(safe=safe_address, network=network, since=since,
+                                         token=token or usdt_contract(network))
+        result = reconcile(NotionClient().iter_payout_rows(since=since), transfers, output=output)
+    for category in ("missing", "duplicated", "over_paid", "under_paid", "unexpected", "unresolved"):
+        for record in result["samples"].get(category, []):
+            logger.warning(f"{category}: {record.get('page_id') or ''} {record.get('address') or ''} "
+                           f"{record.get('amount') or ''} {record.get('tx_hash') or ''}".rstrip())
+    logger.info(f"对账报告: {result['output']}")
+
+
+def confirm_command(plan_path: str):
+    """从链上日志索引Safe转出的转账，核对计划中每笔Safe交易的转账是否全部到账"""
+    logger.section("确认到账")
+    plan = PlanFile(plan_path)
+    plan.verify()
+    groups: Dict = {}
+    for record in plan.safe_txs():
+        groups.setdefault((record["network"], record["safe"]), []).append(record)
+
+    counts = {"pending": 0, "confirmed": 0, "incomplete": 0, "failed": 0}
+    statuses = {"confirmed": STATUS_EXECUTED, "incomplete": STATUS_INCOMPLETE, "failed": STATUS_FAILED}
+    updates = {}
+    with PayoutLedger() as ledger:
+        for (network, safe_address), records in groups.items():
+            rpc_url = os.getenv(f"RPC_URL_{network.upper()}") or os.getenv("RPC_URL")
+            if not rpc_url:
+                raise ValueError(f"未配置网络 {network} 的RPC_URL")
+            w3 = create_web3(rpc_url)
+            for token in sorted({transfer["token"] for record in records for transfer in record["transfers"]}):
+                TransferLogIndexer(w3, network, safe_address, token, ledger).index()
+            for record in records:
+                safe_tx_hash = record["tx"]["safe_tx_hash"]
+                result = confirm_batch(ledger, network, safe_address, safe_tx_hash, record["transfers"])
+                counts[result["status"]] += 1
+                if result["status"] != "pending":
+                    updates[safe_tx_hash] = {"tx_hash": result["tx_hash"], "status": statuses[result["status"]]}
+                if result["status"] == "incomplete":
+                    logger.warning(f"{safe_tx_hash} 已执行 ({result['tx_hash']})，"
+                                   f"但有 {len(result['missing'])} 笔转账未到账: {result['missing']}")
+                elif result["status"] == "failed":
+                    logger.warning(f"{safe_tx_hash} 执行失败 (ExecutionFailure, {result['tx_hash']})，"
+                                   f"nonce {record['tx']['nonce']} 已使用，需要重新发起这些转账")
+                else:
+                    logger.info(f"{safe_tx_hash}: {result['status']} {result['tx_hash'] or ''}".rstrip())
+    logger.info(f"已确认 {counts['confirmed']} 笔，未执行 {counts['pending']} 笔，不完整 {counts['incomplete']} 笔，"
+                f"执行失败 {counts['failed']} 笔")
+    write_back_plan(plan, updates)
+
 
 def main():
     # 加载环境变量
     load_dotenv()
     
+    # 运行日志：进程中断后重新运行时从最后完成的阶段继续
+    journal = RunJournal.open()
+    logger.set_run_id(journal.run_id)
+    # 写回队列在后台把提议/执行结果写到Notion页面，同时写出上次中断时未写完的更新
+    writeback = NotionWriteback().start() if writeback_enabled() else None
+    
     try:
-        # 1. 从Notion获取已审核的交易
-        logger.section("从Notion获取交易")
-        notion_client = NotionClient()
-        transactions = notion_client.get_approved_transactions()
+        # 以流水线方式处理：拉取Notion下一页的同时解析、编码和提议已到达的行，
+        # 按 (网络, Safe) 分组，直接执行或签名并提议
+        logger.section("从Notion获取并处理交易")
+        orchestrator = SafeOrchestrator()
+        orchestrator.writeback = writeback
+        with metrics.span("run"):
+            results = orchestrator.run(fetch_transactions(journal), journal)
         
-        if not transactions:
+        if not results:
             logger.info("没有找到需要处理的交易")
+            journal.close("complete")
             return
-            
-        logger.info(f"找到 {len(transactions)} 笔待处理交易")
-        
-        # 2. 准备Safe交易处理器
-        safe_handler = SafeTransactionHandler()
-        
-        # 打印交易信息
-        logger.section("交易数据概览")
-        for i, tx in enumerate(transactions):
-            logger.transaction_info(tx['address'], tx['amount'])
-        
-        # 3. 准备批量转账数据
-        try:
-            batch_tx = safe_handler.prepare_batch_transfers(transactions)   
-        except Exception as e:
-            logger.error(f"准备批量转账数据失败: {str(e)}")
-            raise
         
-        # 4. 签名交易
-        try:
-            signature = safe_handler.sign_transaction(batch_tx)
-        except Exception as e:
-            logger.error(f"签名交易失败: {str(e)}")
-            raise
+        logger.info(f"共处理 {sum(result['count'] for result in results)} 笔交易")
         
-        # 5. 提议或执行交易
-        try:
-            # 使用新的方法提议交易
-            tx_hash = safe_handler.propose_transaction(batch_tx, signature)
-            logger.info(f"交易已提议，哈希: {tx_hash}")
-            logger.info("请在Safe钱包中查看和确认交易")
-        except Exception as e:
-            logger.error(f"提议交易失败: {str(e)}")
-            raise
+        report_results(results)
+        journal.close("complete")
         
     except Exception as e:
-        logger.error(f"发生错误: {str(e)}")
-        logger.error("详细错误信息:")
-        traceback.print_exc()
+        logger.error("发生错误: %s", e)
+        # 堆栈随日志记录输出，LOG_FORMAT=json时写在exception字段中
+        logger.error("详细错误信息:", exc_info=True)
+        # 还没有签名或提议时重新运行是安全的，放弃本次运行以便下次读取最新的Notion数据
+        if journal.has_irreversible():
+            logger.info(f"运行日志已保存，重新运行将从中断处继续: {journal.path}")
+        else:
+            journal.close("abandoned")
+    finally:
+        if writeback is not None:
+            writeback.close()
+        export_metrics()
+
+
+def export_metrics():
+    """写出运行报告（调用统计和各阶段耗时），导出失败不影响运行结果"""
+    try:
+        report_file = metrics.export()
+        if report_file:
+            logger.info(f"运行报告: {report_file}")
+    except OSError as e:
+        logger.warning(f"写出运行报告失败: {str(e)}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="从Notion批量创建Safe USDT转账")
+    parser.add_argument("command", nargs="?", default="run",
+                        choices=["run", "plan", "sign", "propose", "confirm", "sync", "history", "reconcile"],
+                        help="run: 拉取、签名并提议（默认）; plan: 只生成计划文件; sign/propose: 签名或提议计划文件; "
+                             "confirm: 从链上日志确认计划中的转账已到账; "
+                             "sync: 同步Safe历史到本地账本; history: 查询本地账本; "
+                             "reconcile: 对账Notion行与链上转账")
+    parser.add_argument("plan", nargs="?", default=os.getenv("PLAN_FILE", DEFAULT_PLAN_FILE), help="计划文件路径")
+    parser.add_argument("--safe", help="sync/history/reconcile: Safe地址，sync默认读取SAFE_ADDRESS")
+    parser.add_argument("--network", help="sync/reconcile: 网络，默认读取NETWORK")
+    parser.add_argument("--to", help="history: 收款地址")
+    parser.add_argument("--month", help="history: 月份，格式同Notion月份列，如 2025.2")
+    parser.add_argument("--since", help="history/reconcile: 起始日期（包含），如 2025-01-01")
+    parser.add_argument("--until", help="history: 结束日期（不包含）")
+    parser.add_argument("--token", help="history/reconcile: 代币合约地址，reconcile默认为该网络的USDT")
+    parser.add_argument("--output", help="reconcile: 报告文件，默认读取RECONCILE_OUTPUT（reconcile.jsonl）")
+    parser.add_argument("--no-sync", action="store_true", help="reconcile: 不先同步，直接使用本地账本")
+    parser.add_argument("--profile", action="store_true",
+                        help="采样CPU和tracemalloc分配，按阶段写出火焰图折叠栈和分配排行")
+    args = parser.parse_args()
+    
+    with profile(args.profile, PROFILE_STAGES):
+        if args.command == "run":
+            main()
+        else:
+            load_dotenv()
+            commands = {
+                "plan": lambda: plan_command(args.plan),
+                "sign": lambda: sign_command(args.plan),
+                "propose": lambda: propose_command(args.plan),
+                "confirm": lambda: confirm_command(args.plan),
+                "sync": lambda: sync_command(args.safe, args.network),
+                "history": lambda: history_command(args.to, args.safe, args.month, args.since, args.until, args.token),
+                "reconcile": lambda: reconcile_command(args.safe, args.network, args.since, args.token, args.output,
+                                                       not args.no_sync),
+            }
+            try:
+                with metrics.span(args.command):
+                    commands[args.command]()
+            except Exception as e:
+                logger.error("发生错误: %s", e, exc_info=True)
+                logger.flush()
+                sys.exit(1)
+            finally:
+                export_metrics() 
\ No newline at end of file
@@ -1,16 +1,52 @@
+import time
 from datetime import datetime
-from typing import List, Dict
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from notion_client import Client
+from notion_client import APIErrorCode, APIResponseError, Client
 from dotenv import load_dotenv
 import os
 
+from utils.logger import logger
+from utils.metrics import instrument_notion
+
 load_dotenv()
 
+# 写回Notion的支付状态（状态列为select）
+STATUS_PROPOSED = "已提议"
+STATUS_EXECUTED = "已执行"
+STATUS_INCOMPLETE = "到账不完整"
+STATUS_FAILED = "执行失败"
+
+
 class NotionClient:
     def __init__(self):
-        self.client = Client(auth=os.getenv("NOTION_API_KEY"))
+        # NOTION_BASE_URL可指向本地替身（testing/local_notion.py）
+        options = {"base_url": os.getenv("NOTION_BASE_URL")} if os.getenv("NOTION_BASE_URL") else {}
+        self.client = instrument_notion(Client(auth=os.getenv("NOTION_API_KEY"), **options))
         self.database_id = os.getenv("NOTION_DATABASE_ID")
+        # 多Safe/多网络路由使用的列，列不存在或为空时使用SAFE_ADDRESS/NETWORK
+        self.safe_property = os.getenv("NOTION_SAFE_PROPERTY", "Safe")
+        self.network_property = os.getenv("NOTION_NETWORK_PROPERTY", "网络")
+        # 写回支付状态的列：safeTxHash、nonce、状态和执行交易哈希
+        self.safe_tx_hash_property = os.getenv("NOTION_SAFE_TX_HASH_PROPERTY", "Safe交易哈希")
+        self.nonce_property = os.getenv("NOTION_NONCE_PROPERTY", "Nonce")
+        self.status_property = os.getenv("NOTION_STATUS_PROPERTY", "状态")
+        self.execution_tx_property = os.getenv("NOTION_EXECUTION_TX_PROPERTY", "执行交易哈希")
+        # 每页拉取的行数，Notion上限为100
+        self.page_size = int(os.getenv("NOTION_PAGE_SIZE", "100"))
+        # 被限流（429）时的最大重试次数
+        self.max_retries = int(os.getenv("NOTION_MAX_RETRIES", "5"))
+    
+    @staticmethod
+    def _property_text(prop: Dict) -> str:
+        """读取rich_text/title/select类型属性的文本，其他类型返回空字符串"""
+        if not prop:
+            return ""
+        if prop.get("type") == "select":
+            return (prop.get("select") or {}).get("name", "")
+        if prop.get("type") in ("rich_text", "title"):
+            return "".join(part["plain_text"] for part in prop[prop["type"]])
+        return ""
 
     def get_approved_transactions(self) -> List[Dict]:
         """
@@ -20,11 +56,26 @@ class NotionClient:
         2. "审核完毕，Signer"为BigSong
         3. 创建时间在2025.2.1之后
         """
-        current_date = datetime.now()
+        results = []
+        for rows, _ in self.iter_approved_pages():
+            results.extend(rows)
+        return results
+
+    def iter_approved_pages(self, start_cursor: Optional[str] = None) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+        """
+        按页获取已审核的交易数据，筛选条件同get_approved_transactions
+        
+        Args:
+            start_cursor: 从该游标继续拉取，用于中断后续跑
+            
+        Returns:
+            逐页产出 (该页的交易列表, 下一页游标)，最后一页的游标为None
+        """
         target_date = datetime(2025, 2, 1)
 
         query = {
             "database_id": self.database_id,
+            "page_size": self.page_size,
             "filter": {
                 "and": [
                     {
@@ -49,27 +100,111 @@ class NotionClient:
             }
         }
 
-        results = []
-        response = self.client.databases.query(**query)
-       #print("Query response:", response)
-        
-        for page in response["results"]:
+        cursor = start_cursor
+        while True:
+            if cursor:
+                query["start_cursor"] = cursor
+            response = self._query(query)
+            cursor = response.get("next_cursor") if response.get("has_more") else None
+            
+            rows = []
+            for page in response["results"]:
+                row = self._parse_page(page)
+                if row is not None:
+                    rows.append(row)
+            yield rows, cursor
+            
+            if cursor is None:
+                return
+
+    def iter_payout_rows(self, since: Optional[str] = None) -> Iterator[Dict]:
+        """
+        按创建时间升序逐行获取所有已审核的行（不限月份），用于和链上转账对账
+
+        Args:
+            since: 只返回该日期（包含）之后创建的行，ISO格式
+
+        Returns:
+            解析后的行，另带created_time
+        """
+        conditions = [{"property": "审核完毕，Signer", "people": {"is_not_empty": True}}]
+        if since:
+            conditions.append({"property": "Created time", "date": {"on_or_after": since}})
+        query = {
+            "database_id": self.database_id,
+            "page_size": self.page_size,
+            "filter": {"and": conditions},
+            "sorts": [{"timestamp": "created_time", "direction": "ascending"}],
+        }
+
+        while True:
+            response = self._query(query)
+            for page in response["results"]:
+                row = self._parse_page(page)
+                if row is not None:
+                    row["created_time"] = page["created_time"]
+                    yield row
+            if not response.get("has_more"):
+                return
+            query["start_cursor"] = response["next_cursor"]
+
+    def payout_properties(self, safe_tx_hash: Optional[str] = None, nonce: Optional[int] = None,
+                          status: Optional[str] = None, tx_hash: Optional[str] = None) -> Dict:
+        """生成写回支付状态的属性值，为None的字段不写"""
+        properties = {}
+        if safe_tx_hash is not None:
+            properties[self.safe_tx_hash_property] = {"rich_text": [{"text": {"content": safe_tx_hash}}]}
+        if nonce is not None:
+            properties[self.nonce_property] = {"number": int(nonce)}
+        if status is not None:
+            properties[self.status_property] = {"select": {"name": status}}
+        if tx_hash is not None:
+            properties[self.execution_tx_property] = {"rich_text": [{"text": {"content": tx_hash}}]}
+        return properties
+
+    def update_page(self, page_id: str, properties: Dict) -> Dict:
+        """pages.update，被限流时按Retry-After等待后重试"""
+        return self._with_retry(lambda: self.client.pages.update(page_id=page_id, properties=properties))
+
+    def _query(self, query: Dict) -> Dict:
+        """databases.query，被限流时按Retry-After等待后重试"""
+        return self._with_retry(lambda: self.client.databases.query(**query))
+
+    def _with_retry(self, call):
+        for attempt in range(self.max_retries + 1):
             try:
-                signer = page["properties"]["审核完毕，Signer"]["people"]
-                if signer and any(person["name"] == "BigSong" for person in signer):
-                    address = page["properties"]["地址"]["rich_text"][0]["text"]["content"]
-                    amount = float(page["properties"]["USDT"]["number"])
-                    
-                    print("\nNotion数据:")
-                    print(f"原始地址内容: {address}")
-                    print(f"金额: {amount}")
-                    
-                    results.append({
-                        "address": address,
-                        "amount": amount
-                    })
-            except (KeyError, IndexError) as e:
-                print(f"Error processing page {page['id']}: {str(e)}")
-                continue
-
-        return results 
\ No newline at end of file
+                return call()
+            except APIResponseError as e:
+                if e.code != APIErrorCode.RateLimited or attempt == self.max_retries:
+                    raise
+                delay = float(e.headers.get("Retry-After") or 2 ** attempt)
+                logger.warning("Notion限流，%.1f 秒后重试 (%d/%d)", delay, attempt + 1, self.max_retries)
+                time.sleep(delay)
+
+    def _parse_page(self, page: Dict) -> Optional[Dict]:
+        """解析一个Notion页面，不是BigSong审核的或字段缺失时返回None"""
+        try:
+            signer = page["properties"]["审核完毕，Signer"]["people"]
+            if not (signer and any(person["name"] == "BigSong" for person in signer)):
+                return None
+            address = page["properties"]["地址"]["rich_text"][0]["text"]["content"]
+            amount = float(page["properties"]["USDT"]["number"])
+            
+            result = {
+                "address": address,
+                "amount": amount,
+                "page_id": page["id"]
+            }
+            
+            # 路由列：决定该行由哪个Safe、在哪个网络上支付
+            safe = self._property_text(page["properties"].get(self.safe_property)).strip()
+            network = self._property_text(page["properties"].get(self.network_property)).strip()
+            if safe:
+                result["safe"] = safe
+            if network:
+                result["network"] = network.lower()
+            
+            return result
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logger.warning("跳过无法解析的Notion页面 %s: %s", page["id"], e)
+            return None
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from notion_client import APIResponseError
+
+from notion.client import NotionClient
+from utils.logger import logger
+
+load_dotenv()
+
+DEFAULT_WRITEBACK_FILE = ".cache/notion_writeback.jsonl"
+
+
+def writeback_enabled() -> bool:
+    """NOTION_WRITEBACK为true时把支付状态写回Notion（需要先在数据库中建好对应的列）"""
+    return os.getenv("NOTION_WRITEBACK", "false").lower() == "true"
+
+
+class NotionWriteback:
+    """
+    把safeTxHash、nonce、状态和执行交易哈希写回来源页面
+
+    - submit只把更新放入队列，同一页面尚未写出的更新合并为一次pages.update，后提交的字段覆盖先提交的
+    - 多个工作线程并发写出，共用一个令牌桶，总速率不超过NOTION_WRITE_RATE（默认3次/秒，即Notion的平均限额），
+      被限流时由NotionClient按Retry-After重试；同一页面不会同时有两个请求
+    - 每次提交和完成都追加到日志文件，进程中断后重新创建时从日志恢复未写出的更新；全部写出后删除日志
+    """
+
+    def __init__(self, client: Optional[NotionClient] = None, path: Optional[str] = None,
+                 workers: Optional[int] = None, rate: Optional[float] = None):
+        """
+        Args:
+            path: 更新日志文件，默认读取NOTION_WRITEBACK_FILE
+            workers: 并发写出的线程数，默认读取NOTION_WRITE_WORKERS（3）
+            rate: 每秒最多发出的pages.update请求数，默认读取NOTION_WRITE_RATE（3），0表示不限制
+        """
+        self.client = client or NotionClient()
+        self.path = Path(path or os.getenv("NOTION_WRITEBACK_FILE", DEFAULT_WRITEBACK_FILE))
+        self.workers = workers or int(os.getenv("NOTION_WRITE_WORKERS", "3"))
+        self.rate = rate if rate is not None else float(os.getenv("NOTION_WRITE_RATE", "3"))
+        # 待写出的更新：{页面ID: (序号, 合并后的属性)}，按首次提交的顺序写出
+        self._pending: Dict[str, Tuple[int, Dict]] = {}
+        self._in_flight: Set[str] = set()
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._next_slot = 0.0
+        self._closing = False
+        self._threads: List[threading.Thread] = []
+        self.written = 0
+        self.failed = 0
+        self.unfinished = 0
+        self._restore()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    # ---- 日志 ----
+
+    def _restore(self):
+        """重放日志：每个页面只保留最后一次完成之后提交的更新"""
+        if not self.path.exists():
+            return
+        submitted: Dict[str, List[Tuple[int, Dict]]] = {}
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 中断时最后一行可能不完整
+                    continue
+                self._seq = max(self._seq, record["seq"])
+                updates = submitted.setdefault(record["page_id"], [])
+                if record.get("done"):
+                    updates[:] = [update for update in updates if update[0] > record["seq"]]
+                else:
+                    updates.append((record["seq"], record["properties"]))
+        for page_id, updates in submitted.items():
+            if updates:
+                properties = {}
+                for _, update in updates:
+                    properties.update(update)
+                self._pending[page_id] = (updates[-1][0], properties)
+        if self._pending:
+            logger.info("从 %s 恢复 %d 个未写回Notion的页面", self.path, len(self._pending))
+
+    def _log(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    # ---- 提交 ----
+
+    def submit(self, page_id: str, **fields):
+        """
+        提交一个页面的更新，字段同NotionClient.payout_properties（safe_tx_hash、nonce、status、tx_hash）
+        """
+        properties = self.client.payout_properties(**fields)
+        if not page_id or not properties:
+            return
+        with self._cond:
+            self._seq += 1
+            self._log({"page_id": page_id, "seq": self._seq, "properties": properties})
+            _, merged = self._pending.get(page_id, (0, {}))
+            self._pending[page_id] = (self._seq, {**merged, **properties})
+            self._cond.notify()
+
+    # ---- 写出 ----
+
+    def start(self) -> "NotionWriteback":
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"notion-writeback-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _throttle(self):
+        if not self.rate:
+            return
+        with self._cond:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _take(self) -> Optional[Tuple[str, int, Dict]]:
+        """取出第一个没有请求在途的页面；关闭且没有可写的页面时返回None"""
+        with self._cond:
+            while True:
+                for page_id in self._pending:
+                    if page_id not in self._in_flight:
+                        seq, properties = self._pending.pop(page_id)
+                        self._in_flight.add(page_id)
+                        return page_id, seq, properties
+                if self._closing and not self._pending:
+                    return None
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            task = self._take()
+            if task is None:
+                return
+            page_id, seq, properties = task
+            self._throttle()
+            outcome = "written"
+            try:
+                self.client.update_page(page_id, properties)
+            except APIResponseError as e:
+                # 列不存在或类型不符等错误重试也不会成功，记录后放弃
+                outcome = "failed"
+                logger.warning("写回Notion页面 %s 失败: %s", page_id, e)
+            except Exception as e:
+                # 网络错误：更新留在日志中，下次运行时重试
+                outcome = "unfinished"
+                logger.warning("写回Notion页面 %s 失败，下次运行时重试: %s", page_id, e)
+            done = outcome != "unfinished"
+            # 计数器由多个写回线程更新，与在途集合一起在锁内修改
+            with self._cond:
+                if outcome == "written":
+                    self.written += 1
+                elif outcome == "failed":
+                    self.failed += 1
+                else:
+                    self.unfinished += 1
+                self._in_flight.discard(page_id)
+                if done:
+                    self._log({"page_id": page_id, "seq": seq, "done": True})
+                self._cond.notify_all()
+
+    def close(self, wait: bool = True):
+        """
+        Args:
+            wait: 等待队列全部写出后删除日志；为False时只等待在途的请求，剩余的更新留在日志中下次恢复
+        """
+        with self._cond:
+            self._closing = True
+            if not wait:
+                self._pending.clear()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._file.close()
+        if wait and not self._pending and not self.unfinished:
+            self.path.unlink(missing_ok=True)
+        logger.info("已写回 %d 个Notion页面%s", self.written, f"，{self.failed} 个失败" if self.failed else "")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
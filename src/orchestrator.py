@@ -0,0 +1,533 @@
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import os
+
+from dotenv import load_dotenv
+from web3 import Web3
+from safe_eth.eth import EthereumClient
+
+from notion.client import STATUS_EXECUTED, STATUS_PROPOSED
+from notion.writeback import NotionWriteback
+from safe.plan import PlanFile, PlanWriter, combined_signature, decode_transfers, included_rows
+from safe.rpc import create_ethereum_client
+from safe.transaction import SafeTransactionHandler
+from utils.journal import RunJournal
+from utils.logger import logger
+from utils.pipeline import Pipeline, Stage
+from utils.summary import TransferSummary
+
+load_dotenv()
+
+
+def execute_batch_tx(
+    safe_handler: SafeTransactionHandler, batch_tx: Dict, journal: Optional[RunJournal] = None
+) -> str:
+    """
+    直接执行一笔Safe交易
+    
+    发送前先在运行日志中写入execute-intent（已签名的以太坊交易哈希和nonce）；续跑时遇到
+    execute-intent或链上nonce已使用，先在链上确认该Safe交易发出了ExecutionSuccess才视为已执行，
+    nonce被其他交易使用或执行失败时报错，不把行标记为已执行
+    
+    Returns:
+        以太坊交易哈希
+    """
+    safe_tx_hash = batch_tx["safe_tx_hash"]
+    executed = journal.get("execute", safe_tx_hash) if journal else None
+    if executed is not None:
+        return executed["tx_hash"]
+    intent = journal.get("execute-intent", safe_tx_hash) if journal else None
+    if intent is not None or (journal and journal.resumed and safe_handler.is_nonce_used(batch_tx)):
+        tx_hash = reconcile_execution(safe_handler, batch_tx, intent)
+        if tx_hash is not None:
+            journal.record("execute", safe_tx_hash, {"tx_hash": tx_hash})
+            return tx_hash
+    try:
+        execution = safe_handler.prepare_execution(batch_tx)
+        if journal:
+            journal.record("execute-intent", safe_tx_hash, {
+                "tx_hash": execution["tx_hash"], "sender": execution["sender"],
+                "nonce": execution["nonce"], "block": execution["block"],
+            })
+        tx_hash = safe_handler.send_execution(batch_tx, execution)
+        logger.info("交易已执行，哈希: %s", tx_hash)
+    except Exception as e:
+        logger.error("直接执行交易失败: %s", e)
+        raise
+    if journal:
+        journal.record("execute", safe_tx_hash, {"tx_hash": tx_hash})
+    return tx_hash
+
+
+def reconcile_execution(
+    safe_handler: SafeTransactionHandler, batch_tx: Dict, intent: Optional[Dict]
+) -> Optional[str]:
+    """
+    续跑时核对上一次可能已经发送的execTransaction
+    
+    Returns:
+        链上确认执行成功时返回以太坊交易哈希；没有上链且nonce未使用时返回None，可以重新执行
+        
+    Raises:
+        Exception: 该Safe交易执行失败（ExecutionFailure），或nonce已被其他Safe交易使用
+    """
+    safe_tx_hash = batch_tx["safe_tx_hash"]
+    if intent is not None:
+        found = safe_handler.find_execution(batch_tx, intent["tx_hash"], intent["block"])
+    else:
+        found = safe_handler.find_execution(batch_tx)
+    if found is not None and found["success"]:
+        logger.info("交易已在链上执行，跳过: %s (%s)", safe_tx_hash, found["tx_hash"])
+        return found["tx_hash"]
+    if found is not None:
+        raise Exception(f"Safe交易执行失败 (ExecutionFailure)，nonce {batch_tx['nonce']} 已使用，"
+                        f"转账没有发生: {safe_tx_hash} ({found['tx_hash']})")
+    if safe_handler.is_nonce_used(batch_tx):
+        raise Exception(f"nonce {batch_tx['nonce']} 已被其他Safe交易使用，无法确认 {safe_tx_hash} 已执行")
+    if intent is not None:
+        # 同一nonce的Safe交易最多执行一次，即使上次发送的交易之后上链，重新执行也不会重复转账
+        logger.warning("上次发送的执行交易 %s 没有上链，重新执行: %s", intent["tx_hash"], safe_tx_hash)
+    return None
+
+
+def sign_batch_tx(
+    safe_handler: SafeTransactionHandler, batch_tx: Dict, journal: Optional[RunJournal] = None
+) -> Optional[bytes]:
+    """
+    签名一笔Safe交易，续跑时复用运行日志中的签名
+    
+    Returns:
+        签名，交易已经提议过时为None
+    """
+    safe_tx_hash = batch_tx["safe_tx_hash"]
+    if journal and journal.get("propose", safe_tx_hash) is not None:
+        return None
+    
+    signature = journal.get("sign", safe_tx_hash) if journal else None
+    if signature is not None:
+        return bytes.fromhex(signature)
+    try:
+        signature = safe_handler.sign_transaction(batch_tx)
+    except Exception as e:
+        logger.error("签名交易失败: %s", e)
+        raise
+    if journal:
+        journal.record("sign", safe_tx_hash, signature.hex())
+    return signature
+
+
+def propose_batch_tx(
+    safe_handler: SafeTransactionHandler, batch_tx: Dict, signature: Optional[bytes],
+    journal: Optional[RunJournal] = None,
+) -> str:
+    """
+    提议一笔已签名的Safe交易；续跑时上一次可能已经提交成功但没来得及记录
+    
+    Returns:
+        Safe交易哈希
+    """
+    safe_tx_hash = batch_tx["safe_tx_hash"]
+    if signature is None:
+        logger.info("交易已提议，跳过: %s", safe_tx_hash)
+        return safe_tx_hash
+    try:
+        if journal and journal.resumed and safe_handler.is_proposed(batch_tx):
+            logger.info("交易服务中已存在该提议，跳过: %s", safe_tx_hash)
+            tx_hash = safe_tx_hash
+        else:
+            tx_hash = safe_handler.propose_transaction(batch_tx, signature)
+            logger.info("交易已提议，哈希: %s", tx_hash)
+    except Exception as e:
+        logger.error("提议交易失败: %s", e)
+        raise
+    if journal:
+        journal.record("propose", safe_tx_hash, {"safe_tx_hash": tx_hash})
+    return tx_hash
+
+
+class _Group:
+    """流水线运行期间一个 (网络, Safe) 组的状态"""
+    
+    def __init__(self, network: str, safe_address: str, tag: bool):
+        self.network = network
+        self.safe_address = safe_address
+        self.key = f"{network}:{safe_address}"
+        self.context = f"{network} {safe_address[:6]}...{safe_address[-4:]}" if tag else None
+        self.lock = Lock()
+        self.handler: Optional[SafeTransactionHandler] = None
+        self.direct: Optional[bool] = None
+        self.error: Optional[str] = None
+        self.count = 0
+        self.tx_hashes: List[str] = []
+        # plan阶段的状态：待打包的行、已规划的Safe交易数、下一个nonce和累计金额
+        self.rows: List[Dict] = []
+        self.planned = 0
+        self.nonce: Optional[int] = None
+        self.total_amount = 0
+        self.owners: Optional[List[str]] = None
+    
+    def fail(self, error: Exception):
+        if self.error is None:
+            logger.error("处理失败: %s", error)
+            self.error = str(error)
+    
+    def result(self) -> Dict:
+        return {"network": self.network, "safe": self.safe_address, "count": self.count,
+                "tx_hashes": self.tx_hashes, "error": self.error}
+
+
+class SafeOrchestrator:
+    """
+    多Safe、多网络交易编排器
+    
+    把Notion拉取的交易按 (网络, Safe) 分组，以流水线方式处理：拉取下一页的同时
+    解析、编码和提议已经到达的行；同一网络的所有Safe共用一个带连接池的EthereumClient。
+    每个网络的RPC和USDT合约通过 RPC_URL_<网络>、USDT_CONTRACT_<网络> 配置，
+    未配置时使用 RPC_URL、USDT_CONTRACT
+    """
+    
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        Args:
+            max_workers: resolve阶段（ENS解析、创建处理器）的并发数，以及build/sign/propose阶段
+                同时处理的Safe数，默认读取ORCHESTRATOR_WORKERS
+        """
+        self.workers = max_workers or int(os.getenv("ORCHESTRATOR_WORKERS", "4"))
+        self.gas_workers = int(os.getenv("GAS_ESTIMATION_WORKERS", "8"))
+        self.default_network = os.getenv("NETWORK", "sepolia").lower()
+        self.default_safe = os.getenv("SAFE_ADDRESS")
+        self._clients: Dict[str, EthereumClient] = {}
+        self._clients_lock = Lock()
+        # 设置后，提议或执行成功的行把safeTxHash、nonce和状态写回Notion
+        self.writeback: Optional[NotionWriteback] = None
+    
+    @staticmethod
+    def _network_env(name: str, network: str) -> Optional[str]:
+        return os.getenv(f"{name}_{network.upper()}") or os.getenv(name)
+    
+    def get_ethereum_client(self, network: str) -> EthereumClient:
+        """获取网络对应的EthereumClient，每个网络只创建一次"""
+        with self._clients_lock:
+            if network not in self._clients:
+                rpc_url = self._network_env("RPC_URL", network)
+                if not rpc_url:
+                    raise ValueError(f"未配置网络 {network} 的RPC_URL")
+                self._clients[network] = create_ethereum_client(rpc_url)
+            return self._clients[network]
+    
+    def create_handler(self, network: str, safe_address: str) -> SafeTransactionHandler:
+        """为 (网络, Safe) 创建交易处理器，复用该网络的EthereumClient"""
+        return SafeTransactionHandler(
+            safe_address=safe_address,
+            network=network,
+            rpc_url=self._network_env("RPC_URL", network),
+            usdt_contract_address=self._network_env("USDT_CONTRACT", network),
+            ethereum_client=self.get_ethereum_client(network),
+        )
+    
+    def group_transactions(self, transactions: List[Dict]) -> Dict[Tuple[str, str], List[Dict]]:
+        """
+        按 (网络, Safe地址) 分组，未指定路由的行使用默认网络和Safe
+        
+        Returns:
+            {(network, checksum safe address): 交易列表}，保持交易原有顺序
+        """
+        groups: Dict[Tuple[str, str], List[Dict]] = {}
+        for tx in transactions:
+            groups.setdefault(self._route(tx), []).append(tx)
+        return groups
+    
+    def _route(self, row: Dict) -> Tuple[str, str]:
+        network = (row.get("network") or self.default_network).lower()
+        safe_address = row.get("safe") or self.default_safe
+        if not safe_address:
+            raise ValueError(f"交易未指定Safe且未配置SAFE_ADDRESS: {row.get('page_id', row['address'])}")
+        return network, Web3.to_checksum_address(safe_address)
+    
+    def build_pipeline(self, journal: Optional[RunJournal] = None, plan_only: bool = False) -> Pipeline:
+        """
+        构建处理流水线：
+        ingest -> resolve -> validate -> encode -> plan -> build -> estimate -> sign -> propose
+        
+        ingest拉取数据源（Notion分页）并按 (网络, Safe) 路由；resolve并发解析ENS；
+        plan按MAX_TRANSFERS_PER_TX把同组的行打包，build依次分配nonce并构建Safe交易，
+        estimate并发估算safeTxGas（同一Safe的多笔交易也并行，并发数为GAS_ESTIMATION_WORKERS）。
+        build、sign、propose在按组划分的线程池中执行：同一组的Safe交易按nonce顺序串行，
+        不同组之间并发。某组失败时丢弃该组后续的数据，不影响其他组。各阶段执行器可通过PIPELINE_EXECUTORS覆盖
+        
+        Args:
+            journal: 运行日志
+            plan_only: 只运行到estimate阶段，不签名也不提议
+        """
+        self._groups: Dict[Tuple[str, str], _Group] = {}
+        self._journal = journal
+        # 逐行只计入汇总，结束时输出一次；明细按需写入TRANSFER_DETAIL_FILE
+        self.summary = TransferSummary()
+        by_group = lambda item: item["group"].key
+        stages = [
+            Stage("ingest", self._ingest, stream=True),
+            Stage("resolve", self._resolve, executor="thread", workers=self.workers),
+            Stage("validate", self._validate),
+            Stage("encode", self._encode),
+            Stage("plan", self._plan, stream=True),
+            Stage("build", self._build, executor="thread", workers=self.workers, key=by_group),
+            Stage("estimate", self._estimate, executor="thread", workers=self.gas_workers),
+        ]
+        if not plan_only:
+            stages += [
+                Stage("sign", self._sign, executor="thread", workers=self.workers, key=by_group),
+                Stage("propose", self._propose, executor="thread", workers=self.workers, key=by_group),
+            ]
+        self.pipeline = Pipeline(stages).configure()
+        return self.pipeline
+    
+    def _in_group(self, group: _Group, fn, *args, **fields):
+        """
+        在组的日志上下文中执行，组已失败时跳过，异常记为该组失败
+        
+        fields作为结构化日志字段（page_id、nonce）附加到期间的日志上
+        """
+        if group.error:
+            return None
+        logger.set_context(group.context)
+        with logger.bind(network=group.network, safe=group.safe_address, **fields):
+            try:
+                return fn(*args)
+            except Exception as e:
+                group.fail(e)
+                return None
+            finally:
+                logger.set_context(None)
+    
+    def _ingest(self, rows: Iterator[Dict]) -> Iterator[Dict]:
+        default = (self.default_network, self.default_safe and Web3.to_checksum_address(self.default_safe))
+        for row in rows:
+            key = self._route(row)
+            if key not in self._groups:
+                # 默认 (网络, Safe) 不加日志前缀，输出与单Safe模式一致
+                self._groups[key] = _Group(*key, tag=key != default)
+            group = self._groups[key]
+            group.count += 1
+            yield {"row": row, "group": group}
+    
+    def _resolve(self, item: Dict) -> Optional[Dict]:
+        group = item["group"]
+        
+        def resolve():
+            with group.lock:
+                if group.handler is None:
+                    group.handler = self.create_handler(group.network, group.safe_address)
+            item["to_address"] = group.handler.resolve_address(item["row"]["address"])
+            return item
+        
+        return self._in_group(group, resolve, page_id=item["row"].get("page_id"))
+    
+    def _validate(self, item: Dict) -> Optional[Dict]:
+        def validate():
+            amount = item["row"]["amount"]
+            if not isinstance(amount, (int, float)) or not amount > 0 or amount == float("inf"):
+                raise ValueError(f"转账金额无效 ({item['row'].get('page_id', item['row']['address'])}): {amount}")
+            return item
+        
+        return self._in_group(item["group"], validate, page_id=item["row"].get("page_id"))
+    
+    def _encode(self, item: Dict) -> Optional[Dict]:
+        def encode():
+            group, row = item["group"], item["row"]
+            item["multi_send_tx"] = group.handler.encode_transfer(item["to_address"], row["amount"])
+            self.summary.add(item["to_address"], row["amount"], network=group.network, safe=group.safe_address,
+                             page_id=row.get("page_id"), address=row["address"])
+            return item
+        
+        return self._in_group(item["group"], encode, page_id=item["row"].get("page_id"))
+    
+    def _plan(self, items: Iterator[Dict]) -> Iterator[Dict]:
+        def chunk(group: _Group) -> Dict:
+            rows, group.rows = group.rows, []
+            group.planned += 1
+            return {"group": group, "index": group.planned - 1, "items": rows}
+        
+        for item in items:
+            group = item["group"]
+            if group.error:
+                continue
+            group.rows.append(item)
+            if len(group.rows) == group.handler.max_transfers_per_tx:
+                yield chunk(group)
+        for group in self._groups.values():
+            if group.rows and not group.error:
+                yield chunk(group)
+    
+    def _build(self, batch: Dict) -> Optional[Dict]:
+        group = batch["group"]
+        journal = self._journal
+        
+        def build():
+            handler = group.handler
+            key = f"{group.key}:{batch['index']}"
+            batch_txs = journal.get("prepare", key) if journal else None
+            prepared = batch_txs is not None
+            if prepared:
+                logger.info("复用运行日志中已准备的Safe交易: %s", key)
+            else:
+                if group.nonce is None:
+                    group.nonce = handler.safe.retrieve_nonce()
+                rows = [item["row"] for item in batch["items"]]
+                group.total_amount += sum(row["amount"] for row in rows)
+                handler.check_balance(group.total_amount)
+                # safeTxGas在estimate阶段估算，同一Safe的多笔交易可以并行估算
+                batch_txs = handler.build_batches(
+                    [item["multi_send_tx"] for item in batch["items"]], rows, nonce=group.nonce, estimate_gas=False
+                )
+            if not batch_txs:
+                return None
+            group.nonce = int(batch_txs[-1]["nonce"]) + 1
+            return {"group": group, "key": key, "prepared": prepared, "batch_txs": batch_txs, "items": batch["items"]}
+        
+        return self._in_group(group, build)
+    
+    def _estimate(self, item: Dict) -> Optional[Dict]:
+        group = item["group"]
+        
+        def estimate():
+            batch_txs = item.pop("batch_txs")
+            if not item["prepared"]:
+                batch_txs = group.handler.estimate_batches(batch_txs)
+                if self._journal:
+                    self._journal.record("prepare", item["key"], batch_txs)
+            item["batch_tx"] = batch_txs[0]
+            return item
+        
+        return self._in_group(group, estimate)
+    
+    def _sign(self, item: Dict) -> Optional[Dict]:
+        group = item["group"]
+        
+        def sign():
+            # 本地私钥满足阈值时直接执行，执行时再聚合签名
+            if group.direct is None:
+                group.direct = group.handler.should_execute_directly()
+            if not group.direct:
+                item["signature"] = sign_batch_tx(group.handler, item["batch_tx"], self._journal)
+            return item
+        
+        return self._in_group(group, sign, nonce=item["batch_tx"]["nonce"])
+    
+    def _propose(self, item: Dict) -> Optional[str]:
+        group = item["group"]
+        
+        def propose():
+            if group.direct:
+                tx_hash = execute_batch_tx(group.handler, item["batch_tx"], self._journal)
+            else:
+                tx_hash = propose_batch_tx(group.handler, item["batch_tx"], item["signature"], self._journal)
+            group.tx_hashes.append(tx_hash)
+            if self.writeback is not None:
+                self._write_back(item, tx_hash if group.direct else None)
+            return tx_hash
+        
+        return self._in_group(group, propose, nonce=item["batch_tx"]["nonce"])
+    
+    def _write_back(self, item: Dict, executed_tx_hash: Optional[str]):
+        """把Safe交易的状态提交给写回队列；模拟阶段丢弃的行不写"""
+        batch_tx = item["batch_tx"]
+        status = STATUS_EXECUTED if item["group"].direct else STATUS_PROPOSED
+        for row_item, _, included in included_rows(decode_transfers(batch_tx["data"]), item["items"]):
+            if included:
+                self.writeback.submit(row_item["row"].get("page_id"), safe_tx_hash=batch_tx["safe_tx_hash"],
+                                      nonce=batch_tx["nonce"], status=status, tx_hash=executed_tx_hash)
+    
+    def plan(self, transactions: Iterable[Dict], writer: PlanWriter) -> List[Dict]:
+        """
+        只构建Safe交易并写入计划文件，不需要私钥
+        
+        Args:
+            transactions: 交易行
+            writer: 计划文件写入器
+        
+        Returns:
+            每组的处理结果，tx_hashes为计划中的Safe交易哈希
+        """
+        def ingest(rows):
+            for row in rows:
+                writer.add_source_row(row)
+                yield row
+        
+        pipeline = self.build_pipeline(plan_only=True)
+        try:
+            for item in pipeline.stream(ingest(transactions)):
+                group, handler = item["group"], item["group"].handler
+                if group.owners is None:
+                    group.owners = handler.safe.retrieve_owners()
+                writer.add_safe_tx(
+                    group.network, handler.ethereum_client.get_chain_id(), group.safe_address,
+                    handler.safe.get_version(), group.owners, item["batch_tx"], item["items"],
+                )
+                group.tx_hashes.append(item["batch_tx"]["safe_tx_hash"])
+        finally:
+            self.summary.log()
+        return [group.result() for group in self._groups.values()]
+    
+    def propose_plan(self, plan: PlanFile, signatures: Dict[str, Dict[str, str]]) -> List[Dict]:
+        """
+        提议计划文件中的Safe交易，使用签名文件中的全部签名
+        
+        已提议或nonce已在链上使用的交易跳过，某组失败不影响其他组
+        
+        Returns:
+            每组的处理结果
+        """
+        groups: Dict[Tuple[str, str], _Group] = {}
+        for record in plan.safe_txs():
+            key = (record["network"], record["safe"])
+            if key not in groups:
+                groups[key] = _Group(*key, tag=True)
+            group = groups[key]
+            batch_tx = record["tx"]
+            
+            def propose():
+                if group.handler is None:
+                    group.handler = self.create_handler(group.network, group.safe_address)
+                if group.owners is None:
+                    group.owners = group.handler.safe.retrieve_owners()
+                safe_tx_hash = batch_tx["safe_tx_hash"]
+                # 按当前链上的所有者过滤，签名后被移除的所有者的签名不提交
+                signature = combined_signature(signatures.get(safe_tx_hash, {}), group.owners)
+                if signature is None:
+                    raise Exception(f"交易没有所有者签名，请先运行sign: {safe_tx_hash}")
+                if group.handler.is_nonce_used(batch_tx):
+                    logger.warning("nonce %s 已在链上使用，跳过: %s", batch_tx["nonce"], safe_tx_hash)
+                    return None
+                if group.handler.is_proposed(batch_tx):
+                    logger.info("交易服务中已存在该提议，跳过: %s", safe_tx_hash)
+                else:
+                    group.handler.propose_transaction(batch_tx, signature)
+                return safe_tx_hash
+            
+            group.count += 1
+            tx_hash = self._in_group(group, propose, nonce=batch_tx["nonce"])
+            if tx_hash:
+                group.tx_hashes.append(tx_hash)
+        return [group.result() for group in groups.values()]
+    
+    def run(self, transactions: Iterable[Dict], journal: Optional[RunJournal] = None) -> List[Dict]:
+        """
+        以流水线方式处理交易，数据源可以是列表或逐页产出的生成器
+        
+        Args:
+            transactions: 交易行，例如Notion分页拉取的生成器
+            journal: 运行日志，用于崩溃后续跑
+        
+        Returns:
+            每组的处理结果，包含network、safe、count、tx_hashes和error
+        """
+        pipeline = self.build_pipeline(journal)
+        try:
+            pipeline.run(transactions)
+        finally:
+            self.summary.log()
+        
+        results = [group.result() for group in self._groups.values()]
+        if any(not group.direct and group.tx_hashes for group in self._groups.values()):
+            logger.info("请在Safe钱包中查看和确认交易")
+        return results
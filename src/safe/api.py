@@ -1,27 +1,41 @@
 import os
 import requests
-from typing import Dict
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
+from safe.networks import network_registry
+from utils.metrics import instrument_session
+
 load_dotenv()
 
 class SafeAPI:
-    def __init__(self):
-        self.network = os.getenv("NETWORK", "sepolia")
-        self.base_url = f"https://safe-transaction-{self.network}.safe.global/api"
-        self.safe_address = os.getenv("SAFE_ADDRESS")
+    def __init__(self, network: Optional[str] = None, safe_address: Optional[str] = None):
+        self.network = network or os.getenv("NETWORK", "sepolia")
+        self.base_url = f"{network_registry.service_url(self.network)}/api"
+        self.safe_address = safe_address or os.getenv("SAFE_ADDRESS")
+        self.session = instrument_session(requests.Session(), "safe_service")
 
     def get_current_nonce(self) -> int:
         """获取Safe当前nonce"""
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/v1/safes/{self.safe_address}/"
         )
         response.raise_for_status()
         return int(response.json()["nonce"])
 
+    def get_multisig_transaction(self, safe_tx_hash: str) -> Optional[Dict]:
+        """按Safe交易哈希查询已提议的交易，不存在时返回None"""
+        response = self.session.get(
+            f"{self.base_url}/v1/multisig-transactions/{safe_tx_hash}/"
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
     def estimate_safe_transaction(self, safe_tx: Dict) -> Dict:
         """估算Safe交易gas"""
-        response = requests.post(
+        response = self.session.post(
             f"{self.base_url}/v1/safes/{self.safe_address}/multisig-transactions/estimations/",
             json=safe_tx
         )
@@ -36,7 +50,7 @@ class SafeAPI:
             "safe": self.safe_address,
         }
         
-        response = requests.post(
+        response = self.session.post(
             f"{self.base_url}/v1/safes/{self.safe_address}/multisig-transactions/",
             json=tx_data
         )
@@ -0,0 +1,171 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import List, Dict, Optional
+import json
+import os
+from pathlib import Path
+
+from web3 import Web3
+from safe_eth.safe.exceptions import CannotEstimateGas
+
+from safe.api import SafeAPI
+# 导入自定义日志工具
+from utils.logger import logger
+from utils.files import write_json_atomic
+
+# safeTxGas估算后端：
+# service - Safe Transaction Service的 /multisig-transactions/estimations/ 接口
+# rpc     - 通过本地RPC估算（safe-eth-py的Safe.estimate_tx_gas，失败时回退到eth_estimateGas）
+# off     - 不估算，safeTxGas为0
+GAS_ESTIMATION_BACKENDS = ("service", "rpc", "off")
+
+DEFAULT_GAS_CACHE_FILE = ".cache/safe_tx_gas.json"
+
+
+class _GasCache:
+    """
+    safeTxGas估算缓存，同一缓存文件在进程内只有一个实例，由所有Safe的估算器共用
+    
+    写回磁盘时先与文件中已有的条目（其他进程写入的）合并，不会覆盖别人的估算结果
+    """
+    
+    _shared: Dict[Path, "_GasCache"] = {}
+    _shared_lock = Lock()
+    
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self._lock = Lock()
+        self._entries = self._load()
+    
+    @classmethod
+    def open(cls, path: Optional[Path]) -> "_GasCache":
+        """返回缓存文件对应的共享实例，path为None时返回只在内存中的缓存"""
+        if path is None:
+            return cls(None)
+        with cls._shared_lock:
+            key = path.resolve()
+            if key not in cls._shared:
+                cls._shared[key] = cls(path)
+            return cls._shared[key]
+    
+    def _load(self) -> Dict[str, int]:
+        if not self.path or not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取gas估算缓存失败，将重新估算: {str(e)}")
+            return {}
+    
+    def get(self, key: str) -> Optional[int]:
+        with self._lock:
+            return self._entries.get(key)
+    
+    def set(self, key: str, safe_tx_gas: int):
+        with self._lock:
+            self._entries[key] = safe_tx_gas
+    
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            self._entries = {**self._load(), **self._entries}
+            write_json_atomic(self.path, self._entries)
+
+
+class SafeTxGasEstimator:
+    """
+    并行估算一次运行中所有Safe交易的safeTxGas
+    
+    估算结果按 (链ID, safe, to, data哈希, nonce) 缓存并写入磁盘，重试或重新运行时不会重复估算；
+    同一进程中的所有估算器共用一份缓存
+    """
+    
+    def __init__(
+        self,
+        handler,
+        backend: str = "service",
+        cache_file: Optional[str] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Args:
+            handler: SafeTransactionHandler实例
+            backend: service或rpc
+            cache_file: 缓存文件路径，默认读取GAS_CACHE_FILE，设为空字符串时只在内存中缓存
+            max_workers: 并行估算的线程数，默认读取GAS_ESTIMATION_WORKERS
+        """
+        if backend not in GAS_ESTIMATION_BACKENDS:
+            raise ValueError(f"不支持的gas估算后端: {backend}")
+        self.handler = handler
+        self.backend = backend
+        self.max_workers = max_workers or int(os.getenv("GAS_ESTIMATION_WORKERS", "8"))
+        if cache_file is None:
+            cache_file = os.getenv("GAS_CACHE_FILE", DEFAULT_GAS_CACHE_FILE)
+        self.cache_file = Path(cache_file) if cache_file else None
+        self._cache = _GasCache.open(self.cache_file)
+        self._api = None
+    
+    def cache_key(self, to: str, data: bytes, nonce: int) -> str:
+        """缓存键: chainId:safe:to:keccak(data):nonce，同一地址的Safe在不同网络上分开缓存"""
+        return ":".join([
+            str(self.handler.ethereum_client.get_chain_id()),
+            self.handler.safe_address.lower(),
+            to.lower(),
+            Web3.keccak(data).hex(),
+            str(nonce),
+        ])
+    
+    def _estimate(self, to: str, data: bytes, operation: int) -> int:
+        if self.backend == "service":
+            if self._api is None:
+                self._api = SafeAPI(network=self.handler.network, safe_address=self.handler.safe_address)
+            result = self._api.estimate_safe_transaction({
+                "to": to,
+                "value": "0",
+                "data": "0x" + data.hex() if data else None,
+                "operation": operation,
+            })
+            return int(result["safeTxGas"])
+        return self.handler.safe.estimate_tx_gas(to, 0, data, operation)
+    
+    def estimate(self, to: str, data: bytes, operation: int, nonce: int) -> int:
+        """
+        估算单笔Safe交易的safeTxGas，命中缓存时直接返回
+        
+        估算失败时记录警告并返回0（Safe v1.3+中0表示使用全部可用gas）
+        """
+        key = self.cache_key(to, data, nonce)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        
+        try:
+            safe_tx_gas = self._estimate(to, data, operation)
+        except (CannotEstimateGas, ValueError, KeyError, OSError) as e:
+            logger.warning(f"safeTxGas估算失败，使用0: {str(e)}")
+            return 0
+        
+        self._cache.set(key, safe_tx_gas)
+        return safe_tx_gas
+    
+    def estimate_all(self, requests: List[Dict]) -> List[int]:
+        """
+        并行估算多笔Safe交易
+        
+        Args:
+            requests: 每项包含to、data、operation、nonce
+            
+        Returns:
+            与requests一一对应的safeTxGas列表
+        """
+        logger.info(f"估算 {len(requests)} 笔Safe交易的safeTxGas (后端: {self.backend})...")
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="gas") as pool:
+            results = list(pool.map(
+                lambda request: self.estimate(
+                    request["to"], request["data"], request["operation"], request["nonce"]
+                ),
+                requests,
+            ))
+        self._cache.save()
+        return results
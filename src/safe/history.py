@@ -0,0 +1,375 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from safe.api import SafeAPI
+from utils.logger import logger
+
+load_dotenv()
+
+DEFAULT_HISTORY_DB = ".cache/history.sqlite"
+
+# 交易服务的转账接口最多返回最新的1000条，超过时按区块向前分段
+TRANSFERS_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfers (
+    network TEXT NOT NULL,
+    safe TEXT NOT NULL,
+    transfer_id TEXT NOT NULL,
+    token TEXT,
+    recipient TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    value TEXT,
+    block INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    execution_date TEXT NOT NULL,
+    type TEXT,
+    symbol TEXT,
+    decimals INTEGER,
+    PRIMARY KEY (network, safe, transfer_id)
+);
+CREATE INDEX IF NOT EXISTS transfers_lookup ON transfers (network, safe, token, recipient, block);
+CREATE INDEX IF NOT EXISTS transfers_recipient ON transfers (recipient, token, execution_date);
+CREATE INDEX IF NOT EXISTS transfers_date ON transfers (execution_date, transfer_id);
+CREATE TABLE IF NOT EXISTS transactions (
+    network TEXT NOT NULL,
+    safe TEXT NOT NULL,
+    tx_type TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    safe_tx_hash TEXT NOT NULL,
+    nonce INTEGER,
+    block INTEGER,
+    execution_date TEXT,
+    is_successful INTEGER,
+    PRIMARY KEY (network, safe, tx_type, tx_hash, safe_tx_hash)
+);
+CREATE INDEX IF NOT EXISTS transactions_hash ON transactions (tx_hash);
+CREATE TABLE IF NOT EXISTS sync_state (
+    network TEXT NOT NULL,
+    safe TEXT NOT NULL,
+    stream TEXT NOT NULL,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    watermark INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT,
+    PRIMARY KEY (network, safe, stream)
+);
+"""
+
+
+def _lower(value: Optional[str]) -> Optional[str]:
+    return value.lower() if value else value
+
+
+class PayoutLedger:
+    """
+    Safe转账历史的本地SQLite账本
+
+    transfers表按 (网络, Safe, 代币, 收款地址, 区块) 建索引，另有按收款地址和日期的索引，
+    同步之后的查询不访问网络。地址统一存为小写，金额为基础单位的十进制字符串
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: 数据库文件，默认读取HISTORY_DB；":memory:"表示只在内存中保存
+        """
+        self.path = path or os.getenv("HISTORY_DB", DEFAULT_HISTORY_DB)
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- 同步状态 ----
+
+    def state(self, network: str, safe: str, stream: str) -> Tuple[int, int]:
+        """返回 (游标, 区块水位)，没有同步过时为 (0, 0)"""
+        row = self.conn.execute(
+            "SELECT cursor, watermark FROM sync_state WHERE network = ? AND safe = ? AND stream = ?",
+            (network, _lower(safe), stream),
+        ).fetchone()
+        return (row["cursor"], row["watermark"]) if row else (0, 0)
+
+    def set_state(self, network: str, safe: str, stream: str, cursor: int, watermark: int):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state (network, safe, stream, cursor, watermark, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (network, _lower(safe), stream, cursor, watermark, datetime.now(timezone.utc).isoformat()),
+            )
+
+    # ---- 写入 ----
+
+    def save_transfers(self, network: str, safe: str, transfers: List[Dict]):
+        """写入交易服务返回的转账记录，重复的transferId覆盖旧记录"""
+        safe = _lower(safe)
+        rows = []
+        for transfer in transfers:
+            token_info = transfer.get("tokenInfo") or {}
+            rows.append((
+                network, safe, transfer["transferId"], _lower(transfer.get("tokenAddress")),
+                _lower(transfer["to"]), _lower(transfer["from"]), transfer.get("value"),
+                int(transfer["blockNumber"]), transfer["transactionHash"], transfer["executionDate"],
+                transfer.get("type"), token_info.get("symbol"), token_info.get("decimals"),
+            ))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO transfers (network, safe, transfer_id, token, recipient, sender, value, "
+                "block, tx_hash, execution_date, type, symbol, decimals) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def save_transactions(self, network: str, safe: str, transactions: List[Dict], keep_existing: bool = False):
+        """
+        写入all-transactions接口返回的已执行交易（multisig、module和入账交易）
+
+        Args:
+            keep_existing: 已有记录时保留原记录，用于从链上日志得到的不含nonce的记录
+        """
+        safe = _lower(safe)
+        rows = [
+            (
+                network, safe, tx["txType"], tx.get("transactionHash") or tx.get("txHash") or "",
+                tx.get("safeTxHash") or "", tx.get("nonce"), tx.get("blockNumber"), tx.get("executionDate"),
+                None if tx.get("isSuccessful") is None else int(tx["isSuccessful"]),
+            )
+            for tx in transactions
+        ]
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR {'IGNORE' if keep_existing else 'REPLACE'} INTO transactions "
+                "(network, safe, tx_type, tx_hash, safe_tx_hash, nonce, block, "
+                "execution_date, is_successful) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    # ---- 查询 ----
+
+    def payments(self, to: Optional[str] = None, safe: Optional[str] = None, token: Optional[str] = None,
+                 network: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """
+        Safe转出的转账，按执行时间排序，附带所属Safe交易的nonce和safeTxHash
+
+        Args:
+            since/until: ISO日期或时间，包含since、不包含until
+        """
+        return list(self.iter_payments(to=to, safe=safe, token=token, network=network, since=since, until=until))
+
+    def iter_payments(self, to: Optional[str] = None, safe: Optional[str] = None, token: Optional[str] = None,
+                      network: Optional[str] = None, since: Optional[str] = None,
+                      until: Optional[str] = None) -> Iterator[Dict]:
+        """同payments，逐行从游标读取，多年的历史也不会一次载入内存"""
+        conditions, params = ["t.sender = t.safe"], []
+        for column, value in (("t.recipient", _lower(to)), ("t.safe", _lower(safe)),
+                              ("t.token", _lower(token)), ("t.network", network)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            conditions.append("t.execution_date >= ?")
+            params.append(since)
+        if until:
+            conditions.append("t.execution_date < ?")
+            params.append(until)
+        cursor = self.conn.execute(
+            "SELECT t.*, x.nonce, x.safe_tx_hash FROM transfers t "
+            "LEFT JOIN transactions x ON x.network = t.network AND x.safe = t.safe AND x.tx_hash = t.tx_hash "
+            "AND x.tx_type = 'MULTISIG_TRANSACTION' "
+            f"WHERE {' AND '.join(conditions)} ORDER BY t.execution_date, t.transfer_id",
+            params,
+        )
+        for row in cursor:
+            yield dict(row)
+
+    def execution(self, network: str, safe: str, safe_tx_hash: str) -> Optional[Dict]:
+        """safeTxHash对应的已执行交易，未执行时返回None"""
+        row = self.conn.execute(
+            "SELECT * FROM transactions WHERE network = ? AND safe = ? AND safe_tx_hash = ? "
+            "AND tx_type = 'MULTISIG_TRANSACTION' ORDER BY block LIMIT 1",
+            (network, _lower(safe), _lower(safe_tx_hash)),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def transfers_in(self, network: str, safe: str, tx_hash: str) -> List[Dict]:
+        """一笔以太坊交易中Safe转出的全部转账"""
+        rows = self.conn.execute(
+            "SELECT * FROM transfers WHERE network = ? AND safe = ? AND tx_hash = ? AND sender = safe",
+            (network, _lower(safe), _lower(tx_hash)),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def total_paid(self, to: str, **filters) -> int:
+        """Safe转给某地址的总额（基础单位）"""
+        return sum(int(row["value"] or 0) for row in self.payments(to=to, **filters))
+
+
+class SafeHistorySync:
+    """
+    从交易服务增量同步Safe的转账和已执行交易到PayoutLedger
+
+    - transfers: 从上次的区块水位开始拉取（包含水位所在区块），第一页确定总数和最高区块后，
+      其余页在固定的区块上限内并行拉取；超过接口的1000条上限时按最低区块继续向前分段
+    - all-transactions: 按时间升序，从上次的游标（偏移量）往前一页开始拉取，其余页并行拉取
+
+    两个接口同时拉取，每页到达后立即写入账本；全部完成后才更新游标和水位，中断后重新运行会重新拉取
+    未完成的部分，重复的记录按主键覆盖
+    """
+
+    def __init__(self, network: Optional[str] = None, safe_address: Optional[str] = None,
+                 ledger: Optional[PayoutLedger] = None, page_size: Optional[int] = None,
+                 workers: Optional[int] = None):
+        """
+        Args:
+            page_size: 每页条数，默认读取HISTORY_PAGE_SIZE（100）
+            workers: 并行请求数，默认读取HISTORY_SYNC_WORKERS（4）
+        """
+        self.api = SafeAPI(network, safe_address)
+        self.network = self.api.network
+        self.safe_address = self.api.safe_address
+        if not self.safe_address:
+            raise ValueError("未配置SAFE_ADDRESS")
+        self.ledger = ledger or PayoutLedger()
+        self.page_size = page_size or int(os.getenv("HISTORY_PAGE_SIZE", "100"))
+        self.workers = workers or int(os.getenv("HISTORY_SYNC_WORKERS", "4"))
+        self.max_retries = int(os.getenv("SAFE_SERVICE_MAX_RETRIES", "5"))
+
+    def _get(self, endpoint: str, params: Dict) -> Dict:
+        """GET交易服务接口，429和5xx按Retry-After或指数退避重试"""
+        url = f"{self.api.base_url}/v1/safes/{self.safe_address}/{endpoint}/"
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.api.session.get(url, params=params, timeout=30)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("交易服务请求失败，第 %d 次重试: %s", attempt + 1, e)
+                time.sleep(2 ** attempt)
+                continue
+            if response.status_code != 429 and response.status_code < 500 or attempt == self.max_retries:
+                response.raise_for_status()
+                return response.json()
+            delay = float(response.headers.get("Retry-After") or 2 ** attempt)
+            logger.warning("交易服务返回 %d，%.0f 秒后重试", response.status_code, delay)
+            time.sleep(delay)
+
+    def _transfer_pages(self, pool: ThreadPoolExecutor, emit: Callable, watermark: int) -> int:
+        """拉取水位之后的转账，返回新的水位"""
+        base = {"limit": self.page_size}
+        if watermark:
+            base["block_number__gt"] = watermark - 1
+        upper, top = None, watermark
+        while True:
+            first = self._get("transfers", {**base, "offset": 0, **({"block_number__lt": upper} if upper else {})})
+            if not first["results"]:
+                return top
+            blocks = [int(transfer["blockNumber"]) for transfer in first["results"]]
+            if upper is None:
+                # 之后的页固定区块上限，同步期间到达的新转账不会让偏移量错位
+                top = max(top, max(blocks))
+                upper = max(blocks) + 1
+            emit("transfers", first["results"])
+            lowest = min(blocks)
+            count = min(first["count"], TRANSFERS_LIMIT)
+            params = {**base, "block_number__lt": upper}
+            offsets = range(self.page_size, count, self.page_size)
+            for page in pool.map(lambda offset: self._get("transfers", {**params, "offset": offset}), offsets):
+                emit("transfers", page["results"])
+                lowest = min([lowest] + [int(transfer["blockNumber"]) for transfer in page["results"]])
+            if first["count"] < TRANSFERS_LIMIT:
+                return top
+            if lowest + 1 >= upper:
+                logger.warning("区块 %d 中的转账超过接口上限 %d 条，部分转账未同步", lowest, TRANSFERS_LIMIT)
+                return top
+            upper = lowest + 1
+
+    def _transaction_pages(self, pool: ThreadPoolExecutor, emit: Callable, cursor: int) -> int:
+        """从游标往前一页开始按时间升序拉取已执行交易，返回新的游标"""
+        offset = max(0, cursor - self.page_size)
+        params = {"ordering": "timestamp", "limit": self.page_size}
+        first = self._get("all-transactions", {**params, "offset": offset})
+        emit("transactions", first["results"])
+        offsets = range(offset + self.page_size, first["count"], self.page_size)
+        for page in pool.map(lambda o: self._get("all-transactions", {**params, "offset": o}), offsets):
+            emit("transactions", page["results"])
+        return max(cursor, first["count"])
+
+    def sync(self) -> Dict:
+        """同步一次，返回本次收到的转账数、交易数以及新的水位和游标"""
+        started = time.perf_counter()
+        _, watermark = self.ledger.state(self.network, self.safe_address, "transfers")
+        cursor, _ = self.ledger.state(self.network, self.safe_address, "all-transactions")
+        # 页面经有界队列交给当前线程写入SQLite（连接只在创建它的线程中使用）
+        pages: queue.Queue = queue.Queue(maxsize=self.workers * 2)
+        outcome: Dict[str, object] = {}
+
+        def run(name: str, stream: Callable, position: int):
+            try:
+                outcome[name] = stream(pool, lambda kind, rows: pages.put((kind, rows)), position)
+            except Exception as e:
+                outcome[name] = e
+            finally:
+                pages.put(None)
+
+        counts = {"transfers": 0, "transactions": 0}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="history") as pool:
+            streams = [
+                threading.Thread(target=run, args=("transfers", self._transfer_pages, watermark), daemon=True),
+                threading.Thread(target=run, args=("transactions", self._transaction_pages, cursor), daemon=True),
+            ]
+            for thread in streams:
+                thread.start()
+            finished = 0
+            while finished < len(streams):
+                item = pages.get()
+                if item is None:
+                    finished += 1
+                    continue
+                kind, rows = item
+                counts[kind] += len(rows)
+                if kind == "transfers":
+                    self.ledger.save_transfers(self.network, self.safe_address, rows)
+                else:
+                    self.ledger.save_transactions(self.network, self.safe_address, rows)
+
+        for name in ("transfers", "transactions"):
+            if isinstance(outcome.get(name), Exception):
+                raise outcome[name]
+        self.ledger.set_state(self.network, self.safe_address, "transfers", 0, outcome["transfers"])
+        self.ledger.set_state(self.network, self.safe_address, "all-transactions", outcome["transactions"], 0)
+        logger.info(
+            "同步 %s %s: %d 条转账, %d 笔交易, 区块水位 %d, 耗时 %.1fs",
+            self.network, self.safe_address, counts["transfers"], counts["transactions"],
+            outcome["transfers"], time.perf_counter() - started,
+        )
+        return {**counts, "watermark": outcome["transfers"], "cursor": outcome["transactions"]}
+
+
+def month_range(month: str) -> Tuple[str, str]:
+    """Notion月份列的格式（如 "2025.2"）转换为 [since, until) 日期"""
+    try:
+        year, number = (int(part) for part in month.split("."))
+        start = datetime(year, number, 1)
+    except ValueError:
+        raise ValueError(f"月份格式应为 年.月: {month}")
+    end = datetime(year + number // 12, number % 12 + 1, 1)
+    return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
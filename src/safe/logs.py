@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from web3 import Web3
+
+from safe.history import PayoutLedger
+from safe.rpc import is_too_many_results
+from safe.transaction import EXECUTION_FAILURE_TOPIC, EXECUTION_SUCCESS_TOPIC, execution_safe_tx_hash
+from utils.logger import logger
+
+load_dotenv()
+
+TRANSFER_TOPIC = Web3.keccak(text="Transfer(address,address,uint256)").hex()
+
+# 同步状态中日志索引使用的stream名
+LOGS_STREAM = "logs"
+
+
+class TooManyResults(Exception):
+    """节点拒绝了eth_getLogs的区块范围"""
+
+
+def _hex(value) -> str:
+    return value.hex() if isinstance(value, (bytes, bytearray)) else str(value)
+
+
+def _topic_address(address: str) -> str:
+    return "0x" + "0" * 24 + address.lower()[2:]
+
+
+class TransferLogIndexer:
+    """
+    从链上日志索引Safe转出的ERC-20转账，不依赖交易服务或外部索引器
+
+    - eth_getLogs按区块范围查询代币合约上from为Safe的Transfer事件，以及Safe自身的ExecutionSuccess/
+      ExecutionFailure事件（对应safeTxHash、以太坊交易哈希和是否成功）
+    - 节点返回结果过多或范围过大的错误时把范围对半拆分重试，之后的范围也按缩小后的大小查询，
+      之后每次整段成功再逐步放大
+    - 多个范围并行查询，按区块顺序写入PayoutLedger，每写完一个范围就把水位推进到该范围末尾，
+      中断后重新运行从水位继续
+
+    转账以与交易服务相同的transferId写入transfers表，与sync同步的记录互相去重
+    """
+
+    def __init__(self, w3: Web3, network: str, safe_address: str, token: str, ledger: Optional[PayoutLedger] = None,
+                 chunk: Optional[int] = None, workers: Optional[int] = None, confirmations: Optional[int] = None,
+                 start_block: Optional[int] = None):
+        """
+        Args:
+            chunk: 单次查询的最大区块数，默认读取LOG_INDEX_RANGE（5000）
+            workers: 并行查询数，默认读取LOG_INDEX_WORKERS（4）
+            confirmations: 只索引到最新区块之前若干个区块，避免重组，默认读取LOG_INDEX_CONFIRMATIONS（12）
+            start_block: 第一次索引的起始区块，默认读取LOG_INDEX_START_BLOCK（0）
+        """
+        self.w3 = w3
+        self.network = network.lower()
+        self.safe_address = Web3.to_checksum_address(safe_address)
+        self.token = Web3.to_checksum_address(token)
+        self.ledger = ledger or PayoutLedger()
+        self.max_chunk = chunk or int(os.getenv("LOG_INDEX_RANGE", "5000"))
+        self.chunk = self.max_chunk
+        self.workers = workers or int(os.getenv("LOG_INDEX_WORKERS", "4"))
+        self.confirmations = (confirmations if confirmations is not None
+                              else int(os.getenv("LOG_INDEX_CONFIRMATIONS", "12")))
+        self.start_block = start_block if start_block is not None else int(os.getenv("LOG_INDEX_START_BLOCK", "0"))
+        self.splits = 0
+        self._lock = threading.Lock()
+        self._token_info: Optional[Dict] = None
+
+    # ---- 查询 ----
+
+    def _get_logs(self, params: Dict) -> List:
+        try:
+            return self.w3.eth.get_logs(params)
+        except ValueError as e:
+            error = e.args[0] if e.args else e
+            if is_too_many_results(error):
+                raise TooManyResults(str(error))
+            raise
+
+    def _fetch(self, start: int, end: int) -> Tuple[List, List]:
+        """查询 [start, end] 内的转账和执行事件，范围被拒绝时对半拆分"""
+        try:
+            transfers = self._get_logs({
+                "fromBlock": start, "toBlock": end, "address": self.token,
+                "topics": [TRANSFER_TOPIC, _topic_address(self.safe_address)],
+            })
+            executions = self._get_logs({
+                "fromBlock": start, "toBlock": end, "address": self.safe_address,
+                "topics": [[EXECUTION_SUCCESS_TOPIC, EXECUTION_FAILURE_TOPIC]],
+            })
+        except TooManyResults as e:
+            if start == end:
+                raise
+            middle = (start + end) // 2
+            with self._lock:
+                self.splits += 1
+                self.chunk = max(1, min(self.chunk, middle - start + 1))
+            logger.debug("区块 %d-%d 的日志过多（%s），拆分查询", start, end, e)
+            left = self._fetch(start, middle)
+            right = self._fetch(middle + 1, end)
+            return left[0] + right[0], left[1] + right[1]
+        with self._lock:
+            # 整段查询成功后逐步恢复范围（每次加四分之一，避免在节点限制附近反复拆分）
+            if end - start + 1 >= self.chunk:
+                self.chunk = min(self.max_chunk, self.chunk + max(1, self.chunk // 4))
+        return list(transfers), list(executions)
+
+    def _process(self, start: int, end: int) -> Tuple[List[Dict], List[Dict]]:
+        """查询一个范围并转换为交易服务格式的转账和交易记录"""
+        transfer_logs, execution_logs = self._fetch(start, end)
+        timestamps = {}
+        for log in transfer_logs + execution_logs:
+            if log["blockNumber"] not in timestamps:
+                block = self.w3.eth.get_block(log["blockNumber"])
+                timestamps[log["blockNumber"]] = (
+                    datetime.fromtimestamp(block["timestamp"], timezone.utc).isoformat().replace("+00:00", "Z")
+                )
+
+        transfers = []
+        for log in transfer_logs:
+            tx_hash = _hex(log["transactionHash"])
+            transfers.append({
+                "type": "ERC20_TRANSFER", "transferId": f"e{tx_hash[2:]}{log['logIndex']}",
+                "tokenAddress": self.token, "from": self.safe_address,
+                "to": Web3.to_checksum_address("0x" + _hex(log["topics"][2])[-40:]),
+                "value": str(int(_hex(log["data"]), 16)), "blockNumber": log["blockNumber"],
+                "transactionHash": tx_hash, "executionDate": timestamps[log["blockNumber"]],
+                "tokenInfo": self._token_info,
+            })
+        transactions = [
+            {
+                "txType": "MULTISIG_TRANSACTION", "transactionHash": _hex(log["transactionHash"]),
+                "safeTxHash": execution_safe_tx_hash(log), "nonce": None, "blockNumber": log["blockNumber"],
+                "executionDate": timestamps[log["blockNumber"]],
+                "isSuccessful": _hex(log["topics"][0]) == EXECUTION_SUCCESS_TOPIC,
+            }
+            for log in execution_logs
+        ]
+        return transfers, transactions
+
+    def _load_token_info(self):
+        if self._token_info is None:
+            token = self.w3.eth.contract(address=self.token, abi=[
+                {"name": name, "type": "function", "inputs": [], "stateMutability": "view",
+                 "outputs": [{"name": "", "type": kind}]}
+                for name, kind in (("symbol", "string"), ("decimals", "uint8"))
+            ])
+            self._token_info = {"symbol": token.functions.symbol().call(),
+                                "decimals": token.functions.decimals().call()}
+
+    # ---- 索引 ----
+
+    def index(self) -> Dict:
+        """索引水位之后到 最新区块-confirmations 的日志，返回本次的转账数、交易数和新的水位"""
+        started = time.perf_counter()
+        _, watermark = self.ledger.state(self.network, self.safe_address, LOGS_STREAM)
+        start = max(watermark + 1, self.start_block)
+        head = self.w3.eth.block_number - self.confirmations
+        counts = {"transfers": 0, "transactions": 0, "ranges": 0}
+        if start > head:
+            return {**counts, "watermark": watermark}
+        self._load_token_info()
+
+        # 范围在提交时按当前大小切分，结果按提交顺序写入，水位总是连续推进
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="logs") as pool:
+            try:
+                while start <= head or in_flight:
+                    while start <= head and len(in_flight) < self.workers * 2:
+                        end = min(head, start + self.chunk - 1)
+                        in_flight.append((end, pool.submit(self._process, start, end)))
+                        start = end + 1
+                    end, future = in_flight.popleft()
+                    transfers, transactions = future.result()
+                    self.ledger.save_transfers(self.network, self.safe_address, transfers)
+                    self.ledger.save_transactions(self.network, self.safe_address, transactions, keep_existing=True)
+                    self.ledger.set_state(self.network, self.safe_address, LOGS_STREAM, 0, end)
+                    watermark = end
+                    counts["transfers"] += len(transfers)
+                    counts["transactions"] += len(transactions)
+                    counts["ranges"] += 1
+            finally:
+                for _, future in in_flight:
+                    future.cancel()
+
+        logger.info(
+            "索引日志 %s %s: %d 条转账, %d 笔交易, 区块水位 %d, 拆分 %d 次, 耗时 %.1fs",
+            self.network, self.safe_address, counts["transfers"], counts["transactions"], watermark,
+            self.splits, time.perf_counter() - started,
+        )
+        return {**counts, "watermark": watermark}
+
+
+def confirm_batch(ledger: PayoutLedger, network: str, safe_address: str, safe_tx_hash: str,
+                  expected: List[Dict]) -> Dict:
+    """
+    核对一笔Safe交易中的转账是否全部到账
+
+    Args:
+        expected: 计划文件中从MultiSend数据解码出的转账 [{"token", "to", "amount"}]
+
+    Returns:
+        {"status": "pending"/"confirmed"/"incomplete"/"failed", "tx_hash", "missing": [...], "unexpected": [...]}，
+        failed表示交易已上链但Safe发出了ExecutionFailure，转账都没有发生，nonce已被消耗
+    """
+    execution = ledger.execution(network.lower(), safe_address, safe_tx_hash)
+    if execution is None:
+        return {"status": "pending", "tx_hash": None, "missing": list(expected), "unexpected": []}
+    if execution["is_successful"] == 0:
+        return {"status": "failed", "tx_hash": execution["tx_hash"], "missing": list(expected), "unexpected": []}
+    wanted = Counter((transfer["token"].lower(), transfer["to"].lower(), int(transfer["amount"]))
+                     for transfer in expected)
+    landed = Counter((row["token"], row["recipient"], int(row["value"] or 0))
+                     for row in ledger.transfers_in(network.lower(), safe_address, execution["tx_hash"]))
+    missing = [{"token": token, "to": to, "amount": amount}
+               for (token, to, amount), count in (wanted - landed).items() for _ in range(count)]
+    unexpected = [{"token": token, "to": to, "amount": amount}
+                  for (token, to, amount), count in (landed - wanted).items() for _ in range(count)]
+    return {"status": "incomplete" if missing else "confirmed", "tx_hash": execution["tx_hash"],
+            "missing": missing, "unexpected": unexpected}
@@ -0,0 +1,211 @@
+from threading import RLock
+from typing import Dict, Optional
+import json
+import os
+import time
+from pathlib import Path
+
+import requests
+from web3 import Web3
+
+# 导入自定义日志工具
+from utils.logger import logger
+from utils.files import write_json_atomic
+
+# 缓存文件格式版本，结构变化时递增，旧版本缓存会被丢弃并重新发现
+REGISTRY_VERSION = 1
+
+DEFAULT_REGISTRY_FILE = ".cache/networks.json"
+
+MULTISEND_CALL_ONLY_V1_3_0 = "0x40A2aCCbd92BCA938b02010E17A5b8929b49130D"
+MULTISEND_CALL_ONLY_V1_4_1 = "0x9641d764fc13c8B624c04430C7356C1C7C8102e2"
+
+# 离线内置的网络表，交易服务不可用时使用
+BUNDLED_NETWORKS = {
+    "mainnet": {
+        "chain_id": 1,
+        "service_url": "https://safe-transaction-mainnet.safe.global",
+        "multisend_call_only": {"1.3.0": MULTISEND_CALL_ONLY_V1_3_0, "1.4.1": MULTISEND_CALL_ONLY_V1_4_1},
+    },
+    "sepolia": {
+        "chain_id": 11155111,
+        "service_url": "https://safe-transaction-sepolia.safe.global",
+        "multisend_call_only": {"1.3.0": MULTISEND_CALL_ONLY_V1_3_0, "1.4.1": MULTISEND_CALL_ONLY_V1_4_1},
+    },
+    "gnosis-chain": {
+        "chain_id": 100,
+        "service_url": "https://safe-transaction-gnosis-chain.safe.global",
+        "multisend_call_only": {"1.3.0": MULTISEND_CALL_ONLY_V1_3_0},
+    },
+    "polygon": {
+        "chain_id": 137,
+        "service_url": "https://safe-transaction-polygon.safe.global",
+        "multisend_call_only": {"1.3.0": MULTISEND_CALL_ONLY_V1_3_0},
+    },
+    "arbitrum": {
+        "chain_id": 42161,
+        "service_url": "https://safe-transaction-arbitrum.safe.global",
+        "multisend_call_only": {"1.3.0": MULTISEND_CALL_ONLY_V1_3_0},
+    },
+    "optimism": {
+        "chain_id": 10,
+        "service_url": "https://safe-transaction-optimism.safe.global",
+        "multisend_call_only": {"1.3.0": MULTISEND_CALL_ONLY_V1_3_0},
+    },
+    "base": {
+        "chain_id": 8453,
+        "service_url": "https://safe-transaction-base.safe.global",
+        "multisend_call_only": {"1.3.0": MULTISEND_CALL_ONLY_V1_3_0},
+    },
+    "bsc": {
+        "chain_id": 56,
+        "service_url": "https://safe-transaction-bsc.safe.global",
+        "multisend_call_only": {"1.3.0": MULTISEND_CALL_ONLY_V1_3_0},
+    },
+}
+
+
+def _version_key(version: str):
+    """把 "1.4.1" / "1.3.0+L2" 之类的版本号转换为可比较的元组"""
+    return tuple(int(part) for part in version.split("+")[0].split(".") if part.isdigit())
+
+
+def select_multisend_call_only(network_info: Dict, safe_version: Optional[str] = None) -> str:
+    """
+    选择MultiSendCallOnly地址：优先与Safe版本一致的部署，否则使用最新版本
+    """
+    deployments = network_info["multisend_call_only"]
+    if safe_version:
+        version = safe_version.split("+")[0]
+        if version in deployments:
+            return deployments[version]
+    return deployments[max(deployments, key=_version_key)]
+
+
+class NetworkRegistry:
+    """
+    网络注册表：网络名 -> 链ID、交易服务地址、各版本MultiSendCallOnly地址、singleton列表
+    
+    查找顺序为 内存 -> 磁盘缓存 -> 交易服务 /v1/about/deployments/ 和 /v1/about/singletons/ -> 内置表。
+    首次填充某个网络时校验链ID和合约代码，之后的运行只读取磁盘缓存，不产生额外的网络I/O
+    """
+    
+    def __init__(self, cache_file: Optional[str] = None):
+        if cache_file is None:
+            cache_file = os.getenv("NETWORK_REGISTRY_FILE", DEFAULT_REGISTRY_FILE)
+        self.cache_file = Path(cache_file) if cache_file else None
+        self._lock = RLock()
+        self._networks: Optional[Dict[str, Dict]] = None
+    
+    def _load(self) -> Dict[str, Dict]:
+        if self._networks is not None:
+            return self._networks
+        self._networks = {}
+        if self.cache_file and self.cache_file.exists():
+            try:
+                cached = json.loads(self.cache_file.read_text())
+                if cached.get("version") == REGISTRY_VERSION:
+                    self._networks = cached["networks"]
+                else:
+                    logger.info("网络注册表缓存版本已变化，将重新发现")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"读取网络注册表缓存失败: {str(e)}")
+        return self._networks
+    
+    def _save(self):
+        if self.cache_file:
+            write_json_atomic(self.cache_file, {"version": REGISTRY_VERSION, "networks": self._networks})
+    
+    def service_url(self, name: str) -> str:
+        """交易服务地址，不产生网络I/O"""
+        name = name.lower()
+        override = os.getenv(f"SAFE_SERVICE_URL_{name.upper().replace('-', '_')}")
+        if override:
+            return override.rstrip("/")
+        with self._lock:
+            known = self._load().get(name) or BUNDLED_NETWORKS.get(name)
+        if known:
+            return known["service_url"]
+        return f"https://safe-transaction-{name}.safe.global"
+    
+    def _discover(self, name: str) -> Dict:
+        """从交易服务读取部署信息"""
+        base_url = self.service_url(name)
+        timeout = int(os.getenv("SAFE_SERVICE_TIMEOUT", "10"))
+        
+        response = requests.get(f"{base_url}/api/v1/about/deployments/", timeout=timeout)
+        response.raise_for_status()
+        multisend_call_only = {}
+        for deployment in response.json():
+            for contract in deployment["contracts"]:
+                if contract["contractName"] == "MultiSendCallOnly" and contract["address"]:
+                    multisend_call_only[deployment["version"]] = contract["address"]
+        if not multisend_call_only:
+            raise ValueError(f"交易服务未返回MultiSendCallOnly部署: {base_url}")
+        
+        response = requests.get(f"{base_url}/api/v1/about/singletons/", timeout=timeout)
+        response.raise_for_status()
+        singletons = [
+            {"address": singleton["address"], "version": singleton["version"], "l2": singleton["l2"]}
+            for singleton in response.json()
+        ]
+        
+        return {
+            "service_url": base_url,
+            "multisend_call_only": multisend_call_only,
+            "singletons": singletons,
+        }
+    
+    def _verify(self, name: str, network_info: Dict, w3: Web3):
+        """校验RPC链ID与网络一致，且所有MultiSendCallOnly地址上有合约代码"""
+        chain_id = w3.eth.chain_id
+        if network_info.get("chain_id") not in (None, chain_id):
+            raise ValueError(f"RPC链ID {chain_id} 与网络 {name} ({network_info['chain_id']}) 不一致")
+        network_info["chain_id"] = chain_id
+        for version, address in network_info["multisend_call_only"].items():
+            if not w3.eth.get_code(Web3.to_checksum_address(address)):
+                raise ValueError(f"网络 {name} 上MultiSendCallOnly {version} ({address}) 没有合约代码")
+    
+    def get(self, name: str, w3: Optional[Web3] = None) -> Dict:
+        """
+        获取网络信息
+        
+        Args:
+            name: 网络名，如mainnet、sepolia、gnosis-chain
+            w3: 该网络的Web3连接，用于首次填充时的校验；为None时只查缓存和内置表，不产生网络I/O
+            
+        Returns:
+            包含chain_id、service_url、multisend_call_only的字典
+        """
+        name = name.lower()
+        with self._lock:
+            networks = self._load()
+            if name in networks:
+                return networks[name]
+            bundled = BUNDLED_NETWORKS.get(name)
+            if w3 is None:
+                if not bundled:
+                    raise ValueError(f"不支持的网络: {name}")
+                return {**bundled, "source": "bundled"}
+            
+            try:
+                network_info = self._discover(name)
+                network_info["source"] = "service"
+                if bundled:
+                    network_info["chain_id"] = bundled["chain_id"]
+            except (OSError, ValueError, KeyError) as e:
+                if not bundled:
+                    raise ValueError(f"不支持的网络: {name} ({str(e)})")
+                logger.warning(f"无法从交易服务获取 {name} 的部署信息，使用内置表: {str(e)}")
+                network_info = {**bundled, "source": "bundled"}
+            
+            self._verify(name, network_info, w3)
+            network_info["fetched_at"] = int(time.time())
+            networks[name] = network_info
+            self._save()
+            logger.info(f"已缓存网络 {name} 的部署信息 (来源: {network_info['source']})")
+            return network_info
+
+
+# 创建单例实例
+network_registry = NetworkRegistry()
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import mmap
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from eth_account import Account
+from hexbytes import HexBytes
+from safe_eth.safe import SafeTx
+from safe_eth.safe.multi_send import MultiSend
+from web3 import Web3
+
+from utils.logger import logger
+
+# 计划文件格式版本，格式不兼容地变化时递增（2: safe_tx记录包含Safe的所有者）
+PLAN_VERSION = 2
+
+DEFAULT_PLAN_FILE = "plan.jsonl"
+
+# ERC20 transfer(address,uint256) 的函数选择器
+TRANSFER_SELECTOR = HexBytes("0xa9059cbb")
+
+
+def _dumps(record: Dict) -> bytes:
+    """规范化JSON：同样的内容总是得到同样的字节"""
+    return json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def decode_transfers(multisend_data: str) -> List[Dict]:
+    """
+    从MultiSend数据中解码出USDT转账，计划文件中以此为准，便于审核实际会支付的内容
+
+    Returns:
+        [{"token", "to", "amount"}]，amount为最小单位
+    """
+    transfers = []
+    for tx in MultiSend.from_transaction_data(HexBytes(multisend_data)):
+        data = HexBytes(tx.data)
+        if data[:4] != TRANSFER_SELECTOR or len(data) != 68:
+            raise ValueError(f"MultiSend中包含非transfer调用: {tx.to}")
+        transfers.append({
+            "token": tx.to,
+            "to": Web3.to_checksum_address(data[16:36]),
+            "amount": int.from_bytes(data[36:68], "big"),
+        })
+    return transfers
+
+
+def included_rows(transfers: List[Dict], rows: List[Dict]) -> Iterator[Tuple[Dict, int, bool]]:
+    """
+    逐行判断是否包含在解码出的转账中；模拟阶段丢弃的行不会出现在MultiSend数据中
+
+    Returns:
+        逐行产出 (行, 最小单位金额, 是否包含)
+    """
+    remaining = Counter((transfer["to"], transfer["amount"]) for transfer in transfers)
+    for item in rows:
+        amount = int(item["row"]["amount"] * 10**6)
+        included = remaining[(item["to_address"], amount)] > 0
+        if included:
+            remaining[(item["to_address"], amount)] -= 1
+        yield item, amount, included
+
+
+class PlanWriter:
+    """
+    流式写入计划文件（JSON lines）
+
+    第一行是header，随后是row和safe_tx记录，最后一行是end记录，包含输入快照哈希、
+    记录数和之前所有行的sha256。内容不含时间戳，同样的输入和链上状态得到逐字节相同的文件。
+    先写临时文件，close时再替换，中断时不会留下不完整的计划
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.temp_file = self.path.with_suffix(self.path.suffix + ".tmp")
+        self._file = open(self.temp_file, "wb")
+        self._digest = hashlib.sha256()
+        self._snapshot = hashlib.sha256()
+        self.rows = 0
+        self.safe_txs = 0
+        self._write({"type": "header", "version": PLAN_VERSION})
+
+    def _write(self, record: Dict):
+        line = _dumps(record)
+        self._digest.update(line)
+        self._file.write(line)
+
+    def add_source_row(self, row: Dict):
+        """把一行Notion原始数据计入输入快照哈希"""
+        self._snapshot.update(_dumps(row))
+
+    def add_safe_tx(self, network: str, chain_id: int, safe_address: str, safe_version: str,
+                    owners: List[str], batch_tx: Dict, rows: List[Dict]):
+        """
+        写入一笔Safe交易及其包含的行
+
+        Args:
+            owners: 构建时Safe的所有者，离线签名时只用这些地址对应的私钥
+            batch_tx: build阶段生成的交易数据字典
+            rows: 打包进这笔交易的行，包含原始行和解析后的收款地址
+        """
+        transfers = decode_transfers(batch_tx["data"])
+        for item, amount, included in included_rows(transfers, rows):
+            row = item["row"]
+            self._write({
+                "type": "row",
+                "page_id": row.get("page_id"),
+                "address": row["address"],
+                "to": item["to_address"],
+                "amount": row["amount"],
+                "amount_base": amount,
+                "network": network,
+                "safe": safe_address,
+                "safe_tx_hash": batch_tx["safe_tx_hash"] if included else None,
+            })
+            self.rows += 1
+
+        self._write({
+            "type": "safe_tx",
+            "network": network,
+            "chain_id": chain_id,
+            "safe": safe_address,
+            "safe_version": safe_version,
+            "owners": owners,
+            "tx": batch_tx,
+            "transfers": transfers,
+        })
+        self.safe_txs += 1
+
+    def close(self) -> Dict:
+        """写入end记录并原子替换目标文件"""
+        end = {
+            "type": "end",
+            "snapshot_hash": self._snapshot.hexdigest(),
+            "rows": self.rows,
+            "safe_txs": self.safe_txs,
+            "digest": self._digest.hexdigest(),
+        }
+        self._file.write(_dumps(end))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_file, self.path)
+        return end
+
+    def abort(self):
+        self._file.close()
+        self.temp_file.unlink(missing_ok=True)
+
+
+class PlanFile:
+    """
+    读取计划文件
+
+    文件通过mmap逐行读取，遍历巨大的计划时内存占用与单条记录大小相当
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.header = json.loads(f.readline())
+        if self.header.get("type") != "header" or self.header.get("version") != PLAN_VERSION:
+            raise ValueError(f"不支持的计划文件版本: {self.header.get('version')}")
+        self.end = self._read_end()
+
+    def _read_end(self) -> Dict:
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 4096))
+            last = f.read().rstrip(b"\n").rsplit(b"\n", 1)[-1]
+        end = json.loads(last)
+        if end.get("type") != "end":
+            raise ValueError(f"计划文件不完整: {self.path}")
+        return end
+
+    def records(self) -> Iterator[Dict]:
+        """按顺序产出header之后、end之前的全部记录"""
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            mm.readline()
+            while True:
+                line = mm.readline()
+                record = json.loads(line)
+                if record["type"] == "end":
+                    return
+                yield record
+
+    def rows(self) -> Iterator[Dict]:
+        return (record for record in self.records() if record["type"] == "row")
+
+    def safe_txs(self) -> Iterator[Dict]:
+        return (record for record in self.records() if record["type"] == "safe_tx")
+
+    def verify(self):
+        """校验文件内容与end记录中的摘要一致，并逐笔重新计算Safe交易哈希"""
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while True:
+                line = mm.readline()
+                if json.loads(line)["type"] == "end":
+                    break
+                digest.update(line)
+        if digest.hexdigest() != self.end["digest"]:
+            raise ValueError(f"计划文件已被修改: {self.path}")
+        for record in self.safe_txs():
+            safe_tx_hash = build_safe_tx(record).safe_tx_hash.hex()
+            if HexBytes(safe_tx_hash) != HexBytes(record["tx"]["safe_tx_hash"]):
+                raise ValueError(f"Safe交易哈希不匹配: {record['tx']['safe_tx_hash']}")
+
+
+def build_safe_tx(record: Dict) -> SafeTx:
+    """
+    根据计划中的safe_tx记录离线重建SafeTx，链ID和Safe版本都来自计划文件，不需要RPC
+    """
+    tx = record["tx"]
+    return SafeTx(
+        None,
+        record["safe"],
+        tx["to"],
+        int(tx["value"]),
+        HexBytes(tx["data"]),
+        int(tx["operation"]),
+        int(tx["safeTxGas"]),
+        int(tx["baseGas"]),
+        int(tx["gasPrice"]),
+        tx["gasToken"],
+        tx["refundReceiver"],
+        safe_nonce=int(tx["nonce"]),
+        safe_version=record["safe_version"],
+        chain_id=record["chain_id"],
+    )
+
+
+def signatures_path(plan_path: Path) -> Path:
+    """签名与计划文件放在一起：plan.jsonl -> plan.jsonl.signatures"""
+    plan_path = Path(plan_path)
+    return plan_path.with_name(plan_path.name + ".signatures")
+
+
+def load_signatures(plan_path: Path) -> Dict[str, Dict[str, str]]:
+    """
+    读取计划的签名文件
+
+    Returns:
+        {safe_tx_hash: {签名者地址: 签名hex}}
+    """
+    signatures: Dict[str, Dict[str, str]] = {}
+    path = signatures_path(plan_path)
+    if not path.exists():
+        return signatures
+    for line in path.read_text().splitlines():
+        if line.strip():
+            record = json.loads(line)
+            signatures.setdefault(record["safe_tx_hash"], {})[record["signer"]] = record["signature"]
+    return signatures
+
+
+def sign_plan(plan_path: Path, private_keys: List[str]) -> int:
+    """
+    使用本地私钥离线签名计划中的每笔Safe交易，签名追加到签名文件，已签过的跳过；
+    不属于该Safe所有者的私钥不签名，否则交易服务会拒绝整个提议
+
+    Returns:
+        新增的签名数
+    """
+    plan = PlanFile(plan_path)
+    plan.verify()
+    existing = load_signatures(plan_path)
+    signers = [(key, Account.from_key(key).address) for key in private_keys]
+
+    count = 0
+    with open(signatures_path(plan_path), "a") as f:
+        for record in plan.safe_txs():
+            safe_tx_hash = record["tx"]["safe_tx_hash"]
+            owners = {owner.lower() for owner in record["owners"]}
+            for key, signer in signers:
+                if signer.lower() not in owners:
+                    logger.debug("%s 不是 %s 的所有者，跳过签名", signer, record["safe"])
+                    continue
+                if signer in existing.get(safe_tx_hash, {}):
+                    continue
+                signature = build_safe_tx(record).sign(key)
+                f.write(json.dumps({"safe_tx_hash": safe_tx_hash, "signer": signer,
+                                    "signature": signature.hex()}, sort_keys=True) + "\n")
+                existing.setdefault(safe_tx_hash, {})[signer] = signature.hex()
+                count += 1
+                logger.info("已签名 nonce %s: %s (%s)", record["tx"]["nonce"], safe_tx_hash, signer)
+        f.flush()
+        os.fsync(f.fileno())
+    return count
+
+
+def combined_signature(signatures: Dict[str, str], owners: List[str]) -> Optional[bytes]:
+    """只保留所有者的签名，按签名者地址升序拼接，Safe合约要求的顺序"""
+    owners = {owner.lower() for owner in owners}
+    signers = [signer for signer in signatures if signer.lower() in owners]
+    if not signers:
+        return None
+    return b"".join(
+        HexBytes(signatures[signer])
+        for signer in sorted(signers, key=lambda address: int(address, 16))
+    )
@@ -0,0 +1,258 @@
+import json
+import os
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from web3 import Web3
+
+from utils.logger import logger
+
+load_dotenv()
+
+DEFAULT_RECONCILE_OUTPUT = "reconcile.jsonl"
+
+# 对账结果的分类
+MATCHED = "matched"          # 行与一笔金额相同的转账对应
+MISSING = "missing"          # 时间窗口内没有找到对应的转账
+PENDING = "pending"          # 还没有转账，但时间窗口尚未结束
+DUPLICATED = "duplicated"    # 行已经支付过，时间窗口内又收到相同金额的转账
+OVER_PAID = "over_paid"      # 转给待支付的收款地址，金额大于行的金额
+UNDER_PAID = "under_paid"    # 转给待支付的收款地址，金额小于行的金额
+UNEXPECTED = "unexpected"    # 没有任何待支付的行对应
+UNRESOLVED = "unresolved"    # 行的地址是ENS名称且没有提供解析函数
+
+CATEGORIES = (MATCHED, MISSING, PENDING, DUPLICATED, OVER_PAID, UNDER_PAID, UNEXPECTED, UNRESOLVED)
+
+Key = Tuple[str, str, str, int]
+
+
+def parse_time(value: str) -> datetime:
+    """Notion的created_time和交易服务的executionDate（以Z结尾的ISO时间）"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def usdt_contract(network: str) -> str:
+    """网络对应的USDT合约，配置方式同SafeOrchestrator"""
+    address = os.getenv(f"USDT_CONTRACT_{network.upper()}") or os.getenv("USDT_CONTRACT") or ""
+    return address.lower()
+
+
+class _Entry:
+    """窗口中的一行，matched_at为None表示尚未支付"""
+
+    __slots__ = ("row", "key", "time", "matched_at")
+
+    def __init__(self, row: Dict, key: Key, time: datetime):
+        self.row = row
+        self.key = key
+        self.time = time
+        self.matched_at: Optional[datetime] = None
+
+
+class Reconciler:
+    """
+    Notion行与链上转账的对账
+
+    两个输入都按时间升序流式读取，做滑动窗口的哈希连接：
+    - 行按 (网络, 收款地址, 代币, 基础单位金额) 放入哈希索引，等待创建之后window内的转账
+    - 转账先查相同键的待支付行（最早的优先），其次是窗口内已经支付过的相同键（重复支付），
+      再其次是同一收款地址和代币的待支付行（金额不符），都没有时为unexpected
+    - 行的窗口结束时仍未支付则为missing；已支付的行在窗口结束后移出索引
+
+    内存只与窗口内的行数有关，多年的历史一次扫描完成。结果逐条交给emit，不在内存中累积
+    """
+
+    def __init__(self, window: Optional[timedelta] = None, resolve: Optional[Callable[[str], Optional[str]]] = None,
+                 default_network: Optional[str] = None):
+        """
+        Args:
+            window: 行创建后等待转账的时间，默认读取RECONCILE_WINDOW_DAYS（30天）
+            resolve: ENS名称解析函数，未提供时ENS地址的行归为unresolved
+            default_network: 行没有网络列时使用，默认读取NETWORK
+        """
+        self.window = window or timedelta(days=float(os.getenv("RECONCILE_WINDOW_DAYS", "30")))
+        self.resolve = resolve
+        self.default_network = (default_network or os.getenv("NETWORK", "sepolia")).lower()
+        # 哈希索引：待支付的行和窗口内已支付的行，各自按时间排序
+        self._pending: Dict[Key, Deque[_Entry]] = {}
+        self._paid: Dict[Key, Deque[_Entry]] = {}
+        # 同一 (网络, 收款地址, 代币) 下有待支付行的金额及行数，用于识别金额不符
+        self._amounts: Dict[Tuple[str, str, str], Counter] = {}
+        # 按加入窗口的时间排序，用于淘汰
+        self._window: Deque[_Entry] = deque()
+        self.counts = Counter()
+        self.peak_window = 0
+
+    def row_key(self, row: Dict) -> Optional[Key]:
+        network = (row.get("network") or self.default_network).lower()
+        address = row["address"].strip()
+        if not Web3.is_address(address):
+            address = self.resolve(address) if self.resolve else None
+            if not address:
+                return None
+        # 与encode_transfer的换算一致，才能和实际转出的金额对上
+        return network, address.lower(), usdt_contract(network), int(row["amount"] * 10**6)
+
+    @staticmethod
+    def transfer_key(transfer: Dict) -> Key:
+        return (transfer["network"].lower(), transfer["recipient"].lower(), (transfer["token"] or "").lower(),
+                int(transfer["value"] or 0))
+
+    # ---- 窗口维护 ----
+
+    def _add(self, entry: _Entry):
+        self._pending.setdefault(entry.key, deque()).append(entry)
+        self._amounts.setdefault(entry.key[:3], Counter())[entry.key[3]] += 1
+        self._window.append(entry)
+        self.peak_window = max(self.peak_window, len(self._window))
+
+    def _take(self, key: Key) -> _Entry:
+        """取出相同键最早的待支付行"""
+        pending = self._pending[key]
+        entry = pending.popleft()
+        if not pending:
+            del self._pending[key]
+        amounts = self._amounts[key[:3]]
+        amounts[key[3]] -= 1
+        if not amounts[key[3]]:
+            del amounts[key[3]]
+            if not amounts:
+                del self._amounts[key[:3]]
+        return entry
+
+    def _expire(self, now: datetime, emit: Callable[[str, Dict], None]):
+        """淘汰窗口在now之前结束的行"""
+        while self._window and self._window[0].time + self.window < now:
+            entry = self._window.popleft()
+            if entry.matched_at is None:
+                self._take(entry.key)
+                self._emit(emit, MISSING, entry.row)
+            else:
+                paid = self._paid[entry.key]
+                paid.remove(entry)
+                if not paid:
+                    del self._paid[entry.key]
+
+    # ---- 结果 ----
+
+    def _emit(self, emit: Callable[[str, Dict], None], category: str, row: Optional[Dict] = None,
+              transfer: Optional[Dict] = None):
+        self.counts[category] += 1
+        record = {"category": category}
+        if row is not None:
+            record.update(page_id=row.get("page_id"), address=row.get("address"),
+                          amount=row.get("amount"), created_time=row.get("created_time"))
+        if transfer is not None:
+            record.update(recipient=transfer["recipient"], value=str(transfer["value"]),
+                          tx_hash=transfer.get("tx_hash"), execution_date=transfer.get("execution_date"),
+                          safe=transfer.get("safe"), nonce=transfer.get("nonce"),
+                          safe_tx_hash=transfer.get("safe_tx_hash"))
+        emit(category, record)
+
+    def _on_transfer(self, transfer: Dict, at: datetime, emit: Callable[[str, Dict], None]):
+        key = self.transfer_key(transfer)
+        if key in self._pending:
+            entry = self._take(key)
+            entry.matched_at = at
+            self._paid.setdefault(key, deque()).append(entry)
+            self._emit(emit, MATCHED, entry.row, transfer)
+            return
+        if key in self._paid:
+            self._emit(emit, DUPLICATED, self._paid[key][0].row, transfer)
+            return
+        amounts = self._amounts.get(key[:3])
+        if amounts:
+            # 金额不符时对应最早创建的待支付行
+            entry = min((self._pending[key[:3] + (amount,)][0] for amount in amounts), key=lambda e: e.time)
+            self._take(entry.key)
+            entry.matched_at = at
+            self._paid.setdefault(entry.key, deque()).append(entry)
+            self._emit(emit, OVER_PAID if key[3] > entry.key[3] else UNDER_PAID, entry.row, transfer)
+            return
+        self._emit(emit, UNEXPECTED, transfer=transfer)
+
+    def run(self, rows: Iterable[Dict], transfers: Iterable[Dict], emit: Callable[[str, Dict], None],
+            as_of: Optional[datetime] = None) -> Counter:
+        """
+        Args:
+            rows: 按created_time升序的Notion行（NotionClient.iter_payout_rows）
+            transfers: 按execution_date升序的转出记录（PayoutLedger.iter_payments）
+            emit: 每条结果调用一次 emit(分类, 记录)
+            as_of: 窗口在此时间之后才结束的未支付行为pending，默认为最后一笔转账的时间
+
+        Returns:
+            各分类的条数
+        """
+        rows, transfers = iter(rows), iter(transfers)
+        row = next(rows, None)
+        transfer = next(transfers, None)
+        row_time = parse_time(row["created_time"]) if row else None
+        transfer_time = parse_time(transfer["execution_date"]) if transfer else None
+        last = None
+        while row is not None or transfer is not None:
+            # 时间相同时先处理行：行总是在支付它的转账之前创建
+            if transfer is None or (row is not None and row_time <= transfer_time):
+                self._expire(row_time, emit)
+                key = self.row_key(row)
+                if key is None:
+                    self._emit(emit, UNRESOLVED, row)
+                else:
+                    self._add(_Entry(row, key, row_time))
+                row = next(rows, None)
+                row_time = parse_time(row["created_time"]) if row else None
+            else:
+                self._expire(transfer_time, emit)
+                self._on_transfer(transfer, transfer_time, emit)
+                last = transfer_time
+                transfer = next(transfers, None)
+                transfer_time = parse_time(transfer["execution_date"]) if transfer else None
+
+        as_of = as_of or last
+        for entry in self._window:
+            if entry.matched_at is None:
+                self._emit(emit, MISSING if as_of and entry.time + self.window < as_of else PENDING, entry.row)
+        self._window.clear()
+        self._pending.clear()
+        self._paid.clear()
+        self._amounts.clear()
+        return self.counts
+
+
+class ReportWriter:
+    """对账结果逐行写入JSONL文件，另外保留每个分类的前几条用于日志"""
+
+    def __init__(self, path: Optional[str] = None, samples: int = 5):
+        self.path = Path(path or os.getenv("RECONCILE_OUTPUT", DEFAULT_RECONCILE_OUTPUT))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.samples: Dict[str, List[Dict]] = {}
+        self.limit = samples
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "w", encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+    def __call__(self, category: str, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        samples = self.samples.setdefault(category, [])
+        if len(samples) < self.limit:
+            samples.append(record)
+
+
+def reconcile(rows: Iterable[Dict], transfers: Iterable[Dict], output: Optional[str] = None,
+              window: Optional[timedelta] = None, resolve: Optional[Callable[[str], Optional[str]]] = None,
+              as_of: Optional[datetime] = None) -> Dict:
+    """对账并写出报告，返回 {"counts", "samples", "output", "peak_window"}"""
+    reconciler = Reconciler(window=window, resolve=resolve)
+    with ReportWriter(output) as writer:
+        counts = reconciler.run(rows, transfers, writer, as_of=as_of)
+    summary = ", ".join(f"{category} {counts[category]}" for category in CATEGORIES if counts[category])
+    logger.info("对账完成: %s (窗口内最多 %d 行)", summary or "没有数据", reconciler.peak_window)
+    return {"counts": dict(counts), "samples": writer.samples, "output": str(writer.path),
+            "peak_window": reconciler.peak_window}
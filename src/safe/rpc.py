@@ -0,0 +1,366 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from safe_eth.eth import EthereumClient
+from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+
+from safe.rpc_cache import RPCCacheProvider, install_rpc_cache
+from utils.logger import logger
+from utils.metrics import metrics
+
+# 结果与端点无关的只读请求，同时发给最快的几个端点，取最先返回的正常结果
+HEDGED_METHODS = {"eth_call", "eth_getCode", "eth_chainId", "eth_getStorageAt", "eth_getBalance", "net_version"}
+
+# 写请求固定发往一个端点；已签名交易的哈希确定，超时后重发是安全的
+WRITE_METHODS = {"eth_sendRawTransaction"}
+
+# 节点已经收到该交易时的错误信息，视为发送成功
+_ALREADY_KNOWN = ("already known", "known transaction", "already imported", "transaction already exists")
+
+# 与端点状态有关、换一个端点可能成功的JSON-RPC错误
+_RETRYABLE_CODES = {-32005, -32603, -32002}
+_RETRYABLE_MESSAGES = ("rate limit", "too many requests", "timeout", "timed out", "header not found",
+                       "missing trie node", "capacity", "unavailable")
+
+# eth_getLogs的结果或区块范围超出节点限制，缩小范围重试而不是换端点
+TOO_MANY_RESULTS_MESSAGES = ("query returned more than", "response size exceeded", "block range", "is limited to",
+                             "too many results", "range too large", "range is too large", "too wide",
+                             "max results")
+
+# 连续失败后暂停使用端点的时长（秒），随连续失败次数翻倍
+COOLDOWN_BASE = 1.0
+COOLDOWN_MAX = 60.0
+
+# 延迟的指数移动平均系数
+LATENCY_ALPHA = 0.3
+
+
+def rpc_urls(value: Optional[str]) -> List[str]:
+    """RPC_URL可以是逗号分隔的多个端点"""
+    return [url.strip() for url in (value or "").split(",") if url.strip()]
+
+
+class Endpoint:
+    """一个RPC端点的健康状态"""
+
+    def __init__(self, url: str):
+        self.url = url
+        parsed = urlparse(url)
+        # 路径中常带有API Key，统计和日志只使用协议和主机
+        self.label = f"{parsed.scheme}://{parsed.netloc}"
+        self.latency: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.hedge_wins = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def score(self) -> float:
+        """越小越好：平均延迟，按连续失败次数加权；没有数据的端点排在已知较快的端点之后"""
+        latency = self.latency if self.latency is not None else 0.5
+        return latency * (1 + self.consecutive_failures)
+
+    def record(self, seconds: float, ok: bool):
+        if ok:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.cooldown_until = 0.0
+            self.latency = seconds if self.latency is None else (
+                LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * self.latency
+            )
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            cooldown = min(COOLDOWN_MAX, COOLDOWN_BASE * 2 ** (self.consecutive_failures - 1))
+            self.cooldown_until = time.monotonic() + cooldown
+
+    def to_dict(self) -> Dict:
+        return {
+            "endpoint": self.label,
+            "latency_ms": None if self.latency is None else self.latency * 1000,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+def _json_response(url: str, payload: Any) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps(payload).encode()
+    return response
+
+
+def is_too_many_results(error: Any) -> bool:
+    """JSON-RPC错误（字典或错误信息）是否表示eth_getLogs的结果过多"""
+    message = str(error.get("message", "") if isinstance(error, dict) else error).lower()
+    return any(text in message for text in TOO_MANY_RESULTS_MESSAGES)
+
+
+def _retry_reason(response: requests.Response) -> Optional[str]:
+    """响应是否说明该端点出了问题（换一个端点可能成功）；确定性的错误（如revert）返回None"""
+    if response.status_code >= 300:
+        return f"HTTP {response.status_code}"
+    try:
+        payload = response.json()
+    except ValueError:
+        return "响应不是JSON"
+    for item in payload if isinstance(payload, list) else [payload]:
+        error = item.get("error") if isinstance(item, dict) else None
+        if not error:
+            continue
+        message = str(error.get("message", "")).lower()
+        if "revert" in message or is_too_many_results(error):
+            continue
+        if error.get("code") in _RETRYABLE_CODES or any(text in message for text in _RETRYABLE_MESSAGES):
+            return f"RPC错误 {error.get('code')}: {error.get('message')}"
+    return None
+
+
+class FailoverSession(requests.Session):
+    """
+    在多个RPC端点之间路由JSON-RPC请求的requests会话
+
+    - HEDGED_METHODS中的只读请求同时发给健康评分最好的hedge个端点，取最先返回的正常结果，
+      都失败时依次尝试其余端点
+    - 其他读请求按评分依次尝试，端点出错（HTTP错误、超时、限流等）时切换到下一个
+    - eth_sendRawTransaction固定发往一个端点；连接失败或超时时在同一端点重试，
+      节点回复已知交易时视为成功，重试用尽后才换端点重发同一笔已签名交易
+
+    健康评分为延迟的指数移动平均，按连续失败次数加权；连续失败的端点暂停使用一段时间，
+    所有端点都在暂停中时仍按恢复时间依次尝试。传给request的url被忽略
+    """
+
+    def __init__(self, urls: List[str], hedge: Optional[int] = None, hedge_delay: Optional[float] = None,
+                 write_retries: Optional[int] = None):
+        """
+        Args:
+            urls: RPC端点
+            hedge: 对冲读取同时请求的端点数，默认读取RPC_HEDGE（2）
+            hedge_delay: 第一个端点超过该时间（秒）仍未返回时才请求其余端点，默认读取RPC_HEDGE_DELAY（0，立即发出）
+            write_retries: 写请求在同一端点的重试次数，默认读取RPC_WRITE_RETRIES（2）
+        """
+        super().__init__()
+        if not urls:
+            raise ValueError("至少需要一个RPC端点")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.hedge = hedge or int(os.getenv("RPC_HEDGE", "2"))
+        self.hedge_delay = hedge_delay if hedge_delay is not None else float(os.getenv("RPC_HEDGE_DELAY", "0"))
+        self.write_retries = write_retries if write_retries is not None else int(os.getenv("RPC_WRITE_RETRIES", "2"))
+        self.pinned: Optional[Endpoint] = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(4, len(urls) * 4), thread_name_prefix="rpc")
+
+    def ordered(self) -> List[Endpoint]:
+        """可用端点按评分排序，暂停中的端点按恢复时间排在最后"""
+        now = time.monotonic()
+        with self._lock:
+            available = sorted((e for e in self.endpoints if e.available(now)), key=Endpoint.score)
+            cooling = sorted((e for e in self.endpoints if not e.available(now)), key=lambda e: e.cooldown_until)
+        return available + cooling
+
+    def health(self) -> List[Dict]:
+        with self._lock:
+            return [endpoint.to_dict() for endpoint in self.endpoints]
+
+    # ---- 路由 ----
+
+    def request(self, method, url, *args, **kwargs):
+        if method.upper() != "POST":
+            return super().request(method, url, *args, **kwargs)
+        return self.route(**kwargs)
+
+    def route(self, **kwargs) -> requests.Response:
+        """按请求中的JSON-RPC方法选择对冲、故障转移或固定端点；kwargs与requests.post相同"""
+        payload = kwargs.get("json")
+        if payload is None:
+            try:
+                payload = json.loads(kwargs.get("data") or b"null")
+            except ValueError:
+                payload = None
+        calls = payload if isinstance(payload, list) else [payload]
+        methods = {call.get("method") for call in calls if isinstance(call, dict)}
+
+        if methods & WRITE_METHODS and isinstance(payload, dict):
+            return self._write(payload, kwargs)
+        if methods and methods <= HEDGED_METHODS and len(self.endpoints) > 1:
+            return self._hedged(kwargs)
+        return self._failover(self.ordered(), kwargs)
+
+    def _send(self, endpoint: Endpoint, kwargs: Dict) -> Tuple[Optional[requests.Response], Optional[Exception]]:
+        """向一个端点发送请求并更新健康状态，返回 (响应, 异常)，响应为None时表示连接失败"""
+        started = time.perf_counter()
+        response, error = None, None
+        try:
+            response = super().request("POST", endpoint.url, **kwargs)
+            reason = _retry_reason(response)
+        except requests.RequestException as e:
+            error, reason = e, str(e)
+        seconds = time.perf_counter() - started
+        with self._lock:
+            endpoint.record(seconds, reason is None)
+            failures = endpoint.consecutive_failures
+        metrics.record_call("rpc_endpoint", endpoint.label, seconds, error=reason is not None)
+        if reason is not None:
+            logger.warning("RPC端点 %s 请求失败 (连续 %d 次): %s", endpoint.label, failures, reason)
+        return response, error
+
+    def _failover(self, endpoints: List[Endpoint], kwargs: Dict,
+                  last: Tuple[Optional[requests.Response], Optional[Exception]] = (None, None)):
+        """依次尝试，返回第一个正常的响应；都失败时返回最后一个响应或抛出最后的异常"""
+        response, error = last
+        for endpoint in endpoints:
+            response, error = self._send(endpoint, kwargs)
+            if response is not None and _retry_reason(response) is None:
+                return response
+        if response is not None:
+            return response
+        raise error or requests.ConnectionError("没有可用的RPC端点")
+
+    def _hedged(self, kwargs: Dict):
+        candidates = self.ordered()
+        first, rest = candidates[:self.hedge], candidates[self.hedge:]
+        done = threading.Event()
+
+        def attempt(index: int, endpoint: Endpoint):
+            # 排在后面的端点等待hedge_delay，期间已有结果时不再发出
+            if index and self.hedge_delay and done.wait(self.hedge_delay):
+                return endpoint, None, None
+            response, error = self._send(endpoint, kwargs)
+            if response is not None and _retry_reason(response) is None:
+                done.set()
+            return endpoint, response, error
+
+        pending = {self._executor.submit(attempt, i, endpoint) for i, endpoint in enumerate(first)}
+        last: Tuple[Optional[requests.Response], Optional[Exception]] = (None, None)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                endpoint, response, error = future.result()
+                if response is not None and _retry_reason(response) is None:
+                    done.set()
+                    with self._lock:
+                        endpoint.hedge_wins += 1
+                    return response
+                if response is not None or error is not None:
+                    last = (response, error)
+        return self._failover(rest, kwargs, last)
+
+    def _write(self, payload: Dict, kwargs: Dict):
+        attempts = 0
+        tried = []
+        while True:
+            if self.pinned is None or self.pinned in tried:
+                remaining = [e for e in self.ordered() if e not in tried]
+                if not remaining:
+                    break
+                self.pinned = remaining[0]
+                attempts = 0
+            endpoint = self.pinned
+            response, error = self._send(endpoint, kwargs)
+            if response is not None:
+                known = self._already_known(payload, response)
+                if known is not None:
+                    return known
+                if _retry_reason(response) is None:
+                    return response
+            attempts += 1
+            if attempts > self.write_retries:
+                logger.warning("RPC端点 %s 发送交易失败 %d 次，换端点重发同一笔已签名交易", endpoint.label, attempts)
+                tried.append(endpoint)
+        if response is not None:
+            return response
+        raise error
+
+    @staticmethod
+    def _already_known(payload: Dict, response: requests.Response) -> Optional[requests.Response]:
+        """节点回复交易已知时，按已签名交易计算哈希，返回成功的响应"""
+        try:
+            error = response.json().get("error") or {}
+        except ValueError:
+            return None
+        if not any(text in str(error.get("message", "")).lower() for text in _ALREADY_KNOWN):
+            return None
+        tx_hash = Web3.keccak(hexstr=payload["params"][0]).hex()
+        return _json_response(response.url, {"jsonrpc": "2.0", "id": payload.get("id"), "result": tx_hash})
+
+    def verify_chain_id(self):
+        """所有能连接的端点必须在同一条链上"""
+        chain_ids = {}
+        for endpoint in self.endpoints:
+            response, _ = self._send(endpoint, {"json": {"jsonrpc": "2.0", "id": 1, "method": "eth_chainId",
+                                                         "params": []}, "timeout": 10})
+            if response is not None and _retry_reason(response) is None and "result" in response.json():
+                chain_ids[endpoint.label] = int(response.json()["result"], 16)
+        if len(set(chain_ids.values())) > 1:
+            raise ValueError(f"RPC端点的链ID不一致: {chain_ids}")
+
+
+class FailoverProvider(JSONBaseProvider):
+    """通过FailoverSession发送请求的web3 provider"""
+
+    def __init__(self, session: FailoverSession, timeout: float = 10):
+        super().__init__()
+        self.session = session
+        self.timeout = timeout
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        # 直接调用route，不经过instrument_session对会话的统计，避免web3调用重复计数
+        response = self.session.route(data=request_data, headers={"Content-Type": "application/json"},
+                                      timeout=self.timeout)
+        response.raise_for_status()
+        return self.decode_rpc_response(response.content)
+
+
+def create_ethereum_client(rpc_url: str) -> EthereumClient:
+    """
+    创建EthereumClient；rpc_url包含多个逗号分隔的端点时，web3请求和safe-eth-py的批量请求
+    都经过同一个FailoverSession。web3请求经过RPC结果缓存（见safe.rpc_cache）
+    """
+    urls = rpc_urls(rpc_url)
+    if len(urls) <= 1:
+        ethereum_client = EthereumClient(rpc_url)
+    else:
+        session = FailoverSession(urls)
+        session.verify_chain_id()
+        ethereum_client = EthereumClient(urls[0])
+        ethereum_client.http_session = session
+        # EthereumClient的各个管理器在构造时保存了会话，需要一并替换；w3对象是共享的，替换provider即可
+        ethereum_client.w3.provider = FailoverProvider(session, ethereum_client.timeout)
+        ethereum_client.slow_w3.provider = FailoverProvider(session, ethereum_client.slow_timeout)
+        for manager in (ethereum_client.erc20, ethereum_client.erc721,
+                        ethereum_client.tracing, ethereum_client.batch_call_manager):
+            manager.http_session = session
+        logger.info("RPC端点 %d 个: %s", len(urls), ", ".join(endpoint.label for endpoint in session.endpoints))
+    install_rpc_cache(ethereum_client.slow_w3, install_rpc_cache(ethereum_client.w3))
+    return ethereum_client
+
+
+def create_web3(rpc_url: str, ethereum_client: Optional[EthereumClient] = None) -> Web3:
+    """创建Web3；与ethereum_client共用FailoverSession和RPC缓存，使两者的健康评分一致、发送交易后缓存同时失效"""
+    session = getattr(ethereum_client, "http_session", None)
+    if isinstance(session, FailoverSession):
+        w3 = Web3(FailoverProvider(session, ethereum_client.timeout))
+    elif len(rpc_urls(rpc_url)) > 1:
+        w3 = Web3(FailoverProvider(FailoverSession(rpc_urls(rpc_url))))
+    else:
+        w3 = Web3(Web3.HTTPProvider(rpc_url))
+    cache = None
+    if ethereum_client is not None and isinstance(ethereum_client.w3.provider, RPCCacheProvider):
+        cache = ethereum_client.w3.provider.cache
+    install_rpc_cache(w3, cache)
+    return w3
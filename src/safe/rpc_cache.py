@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from web3 import Web3
+from web3.providers.base import BaseProvider
+
+from utils.files import write_json_atomic
+from utils.logger import logger
+from utils.metrics import metrics
+
+DEFAULT_RPC_CACHE_DIR = ".cache/rpc"
+
+# 可缓存的读方法，以及区块参数在params中的位置
+BLOCK_PARAM_INDEX = {
+    "eth_call": 1,
+    "eth_getCode": 1,
+    "eth_getBalance": 1,
+    "eth_getStorageAt": 2,
+    "eth_getTransactionCount": 1,
+}
+
+# 发送交易后，按latest缓存的结果可能已经过期
+WRITE_METHODS = {"eth_sendRawTransaction", "eth_sendTransaction"}
+
+# 超过该条数时清理已过期的短期缓存
+_MAX_VOLATILE_ENTRIES = 10000
+
+
+def block_tag(method: str, params: Any) -> Optional[str]:
+    """请求的区块参数，未指定时为latest；不可缓存的方法返回None"""
+    index = BLOCK_PARAM_INDEX.get(method)
+    if index is None:
+        return None
+    params = list(params or [])
+    tag = params[index] if len(params) > index else "latest"
+    if isinstance(tag, int):
+        return hex(tag)
+    if isinstance(tag, dict):
+        # EIP-1898 {"blockHash": ...} / {"blockNumber": ...}
+        return tag.get("blockHash") or tag.get("blockNumber")
+    return str(tag)
+
+
+def is_pinned(tag: str) -> bool:
+    """区块号、区块哈希和earliest对应的结果不会再变化"""
+    return tag == "earliest" or tag.startswith("0x")
+
+
+def _json_default(value):
+    return Web3.to_hex(value) if isinstance(value, bytes) else str(value)
+
+
+class RPCCache:
+    """
+    只读RPC结果的缓存
+
+    缓存键为 (链ID, 方法, 参数, 区块参数) 的SHA-256，持久部分按键存放在cache_dir下的独立文件中：
+    - 指定区块号/区块哈希的读请求，以及已部署合约的eth_getCode，结果不会变化，写入磁盘永久保存，
+      重新运行和同一网络的其他Safe直接复用
+    - 按latest读取的结果只在内存中保存ttl秒，发送交易或看到交易回执后全部失效
+    - pending、带状态覆盖的eth_call和出错的响应不缓存
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, ttl: Optional[float] = None):
+        """
+        Args:
+            cache_dir: 持久缓存目录，默认读取RPC_CACHE_DIR，设为空字符串时只在内存中缓存
+            ttl: latest结果的缓存秒数，默认读取RPC_CACHE_TTL（10），0表示不缓存
+        """
+        if cache_dir is None:
+            cache_dir = os.getenv("RPC_CACHE_DIR", DEFAULT_RPC_CACHE_DIR)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.ttl = ttl if ttl is not None else float(os.getenv("RPC_CACHE_TTL", "10"))
+        self._pinned: Dict[str, Any] = {}
+        self._volatile: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(chain_id: int, method: str, params: Any, tag: str) -> str:
+        canonical = json.dumps([chain_id, method, params, tag], sort_keys=True, separators=(",", ":"),
+                               default=_json_default)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """返回 (是否命中, 结果)"""
+        with self._lock:
+            if key in self._pinned:
+                return True, self._pinned[key]
+            if key in self._volatile:
+                expires, result = self._volatile[key]
+                if time.monotonic() < expires:
+                    return True, result
+        if self.cache_dir:
+            path = self._path(key)
+            try:
+                result = json.loads(path.read_text())["result"]
+            except FileNotFoundError:
+                return False, None
+            except (ValueError, KeyError):
+                logger.warning("RPC缓存文件 %s 无法读取，已忽略", path)
+                return False, None
+            with self._lock:
+                self._pinned[key] = result
+            return True, result
+        return False, None
+
+    def put(self, key: str, result: Any, pinned: bool):
+        with self._lock:
+            if not pinned:
+                if len(self._volatile) > _MAX_VOLATILE_ENTRIES:
+                    now = time.monotonic()
+                    self._volatile = {k: v for k, v in self._volatile.items() if v[0] > now}
+                self._volatile[key] = (time.monotonic() + self.ttl, result)
+                return
+            self._pinned[key] = result
+        if self.cache_dir:
+            # 进程内provider（如eth-tester）返回bytes，写入磁盘时转为十六进制字符串
+            write_json_atomic(self._path(key), {"result": _json_default(result) if isinstance(result, bytes) else result})
+
+    def invalidate(self):
+        """丢弃按latest缓存的结果"""
+        with self._lock:
+            self._volatile.clear()
+
+
+class RPCCacheProvider(BaseProvider):
+    """
+    经过RPCCache发送只读请求的provider包装；多个provider（如EthereumClient的w3和slow_w3）可以共用一个缓存
+
+    统计中间件在本provider之外，命中缓存的调用仍计入rpc类别，另外按方法计入rpc_cache类别
+    """
+
+    def __init__(self, provider: BaseProvider, cache: RPCCache):
+        self.provider = provider
+        self.cache = cache
+        # 保留被包装provider自身的中间件（如HTTPProvider的重试）
+        self.middlewares = provider.middlewares
+        provider.middlewares = ()
+        self.chain_id: Optional[int] = None
+
+    def __getattr__(self, name):
+        # endpoint_uri、session等属性取自被包装的provider
+        if name == "provider":
+            raise AttributeError(name)
+        return getattr(self.provider, name)
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return self.provider.is_connected(show_traceback)
+
+    def make_request(self, method, params):
+        cache = self.cache
+        if method in WRITE_METHODS:
+            cache.invalidate()
+            return self.provider.make_request(method, params)
+        if method == "eth_getTransactionReceipt":
+            response = self.provider.make_request(method, params)
+            if response.get("result"):
+                cache.invalidate()
+            return response
+
+        tag = block_tag(method, params)
+        # 第三个参数为状态覆盖的eth_call只用于模拟，不缓存
+        if tag is None or tag == "pending" or (method == "eth_call" and len(params) > 2):
+            return self.provider.make_request(method, params)
+        pinned = is_pinned(tag)
+        if not pinned and not cache.ttl and method != "eth_getCode":
+            return self.provider.make_request(method, params)
+
+        if self.chain_id is None:
+            chain_id = self.provider.make_request("eth_chainId", [])["result"]
+            self.chain_id = int(chain_id, 16) if isinstance(chain_id, str) else int(chain_id)
+        key = cache.key(self.chain_id, method, params, tag)
+        found, result = cache.get(key)
+        if found:
+            cache.hits += 1
+            metrics.record_call("rpc_cache", method, 0.0)
+            return {"jsonrpc": "2.0", "id": 0, "result": result}
+
+        cache.misses += 1
+        response = self.provider.make_request(method, params)
+        if "error" not in response and response.get("result") is not None:
+            result = response["result"]
+            # 合约代码部署后不会改变；空代码（尚未部署）按latest处理
+            if pinned or (method == "eth_getCode" and result not in ("0x", "")):
+                cache.put(key, result, pinned=True)
+            elif cache.ttl:
+                cache.put(key, result, pinned=False)
+        return response
+
+
+def install_rpc_cache(w3, cache: Optional[RPCCache] = None) -> RPCCache:
+    """用RPCCacheProvider包装w3的provider，返回使用的缓存；已经包装过时返回原有的缓存"""
+    if isinstance(w3.provider, RPCCacheProvider):
+        return w3.provider.cache
+    cache = cache or RPCCache()
+    w3.provider = RPCCacheProvider(w3.provider, cache)
+    return cache
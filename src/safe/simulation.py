@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+import os
+
+from hexbytes import HexBytes
+from web3.exceptions import ContractLogicError
+from safe_eth.eth.constants import NULL_ADDRESS
+from safe_eth.safe.multi_send import MultiSendTx
+
+# 导入自定义日志工具
+from utils.logger import logger
+
+# 模拟模式：
+# off    - 不做预执行模拟
+# report - 模拟失败时列出导致回滚的行并中止（默认）
+# drop   - 去掉导致回滚的行后继续
+SIMULATION_MODES = ("off", "report", "drop")
+
+# Safe合约存储布局中threshold所在的槽位
+THRESHOLD_STORAGE_SLOT = "0x" + "4".zfill(64)
+
+
+class BatchSimulator:
+    """
+    批量交易预执行模拟
+    
+    通过eth_call模拟完整的execTransaction，签名使用调用者自身的预验证签名(v=1)，
+    阈值大于1时用state override把threshold临时改为1，因此不需要任何私钥。
+    整批回滚时按层并行二分MultiSendTx列表，N行中k个失败行只需O(k·log N)次调用、O(log N)轮
+    """
+    
+    def __init__(self, handler, max_workers: Optional[int] = None):
+        """
+        Args:
+            handler: SafeTransactionHandler实例，复用其web3连接、Safe和MultiSend配置
+            max_workers: 并行模拟的线程数，默认读取SIMULATION_WORKERS
+        """
+        self.handler = handler
+        self.w3 = handler.w3
+        self.safe = handler.safe
+        self.max_workers = max_workers or int(os.getenv("SIMULATION_WORKERS", "8"))
+        
+        # 以第一个所有者作为调用者，构造预验证签名 {bytes32 r=所有者地址}{bytes32 s=0}{uint8 v=1}
+        self.sender = self.safe.retrieve_owners()[0]
+        self.signature = HexBytes(HexBytes(self.sender).rjust(32, b"\0") + bytes(32) + b"\x01")
+        
+        self.state_override = None
+        if self.safe.retrieve_threshold() > 1:
+            self.state_override = {
+                self.safe.address: {"stateDiff": {THRESHOLD_STORAGE_SLOT: "0x" + "1".zfill(64)}}
+            }
+    
+    def simulate(self, multi_send_txs: List[MultiSendTx]) -> Optional[str]:
+        """
+        模拟执行一组MultiSendTx
+        
+        Returns:
+            None表示执行成功，否则为回滚原因
+        """
+        data = self.handler.multisend.build_tx_data(multi_send_txs)
+        calldata = self.safe.contract.encodeABI(
+            fn_name="execTransaction",
+            args=[
+                self.handler.multisend_address, 0, data, 1,  # DELEGATE_CALL
+                0, 0, 0, NULL_ADDRESS, NULL_ADDRESS, self.signature,
+            ],
+        )
+        call = {"from": self.sender, "to": self.safe.address, "data": calldata}
+        
+        try:
+            if self.state_override:
+                self.w3.eth.call(call, "latest", self.state_override)
+            else:
+                self.w3.eth.call(call, "latest")
+            return None
+        except ContractLogicError as e:
+            return str(e)
+    
+    def find_failing_rows(self, multi_send_txs: List[MultiSendTx]) -> Dict[int, str]:
+        """
+        定位导致整批回滚的行
+        
+        每一轮把所有失败的区间一分为二并行模拟：单行区间失败即为失败行；
+        两半都成功而整体失败说明是组合失败（如累计超出余额），改用前缀二分找出临界行
+        
+        Returns:
+            {行索引: 回滚原因}，整批成功时为空字典
+        """
+        error = self.simulate(multi_send_txs)
+        if error is None:
+            return {}
+        
+        failures = {}
+        frontier = [(list(range(len(multi_send_txs))), error)]
+        rounds = 0
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="simulate") as pool:
+            while frontier:
+                rounds += 1
+                children = []
+                for indexes, _ in frontier:
+                    middle = len(indexes) // 2
+                    children.append(indexes[:middle])
+                    children.append(indexes[middle:])
+                
+                errors = list(pool.map(
+                    lambda indexes: self.simulate([multi_send_txs[i] for i in indexes]),
+                    children,
+                ))
+                
+                next_frontier = []
+                for position, (parent, parent_error) in enumerate(frontier):
+                    failed_children = [
+                        (children[2 * position + offset], errors[2 * position + offset])
+                        for offset in (0, 1)
+                        if errors[2 * position + offset] is not None
+                    ]
+                    if not failed_children:
+                        index = self._find_failing_prefix(multi_send_txs, parent)
+                        failures[index] = f"组合失败: {parent_error}"
+                    for indexes, child_error in failed_children:
+                        if len(indexes) == 1:
+                            failures[indexes[0]] = child_error
+                        else:
+                            next_frontier.append((indexes, child_error))
+                frontier = next_frontier
+        
+        logger.debug("二分定位完成，共 %d 轮", rounds)
+        return failures
+    
+    def _find_failing_prefix(self, multi_send_txs: List[MultiSendTx], indexes: List[int]) -> int:
+        """在整体失败的区间内二分查找使前缀开始失败的那一行"""
+        low, high = 1, len(indexes)
+        while low < high:
+            middle = (low + high) // 2
+            if self.simulate([multi_send_txs[i] for i in indexes[:middle]]) is None:
+                low = middle + 1
+            else:
+                high = middle
+        return indexes[low - 1]
+    
+    def check(
+        self, multi_send_txs: List[MultiSendTx], transactions: List[Dict], mode: str = "report"
+    ) -> Tuple[List[MultiSendTx], List[Dict]]:
+        """
+        预执行模拟批量交易，报告或去掉导致回滚的行
+        
+        Args:
+            multi_send_txs: 待模拟的MultiSendTx列表
+            transactions: 与multi_send_txs一一对应的原始交易（含Notion page_id）
+            mode: report或drop
+            
+        Returns:
+            可以成功执行的 (multi_send_txs, transactions)
+        """
+        logger.info(f"预执行模拟 {len(multi_send_txs)} 笔转账...")
+        try:
+            failures = self.find_failing_rows(multi_send_txs)
+        except Exception as e:
+            # 节点不支持state override等情况下不阻塞流程
+            logger.warning(f"预执行模拟不可用，已跳过: {str(e)}")
+            return multi_send_txs, transactions
+        
+        if not failures:
+            logger.info("预执行模拟通过")
+            return multi_send_txs, transactions
+        
+        for index, reason in sorted(failures.items()):
+            tx = transactions[index]
+            logger.error(
+                f"第 {index + 1} 行会导致回滚: {tx['address']} {tx['amount']} USDT, "
+                f"Notion页面: {tx.get('page_id', '未知')}, 原因: {reason}"
+            )
+        
+        if mode != "drop":
+            raise Exception(f"预执行模拟失败，{len(failures)} 行会导致整批交易回滚")
+        
+        kept = [i for i in range(len(multi_send_txs)) if i not in failures]
+        logger.warning(f"已去掉 {len(failures)} 行，剩余 {len(kept)} 行")
+        if not kept:
+            raise Exception("没有可执行的交易")
+        
+        # 去掉失败行后重新模拟，直到整批通过
+        return self.check(
+            [multi_send_txs[i] for i in kept],
+            [transactions[i] for i in kept],
+            mode,
+        )
@@ -1,77 +1,147 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 import os
-import sys
-import json
-from pathlib import Path
 from dotenv import load_dotenv
-from decimal import Decimal
 from web3 import Web3
 from web3.exceptions import TransactionNotFound
-from web3.types import TxReceipt, Wei
+from web3.types import TxReceipt
 from eth_account import Account
-from eth_typing import ChecksumAddress
 from hexbytes import HexBytes
 
 # 导入safe-eth-py相关库
 from safe_eth.eth import EthereumClient, EthereumNetwork
 from safe_eth.safe import Safe, SafeTx
+from safe_eth.safe.safe_signature import SafeSignature
 from safe_eth.safe.api.transaction_service_api import TransactionServiceApi
 from safe_eth.safe.multi_send import MultiSend, MultiSendOperation, MultiSendTx
 
 # 导入自定义日志工具
 from utils.logger import logger
+from utils.summary import TransferSummary
+from utils.metrics import instrument_ethereum_client, instrument_session, instrument_web3
+from safe.simulation import BatchSimulator, SIMULATION_MODES
+from safe.gas import SafeTxGasEstimator, GAS_ESTIMATION_BACKENDS
+from safe.networks import network_registry, select_multisend_call_only
+from safe.api import SafeAPI
+from safe.rpc import create_ethereum_client, create_web3
 
 load_dotenv()
 
+# 执行模式：
+# propose - 只提议交易，等待其他所有者在Safe钱包中确认（默认）
+# execute - 使用本地私钥聚合签名后直接执行，本地私钥不足阈值时报错
+# auto    - 本地私钥数量满足阈值时直接执行，否则提议
+EXECUTION_MODES = ("propose", "execute", "auto")
+
+# 直接执行时在本地gas估算结果上增加的余量
+EXECUTION_GAS_MARGIN = 1.2
+
+# execTransaction结束时发出；v1.4.1中safeTxHash为第二个topic，v1.3.0中为data的前32字节。
+# safeTxGas不为0时内部调用失败不会回滚execTransaction，Safe只发出ExecutionFailure并消耗nonce
+EXECUTION_SUCCESS_TOPIC = Web3.keccak(text="ExecutionSuccess(bytes32,uint256)").hex()
+EXECUTION_FAILURE_TOPIC = Web3.keccak(text="ExecutionFailure(bytes32,uint256)").hex()
+
+
+def execution_safe_tx_hash(log) -> str:
+    """ExecutionSuccess/ExecutionFailure事件中的safeTxHash"""
+    if len(log["topics"]) > 1:
+        return HexBytes(log["topics"][1]).hex()
+    return "0x" + HexBytes(log["data"]).hex()[2:66]
+
+
+def load_private_keys() -> List[str]:
+    """
+    读取本地私钥：PRIVATE_KEY为提议者/执行者，OWNER_PRIVATE_KEYS为其他可用的所有者私钥(逗号分隔)
+    """
+    private_keys = [os.getenv("PRIVATE_KEY")] + os.getenv("OWNER_PRIVATE_KEYS", "").split(",")
+    return list(dict.fromkeys(key.strip() for key in private_keys if key and key.strip()))
+
+
 class SafeTransactionHandler:
-    def __init__(self):
+    def __init__(
+        self,
+        safe_address: Optional[str] = None,
+        network: Optional[str] = None,
+        rpc_url: Optional[str] = None,
+        usdt_contract_address: Optional[str] = None,
+        private_keys: Optional[List[str]] = None,
+        multisend_address: Optional[str] = None,
+        execution_mode: Optional[str] = None,
+        simulation_mode: Optional[str] = None,
+        gas_estimation: Optional[str] = None,
+        ethereum_client: Optional[EthereumClient] = None,
+    ):
         """
         初始化Safe交易处理器
+        
+        未传入的参数从环境变量读取；传入ethereum_client时复用其web3连接，
+        便于在本地进程内EVM上测试
         """
         # 配置信息
-        self.network = os.getenv("NETWORK", "sepolia")
-        self.rpc_url = os.getenv("RPC_URL")
-        self.safe_address = os.getenv("SAFE_ADDRESS")
-        self.private_key = os.getenv("PRIVATE_KEY")
-        self.usdt_contract_address = os.getenv("USDT_CONTRACT")
+        self.network = network or os.getenv("NETWORK", "sepolia")
+        self.rpc_url = rpc_url or os.getenv("RPC_URL")
+        self.safe_address = safe_address or os.getenv("SAFE_ADDRESS")
+        self.usdt_contract_address = usdt_contract_address or os.getenv("USDT_CONTRACT")
+        self.execution_mode = (execution_mode or os.getenv("EXECUTION_MODE", "propose")).lower()
+        if self.execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"不支持的执行模式: {self.execution_mode}")
+        self.simulation_mode = (simulation_mode or os.getenv("SIMULATION_MODE", "report")).lower()
+        if self.simulation_mode not in SIMULATION_MODES:
+            raise ValueError(f"不支持的模拟模式: {self.simulation_mode}")
+        self.gas_estimation = (gas_estimation or os.getenv("GAS_ESTIMATION", "service")).lower()
+        if self.gas_estimation not in GAS_ESTIMATION_BACKENDS:
+            raise ValueError(f"不支持的gas估算后端: {self.gas_estimation}")
+        # 单笔Safe交易最多包含的转账数，0表示不拆分
+        self.max_transfers_per_tx = int(os.getenv("MAX_TRANSFERS_PER_TX", "0"))
+        self.gas_estimator = None
+        
+        # 私钥配置：PRIVATE_KEY为提议者/执行者，OWNER_PRIVATE_KEYS为其他可用的所有者私钥(逗号分隔)
+        if private_keys is None:
+            private_keys = load_private_keys()
+        self.private_keys = list(dict.fromkeys(key.strip() for key in private_keys if key and key.strip()))
+        self.private_key = self.private_keys[0] if self.private_keys else None
         
         logger.section("初始化Safe交易处理器")
         logger.info(f"网络: {self.network}")
         logger.info(f"Safe地址: {self.safe_address}")
         logger.info(f"USDT合约地址: {self.usdt_contract_address}")
         
-        # 初始化Web3
-        self.w3 = Web3(Web3.HTTPProvider(self.rpc_url))
+        # 初始化以太坊客户端和Web3
+        if ethereum_client is None:
+            # RPC_URL可以是逗号分隔的多个端点，此时请求在端点之间故障转移
+            self.ethereum_client = create_ethereum_client(self.rpc_url)
+            self.w3 = create_web3(self.rpc_url, self.ethereum_client)
+        else:
+            self.w3 = ethereum_client.w3
+            self.ethereum_client = ethereum_client
+        instrument_web3(self.w3)
+        instrument_ethereum_client(self.ethereum_client)
         logger.info(f"Web3连接状态: {'成功' if self.w3.is_connected() else '失败'}")
         
-        # 初始化以太坊客户端
-        self.ethereum_client = EthereumClient(self.rpc_url)
-        
-        # 设置网络
-        if self.network.lower() == 'mainnet':
-            self.ethereum_network = EthereumNetwork.MAINNET
-            # MultiSendCallOnly合约地址 (mainnet)
-            self.multisend_address = "0x40A2aCCbd92BCA938b02010E17A5b8929b49130D"
-        elif self.network.lower() == 'sepolia':
-            self.ethereum_network = EthereumNetwork.SEPOLIA
-            # MultiSendCallOnly合约地址 (sepolia)
-            self.multisend_address = "0x9641d764fc13c8B624c04430C7356C1C7C8102e2"
-        else:
-            raise ValueError(f"不支持的网络: {self.network}")
+        # 从网络注册表获取链ID、交易服务地址和MultiSendCallOnly部署；
+        # 显式指定MultiSendCallOnly地址（如本地测试链）时只查缓存和内置表，不做发现和校验
+        self.network_info = network_registry.get(self.network, None if multisend_address else self.w3)
+        self.ethereum_network = EthereumNetwork(self.network_info["chain_id"])
+        
+        # 初始化Safe
+        self.safe = Safe(self.safe_address, self.ethereum_client)
         
+        # 选择与Safe版本一致的MultiSendCallOnly合约
+        self.multisend_address = multisend_address or select_multisend_call_only(
+            self.network_info, self.safe.get_version()
+        )
         logger.info(f"使用MultiSendCallOnly合约地址: {self.multisend_address}")
         
         # 初始化MultiSend
         self.multisend = MultiSend(ethereum_client=self.ethereum_client, address=self.multisend_address)
         
-        # 初始化Safe
-        self.safe = Safe(self.safe_address, self.ethereum_client)
-        
-        # 初始化交易服务API
+        # 初始化交易服务API；与SafeAPI一样遵循SAFE_SERVICE_URL_<网络>，便于指向自建或本地的交易服务
         self.transaction_service_api = TransactionServiceApi(
             network=self.ethereum_network,
-            ethereum_client=self.ethereum_client
+            ethereum_client=self.ethereum_client,
+            base_url=network_registry.service_url(self.network)
         )
+        instrument_session(self.transaction_service_api.http_session, "safe_service")
+        self.safe_api = SafeAPI(network=self.network, safe_address=self.safe_address)
         
         # USDT ABI
         self.usdt_abi = [
@@ -114,84 +184,206 @@ class SafeTransactionHandler:
         Returns:
             构建好的交易数据字典
         """
+        return self.prepare_split_batch_transfers(transactions, max_transfers_per_tx=0)[0]
+    
+    def prepare_split_batch_transfers(
+        self, transactions: List[Dict], max_transfers_per_tx: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        准备批量USDT转账交易，按max_transfers_per_tx拆分为多笔nonce连续的Safe交易
+        
+        Args:
+            transactions: 交易列表，每个交易包含address和amount
+            max_transfers_per_tx: 单笔Safe交易最多包含的转账数，默认读取MAX_TRANSFERS_PER_TX，0表示不拆分
+            
+        Returns:
+            构建好的交易数据字典列表，按nonce排序
+        """
+        if max_transfers_per_tx is None:
+            max_transfers_per_tx = self.max_transfers_per_tx
         logger.section("准备批量转账")
         logger.info(f"找到 {len(transactions)} 笔待处理交易")
         
         # 先检查USDT余额
+        self.check_balance(sum(tx["amount"] for tx in transactions))
+        
+        # 准备多个交易
+        logger.info("准备多笔USDT转账交易...")
+        multi_send_txs = []
+        
+        summary = TransferSummary()
+        try:
+            for tx in transactions:
+                try:
+                    to_address = self.resolve_address(tx["address"])
+                    multi_send_txs.append(self.encode_transfer(to_address, tx["amount"]))
+                    summary.add(to_address, tx["amount"], network=self.network, safe=self.safe_address,
+                                page_id=tx.get("page_id"), address=tx["address"])
+                except Exception as e:
+                    logger.error(f"地址格式验证失败 ({tx['address']}): {str(e)}")
+                    raise
+        finally:
+            summary.log()
+        
+        return self.build_batches(multi_send_txs, transactions, max_transfers_per_tx=max_transfers_per_tx)
+    
+    def check_balance(self, total_amount: float):
+        """
+        检查Safe的USDT余额是否足够支付total_amount，不足时抛出异常
+        """
         safe_balance = self.usdt_contract.functions.balanceOf(self.safe_address).call()
         safe_balance_decimal = safe_balance / 10**6  # USDT有6位小数
         
-        total_amount = sum(tx["amount"] for tx in transactions)
         logger.info(f"Safe钱包当前USDT余额: {safe_balance_decimal}")
         logger.info(f"需要转账的总金额: {total_amount} USDT")
         
         if safe_balance < total_amount * 10**6:
             raise Exception(f"USDT余额不足. 需要: {total_amount} USDT, 当前余额: {safe_balance_decimal} USDT")
+    
+    def resolve_address(self, address: str) -> str:
+        """
+        解析收款地址：ENS域名解析为地址，并转换为校验和格式
+        """
+        to_address = address
         
-        # 准备多个交易
-        logger.info("准备多笔USDT转账交易...")
-        multi_send_txs = []
-        
-        for tx in transactions:
+        # 检查是否是ENS域名，如果是则解析
+        if to_address.endswith(".eth"):
             try:
-                to_address = tx["address"]
-                
-                # 检查是否是ENS域名，如果是则解析
-                if to_address.endswith(".eth"):
-                    try:
-                        logger.info(f"检测到ENS域名: {to_address}，尝试解析...")
-                        resolved_address = self.w3.ens.address(to_address)
-                        if not resolved_address:
-                            raise Exception(f"无法解析ENS域名: {to_address}")
-                        logger.info(f"成功解析ENS域名 {to_address} 为地址: {resolved_address}")
-                        to_address = resolved_address
-                    except Exception as e:
-                        logger.error(f"ENS域名解析失败 ({to_address}): {str(e)}")
-                        raise Exception(f"ENS域名解析失败: {to_address}")
-                
-                # 确保地址是校验和格式
-                to_address = self.w3.to_checksum_address(to_address)
-                
-                # USDT金额（USDT有6位小数）
-                amount = int(tx["amount"] * 10**6)
-                
-                # 创建USDT转账数据
-                transfer_data = self.usdt_contract.functions.transfer(
-                    to_address, 
-                    amount
-                ).build_transaction({
-                    'chainId': self.ethereum_network.value,
-                    'gas': 100000,
-                    'gasPrice': 0,
-                    'nonce': 0
-                })['data']
-                
-                # 创建MultiSendTx对象
-                multi_send_tx = MultiSendTx(
-                    operation=MultiSendOperation.CALL,  # 标准调用
-                    to=self.usdt_contract.address,  # USDT合约地址
-                    value=0,  # 不发送ETH
-                    data=HexBytes(transfer_data)  # 转账数据
-                )
-                
-                multi_send_txs.append(multi_send_tx)
-                logger.transaction_info(to_address, tx["amount"])
+                logger.info("检测到ENS域名: %s，尝试解析...", to_address)
+                resolved_address = self.w3.ens.address(to_address)
+                if not resolved_address:
+                    raise Exception(f"无法解析ENS域名: {to_address}")
+                logger.info("成功解析ENS域名 %s 为地址: %s", to_address, resolved_address)
+                to_address = resolved_address
             except Exception as e:
-                logger.error(f"地址格式验证失败 ({tx['address']}): {str(e)}")
-                raise
+                logger.error(f"ENS域名解析失败 ({to_address}): {str(e)}")
+                raise Exception(f"ENS域名解析失败: {to_address}")
+        
+        # 确保地址是校验和格式
+        return self.w3.to_checksum_address(to_address)
+    
+    def encode_transfer(self, to_address: str, amount: float) -> MultiSendTx:
+        """
+        编码一笔USDT转账为MultiSendTx
+        
+        Args:
+            to_address: 校验和格式的收款地址
+            amount: USDT金额
+        """
+        # USDT金额（USDT有6位小数）
+        amount = int(amount * 10**6)
+        
+        # 创建USDT转账数据
+        transfer_data = self.usdt_contract.functions.transfer(
+            to_address, 
+            amount
+        ).build_transaction({
+            'chainId': self.ethereum_network.value,
+            'gas': 100000,
+            'gasPrice': 0,
+            'nonce': 0
+        })['data']
+        
+        # 创建MultiSendTx对象
+        return MultiSendTx(
+            operation=MultiSendOperation.CALL,  # 标准调用
+            to=self.usdt_contract.address,  # USDT合约地址
+            value=0,  # 不发送ETH
+            data=HexBytes(transfer_data)  # 转账数据
+        )
+    
+    def build_batches(
+        self,
+        multi_send_txs: List[MultiSendTx],
+        transactions: List[Dict],
+        nonce: Optional[int] = None,
+        max_transfers_per_tx: int = 0,
+        estimate_gas: bool = True,
+    ) -> List[Dict]:
+        """
+        把已编码的转账构建为nonce连续的Safe交易：预执行模拟、拆分、估算safeTxGas
         
+        Args:
+            multi_send_txs: 已编码的转账，与transactions一一对应
+            transactions: 原始交易行，用于在模拟失败时定位Notion行
+            nonce: 第一笔Safe交易的nonce，默认使用Safe当前nonce
+            max_transfers_per_tx: 单笔Safe交易最多包含的转账数，0表示不拆分
+            estimate_gas: 为False时safeTxGas为0，由调用方之后用estimate_batches估算
+            
+        Returns:
+            构建好的交易数据字典列表，按nonce排序
+        """
         if not multi_send_txs:
             raise Exception("没有可执行的交易")
         
+        # 预执行模拟，提前发现会导致整批回滚的行
+        if self.simulation_mode != "off":
+            multi_send_txs, transactions = BatchSimulator(self).check(
+                multi_send_txs, transactions, self.simulation_mode
+            )
+        
         # 获取Safe信息
-        logger.debug("获取Safe信息...")
-        safe_info = self.safe.retrieve_all_info()
-        logger.debug(f"Safe信息: 阈值={safe_info.threshold}, 所有者数量={len(safe_info.owners)}")
+        if nonce is None:
+            logger.debug("获取Safe信息...")
+            safe_info = self.safe.retrieve_all_info()
+            logger.debug("Safe信息: 阈值=%s, 所有者数量=%d", safe_info.threshold, len(safe_info.owners))
+            nonce = safe_info.nonce
+        
+        # 按数量拆分并编码MultiSend数据
+        chunk_size = max_transfers_per_tx or len(multi_send_txs)
+        chunks = [multi_send_txs[i:i + chunk_size] for i in range(0, len(multi_send_txs), chunk_size)]
+        if len(chunks) > 1:
+            logger.info(f"拆分为 {len(chunks)} 笔Safe交易，每笔最多 {chunk_size} 笔转账")
         
-        # 编码MultiSend数据
         logger.debug("编码MultiSend数据...")
-        multisend_data = self.multisend.build_tx_data(multi_send_txs)
-        logger.debug(f"MultiSend数据长度: {len(multisend_data)}")
+        multisend_datas = [self.multisend.build_tx_data(chunk) for chunk in chunks]
+        
+        # 估算safeTxGas，所有Safe交易并行估算
+        safe_tx_gases = [0] * len(chunks)
+        if estimate_gas:
+            safe_tx_gases = self._estimate_safe_tx_gases([
+                {"to": self.multisend_address, "data": data, "operation": 1, "nonce": nonce + i}
+                for i, data in enumerate(multisend_datas)
+            ])
+        
+        return [
+            self._build_tx_data(data, nonce + i, safe_tx_gas)
+            for i, (data, safe_tx_gas) in enumerate(zip(multisend_datas, safe_tx_gases))
+        ]
+    
+    def _estimate_safe_tx_gases(self, requests: List[Dict]) -> List[int]:
+        if self.gas_estimation == "off":
+            return [0] * len(requests)
+        if self.gas_estimator is None:
+            self.gas_estimator = SafeTxGasEstimator(self, self.gas_estimation)
+        return self.gas_estimator.estimate_all(requests)
+    
+    def estimate_batches(self, batch_txs: List[Dict]) -> List[Dict]:
+        """
+        为build_batches(estimate_gas=False)构建的Safe交易估算safeTxGas
+        
+        safeTxGas参与safeTxHash的计算，估算后重新构建交易
+        
+        Returns:
+            估算后的交易数据字典列表，顺序不变
+        """
+        multisend_datas = [HexBytes(batch_tx["data"]) for batch_tx in batch_txs]
+        safe_tx_gases = self._estimate_safe_tx_gases([
+            {"to": batch_tx["to"], "data": bytes(data), "operation": int(batch_tx["operation"]),
+             "nonce": int(batch_tx["nonce"])}
+            for batch_tx, data in zip(batch_txs, multisend_datas)
+        ])
+        return [
+            batch_tx if safe_tx_gas == int(batch_tx["safeTxGas"])
+            else self._build_tx_data(bytes(data), int(batch_tx["nonce"]), safe_tx_gas)
+            for batch_tx, data, safe_tx_gas in zip(batch_txs, multisend_datas, safe_tx_gases)
+        ]
+    
+    def _build_tx_data(self, multisend_data: bytes, nonce: int, safe_tx_gas: int = 0) -> Dict:
+        """
+        构建调用MultiSendCallOnly的Safe交易，返回API需要的交易数据字典
+        """
+        logger.debug("MultiSend数据长度: %d", len(multisend_data))
         
         # 创建Safe交易
         logger.info("创建Safe交易...")
@@ -199,7 +391,9 @@ class SafeTransactionHandler:
             to=self.multisend_address,  # MultiSendCallOnly合约地址
             value=0,  # 不发送ETH
             data=HexBytes(multisend_data),  # MultiSend数据
-            operation=1  # 1表示DELEGATE_CALL
+            operation=1,  # 1表示DELEGATE_CALL
+            safe_tx_gas=safe_tx_gas,
+            safe_nonce=nonce
         )
         
         logger.info(f"Safe交易哈希: {safe_tx.safe_tx_hash.hex()}")
@@ -236,24 +430,8 @@ class SafeTransactionHandler:
         logger.section("签名交易")
         
         try:
-            # 确保data是十六进制字符串
-            data = safe_tx["data"]
-            if isinstance(data, str) and not data.startswith('0x'):
-                data = '0x' + data
-            
             # 构建SafeTx对象
-            tx = self.safe.build_multisig_tx(
-                to=self.w3.to_checksum_address(safe_tx["to"]),
-                value=int(safe_tx["value"]),
-                data=HexBytes(data),
-                operation=int(safe_tx["operation"]),
-                safe_tx_gas=int(safe_tx["safeTxGas"]),
-                base_gas=int(safe_tx["baseGas"]),
-                gas_price=int(safe_tx["gasPrice"]),
-                gas_token=safe_tx["gasToken"],
-                refund_receiver=safe_tx["refundReceiver"],
-                safe_nonce=int(safe_tx["nonce"])
-            )
+            tx = self._build_safe_tx(safe_tx)
             
             # 签名交易
             logger.info("使用私钥签名交易...")
@@ -266,6 +444,209 @@ class SafeTransactionHandler:
             logger.error(f"签名交易失败: {str(e)}")
             raise
     
+    def _build_safe_tx(self, safe_tx: Dict) -> SafeTx:
+        """
+        根据交易数据字典重建SafeTx对象
+        
+        Args:
+            safe_tx: prepare_batch_transfers返回的交易数据字典
+            
+        Returns:
+            SafeTx对象
+        """
+        # 确保data是十六进制字符串
+        data = safe_tx["data"]
+        if isinstance(data, str) and not data.startswith('0x'):
+            data = '0x' + data
+        
+        return self.safe.build_multisig_tx(
+            to=self.w3.to_checksum_address(safe_tx["to"]),
+            value=int(safe_tx["value"]),
+            data=HexBytes(data),
+            operation=int(safe_tx["operation"]),
+            safe_tx_gas=int(safe_tx["safeTxGas"]),
+            base_gas=int(safe_tx["baseGas"]),
+            gas_price=int(safe_tx["gasPrice"]),
+            gas_token=safe_tx["gasToken"],
+            refund_receiver=safe_tx["refundReceiver"],
+            safe_nonce=int(safe_tx["nonce"])
+        )
+    
+    def get_local_owner_keys(self) -> List[str]:
+        """
+        获取本地配置的、属于Safe所有者的私钥
+        
+        Returns:
+            私钥列表，按配置顺序排列
+        """
+        owners = {owner.lower() for owner in self.safe.retrieve_owners()}
+        return [
+            key for key in self.private_keys
+            if Account.from_key(key).address.lower() in owners
+        ]
+    
+    def should_execute_directly(self) -> bool:
+        """
+        根据执行模式和本地私钥数量判断是否跳过交易服务直接执行
+        
+        Returns:
+            True表示直接执行，False表示提议到Safe Transaction Service
+        """
+        if self.execution_mode == "propose":
+            return False
+        
+        threshold = self.safe.retrieve_threshold()
+        owner_keys = self.get_local_owner_keys()
+        logger.info(f"Safe阈值: {threshold}, 本地所有者私钥数量: {len(owner_keys)}")
+        
+        if len(owner_keys) >= threshold:
+            return True
+        if self.execution_mode == "execute":
+            raise Exception(f"本地所有者私钥不足，无法直接执行. 需要: {threshold}, 当前: {len(owner_keys)}")
+        return False
+    
+    def execute_transaction(self, tx: Dict) -> str:
+        """
+        使用本地所有者私钥聚合签名并直接执行Safe交易，不经过Safe Transaction Service
+        
+        签名按所有者地址升序拼接（SafeTx.sign负责排序），gas在本地估算，
+        由PRIVATE_KEY对应的账户发送execTransaction并支付gas（不要求是所有者）
+        
+        Args:
+            tx: 准备好的交易数据
+            
+        Returns:
+            以太坊交易哈希
+        """
+        try:
+            return self.send_execution(tx, self.prepare_execution(tx))
+        except Exception as e:
+            logger.error(f"直接执行交易失败: {str(e)}")
+            raise
+    
+    def prepare_execution(self, tx: Dict) -> Dict:
+        """
+        聚合签名、本地模拟并签名execTransaction，但不发送
+        
+        调用方可以在发送前记录交易哈希，进程在等待上链时中断后据此核对链上结果
+        
+        Returns:
+            {"tx_hash", "sender", "nonce", "block", "raw"}：nonce为发送账户的nonce，
+            block为签名时的区块高度，raw为签名后的原始交易
+        """
+        logger.section("直接执行交易")
+        
+        safe_tx = self._build_safe_tx(tx)
+        threshold = self.safe.retrieve_threshold()
+        owner_keys = self.get_local_owner_keys()
+        if len(owner_keys) < threshold:
+            raise Exception(f"本地所有者私钥不足. 需要: {threshold}, 当前: {len(owner_keys)}")
+        
+        # 只签名阈值所需的数量
+        for key in owner_keys[:threshold]:
+            safe_tx.sign(key)
+        logger.info(f"已聚合签名: {', '.join(safe_tx.sorted_signers)}")
+        
+        # 本地模拟并估算gas
+        sender = Account.from_key(self.private_key)
+        safe_tx.call(tx_sender_address=sender.address)
+        gas_estimate = safe_tx.w3_tx.estimate_gas({"from": sender.address})
+        tx_gas = int(gas_estimate * EXECUTION_GAS_MARGIN)
+        logger.info(f"估算gas: {gas_estimate}, 使用gas上限: {tx_gas}")
+        
+        # 在本地签名execTransaction，发送前即可得到以太坊交易哈希
+        nonce = self.w3.eth.get_transaction_count(sender.address, "pending")
+        signed = sender.sign_transaction(safe_tx.w3_tx.build_transaction({
+            "from": sender.address, "gas": tx_gas, "gasPrice": self.w3.eth.gas_price, "nonce": nonce,
+        }))
+        return {"tx_hash": signed.hash.hex(), "sender": sender.address, "nonce": nonce,
+                "block": self.w3.eth.block_number, "raw": signed.rawTransaction}
+    
+    def send_execution(self, tx: Dict, execution: Dict) -> str:
+        """
+        发送prepare_execution签名的execTransaction并等待上链
+        
+        Returns:
+            以太坊交易哈希
+        """
+        tx_hash = self.w3.eth.send_raw_transaction(execution["raw"])
+        receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+        if receipt["status"] != 1:
+            raise Exception(f"交易执行失败: {tx_hash.hex()}")
+        if self.execution_status(receipt, tx["safe_tx_hash"]) is not True:
+            raise Exception(f"Safe交易内部调用失败 (ExecutionFailure)，nonce {tx['nonce']} 已使用: {tx_hash.hex()}")
+        
+        logger.info(f"交易已执行，交易哈希: {tx_hash.hex()}")
+        return tx_hash.hex()
+    
+    def execution_failed(self, receipt: TxReceipt) -> bool:
+        """receipt中是否有本Safe发出的ExecutionFailure事件"""
+        return any(
+            log["address"].lower() == self.safe_address.lower()
+            and log["topics"] and HexBytes(log["topics"][0]).hex() == EXECUTION_FAILURE_TOPIC
+            for log in receipt["logs"]
+        )
+    
+    def _execution_events(self, logs, safe_tx_hash: str) -> Optional[bool]:
+        for log in logs:
+            if log["address"].lower() != self.safe_address.lower() or not log["topics"]:
+                continue
+            topic = HexBytes(log["topics"][0]).hex()
+            if topic in (EXECUTION_SUCCESS_TOPIC, EXECUTION_FAILURE_TOPIC) \
+                    and execution_safe_tx_hash(log) == HexBytes(safe_tx_hash).hex():
+                return topic == EXECUTION_SUCCESS_TOPIC
+        return None
+    
+    def execution_status(self, receipt: TxReceipt, safe_tx_hash: str) -> Optional[bool]:
+        """
+        receipt中该Safe交易的执行结果
+        
+        Returns:
+            True表示ExecutionSuccess，False表示ExecutionFailure，没有该Safe交易的事件时为None
+        """
+        return self._execution_events(receipt["logs"], safe_tx_hash)
+    
+    def find_execution(self, tx: Dict, tx_hash: Optional[str] = None,
+                       from_block: Optional[int] = None) -> Optional[Dict]:
+        """
+        在链上查找Safe交易的执行结果，用于续跑时核对上次发送的execTransaction
+        
+        先查tx_hash的receipt（交易仍在内存池中时等待上链），找不到时从from_block起查询Safe的
+        ExecutionSuccess/ExecutionFailure事件（交易被加速或替换后哈希会变化）
+        
+        Returns:
+            {"tx_hash", "success"}，没有找到时为None
+        """
+        safe_tx_hash = tx["safe_tx_hash"]
+        if tx_hash:
+            try:
+                self.w3.eth.get_transaction(tx_hash)
+                receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                receipt = None
+            if receipt is not None and receipt["status"] == 1:
+                success = self.execution_status(receipt, safe_tx_hash)
+                if success is not None:
+                    return {"tx_hash": HexBytes(tx_hash).hex(), "success": success}
+        if from_block is not None:
+            logs = self.w3.eth.get_logs({
+                "fromBlock": from_block, "toBlock": "latest", "address": self.safe_address,
+                "topics": [[EXECUTION_SUCCESS_TOPIC, EXECUTION_FAILURE_TOPIC]],
+            })
+            for log in logs:
+                success = self._execution_events([log], safe_tx_hash)
+                if success is not None:
+                    return {"tx_hash": HexBytes(log["transactionHash"]).hex(), "success": success}
+        return None
+    
+    def is_proposed(self, tx: Dict) -> bool:
+        """交易服务中是否已存在该Safe交易哈希的提议"""
+        return self.safe_api.get_multisig_transaction(tx["safe_tx_hash"]) is not None
+    
+    def is_nonce_used(self, tx: Dict) -> bool:
+        """Safe链上nonce是否已超过该交易的nonce（已执行或被替换）"""
+        return self.safe.retrieve_nonce() > int(tx["nonce"])
+    
     def propose_transaction(self, tx: Dict, signature: bytes) -> str:
         """
         提议Safe交易，将其发送到Safe Transaction Service以便其他所有者可以签名
@@ -280,8 +661,9 @@ class SafeTransactionHandler:
         try:
             logger.section("提议交易")
             
-            # 获取发送者地址 - 使用正确的方法
-            sender_address = Account.from_key(self.private_key).address
+            # 发送者为地址最小的签名者，与交易服务的校验一致；签名可能来自离线签名的计划文件
+            signers = SafeSignature.parse_signature(signature, HexBytes(tx["safe_tx_hash"]))
+            sender_address = min((s.owner for s in signers), key=lambda address: int(address, 16))
             logger.info(f"发送者地址: {sender_address}")
             
             # 准备交易数据
@@ -322,7 +704,7 @@ class SafeTransactionHandler:
                 tx["refundReceiver"],
                 signatures=signature,
                 safe_nonce=tx["nonce"],
-                chain_id=self.ethereum_network.value,
+                chain_id=self.ethereum_client.get_chain_id(),
             )
             
             # 使用正确的方法名称：post_transaction
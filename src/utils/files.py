@@ -0,0 +1,29 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+
+
+def write_json_atomic(path: Path, data: Any):
+    """
+    先写临时文件再替换，避免进程中断时留下半个JSON文件
+
+    每次写入使用独立的临时文件，多个线程或进程同时写同一个文件时互不干扰
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=path.parent, prefix=path.name + ".", suffix=".tmp",
+                                     delete=False) as f:
+        temp_file = f.name
+        try:
+            f.write(json.dumps(data, sort_keys=True, indent=2))
+        except BaseException:
+            f.close()
+            os.unlink(temp_file)
+            raise
+    try:
+        os.replace(temp_file, path)
+    except BaseException:
+        os.unlink(temp_file)
+        raise
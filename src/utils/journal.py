@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from utils.logger import logger
+
+DEFAULT_JOURNAL_DIR = ".journal"
+
+# 已产生不可撤销效果（签名、提议、上链）的阶段，出现这些记录后中断的运行必须续跑。
+# execute-intent在广播execTransaction之前写入，发送后等待上链时中断也能续跑并核对链上结果
+IRREVERSIBLE_STAGES = ("sign", "propose", "execute-intent", "execute")
+
+
+def snapshot_hash(rows: List[Dict]) -> str:
+    """输入快照的哈希：对规范化JSON做sha256"""
+    payload = json.dumps(rows, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RunJournal:
+    """
+    只追加、每条记录fsync的运行日志（JSON lines）
+    
+    每个阶段的输出以 (stage, key) 记录：fetch快照、每组准备好的交易、签名、提议和执行结果。
+    进程崩溃后重新运行时读取最近一个未结束的日志，从最后完成的阶段继续
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.run_id = self.path.stem
+        self.resumed = False
+        self.status: Optional[str] = None
+        self._records: Dict[tuple, Any] = {}
+        self._lock = Lock()
+        if self.path.exists():
+            self._replay()
+    
+    @classmethod
+    def open(cls, directory: Optional[str] = None, resume: Optional[bool] = None) -> "RunJournal":
+        """
+        打开最近一个未结束的运行日志继续执行，没有时创建新的运行
+        
+        Args:
+            directory: 日志目录，默认读取JOURNAL_DIR
+            resume: 是否续跑未结束的运行，默认读取RESUME（默认true）；为False时放弃未结束的运行
+        """
+        directory = Path(directory or os.getenv("JOURNAL_DIR", DEFAULT_JOURNAL_DIR))
+        if resume is None:
+            resume = os.getenv("RESUME", "true").lower() == "true"
+        directory.mkdir(parents=True, exist_ok=True)
+        
+        for path in sorted(directory.glob("run-*.jsonl"), reverse=True):
+            journal = cls(path)
+            if journal.status is not None:
+                break
+            if resume:
+                journal.resumed = True
+                logger.info(f"发现未完成的运行 {journal.run_id}，从最后完成的阶段继续")
+                return journal
+            journal.close("abandoned")
+            break
+        
+        # 文件名按时间排序，同一微秒内创建多个运行时递增
+        now = time.time()
+        run_id = time.strftime("run-%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1e6) % 1000000:06d}"
+        name, suffix = run_id, 1
+        while (directory / f"{name}.jsonl").exists():
+            name, suffix = f"{run_id}-{suffix}", suffix + 1
+        journal = cls(directory / f"{name}.jsonl")
+        journal._append({"type": "start", "run_id": journal.run_id, "ts": now})
+        return journal
+    
+    def _replay(self):
+        content = self.path.read_bytes()
+        if content and not content.endswith(b"\n"):
+            # 崩溃时写了一半的最后一行，截断后才能继续追加
+            content = content[:content.rfind(b"\n") + 1]
+            with open(self.path, "r+b") as f:
+                f.truncate(len(content))
+        
+        for line in content.decode("utf-8").splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry["type"] == "stage":
+                self._records[(entry["stage"], entry["key"])] = entry["data"]
+            elif entry["type"] == "end":
+                self.status = entry["status"]
+    
+    def _append(self, entry: Dict):
+        line = json.dumps(entry, ensure_ascii=False, sort_keys=True) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def record(self, stage: str, key: str, data: Any):
+        """记录一个阶段的输出，返回前已落盘"""
+        self._append({"type": "stage", "stage": stage, "key": key, "data": data, "ts": time.time()})
+        with self._lock:
+            self._records[(stage, key)] = data
+    
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        """读取已完成阶段的输出，未完成时返回None"""
+        with self._lock:
+            return self._records.get((stage, key))
+    
+    def has_irreversible(self) -> bool:
+        """是否已经签名、提议或（准备）执行过交易"""
+        with self._lock:
+            return any(stage in IRREVERSIBLE_STAGES for stage, _ in self._records)
+    
+    def close(self, status: str):
+        """结束运行：complete表示成功，abandoned表示放弃（之后不会被续跑）"""
+        self._append({"type": "end", "status": status, "ts": time.time()})
+        self.status = status
@@ -1,7 +1,28 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
-from typing import Optional
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库json
+    orjson = None
+
+load_dotenv()
 
 # 创建日志格式
 VERBOSE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
@@ -15,9 +36,61 @@ LOG_LEVELS = {
     'ERROR': logging.ERROR,
 }
 
+# 输出格式：text为终端阅读，json为每行一个JSON对象，供日志采集使用
+LOG_FORMATS = ("text", "json")
+
+# 进度条宽度（字符）
+PROGRESS_WIDTH = 30
+
+# 去重记录的默认上限；超过后淘汰最久未出现的消息
+DEFAULT_DEDUPE_SIZE = 10000
+
+# 当前线程/协程绑定的结构化字段（stage、network、safe、page_id、nonce等）
+_fields: contextvars.ContextVar = contextvars.ContextVar("log_fields", default={})
+
+
+def _dumps(event: Dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(event, default=str).decode("utf-8")
+    return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志输出为一行JSON：时间、级别、消息，以及记录时绑定的run_id、stage、safe、nonce、page_id等字段
+    """
+    
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "message": record.getMessage(),
+        }
+        event.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        return _dumps(event)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    只把记录的副本放入队列，消息格式化和异常信息都留给监听线程处理
+
+    标准库的QueueHandler.prepare会在调用线程中格式化消息并清除args和exc_info，
+    热循环仍要承担格式化的开销，JSON格式的日志也会丢失异常堆栈
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+
 class SafeLogger:
     """
     Safe应用的日志工具，用于优化终端输出，减少重复信息
+
+    消息支持 %-style 参数（logger.info("已签名 %s", safe_tx_hash)），级别未开启时不做任何格式化。
+    去重按 (上下文, 模板, 参数) 记录在有界的LRU中，可选时间窗口，窗口过后同样的消息可以再次输出。
+    日志记录放入队列后立即返回，由后台线程写到终端，热循环中的日志不会阻塞在I/O上
     """
     
     _instance = None
@@ -42,68 +115,171 @@ class SafeLogger:
         self.logger.setLevel(self.log_level)
         
         # 清除任何已存在的处理器
-        for handler in self.logger.handlers:
+        for handler in list(self.logger.handlers):
             self.logger.removeHandler(handler)
         
         # 创建控制台处理器
         console_handler = logging.StreamHandler(sys.stdout)
         
         # 设置日志格式
-        if self.verbose:
+        self.log_format = os.getenv('LOG_FORMAT', 'text').lower()
+        if self.log_format not in LOG_FORMATS:
+            self.log_format = 'text'
+        if self.log_format == 'json':
+            formatter = JsonFormatter()
+        elif self.verbose:
             formatter = logging.Formatter(VERBOSE_FORMAT)
         else:
             formatter = logging.Formatter(SIMPLE_FORMAT)
         
         console_handler.setFormatter(formatter)
-        self.logger.addHandler(console_handler)
         
-        # 记录已输出的消息，用于避免重复
-        self.logged_messages = set()
+        # 调用方只把记录（保留参数和异常信息）放入队列，由监听线程格式化（包括JSON序列化）并写出；
+        # Queue不设上限，put不会阻塞
+        self._queue = queue.Queue()
+        self.logger.addHandler(_DeferredQueueHandler(self._queue))
+        self._listener = logging.handlers.QueueListener(self._queue, console_handler)
+        self._listener.start()
+        self._listening = True
+        atexit.register(self.close)
+        
+        # 记录已输出的消息，用于避免重复：有界LRU，键为(上下文, 模板, 参数)，值为最近输出的时间
+        self.dedupe_size = int(os.getenv('LOG_DEDUPE_SIZE', str(DEFAULT_DEDUPE_SIZE)))
+        # 去重的时间窗口（秒），0表示在LRU中就一直去重
+        self.dedupe_window = float(os.getenv('LOG_DEDUPE_WINDOW', '0'))
+        self.logged_messages: OrderedDict = OrderedDict()
+        
+        # 进度输出的最小间隔（秒），大批量处理时避免每行都写终端
+        self.progress_interval = float(os.getenv('LOG_PROGRESS_INTERVAL', '1.0'))
+        self._last_progress = float('-inf')
+        # 多个线程共用，需要加锁
+        self._lock = threading.RLock()
+        
+        # 每个线程的上下文前缀，多Safe并行处理时用于区分日志来源
+        self._local = threading.local()
+        
+        # 所有日志共有的字段；run_id默认随机生成，有运行日志时替换为运行日志的ID
+        self.fields = {"run_id": uuid.uuid4().hex[:12]}
     
-    def debug(self, message: str, repeat_ok: bool = False):
-        """输出调试级别日志"""
-        if not repeat_ok and message in self.logged_messages:
+    def set_context(self, context: Optional[str]):
+        """设置当前线程的日志前缀，传入None清除"""
+        self._local.context = context
+    
+    def set_run_id(self, run_id: str):
+        """设置之后所有日志的run_id"""
+        self.fields = {**self.fields, "run_id": run_id}
+    
+    @contextmanager
+    def bind(self, **fields):
+        """
+        在with块内给当前线程（或协程）的日志附加结构化字段，值为None的字段忽略
+        
+        用法: with logger.bind(stage="sign", nonce=12): ...
+        """
+        token = _fields.set({**_fields.get(), **{k: v for k, v in fields.items() if v is not None}})
+        try:
+            yield
+        finally:
+            _fields.reset(token)
+    
+    def flush(self):
+        """等待队列中的日志全部写出，例如在直接print之前"""
+        self._queue.join()
+    
+    def close(self):
+        """写出剩余日志并停止监听线程"""
+        if self._listening:
+            self._listening = False
+            self._listener.stop()
+    
+    def _seen(self, key) -> bool:
+        """key在去重窗口内出现过时返回True，否则记录本次出现；调用方持有锁"""
+        now = time.monotonic()
+        last = self.logged_messages.get(key)
+        if last is not None and (not self.dedupe_window or now - last < self.dedupe_window):
+            self.logged_messages.move_to_end(key)
+            return True
+        self.logged_messages[key] = now
+        self.logged_messages.move_to_end(key)
+        while len(self.logged_messages) > self.dedupe_size:
+            self.logged_messages.popitem(last=False)
+        return False
+    
+    def _log(self, level: int, message: str, args: tuple, repeat_ok: bool, exc_info: bool = False):
+        if not self.logger.isEnabledFor(level):
             return
-        self.logger.debug(message)
-        self.logged_messages.add(message)
+        fields = {**self.fields, **_fields.get()}
+        context = getattr(self._local, "context", None)
+        if context and self.log_format == "text":
+            message = f"[{context}] {message}"
+        with self._lock:
+            if not repeat_ok:
+                # JSON模式下不同行、不同Safe的同一条消息都有意义，字段也参与去重
+                key = (message, args, tuple(fields.items())) if self.log_format == "json" else (message, args)
+                try:
+                    hash(key)
+                except TypeError:
+                    # 参数不可哈希时退回到格式化后的消息
+                    key = message % args if args else message
+                if self._seen(key):
+                    return
+            self.logger.log(level, message, *args, exc_info=exc_info, extra={"fields": fields})
+    
+    def debug(self, message: str, *args, repeat_ok: bool = False):
+        """输出调试级别日志"""
+        self._log(logging.DEBUG, message, args, repeat_ok)
     
-    def info(self, message: str, repeat_ok: bool = False):
+    def info(self, message: str, *args, repeat_ok: bool = False):
         """输出信息级别日志"""
-        if not repeat_ok and message in self.logged_messages:
-            return
-        self.logger.info(message)
-        self.logged_messages.add(message)
+        self._log(logging.INFO, message, args, repeat_ok)
     
-    def warning(self, message: str, repeat_ok: bool = False):
+    def warning(self, message: str, *args, repeat_ok: bool = False):
         """输出警告级别日志"""
-        if not repeat_ok and message in self.logged_messages:
-            return
-        self.logger.warning(message)
-        self.logged_messages.add(message)
+        self._log(logging.WARNING, message, args, repeat_ok)
     
-    def error(self, message: str, repeat_ok: bool = False):
-        """输出错误级别日志"""
-        if not repeat_ok and message in self.logged_messages:
-            return
-        self.logger.error(message)
-        self.logged_messages.add(message)
+    def error(self, message: str, *args, repeat_ok: bool = False, exc_info: bool = False):
+        """输出错误级别日志，exc_info为True时附带当前异常的堆栈"""
+        self._log(logging.ERROR, message, args, repeat_ok, exc_info)
     
     def section(self, title: str):
         """输出分节标题，便于阅读"""
+        if self.log_format == "json":
+            with self.bind(section=title):
+                self.info(title)
+            return
         divider = "-" * 40
-        self.info(f"\n{divider}")
-        self.info(f" {title} ")
-        self.info(f"{divider}")
+        # 分节的三行一起输出，避免被其他线程的日志打断
+        with self._lock:
+            self.info(f"\n{divider}", repeat_ok=True)
+            self.info(f" {title} ", repeat_ok=True)
+            self.info(f"{divider}", repeat_ok=True)
     
-    def progress(self, step: int, total: int, message: str):
-        """输出进度信息"""
-        progress_bar = f"[{'#' * step}{' ' * (total - step)}]"
-        self.info(f"{progress_bar} {step}/{total} {message}", repeat_ok=True)
+    def progress(self, step: int, total: Optional[int], message: str):
+        """
+        输出进度信息，间隔不足LOG_PROGRESS_INTERVAL秒时跳过，最后一步总会输出
+        
+        Args:
+            total: 总数，流式处理中未知时传None，只显示已完成数量
+        """
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        now = time.monotonic()
+        with self._lock:
+            if step != total and now - self._last_progress < self.progress_interval:
+                return
+            self._last_progress = now
+        if total:
+            filled = min(PROGRESS_WIDTH, PROGRESS_WIDTH * step // total)
+            progress_bar = f"[{'#' * filled}{' ' * (PROGRESS_WIDTH - filled)}]"
+            self.info("%s %d/%d %s", progress_bar, step, total, message, repeat_ok=True)
+        else:
+            self.info("%d %s", step, message, repeat_ok=True)
     
     def transaction_info(self, address: str, amount: float, token: str = "USDT"):
         """输出交易信息，以标准格式显示"""
-        formatted_address = self._format_address(address)
-        self.info(f"转账: {formatted_address} ← {amount} {token}")
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        self.info("转账: %s ← %s %s", self._format_address(address), amount, token)
     
     def _format_address(self, address: str) -> str:
         """格式化地址，只显示开头和结尾几位，方便阅读"""
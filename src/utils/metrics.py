@@ -0,0 +1,349 @@
+import bisect
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from utils.files import write_json_atomic
+
+# 延迟直方图的桶上限（秒），与Prometheus默认桶一致
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFAULT_REPORT_FILE = ".cache/run-report.json"
+
+# 路径中的地址、哈希、UUID和数字替换为占位符，避免每个Safe/页面各占一个端点
+_PATH_ID = re.compile(r"^(0x[0-9a-fA-F]+|[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}|\d+)$")
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """把请求归类为端点：GET /api/v1/safes/{id}/"""
+    path = urlparse(url).path if "://" in url else url
+    parts = ["{id}" if _PATH_ID.match(part) else part for part in path.split("/")]
+    return f"{method.upper()} {'/'.join(parts)}"
+
+
+# 当前线程正在统计的调用在传输层实际收发的字节数；由传输层累加，统计包装读取，
+# 不需要把已解析的请求和响应重新序列化
+_wire = threading.local()
+
+
+def _add_wire(sent: int = 0, received: int = 0):
+    _wire.sent = getattr(_wire, "sent", 0) + sent
+    _wire.received = getattr(_wire, "received", 0) + received
+
+
+@contextmanager
+def _wire_bytes():
+    """统计期间传输层收发的字节数，产出 [sent, received]；嵌套调用的字节不计入外层"""
+    outer = (getattr(_wire, "sent", 0), getattr(_wire, "received", 0))
+    _wire.sent = _wire.received = 0
+    sizes = [0, 0]
+    try:
+        yield sizes
+    finally:
+        sizes[:] = _wire.sent, _wire.received
+        _wire.sent, _wire.received = outer
+
+
+def _body_size(response) -> int:
+    """requests响应对应的已编码请求体长度"""
+    body = getattr(getattr(response, "request", None), "body", None)
+    return len(body) if body else 0
+
+
+class _CallStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "seconds": self.seconds,
+            "histogram": {
+                **{str(le): count for le, count in zip(LATENCY_BUCKETS, self.buckets)},
+                "+Inf": self.buckets[-1],
+            },
+        }
+
+
+class Metrics:
+    """
+    运行期间的调用统计和阶段耗时
+
+    按 (类别, 方法或端点) 记录调用次数、错误数、收发字节数和延迟直方图；类别为
+    rpc（web3 provider）、rpc_batch（safe-eth-py直接发出的批量请求）、safe_service和notion。
+    阶段以span记录，流水线各阶段的处理耗时和运行时间一并写入运行报告
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._started = time.perf_counter()
+            self.calls: Dict[str, Dict[str, _CallStats]] = {}
+            self.spans: List[Dict] = []
+            self.stages: Dict[str, Dict] = {}
+
+    def record_call(self, kind: str, name: str, seconds: float, bytes_sent: int = 0,
+                    bytes_received: int = 0, error: bool = False):
+        with self._lock:
+            stats = self.calls.setdefault(kind, {}).setdefault(name, _CallStats())
+            stats.count += 1
+            stats.errors += int(error)
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.seconds += seconds
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def span(self, name: str):
+        """记录一个阶段的开始时间和耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.spans.append({
+                    "name": name,
+                    "start": started - self._started,
+                    "duration": time.perf_counter() - started,
+                    "thread": threading.current_thread().name,
+                })
+
+    def record_stages(self, stats: Dict[str, Dict]):
+        """记录流水线各阶段的统计，同名阶段累加"""
+        with self._lock:
+            for name, stage in stats.items():
+                total = self.stages.setdefault(name, {key: 0 for key in stage})
+                for key, value in stage.items():
+                    total[key] += value
+
+    def report(self) -> Dict:
+        """运行报告，按类别汇总调用次数和耗时，便于判断时间花在Notion、RPC还是编码上"""
+        with self._lock:
+            calls = {
+                kind: {name: stats.to_dict() for name, stats in sorted(endpoints.items())}
+                for kind, endpoints in sorted(self.calls.items())
+            }
+            return {
+                "started": self.started,
+                "duration_seconds": time.perf_counter() - self._started,
+                "summary": {
+                    kind: {
+                        "count": sum(stats["count"] for stats in endpoints.values()),
+                        "errors": sum(stats["errors"] for stats in endpoints.values()),
+                        "seconds": sum(stats["seconds"] for stats in endpoints.values()),
+                    }
+                    for kind, endpoints in calls.items()
+                },
+                "calls": calls,
+                "stages": dict(self.stages),
+                "spans": list(self.spans),
+            }
+
+    def prometheus(self) -> str:
+        """Prometheus textfile collector格式"""
+        report = self.report()
+        lines = [
+            "# TYPE safe_calls_total counter",
+            "# TYPE safe_call_errors_total counter",
+            "# TYPE safe_call_bytes_total counter",
+            "# TYPE safe_call_duration_seconds histogram",
+        ]
+        for kind, endpoints in report["calls"].items():
+            for name, stats in endpoints.items():
+                labels = f'kind="{kind}",name="{name}"'
+                lines.append(f"safe_calls_total{{{labels}}} {stats['count']}")
+                lines.append(f"safe_call_errors_total{{{labels}}} {stats['errors']}")
+                lines.append(f'safe_call_bytes_total{{{labels},direction="sent"}} {stats["bytes_sent"]}')
+                lines.append(f'safe_call_bytes_total{{{labels},direction="received"}} {stats["bytes_received"]}')
+                cumulative = 0
+                for le, count in stats["histogram"].items():
+                    cumulative += count
+                    lines.append(f'safe_call_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"safe_call_duration_seconds_sum{{{labels}}} {stats['seconds']}")
+                lines.append(f"safe_call_duration_seconds_count{{{labels}}} {stats['count']}")
+        lines.append("# TYPE safe_stage_seconds gauge")
+        for name, stage in report["stages"].items():
+            lines.append(f'safe_stage_seconds{{stage="{name}",type="busy"}} {stage.get("busy_seconds", 0)}')
+            lines.append(f'safe_stage_seconds{{stage="{name}",type="wall"}} {stage.get("wall_seconds", 0)}')
+        lines.append("# TYPE safe_span_seconds gauge")
+        for span in report["spans"]:
+            lines.append(f'safe_span_seconds{{name="{span["name"]}"}} {span["duration"]}')
+        lines.append(f"safe_run_duration_seconds {report['duration_seconds']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, report_file: Optional[str] = None, prometheus_file: Optional[str] = None) -> Optional[Path]:
+        """
+        写出运行报告，默认读取RUN_REPORT_FILE（为空时不写）和PROMETHEUS_TEXTFILE
+
+        Returns:
+            运行报告路径
+        """
+        if report_file is None:
+            report_file = os.getenv("RUN_REPORT_FILE", DEFAULT_REPORT_FILE)
+        if prometheus_file is None:
+            prometheus_file = os.getenv("PROMETHEUS_TEXTFILE", "")
+
+        if prometheus_file:
+            # textfile collector只读取完整的文件，先写临时文件再替换
+            path = Path(prometheus_file)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = path.with_suffix(path.suffix + ".tmp")
+            temp_file.write_text(self.prometheus())
+            os.replace(temp_file, path)
+        if report_file:
+            write_json_atomic(Path(report_file), self.report())
+            return Path(report_file)
+        return None
+
+
+def _instrument_provider(provider):
+    """
+    在JSON-RPC provider编码请求、解码响应时记录原始字节数；RPC缓存等包装层向内查找，
+    命中缓存的调用没有收发字节。eth-tester等不经过JSON编码的provider不统计字节数
+    """
+    while getattr(provider, "provider", None) is not None:
+        provider = provider.provider
+    if getattr(provider, "_metrics_instrumented", False) or not hasattr(provider, "encode_rpc_request"):
+        return
+    encode, decode = provider.encode_rpc_request, provider.decode_rpc_response
+
+    def encode_rpc_request(method, params):
+        data = encode(method, params)
+        _add_wire(sent=len(data))
+        return data
+
+    def decode_rpc_response(raw_response):
+        _add_wire(received=len(raw_response))
+        return decode(raw_response)
+
+    provider.encode_rpc_request = encode_rpc_request
+    provider.decode_rpc_response = decode_rpc_response
+    provider._metrics_instrumented = True
+
+
+def instrument_web3(w3):
+    """给web3添加统计中间件，按RPC方法记录调用；重复调用不会重复添加"""
+    if getattr(w3, "_metrics_instrumented", False):
+        return w3
+    _instrument_provider(w3.provider)
+
+    def metrics_middleware(make_request, w3):
+        def middleware(method, params):
+            started = time.perf_counter()
+            response = None
+            sizes = [0, 0]
+            try:
+                with _wire_bytes() as sizes:
+                    response = make_request(method, params)
+                return response
+            finally:
+                metrics.record_call(
+                    "rpc", method, time.perf_counter() - started, sizes[0], sizes[1],
+                    error=response is None or "error" in response,
+                )
+        return middleware
+
+    w3.middleware_onion.add(metrics_middleware, name="metrics")
+    w3._metrics_instrumented = True
+    return w3
+
+
+def instrument_session(session, kind: str, rpc: bool = False):
+    """
+    包装requests.Session.request，按端点记录调用
+
+    Args:
+        kind: 统计类别
+        rpc: 会话发送的是JSON-RPC请求时按方法名归类
+    """
+    if getattr(session, "_metrics_instrumented", False) or not hasattr(session, "request"):
+        return session
+    request = session.request
+
+    def instrumented(method, url, *args, **kwargs):
+        started = time.perf_counter()
+        response = None
+        try:
+            response = request(method, url, *args, **kwargs)
+            return response
+        finally:
+            payload = kwargs.get("json", kwargs.get("data"))
+            if rpc and isinstance(payload, list):
+                methods = sorted({call.get("method", "") for call in payload})
+                name = f"batch:{','.join(methods)}"
+            elif rpc and isinstance(payload, dict):
+                name = payload.get("method", "")
+            else:
+                name = endpoint_name(method, url)
+            metrics.record_call(
+                kind, name, time.perf_counter() - started,
+                _body_size(response), len(response.content) if response is not None else 0,
+                error=response is None or response.status_code >= 400,
+            )
+
+    session.request = instrumented
+    session._metrics_instrumented = True
+    return session
+
+
+def instrument_ethereum_client(ethereum_client):
+    """统计EthereumClient的web3调用和safe-eth-py直接发出的批量请求"""
+    instrument_web3(ethereum_client.w3)
+    instrument_session(ethereum_client.http_session, "rpc_batch", rpc=True)
+    return ethereum_client
+
+
+def instrument_notion(client):
+    """包装notion_client.Client.request，按端点记录调用；字节数取自底层httpx请求和响应的原始内容"""
+    if getattr(client, "_metrics_instrumented", False):
+        return client
+    request = client.request
+    http = getattr(client, "client", None)
+    if http is not None and hasattr(http, "send"):
+        send = http.send
+
+        def sized_send(http_request, *args, **kwargs):
+            response = send(http_request, *args, **kwargs)
+            _add_wire(sent=len(http_request.content), received=len(response.content))
+            return response
+
+        http.send = sized_send
+
+    def instrumented(path, method, query=None, body=None, auth=None):
+        started = time.perf_counter()
+        response = None
+        sizes = [0, 0]
+        try:
+            with _wire_bytes() as sizes:
+                response = request(path, method, query=query, body=body, auth=auth)
+            return response
+        finally:
+            metrics.record_call(
+                "notion", endpoint_name(method, "/" + path), time.perf_counter() - started,
+                sizes[0], sizes[1], error=response is None,
+            )
+
+    client.request = instrumented
+    client._metrics_instrumented = True
+    return client
+
+
+# 全局单例
+metrics = Metrics()
@@ -0,0 +1,302 @@
+import asyncio
+import contextvars
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+# 执行器类型：
+# inline  - 在阶段线程中逐个处理
+# thread  - 线程池并发处理，输出保持输入顺序；阶段设置了key时同一键的元素按输入顺序串行，不同键之间并发
+# asyncio - 事件循环中并发执行协程函数，输出保持输入顺序
+EXECUTORS = ("inline", "thread", "asyncio")
+
+DEFAULT_QUEUE_SIZE = 256
+
+# 流结束标记
+_END = object()
+
+
+class Stage:
+    """
+    流水线中的一个阶段
+    
+    map阶段对每个元素调用fn，返回None表示丢弃该元素；
+    stream阶段的fn接收上游迭代器并返回新的迭代器，用于聚合等有状态处理，只能inline执行。
+    设置key时同一键（如同一个Safe）的元素按输入顺序串行处理，用于分配nonce等必须有序的阶段
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        fn: Callable,
+        executor: str = "inline",
+        workers: int = 1,
+        stream: bool = False,
+        key: Optional[Callable[[Any], Hashable]] = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.stream = stream
+        self.key = key
+        self._check(executor)
+        self.executor = executor
+        self.workers = max(1, workers)
+        # 统计信息：处理数量、处理函数累计耗时和阶段线程从启动到结束的时间
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.wall_seconds = 0.0
+        self._stats_lock = threading.Lock()
+    
+    def _check(self, executor: str):
+        if executor not in EXECUTORS:
+            raise ValueError(f"不支持的执行器: {executor}")
+        if self.stream and executor != "inline":
+            raise ValueError(f"stream阶段只能inline执行: {self.name}")
+        if self.key is not None and executor == "asyncio":
+            raise ValueError(f"按键串行的阶段只能inline或thread执行: {self.name}")
+    
+    def configure(self, spec: str):
+        """按 "thread:8" / "inline" 形式的配置覆盖执行器"""
+        executor, _, workers = spec.partition(":")
+        self._check(executor)
+        self.executor = executor
+        if workers:
+            self.workers = max(1, int(workers))
+    
+    def _count(self, started: float):
+        with self._stats_lock:
+            self.busy_seconds += time.perf_counter() - started
+            self.processed += 1
+    
+    def _timed(self, item: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return self.fn(item)
+        finally:
+            self._count(started)
+    
+    async def _timed_async(self, item: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(self.fn):
+                return await self.fn(item)
+            # 普通函数在线程中执行，不阻塞事件循环
+            return await asyncio.to_thread(self.fn, item)
+        finally:
+            self._count(started)
+    
+    def process(self, items: Iterator[Any]) -> Iterator[Any]:
+        """按执行器处理上游迭代器，返回下游迭代器"""
+        if self.stream:
+            for item in self.fn(items):
+                with self._stats_lock:
+                    self.processed += 1
+                yield item
+        elif self.executor == "inline":
+            for item in items:
+                result = self._timed(item)
+                if result is not None:
+                    yield result
+        elif self.executor == "thread" and self.key is not None:
+            yield from self._process_keyed(items)
+        elif self.executor == "thread":
+            yield from self._process_thread(items)
+        else:
+            yield from self._process_asyncio(items)
+    
+    def _process_thread(self, items: Iterator[Any]) -> Iterator[Any]:
+        # 同时在途的任务数有上限，超过时等待最早的任务完成，形成背压
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name) as pool:
+            for item in items:
+                # 工作线程沿用阶段线程的日志字段（stage等）
+                window.append(pool.submit(contextvars.copy_context().run, self._timed, item))
+                if len(window) >= self.workers * 2:
+                    result = window.popleft().result()
+                    if result is not None:
+                        yield result
+            while window:
+                result = window.popleft().result()
+                if result is not None:
+                    yield result
+    
+    def _process_keyed(self, items: Iterator[Any]) -> Iterator[Any]:
+        # 每个键一条队列，同一时刻最多一个工作线程在处理某个键的队列；输出仍保持输入顺序
+        lanes: Dict[Hashable, deque] = {}
+        lock = threading.Lock()
+        
+        def drain(key: Hashable):
+            while True:
+                with lock:
+                    if not lanes[key]:
+                        del lanes[key]
+                        return
+                    item, future = lanes[key].popleft()
+                try:
+                    future.set_result(self._timed(item))
+                except BaseException as e:
+                    future.set_exception(e)
+        
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name) as pool:
+            for item in items:
+                key, future = self.key(item), Future()
+                with lock:
+                    idle = key not in lanes
+                    lanes.setdefault(key, deque()).append((item, future))
+                if idle:
+                    pool.submit(contextvars.copy_context().run, drain, key)
+                window.append(future)
+                if len(window) >= self.workers * 2:
+                    result = window.popleft().result()
+                    if result is not None:
+                        yield result
+            while window:
+                result = window.popleft().result()
+                if result is not None:
+                    yield result
+    
+    def _process_asyncio(self, items: Iterator[Any]) -> Iterator[Any]:
+        loop = asyncio.new_event_loop()
+        try:
+            window = deque()
+            for item in items:
+                window.append(loop.create_task(self._timed_async(item)))
+                if len(window) >= self.workers * 2:
+                    result = loop.run_until_complete(window.popleft())
+                    if result is not None:
+                        yield result
+            while window:
+                result = loop.run_until_complete(window.popleft())
+                if result is not None:
+                    yield result
+        finally:
+            loop.close()
+
+
+class PipelineError(Exception):
+    """某个阶段抛出异常，流水线已停止"""
+    
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"阶段 {stage} 失败: {str(error)}")
+        self.stage = stage
+        self.error = error
+
+
+class Pipeline:
+    """
+    由有界队列连接的流水线
+    
+    每个阶段运行在独立线程中，阶段之间的队列满时上游阻塞（背压），
+    因此网络密集的阶段（Notion分页、ENS解析）可以与CPU密集的编码重叠，
+    峰值内存取决于队列深度而不是总行数
+    """
+    
+    def __init__(self, stages: List[Stage], queue_size: Optional[int] = None):
+        self.stages = stages
+        self.queue_size = queue_size or int(os.getenv("PIPELINE_QUEUE_SIZE", str(DEFAULT_QUEUE_SIZE)))
+        self._stop = threading.Event()
+        self._errors: List[PipelineError] = []
+    
+    def configure(self, specs: Optional[str] = None):
+        """
+        按 "resolve=thread:8,sign=thread:2" 形式覆盖各阶段执行器，默认读取PIPELINE_EXECUTORS
+        """
+        specs = specs if specs is not None else os.getenv("PIPELINE_EXECUTORS", "")
+        stages = {stage.name: stage for stage in self.stages}
+        for spec in filter(None, (part.strip() for part in specs.split(","))):
+            name, _, value = spec.partition("=")
+            if name not in stages:
+                raise ValueError(f"未知的流水线阶段: {name}")
+            stages[name].configure(value)
+        return self
+    
+    def _drain(self, q: queue.Queue) -> Iterator[Any]:
+        while True:
+            item = q.get()
+            if item is _END:
+                return
+            yield item
+    
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        # 下游停止时不能一直阻塞在满队列上
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run_stage(self, stage: Stage, source: Iterable[Any], output: queue.Queue):
+        started = time.perf_counter()
+        try:
+            with logger.bind(stage=stage.name):
+                for item in stage.process(iter(source)):
+                    if not self._put(output, item):
+                        break
+        except BaseException as e:
+            self._errors.append(PipelineError(stage.name, e))
+            self._stop.set()
+        finally:
+            stage.wall_seconds = time.perf_counter() - started
+            # 结束标记必须送达，否则下游会永远等待
+            while True:
+                try:
+                    output.put(_END, timeout=0.1)
+                    break
+                except queue.Full:
+                    if self._stop.is_set():
+                        try:
+                            output.get_nowait()
+                        except queue.Empty:
+                            pass
+    
+    def stream(self, source: Iterable[Any]) -> Iterator[Any]:
+        """运行流水线，逐个产出最后一个阶段的输出；任一阶段失败时抛出PipelineError"""
+        threads = []
+        upstream: Iterable[Any] = source
+        for stage in self.stages:
+            output = queue.Queue(maxsize=self.queue_size)
+            thread = threading.Thread(
+                target=self._run_stage, args=(stage, upstream, output),
+                name=f"pipeline-{stage.name}", daemon=True,
+            )
+            threads.append(thread)
+            upstream = self._drain(output)
+        
+        for thread in threads:
+            thread.start()
+        try:
+            for item in upstream:
+                yield item
+        finally:
+            # 消费者提前退出时通知各阶段停止
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            metrics.record_stages(self.stats())
+        if self._errors:
+            raise self._errors[0]
+    
+    def run(self, source: Iterable[Any]) -> List[Any]:
+        """运行流水线并收集全部输出"""
+        results = list(self.stream(source))
+        for stage in self.stages:
+            logger.debug("阶段 %s: %d 项, 耗时 %.2fs", stage.name, stage.processed, stage.busy_seconds)
+        return results
+    
+    def stats(self) -> Dict[str, Dict]:
+        """各阶段的处理数量、处理函数累计耗时和阶段运行时间"""
+        return {
+            stage.name: {"processed": stage.processed, "busy_seconds": stage.busy_seconds,
+                         "wall_seconds": stage.wall_seconds}
+            for stage in self.stages
+        }
@@ -0,0 +1,202 @@
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.logger import logger
+
+DEFAULT_PROFILE_DIR = ".cache/profiles"
+
+# 线程名到阶段：流水线阶段线程为 pipeline-<阶段>，阶段内线程池为 <阶段>_<序号>
+_THREAD_STAGE = re.compile(r"^(?:pipeline-)?([a-z]+)(?:_\d+)?$")
+
+# 叶子帧在这些位置时线程处于空闲等待（流水线队列、线程池取任务），不计入采样
+_IDLE_FILES = ("threading.py", "queue.py")
+_IDLE_FUNCTIONS = {("thread.py", "_worker")}
+
+
+def thread_stage(name: str) -> str:
+    """根据线程名推断所属阶段"""
+    if name == "MainThread":
+        return "main"
+    match = _THREAD_STAGE.match(name)
+    return match.group(1) if match else "other"
+
+
+def _frame_label(code) -> str:
+    # 折叠栈格式用分号分隔帧，帧名中不能出现分号
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """
+    采样分析器
+
+    后台线程每隔interval秒读取所有线程的调用栈（sys._current_frames），按线程所属的流水线阶段
+    归类，输出flamegraph.pl / speedscope可直接读取的折叠栈；空闲等待的线程不计入，因此网络等待
+    和CPU计算都会出现在火焰图中。同时用tracemalloc定期拍快照，只保留全程占用最高的一次（所有阶段共用），
+    按分配位置所在的阶段函数汇总出峰值时刻分配最多的位置
+    """
+
+    def __init__(self, interval: Optional[float] = None, snapshot_interval: Optional[float] = None,
+                 stage_functions: Optional[Dict[str, Callable]] = None):
+        """
+        Args:
+            interval: 采样间隔（秒），默认读取PROFILE_INTERVAL
+            snapshot_interval: tracemalloc快照间隔（秒），默认读取PROFILE_SNAPSHOT_INTERVAL
+            stage_functions: {阶段: 函数}，分配栈中包含该函数时归入该阶段
+        """
+        self.interval = interval or float(os.getenv("PROFILE_INTERVAL", "0.005"))
+        self.snapshot_interval = snapshot_interval or float(os.getenv("PROFILE_SNAPSHOT_INTERVAL", "1.0"))
+        self.samples: Counter = Counter()
+        self.peak_snapshot: Optional[tracemalloc.Snapshot] = None
+        self.peak_traced = 0
+        self._stage_ranges = self._line_ranges(stage_functions or {})
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started = 0.0
+        self.duration = 0.0
+
+    @staticmethod
+    def _line_ranges(stage_functions: Dict[str, Callable]) -> List[Tuple[str, str, int, int]]:
+        ranges = []
+        for stage, function in stage_functions.items():
+            function = inspect.unwrap(function)
+            lines, first = inspect.getsourcelines(function)
+            ranges.append((stage, os.path.abspath(inspect.getsourcefile(function)), first, first + len(lines) - 1))
+        return ranges
+
+    def start(self):
+        tracemalloc.start(int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "64")))
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._take_snapshot()
+        tracemalloc.stop()
+        self.duration = time.perf_counter() - self.started
+
+    def _take_snapshot(self):
+        traced, _ = tracemalloc.get_traced_memory()
+        if self.peak_snapshot is None or traced > self.peak_traced:
+            self.peak_snapshot = tracemalloc.take_snapshot()
+            self.peak_traced = traced
+
+    def _run(self):
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        next_snapshot = time.perf_counter() + self.snapshot_interval
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                code = frame.f_code
+                basename = os.path.basename(code.co_filename)
+                if basename in _IDLE_FILES or (basename, code.co_name) in _IDLE_FUNCTIONS:
+                    continue
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(thread_stage(names.get(thread_id, "")))
+                self.samples[";".join(reversed(stack))] += 1
+            if time.perf_counter() >= next_snapshot:
+                self._take_snapshot()
+                next_snapshot = time.perf_counter() + self.snapshot_interval
+
+    def _allocation_stage(self, traceback: tracemalloc.Traceback) -> str:
+        # 从最近的帧向外找，第一个落在阶段函数内的帧决定归属
+        for frame in reversed(traceback):
+            for stage, filename, first, last in self._stage_ranges:
+                if first <= frame.lineno <= last and frame.filename == filename:
+                    return stage
+        return "other"
+
+    def stage_samples(self) -> Dict[str, int]:
+        totals: Counter = Counter()
+        for stack, count in self.samples.items():
+            totals[stack.split(";", 1)[0]] += count
+        return dict(totals.most_common())
+
+    def top_allocations(self, limit: int = 20) -> Dict[str, List[Tuple[str, int, int]]]:
+        """
+        峰值快照中各阶段分配最多的位置
+
+        Returns:
+            {阶段: [(位置, 字节数, 块数)]}，阶段按总字节数降序
+        """
+        if self.peak_snapshot is None:
+            return {}
+        by_stage: Dict[str, Counter] = defaultdict(Counter)
+        blocks: Dict[str, Counter] = defaultdict(Counter)
+        for trace in self.peak_snapshot.traces:
+            stage = self._allocation_stage(trace.traceback)
+            leaf = trace.traceback[-1]
+            site = f"{leaf.filename}:{leaf.lineno}"
+            by_stage[stage][site] += trace.size
+            blocks[stage][site] += 1
+        ordered = sorted(by_stage, key=lambda stage: -sum(by_stage[stage].values()))
+        return {
+            stage: [(site, size, blocks[stage][site]) for site, size in by_stage[stage].most_common(limit)]
+            for stage in ordered
+        }
+
+    def write(self, directory: Optional[str] = None) -> Path:
+        """
+        写出 cpu.collapsed（折叠栈，可用flamegraph.pl或speedscope查看）和 allocations.txt
+
+        Returns:
+            输出目录
+        """
+        directory = Path(directory or os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR))
+        directory = directory / datetime.now().strftime("%Y%m%d-%H%M%S")
+        directory.mkdir(parents=True, exist_ok=True)
+
+        with open(directory / "cpu.collapsed", "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+
+        lines = [f"采样: {sum(self.samples.values())} 次, 间隔 {self.interval * 1000:.1f} ms, 运行 {self.duration:.2f} s",
+                 f"tracemalloc峰值快照: {self.peak_traced / 1024 / 1024:.1f} MiB", "", "各阶段采样数:"]
+        for stage, count in self.stage_samples().items():
+            lines.append(f"  {stage:<12}{count:>8}")
+        for stage, sites in self.top_allocations().items():
+            total = sum(size for _, size, _ in sites)
+            lines += ["", f"[{stage}] 分配最多的位置 (前{len(sites)}项合计 {total / 1024:,.1f} KiB):",
+                      f"  {'KiB':>10}{'块数':>10}  位置"]
+            for site, size, count in sites:
+                lines.append(f"  {size / 1024:>10,.1f}{count:>10}  {site}")
+        (directory / "allocations.txt").write_text("\n".join(lines) + "\n")
+        return directory
+
+
+@contextmanager
+def profile(enabled: bool, stage_functions: Optional[Dict[str, Callable]] = None):
+    """
+    在with块内运行采样分析器，结束时写出结果；enabled为False时不做任何事
+    """
+    if not enabled:
+        yield None
+        return
+    profiler = SamplingProfiler(stage_functions=stage_functions)
+    logger.info(f"性能分析已开启，采样间隔 {profiler.interval * 1000:.1f} ms")
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        directory = profiler.write()
+        logger.info(f"性能分析结果: {directory / 'cpu.collapsed'}, {directory / 'allocations.txt'}")
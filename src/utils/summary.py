@@ -0,0 +1,104 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from utils.logger import logger
+
+# 汇总中列出的最大金额转账数
+DEFAULT_TOP_N = 10
+
+
+class TransferSummary:
+    """
+    转账汇总
+    
+    大批量处理时不再逐行输出到终端，只累计笔数、各 (网络, 代币) 的总额和金额最大的前N笔，
+    处理过程中按LOG_PROGRESS_INTERVAL限频输出进度，结束时输出一次汇总。
+    配置TRANSFER_DETAIL_FILE时，每一行的明细以JSON lines写入该文件
+    """
+    
+    def __init__(self, top_n: Optional[int] = None, detail_file: Optional[str] = None):
+        """
+        Args:
+            top_n: 汇总中列出的最大金额转账数，默认读取SUMMARY_TOP_N
+            detail_file: 逐行明细文件，默认读取TRANSFER_DETAIL_FILE，为空时不写
+        """
+        self.top_n = top_n if top_n is not None else int(os.getenv("SUMMARY_TOP_N", str(DEFAULT_TOP_N)))
+        self.detail_file = detail_file if detail_file is not None else os.getenv("TRANSFER_DETAIL_FILE", "")
+        self.count = 0
+        self.totals: Dict[Tuple[str, str], Decimal] = {}
+        self.counts: Dict[Tuple[str, str], int] = {}
+        # 小顶堆，只保留金额最大的top_n笔
+        self._top: List[Tuple[Decimal, int, Dict]] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._file = None
+    
+    def add(self, to_address: str, amount: float, token: str = "USDT", network: str = "",
+            safe: str = "", page_id: Optional[str] = None, address: Optional[str] = None):
+        """
+        记录一笔转账
+        
+        Args:
+            to_address: 解析后的收款地址
+            address: Notion中的原始地址（ENS域名等），与to_address相同时可不传
+        """
+        value = Decimal(str(amount))
+        key = (network, token)
+        with self._lock:
+            self.count += 1
+            self.totals[key] = self.totals.get(key, Decimal(0)) + value
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if self.top_n:
+                entry = (value, next(self._seq), {"to": to_address, "amount": amount, "token": token,
+                                                  "network": network, "page_id": page_id})
+                if len(self._top) < self.top_n:
+                    heapq.heappush(self._top, entry)
+                elif value > self._top[0][0]:
+                    heapq.heapreplace(self._top, entry)
+            if self.detail_file:
+                if self._file is None:
+                    Path(self.detail_file).parent.mkdir(parents=True, exist_ok=True)
+                    self._file = open(self.detail_file, "w", encoding="utf-8")
+                self._file.write(json.dumps({
+                    "page_id": page_id, "address": address or to_address, "to": to_address,
+                    "amount": amount, "token": token, "network": network, "safe": safe,
+                }, ensure_ascii=False) + "\n")
+            count = self.count
+        logger.progress(count, None, "笔转账已编码")
+    
+    def top(self) -> List[Dict]:
+        """金额最大的转账，按金额降序"""
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._top, key=lambda item: (-item[0], item[1]))]
+    
+    def close(self):
+        """关闭明细文件"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+    
+    def log(self):
+        """输出汇总"""
+        self.close()
+        if not self.count:
+            return
+        logger.section("转账汇总")
+        logger.info("共 %d 笔转账", self.count, repeat_ok=True)
+        for (network, token), total in sorted(self.totals.items()):
+            label = f"{network} {token}" if network else token
+            logger.info("%s: %d 笔, 合计 %s", label, self.counts[(network, token)], total, repeat_ok=True)
+        top = self.top()
+        if top:
+            logger.info("金额最大的 %d 笔:", len(top), repeat_ok=True)
+            for entry in top:
+                logger.info("  %s ← %s %s %s", entry["to"], entry["amount"], entry["token"],
+                            entry["page_id"] or "", repeat_ok=True)
+        if self.detail_file:
+            logger.info("逐行明细: %s", self.detail_file, repeat_ok=True)
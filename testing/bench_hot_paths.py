@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+编码、哈希和签名热路径的离线微基准
+
+所有链上访问都在进程内EVM上完成，不需要网络。每个基准在10 / 1k / 100k个收款人规模下
+多轮计时（统计项与pytest-benchmark一致），再单独运行一轮用tracemalloc记录分配峰值，
+结果保存为JSON，便于在版本之间比较吞吐和分配的变化：
+
+    python testing/bench_hot_paths.py
+    python testing/bench_hot_paths.py --sizes 10,1000 --compare .benchmarks/上一次.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from hexbytes import HexBytes
+from web3 import Web3
+
+from notion.client import NotionClient
+from safe.plan import build_safe_tx
+from local_chain import build_local_chain, make_handler
+
+DEFAULT_SIZES = (10, 1_000, 100_000)
+DEFAULT_OUTPUT_DIR = project_root / ".benchmarks"
+
+# 每个基准的目标总耗时，决定小规模时的轮数
+TARGET_SECONDS = 1.0
+MAX_ROUNDS = 50
+
+
+def notion_page(i: int, address: str) -> dict:
+    """构造与Notion databases.query返回格式一致的页面"""
+    return {
+        "id": f"page-{i}",
+        "properties": {
+            "审核完毕，Signer": {"type": "people", "people": [{"name": "BigSong"}]},
+            "地址": {"type": "rich_text", "rich_text": [{"text": {"content": address}, "plain_text": address}]},
+            "USDT": {"type": "number", "number": 1.5 + i % 100},
+            "Safe": {"type": "rich_text", "rich_text": []},
+            "网络": {"type": "select", "select": None},
+        },
+    }
+
+
+class HotPaths:
+    """准备各基准的输入，只在进程内EVM上部署一次合约"""
+
+    def __init__(self):
+        ethereum_client, contracts, owners = build_local_chain(threshold=1)
+        self.handler = make_handler(ethereum_client, contracts, owners[:1])
+        self.owner_key = owners[0].key.hex()
+        self.chain_id = ethereum_client.get_chain_id()
+        self.safe_version = self.handler.safe.get_version()
+
+        self.notion = NotionClient.__new__(NotionClient)
+        self.notion.safe_property = "Safe"
+        self.notion.network_property = "网络"
+
+    def inputs(self, n: int) -> dict:
+        # 地址用确定的字节生成，避免把随机数生成计入基准
+        addresses = [Web3.to_checksum_address(i.to_bytes(20, "big")) for i in range(1, n + 1)]
+        lower = [address.lower() for address in addresses]
+        multi_send_txs = [self.handler.encode_transfer(address, 1.5) for address in addresses]
+        data = self.handler.multisend.build_tx_data(multi_send_txs)
+        record = {
+            "safe": self.handler.safe_address,
+            "chain_id": self.chain_id,
+            "safe_version": self.safe_version,
+            "tx": {
+                "to": self.handler.multisend_address, "value": "0", "data": HexBytes(data).hex(),
+                "operation": 1, "safeTxGas": "0", "baseGas": "0", "gasPrice": "0",
+                "gasToken": None, "refundReceiver": None, "nonce": "0",
+            },
+        }
+        return {
+            "pages": [notion_page(i, address) for i, address in enumerate(lower)],
+            "lower": lower,
+            "addresses": addresses,
+            "multi_send_txs": multi_send_txs,
+            "record": record,
+        }
+
+    def benchmarks(self, inputs: dict) -> dict:
+        """名称 -> 无参函数，每个函数处理全部n个收款人"""
+        handler = self.handler
+
+        def extract():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for page in inputs["pages"]:
+                    self.notion._parse_page(page)
+
+        def checksum():
+            for address in inputs["lower"]:
+                Web3.to_checksum_address(address)
+
+        def encode():
+            for address in inputs["addresses"]:
+                handler.encode_transfer(address, 1.5)
+
+        def pack():
+            handler.multisend.build_tx_data(inputs["multi_send_txs"])
+
+        def hash_safe_tx():
+            build_safe_tx(inputs["record"]).safe_tx_hash
+
+        def sign():
+            build_safe_tx(inputs["record"]).sign(self.owner_key)
+
+        return {
+            "notion_extract": extract,
+            "checksum_address": checksum,
+            "erc20_calldata": encode,
+            "multisend_pack": pack,
+            "safe_tx_hash": hash_safe_tx,
+            "safe_tx_sign": sign,
+        }
+
+
+def measure(fn, n: int) -> dict:
+    """多轮计时并记录分配峰值，统计项与pytest-benchmark一致"""
+    fn()  # 预热
+    started = time.perf_counter()
+    fn()
+    first = time.perf_counter() - started
+    rounds = max(1, min(MAX_ROUNDS, int(TARGET_SECONDS / max(first, 1e-9))))
+
+    timings = [first]
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mean = statistics.mean(timings)
+    return {
+        "min": min(timings),
+        "max": max(timings),
+        "mean": mean,
+        "median": statistics.median(timings),
+        "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "rounds": len(timings),
+        "ops": 1 / mean if mean else None,
+        "items_per_second": n / mean if mean else None,
+        "peak_alloc_bytes": peak,
+    }
+
+
+def commit_id() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=project_root, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(sizes, names=None) -> dict:
+    """运行基准，返回与pytest-benchmark --benchmark-json结构相近的结果"""
+    paths = HotPaths()
+    results = []
+    for n in sizes:
+        inputs = paths.inputs(n)
+        for name, fn in paths.benchmarks(inputs).items():
+            if names and name not in names:
+                continue
+            stats = measure(fn, n)
+            results.append({"name": f"{name}[{n}]", "group": name, "params": {"n": n}, "stats": stats})
+            print(f"{name:<18} n={n:<7} 中位数 {stats['median'] * 1000:10.3f} ms  "
+                  f"{stats['items_per_second']:14,.0f} 项/秒  分配峰值 {stats['peak_alloc_bytes'] / 1024:10,.1f} KiB")
+    return {
+        "machine_info": {
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "commit_info": {"id": commit_id()},
+        "datetime": datetime.now().isoformat(timespec="seconds"),
+        "benchmarks": results,
+    }
+
+
+def compare(current: dict, previous: dict):
+    """打印与上一次结果的中位数耗时和分配峰值变化"""
+    before = {bench["name"]: bench["stats"] for bench in previous["benchmarks"]}
+    print(f"\n与 {previous.get('commit_info', {}).get('id') or '上一次结果'} 比较:")
+    for bench in current["benchmarks"]:
+        old = before.get(bench["name"])
+        if not old:
+            continue
+        stats = bench["stats"]
+        time_change = (stats["median"] / old["median"] - 1) * 100 if old["median"] else 0
+        alloc_change = (stats["peak_alloc_bytes"] / old["peak_alloc_bytes"] - 1) * 100 if old["peak_alloc_bytes"] else 0
+        print(f"{bench['name']:<28} 耗时 {time_change:+7.1f}%  分配 {alloc_change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="编码、哈希和签名热路径的离线微基准")
+    parser.add_argument("--sizes", default=",".join(str(n) for n in DEFAULT_SIZES), help="收款人数量，逗号分隔")
+    parser.add_argument("--only", default="", help="只运行这些基准，逗号分隔")
+    parser.add_argument("--output", help="结果JSON路径，默认 .benchmarks/<时间>.json")
+    parser.add_argument("--compare", help="与之前保存的结果比较")
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.sizes.split(",") if n]
+    names = {name for name in args.only.split(",") if name}
+    result = run(sizes, names)
+
+    output = Path(args.output) if args.output else (
+        DEFAULT_OUTPUT_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"\n结果已保存: {output}")
+
+    if args.compare:
+        compare(result, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+注入故障和延迟的本地代理
+
+在工具和它的三个上游（RPC、Notion API、Safe Transaction Service）之间各起一个HTTP反向代理，
+按场景文件注入延迟分布、超时、429/5xx、连接重置、响应截断和JSON-RPC批量请求中的部分失败，
+并记录每个端点的延迟分位数和注入的额外延迟，用来在上线前检查超时和重试在压力下的表现：
+
+    python testing/fault_proxy.py testing/scenarios/flaky_upstreams.json -- python src/main.py plan plan.jsonl
+    python testing/fault_proxy.py scenario.json --report proxy-report.json     # 只启动代理，Ctrl-C结束
+
+带命令运行时，代理地址通过 RPC_URL / RPC_URL_<网络>、NOTION_BASE_URL 和 SAFE_SERVICE_URL_<网络>
+传给子进程；上游地址默认取自这些变量的当前值，也可以在场景文件中用target指定。
+
+场景文件（JSON）：
+
+    {
+      "seed": 1,
+      "upstreams": {"rpc": {"port": 18545}, "notion": {}, "safe_service": {"target": "http://127.0.0.1:8000"}},
+      "rules": [
+        {"upstream": "rpc", "rpc_method": "eth_call", "latency": {"distribution": "lognormal", "median": 0.2, "sigma": 1}},
+        {"upstream": "notion", "probability": 0.2, "fault": "status", "status": 429, "headers": {"Retry-After": "1"}},
+        {"upstream": "safe_service", "path": "/multisig-transactions/$", "start": 30, "end": 60, "fault": "status", "status": 503},
+        {"upstream": "rpc", "probability": 0.01, "fault": "timeout", "hang": 30},
+        {"upstream": "rpc", "rpc_method": "eth_getTransactionReceipt", "fault": "batch_errors", "fraction": 0.3}
+      ]
+    }
+
+规则字段：upstream、method（HTTP方法）、rpc_method、path（正则）用于匹配；probability为命中概率；
+start/end为相对代理启动的时间窗口（秒），用于模拟抖动的服务；count为最多注入次数。
+latency可以是秒数或分布（fixed、uniform、normal、lognormal、pareto），所有命中规则的延迟相加；
+fault为status、timeout（保持连接hang秒后断开）、reset（立即断开）、truncate（响应只发送一半）
+或batch_errors（把JSON-RPC批量响应中fraction比例的结果替换为错误），多条命中时第一条生效。
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from utils.files import write_json_atomic
+from utils.metrics import endpoint_name
+
+UPSTREAMS = ("rpc", "notion", "safe_service")
+FAULTS = ("status", "timeout", "reset", "truncate", "batch_errors")
+
+DEFAULT_NOTION_URL = "https://api.notion.com"
+
+# 转发时不复制的逐跳头，以及requests已经解压、长度会变化的头
+_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "content-encoding", "host"}
+
+
+def sample_latency(spec, rng: random.Random) -> float:
+    """按延迟配置采样一次延迟（秒）"""
+    if not spec:
+        return 0.0
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    distribution = spec.get("distribution", "fixed")
+    if distribution == "fixed":
+        value = spec["value"]
+    elif distribution == "uniform":
+        value = rng.uniform(spec.get("min", 0.0), spec["max"])
+    elif distribution == "normal":
+        value = rng.gauss(spec["mean"], spec.get("stddev", 0.0))
+    elif distribution == "lognormal":
+        # 用中位数和sigma描述，长尾由sigma决定
+        value = rng.lognormvariate(math.log(spec["median"]), spec.get("sigma", 1.0))
+    elif distribution == "pareto":
+        value = spec["scale"] * rng.paretovariate(spec.get("alpha", 2.0))
+    else:
+        raise ValueError(f"未知的延迟分布: {distribution}")
+    return max(0.0, min(value, spec.get("cap", float("inf"))))
+
+
+class FaultRule:
+    """场景中的一条规则"""
+
+    def __init__(self, spec: Dict):
+        self.upstream = spec.get("upstream")
+        if self.upstream not in UPSTREAMS:
+            raise ValueError(f"规则的upstream必须是 {', '.join(UPSTREAMS)}: {spec}")
+        self.method = (spec.get("method") or "").upper() or None
+        self.rpc_method = spec.get("rpc_method")
+        self.path = re.compile(spec["path"]) if spec.get("path") else None
+        self.probability = float(spec.get("probability", 1.0))
+        self.start = float(spec.get("start", 0.0))
+        self.end = float(spec.get("end", float("inf")))
+        self.count = spec.get("count")
+        self.latency = spec.get("latency")
+        self.fault = spec.get("fault")
+        if self.fault is not None and self.fault not in FAULTS:
+            raise ValueError(f"未知的故障类型: {self.fault}")
+        self.status = int(spec.get("status", 503))
+        self.body = spec.get("body")
+        self.headers = spec.get("headers") or {}
+        self.hang = float(spec.get("hang", 30.0))
+        self.fraction = float(spec.get("fraction", 0.5))
+        self.applied = 0
+
+    def matches(self, upstream: str, method: str, path: str, rpc_methods: List[str], elapsed: float) -> bool:
+        if upstream != self.upstream or not self.start <= elapsed < self.end:
+            return False
+        if self.count is not None and self.applied >= self.count:
+            return False
+        if self.method and method != self.method:
+            return False
+        if self.rpc_method and self.rpc_method not in rpc_methods:
+            return False
+        return not (self.path and not self.path.search(path))
+
+
+class Scenario:
+    """场景文件：上游配置和规则列表"""
+
+    def __init__(self, spec: Dict):
+        self.seed = spec.get("seed", 0)
+        self.upstreams: Dict[str, Dict] = spec.get("upstreams") or {name: {} for name in UPSTREAMS}
+        unknown = set(self.upstreams) - set(UPSTREAMS)
+        if unknown:
+            raise ValueError(f"未知的上游: {', '.join(sorted(unknown))}")
+        self.rules = [FaultRule(rule) for rule in spec.get("rules", [])]
+
+    @classmethod
+    def load(cls, path) -> "Scenario":
+        return cls(json.loads(Path(path).read_text(encoding="utf-8")))
+
+
+def _rpc_methods(body: bytes) -> Tuple[List[str], Optional[object]]:
+    """请求体为JSON-RPC时返回方法名列表和解析后的请求"""
+    try:
+        payload = json.loads(body) if body else None
+    except ValueError:
+        return [], None
+    calls = payload if isinstance(payload, list) else [payload]
+    methods = [call.get("method", "") for call in calls if isinstance(call, dict)]
+    return methods, payload
+
+
+def _error_body(upstream: str, status: int, payload) -> object:
+    """各上游的错误响应格式"""
+    message = f"fault proxy injected {status}"
+    if upstream == "notion":
+        code = {429: "rate_limited", 502: "bad_gateway", 503: "service_unavailable",
+                504: "gateway_timeout"}.get(status, "internal_server_error")
+        return {"object": "error", "status": status, "code": code, "message": message}
+    if upstream == "rpc":
+        request_id = payload.get("id") if isinstance(payload, dict) else None
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32005 if status == 429 else -32603,
+                                                             "message": message}}
+    return {"detail": message}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+class FaultProxy:
+    """一个上游的反向代理"""
+
+    def __init__(self, upstream: str, target: str, rules: List[FaultRule], rng: random.Random,
+                 records: List[Dict], lock: threading.Lock, started: float, upstream_timeout: float = 60.0):
+        self.upstream = upstream
+        self.target = target.rstrip("/")
+        self.rules = [rule for rule in rules if rule.upstream == upstream]
+        self.rng = rng
+        self.records = records
+        self.lock = lock
+        self.started = started
+        self.upstream_timeout = upstream_timeout
+        self.session = requests.Session()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self):
+                proxy.handle(self)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"fault-proxy-{self.upstream}",
+                         daemon=True).start()
+        return self.url
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _select(self, method: str, path: str, rpc_methods: List[str]) -> Tuple[float, Optional[FaultRule]]:
+        """命中的规则：延迟相加，第一条故障规则生效"""
+        delay, fault = 0.0, None
+        elapsed = time.perf_counter() - self.started
+        with self.lock:
+            for rule in self.rules:
+                if not rule.matches(self.upstream, method, path, rpc_methods, elapsed):
+                    continue
+                if self.rng.random() >= rule.probability:
+                    continue
+                if rule.fault and fault is not None:
+                    continue
+                rule.applied += 1
+                delay += sample_latency(rule.latency, self.rng)
+                if rule.fault:
+                    fault = rule
+        return delay, fault
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, headers: Dict[str, str], data: bytes,
+              truncate: bool = False):
+        handler.send_response(status)
+        for name, value in headers.items():
+            if name.lower() not in _HOP_HEADERS:
+                handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(data)))
+        if truncate:
+            handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.wfile.write(data[:len(data) // 2] if truncate else data)
+        if truncate:
+            handler.close_connection = True
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        started = time.perf_counter()
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        path = handler.path
+        rpc_methods, payload = _rpc_methods(body) if self.upstream == "rpc" else ([], None)
+        if rpc_methods:
+            endpoint = rpc_methods[0] if isinstance(payload, dict) else f"batch:{','.join(sorted(set(rpc_methods)))}"
+        else:
+            endpoint = endpoint_name(handler.command, path.split("?")[0])
+
+        delay, rule = self._select(handler.command, path, rpc_methods)
+        if delay:
+            time.sleep(delay)
+        fault = rule.fault if rule else None
+        status, upstream_seconds = 0, 0.0
+        try:
+            if fault == "timeout":
+                time.sleep(rule.hang)
+                handler.close_connection = True
+            elif fault == "reset":
+                handler.close_connection = True
+            elif fault == "status":
+                data = rule.body if rule.body is not None else _error_body(self.upstream, rule.status, payload)
+                status = rule.status
+                self._send(handler, status, {"Content-Type": "application/json", **rule.headers},
+                           json.dumps(data).encode())
+            else:
+                url = self.target + path if path not in ("", "/") else self.target
+                headers = {name: value for name, value in handler.headers.items() if name.lower() not in _HOP_HEADERS}
+                forwarded = time.perf_counter()
+                try:
+                    response = self.session.request(handler.command, url, data=body, headers=headers,
+                                                    timeout=self.upstream_timeout)
+                except requests.RequestException as e:
+                    upstream_seconds = time.perf_counter() - forwarded
+                    status = 502
+                    self._send(handler, status, {"Content-Type": "application/json"},
+                               json.dumps(_error_body(self.upstream, 502, payload) | {"upstream_error": str(e)}).encode())
+                else:
+                    upstream_seconds = time.perf_counter() - forwarded
+                    status = response.status_code
+                    data = response.content
+                    if fault == "batch_errors":
+                        data = self._break_batch(data, rule.fraction)
+                    self._send(handler, status, dict(response.headers), data, truncate=fault == "truncate")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已经超时断开
+            pass
+        finally:
+            with self.lock:
+                self.records.append({
+                    "upstream": self.upstream, "endpoint": endpoint, "status": status, "fault": fault,
+                    "seconds": time.perf_counter() - started, "upstream_seconds": upstream_seconds,
+                })
+
+    def _break_batch(self, data: bytes, fraction: float) -> bytes:
+        try:
+            results = json.loads(data)
+        except ValueError:
+            return data
+        if not isinstance(results, list):
+            results = [results]
+            single = True
+        else:
+            single = False
+        with self.lock:
+            broken = [self.rng.random() < fraction for _ in results]
+        results = [
+            {"jsonrpc": "2.0", "id": item.get("id"), "error": {"code": -32603, "message": "fault proxy: partial failure"}}
+            if fail and isinstance(item, dict) else item
+            for item, fail in zip(results, broken)
+        ]
+        return json.dumps(results[0] if single else results).encode()
+
+
+class FaultProxySet:
+    """按场景启动各上游的代理，汇总延迟报告"""
+
+    def __init__(self, scenario: Scenario, targets: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            targets: {上游: 地址}，优先于场景文件中的target
+        """
+        self.scenario = scenario
+        self.targets = {name: (targets or {}).get(name) or config.get("target")
+                        for name, config in scenario.upstreams.items()}
+        missing = [name for name, target in self.targets.items() if not target]
+        if missing:
+            raise ValueError(f"未配置上游地址: {', '.join(missing)}")
+        self.records: List[Dict] = []
+        self.proxies: Dict[str, FaultProxy] = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(scenario.seed)
+
+    def start(self, host: str = "127.0.0.1") -> Dict[str, str]:
+        """启动全部代理，返回 {上游: 代理地址}"""
+        started = time.perf_counter()
+        for name, target in self.targets.items():
+            proxy = FaultProxy(name, target, self.scenario.rules, self._rng, self.records, self._lock, started)
+            proxy.start(host, int(self.scenario.upstreams[name].get("port", 0)))
+            self.proxies[name] = proxy
+        return self.urls
+
+    @property
+    def urls(self) -> Dict[str, str]:
+        return {name: proxy.url for name, proxy in self.proxies.items()}
+
+    def stop(self):
+        for proxy in self.proxies.values():
+            proxy.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def env(self, network: str) -> Dict[str, str]:
+        """让工具经过代理访问上游的环境变量"""
+        suffix = network.upper().replace("-", "_")
+        env = {}
+        if "rpc" in self.proxies:
+            env["RPC_URL"] = env[f"RPC_URL_{suffix}"] = self.proxies["rpc"].url
+        if "notion" in self.proxies:
+            env["NOTION_BASE_URL"] = self.proxies["notion"].url
+        if "safe_service" in self.proxies:
+            env[f"SAFE_SERVICE_URL_{suffix}"] = self.proxies["safe_service"].url
+        return env
+
+    def report(self) -> Dict:
+        """
+        按上游和端点汇总：请求数、错误数、各类故障次数、总延迟分位数，以及代理注入的额外延迟
+        （总耗时减去等待上游的时间）的分位数
+        """
+        with self._lock:
+            records = list(self.records)
+        groups: Dict[Tuple[str, str], List[Dict]] = {}
+        for record in records:
+            groups.setdefault((record["upstream"], record["endpoint"]), []).append(record)
+        report: Dict[str, Dict] = {}
+        for (upstream, endpoint), selected in sorted(groups.items()):
+            seconds = sorted(record["seconds"] for record in selected)
+            added = sorted(record["seconds"] - record["upstream_seconds"] for record in selected)
+            faults: Dict[str, int] = {}
+            for record in selected:
+                if record["fault"]:
+                    faults[record["fault"]] = faults.get(record["fault"], 0) + 1
+            report.setdefault(upstream, {})[endpoint] = {
+                "count": len(selected),
+                "errors": sum(1 for record in selected if record["status"] == 0 or record["status"] >= 400),
+                "faults": faults,
+                "p50": _percentile(seconds, 0.5),
+                "p90": _percentile(seconds, 0.9),
+                "p99": _percentile(seconds, 0.99),
+                "max": seconds[-1],
+                "added_p50": _percentile(added, 0.5),
+                "added_p99": _percentile(added, 0.99),
+            }
+        return report
+
+
+def default_targets(network: str) -> Dict[str, str]:
+    """从当前环境推断上游地址：RPC_URL_<网络>/RPC_URL、NOTION_BASE_URL和网络注册表中的交易服务"""
+    from dotenv import load_dotenv
+    from safe.networks import network_registry
+
+    load_dotenv()
+    suffix = network.upper().replace("-", "_")
+    return {
+        "rpc": os.getenv(f"RPC_URL_{suffix}") or os.getenv("RPC_URL"),
+        "notion": os.getenv("NOTION_BASE_URL") or DEFAULT_NOTION_URL,
+        "safe_service": network_registry.service_url(network),
+    }
+
+
+def print_report(report: Dict):
+    print(f"\n{'上游':<14}{'端点':<48}{'请求':>6}{'错误':>6}{'p50(ms)':>10}{'p99(ms)':>10}{'注入p99(ms)':>14}  故障")
+    for upstream, endpoints in report.items():
+        for endpoint, stats in endpoints.items():
+            faults = ", ".join(f"{name}={count}" for name, count in stats["faults"].items())
+            print(f"{upstream:<14}{endpoint[:46]:<48}{stats['count']:>6}{stats['errors']:>6}"
+                  f"{stats['p50'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}{stats['added_p99'] * 1000:>14.1f}  {faults}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="注入故障和延迟的本地代理")
+    parser.add_argument("scenario", help="场景文件（JSON）")
+    parser.add_argument("--network", default=os.getenv("NETWORK", "sepolia"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--report", help="把延迟报告保存为JSON")
+    # -- 之后为经过代理运行的命令
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    args, command = parser.parse_args(argv[:split]), argv[split + 1:]
+
+    scenario = Scenario.load(args.scenario)
+    proxies = FaultProxySet(scenario, default_targets(args.network))
+    proxies.start(args.host)
+    env = proxies.env(args.network)
+    for name, url in proxies.urls.items():
+        print(f"{name}: {url} -> {proxies.targets[name]}")
+
+    returncode = 0
+    try:
+        if command:
+            returncode = subprocess.call(command, env={**os.environ, **env})
+        else:
+            print("\n".join(f"export {name}={value}" for name, value in env.items()))
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxies.stop()
+        report = proxies.report()
+        print_report(report)
+        if args.report:
+            write_json_atomic(Path(args.report), report)
+    sys.exit(returncode)
+
+
+if __name__ == "__main__":
+    main()
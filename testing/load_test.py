@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+端到端压测：生成N行的合成Notion数据库，按main.py的完整流程运行
+
+Notion、RPC和交易服务都使用本地替身：Notion是内存中的分页数据库，RPC是部署了
+Safe、MultiSend和6位小数USDT的进程内EVM，交易服务是通过HTTP访问的本地替身（local_safe_service.py），
+像真实服务一样校验哈希和签名，可以注入延迟和错误。可以配置重复行、ENS行和格式错误行的比例，
+运行结束后报告吞吐(行/秒)、各阶段耗时、交易服务各接口的延迟和峰值RSS：
+
+    python testing/load_test.py --rows 10000 --duplicates 0.05 --ens 0.02 --malformed 0.01
+    python testing/load_test.py --rows 2000 --max-transfers 20 --service-latency 0.05 --service-error-rate 0.01
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from web3 import Web3
+
+import main
+from local_safe_service import LocalSafeService
+from notion.client import NotionClient
+from orchestrator import SafeOrchestrator
+from utils.logger import logger
+from local_chain import build_local_chain, fund_safe, make_handler
+
+
+def generate_pages(rows: int, duplicates: float = 0.0, ens: float = 0.0, malformed: float = 0.0,
+                   seed: int = 0):
+    """
+    生成合成的Notion页面
+
+    Returns:
+        (页面列表, ENS域名到地址的映射)
+    """
+    rng = random.Random(seed)
+    pages, ens_names, previous = [], {}, []
+    for i in range(rows):
+        roll = rng.random()
+        amount = round(rng.uniform(0.5, 5), 2)
+        address = Web3.to_checksum_address(rng.getrandbits(160).to_bytes(20, "big"))
+        if roll < duplicates and previous:
+            address, amount = rng.choice(previous)
+        elif roll < duplicates + ens:
+            name = f"payee-{i}.eth"
+            ens_names[name] = address
+            address = name
+        previous.append((address, amount))
+
+        properties = {
+            "审核完毕，Signer": {"type": "people", "people": [{"name": "BigSong"}]},
+            "地址": {"type": "rich_text", "rich_text": [{"text": {"content": address}, "plain_text": address}]},
+            "USDT": {"type": "number", "number": amount},
+        }
+        if rng.random() < malformed:
+            # 缺少地址、金额为空或缺少审核人，解析时应跳过
+            broken = rng.choice(["地址", "USDT", "审核完毕，Signer"])
+            if broken == "地址":
+                properties["地址"]["rich_text"] = []
+            elif broken == "USDT":
+                properties["USDT"]["number"] = None
+            else:
+                del properties[broken]
+        pages.append({"id": f"page-{i:08d}", "properties": properties})
+    return pages, ens_names
+
+
+class LocalNotionDatabase:
+    """只实现databases.query分页的Notion替身，筛选条件由解析阶段处理"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.databases = self
+        self.queries = 0
+
+    def query(self, database_id=None, filter=None, page_size=100, start_cursor=None, **kwargs):
+        self.queries += 1
+        start = int(start_cursor or 0)
+        end = min(start + page_size, len(self.pages))
+        has_more = end < len(self.pages)
+        return {"results": self.pages[start:end], "has_more": has_more,
+                "next_cursor": str(end) if has_more else None}
+
+
+class LocalENS:
+    def __init__(self, names):
+        self.names = names
+
+    def address(self, name):
+        return self.names.get(name)
+
+
+class LoadTestOrchestrator(SafeOrchestrator):
+    """所有组都使用进程内EVM上的同一个Safe"""
+
+    def __init__(self, ethereum_client, contracts, owners, execution_mode, max_transfers, ens_names):
+        super().__init__()
+        self.default_network = "sepolia"
+        self.default_safe = contracts["safe"]
+        self._clients["sepolia"] = ethereum_client
+        self.contracts = contracts
+        self.owners = owners
+        self.execution_mode = execution_mode
+        self.max_transfers = max_transfers
+        ethereum_client.w3.ens = LocalENS(ens_names)
+
+    def create_handler(self, network, safe_address):
+        handler = make_handler(self.get_ethereum_client(network), self.contracts, self.owners, self.execution_mode)
+        handler.max_transfers_per_tx = self.max_transfers
+        return handler
+
+
+def peak_rss_mb() -> float:
+    # Linux上ru_maxrss单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_load_test(rows: int, duplicates: float = 0.0, ens: float = 0.0, malformed: float = 0.0,
+                  execution_mode: str = "propose", max_transfers: int = 200, seed: int = 0,
+                  quiet: bool = True, service_latency: float = 0.0, service_jitter: float = 0.0,
+                  service_error_rate: float = 0.0) -> dict:
+    """
+    按main.py的完整流程运行一次压测
+
+    Returns:
+        压测报告
+    """
+    pages, ens_names = generate_pages(rows, duplicates, ens, malformed, seed)
+    # 提议模式使用阈值为2的Safe，只有一个本地私钥；执行模式阈值为1
+    threshold = 2 if execution_mode == "propose" else 1
+    ethereum_client, contracts, owners = build_local_chain(threshold=threshold)
+    fund_safe(ethereum_client, contracts, contracts["safe"], rows * 5 * 10**6)
+
+    notion = LocalNotionDatabase(pages)
+    orchestrator = LoadTestOrchestrator(
+        ethereum_client, contracts, owners[:1], execution_mode, max_transfers, ens_names,
+    )
+    service = LocalSafeService(ethereum_client=ethereum_client, latency=service_latency, jitter=service_jitter,
+                               error_rate=service_error_rate, seed=seed)
+
+    def notion_client():
+        client = NotionClient()
+        client.client = notion
+        return client
+
+    original = main.NotionClient, main.SafeOrchestrator
+    main.NotionClient, main.SafeOrchestrator = notion_client, lambda: orchestrator
+    rss_before = peak_rss_mb()
+    output = io.StringIO() if quiet else sys.stdout
+    try:
+        with tempfile.TemporaryDirectory() as journal_dir, contextlib.redirect_stdout(output), service:
+            os.environ["JOURNAL_DIR"] = journal_dir
+            os.environ["SAFE_SERVICE_URL_SEPOLIA"] = service.url
+            started = time.perf_counter()
+            main.main()
+            wall = time.perf_counter() - started
+            logger.flush()
+    finally:
+        main.NotionClient, main.SafeOrchestrator = original
+        os.environ.pop("JOURNAL_DIR", None)
+        os.environ.pop("SAFE_SERVICE_URL_SEPOLIA", None)
+
+    groups = list(orchestrator._groups.values())
+    processed = sum(group.count for group in groups)
+    return {
+        "rows": rows,
+        "parsed_rows": processed,
+        "skipped_rows": rows - processed,
+        "execution_mode": execution_mode,
+        "max_transfers_per_tx": max_transfers,
+        "notion_queries": notion.queries,
+        "safe_txs": sum(len(group.tx_hashes) for group in groups),
+        "proposals": len(service.transactions),
+        "errors": [group.error for group in groups if group.error],
+        "wall_seconds": wall,
+        "rows_per_second": rows / wall if wall else None,
+        "stages": orchestrator.pipeline.stats(),
+        "safe_service": service.stats(),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_before_mb": rss_before,
+    }
+
+
+def print_report(report: dict):
+    print(f"\n行数: {report['rows']} (解析 {report['parsed_rows']}, 跳过 {report['skipped_rows']})")
+    print(f"Safe交易: {report['safe_txs']}, 提议: {report['proposals']}, Notion查询: {report['notion_queries']}")
+    print(f"总耗时: {report['wall_seconds']:.2f}s, 吞吐: {report['rows_per_second']:.1f} 行/秒")
+    print(f"峰值RSS: {report['peak_rss_mb']:.1f} MB (运行前 {report['peak_rss_before_mb']:.1f} MB)")
+    print(f"\n{'阶段':<10}{'处理数':>10}{'处理耗时(s)':>14}{'运行时间(s)':>14}")
+    for name, stats in report["stages"].items():
+        print(f"{name:<10}{stats['processed']:>10}{stats['busy_seconds']:>14.2f}{stats['wall_seconds']:>14.2f}")
+    if report["safe_service"]:
+        print(f"\n{'交易服务接口':<44}{'请求数':>8}{'错误':>6}{'p50(ms)':>10}{'p99(ms)':>10}")
+        for operation, stats in report["safe_service"].items():
+            print(f"{operation:<44}{stats['count']:>8}{stats['errors']:>6}"
+                  f"{stats['p50'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}")
+    for error in report["errors"]:
+        print(f"失败: {error}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="使用本地替身的端到端压测")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--duplicates", type=float, default=0.0, help="重复行比例")
+    parser.add_argument("--ens", type=float, default=0.0, help="ENS地址行比例")
+    parser.add_argument("--malformed", type=float, default=0.0, help="格式错误行比例")
+    parser.add_argument("--mode", choices=["propose", "execute"], default="propose")
+    parser.add_argument("--max-transfers", type=int, default=200, help="单笔Safe交易最多包含的转账数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--service-latency", type=float, default=0.0, help="交易服务每个请求的基础延迟（秒）")
+    parser.add_argument("--service-jitter", type=float, default=0.0, help="交易服务额外的随机延迟上限（秒）")
+    parser.add_argument("--service-error-rate", type=float, default=0.0, help="交易服务随机返回503的概率")
+    parser.add_argument("--output", help="把报告保存为JSON")
+    parser.add_argument("--verbose", action="store_true", help="显示解析和处理过程的输出")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_load_test(
+        args.rows, args.duplicates, args.ens, args.malformed,
+        args.mode, args.max_transfers, args.seed, quiet=not args.verbose,
+        service_latency=args.service_latency, service_jitter=args.service_jitter,
+        service_error_rate=args.service_error_rate,
+    )
+    print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
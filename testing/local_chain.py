@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+进程内EVM (eth-tester / py-evm) 测试链
+
+部署Safe v1.4.1单例、代理工厂、MultiSend、兼容回退处理器、SimulateTxAccessor和6位小数的
+USDT测试代币，创建一个Safe并转入测试USDT，返回配置好的 `SafeTransactionHandler`。
+不需要RPC、测试网和有余额的私钥；支持快照和回滚，同一条链可以在毫秒级重置后运行下一个场景：
+
+    chain = LocalChain.shared(threshold=2)
+    with chain.isolated():
+        handler = chain.handler(chain.owners[:2])
+        handler.execute_transaction(handler.prepare_batch_transfers(transactions))
+    # 退出with后余额和nonce恢复原状
+"""
+
+import json
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+import safe_eth
+from eth_account import Account
+from eth_account.signers.local import LocalAccount
+from eth_tester import EthereumTester, PyEVMBackend
+from eth_tester.exceptions import TransactionFailed
+from web3 import Web3, EthereumTesterProvider
+from web3.exceptions import ContractLogicError
+from safe_eth.eth import EthereumClient
+from safe_eth.eth.contracts import get_erc20_contract
+from safe_eth.safe import Safe
+from safe_eth.safe.multi_send import MultiSend
+from safe_eth.safe.proxy_factory import ProxyFactoryV141
+from safe_eth.safe.safe import SafeV141
+
+from safe.gas import SafeTxGasEstimator
+from safe.transaction import SafeTransactionHandler
+
+# 创建Safe时默认转入的测试USDT（基础单位）
+DEFAULT_SAFE_FUNDING = 10**12
+
+
+class ProviderSession:
+    """
+    将safe-eth-py直接发出的JSON-RPC批量HTTP请求转发给进程内的web3 provider
+    """
+
+    class Response:
+        def __init__(self, payload):
+            self.ok = True
+            self.payload = payload
+            self.text = json.dumps(payload)
+
+        def json(self):
+            return self.payload
+
+    def __init__(self, w3: Web3):
+        self.w3 = w3
+        self.known_accounts = {account.lower() for account in w3.eth.accounts}
+
+    def _dispatch(self, request: dict) -> dict:
+        params = request.get("params", [])
+        # eth-tester只能以自己持有私钥的账户作为eth_call的from，其他地址（如Safe本身）去掉from
+        if request["method"] == "eth_call" and params and params[0].get("from", "").lower() not in self.known_accounts:
+            params = [{k: v for k, v in params[0].items() if k != "from"}] + list(params[1:])
+        try:
+            result = self.w3.manager.request_blocking(request["method"], params)
+            if isinstance(result, bytes):
+                result = Web3.to_hex(result)
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+        except Exception as e:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32000, "message": str(e)}}
+
+    def post(self, url, json=None, timeout=None):
+        if isinstance(json, list):
+            return self.Response([self._dispatch(request) for request in json])
+        return self.Response(self._dispatch(json))
+
+
+def revert_as_contract_logic_error(make_request, w3):
+    """像真实节点一样把eth-tester的回滚转换为ContractLogicError"""
+    def middleware(method, params):
+        try:
+            return make_request(method, params)
+        except TransactionFailed as e:
+            raise ContractLogicError(str(e))
+    return middleware
+
+
+class LocalChain:
+    """
+    部署好合约的进程内测试链
+
+    Attributes:
+        ethereum_client: 所有请求都在进程内完成的EthereumClient
+        contracts: 合约地址 {"safe", "multisend", "usdt", "singleton", "proxy_factory",
+            "fallback_handler", "simulate_tx_accessor"}，以及部署账户 "deployer"
+        owners: Safe所有者账户（eth-tester预置账户，可以作为eth_call的from）
+    """
+
+    _shared: Dict[Tuple[int, int], "LocalChain"] = {}
+
+    def __init__(self, threshold: int = 1, owner_count: int = 3, funding: int = DEFAULT_SAFE_FUNDING):
+        self.tester = EthereumTester(PyEVMBackend())
+        self.w3 = Web3(EthereumTesterProvider(self.tester))
+        self.w3.middleware_onion.add(revert_as_contract_logic_error)
+
+        # EthereumClient的各个管理器在构造时复制了w3，需要一并替换
+        ethereum_client = EthereumClient("http://127.0.0.1:0")
+        ethereum_client.w3 = ethereum_client.slow_w3 = self.w3
+        ethereum_client.http_session = ProviderSession(self.w3)
+        for manager in (ethereum_client.erc20, ethereum_client.erc721,
+                        ethereum_client.tracing, ethereum_client.batch_call_manager):
+            manager.w3 = manager.slow_w3 = self.w3
+            manager.http_session = ethereum_client.http_session
+        self.ethereum_client = ethereum_client
+
+        # eth_call要求from为节点已知账户，因此使用eth-tester预置账户作为所有者
+        self.accounts: List[LocalAccount] = [
+            Account.from_key(key.to_bytes()) for key in self.tester.backend.account_keys
+        ]
+        self.deployer = self.accounts[0]
+        self.owners = self.accounts[1:owner_count + 1]
+        self.contracts = self._deploy()
+        self.contracts["safe"] = self.create_safe(self.owners, threshold, funding)
+
+    def _deploy(self) -> Dict:
+        ethereum_client, deployer = self.ethereum_client, self.deployer
+        # safe-eth-py没有附带MultiSendCallOnly的字节码；MultiSend对只含CALL的批次行为相同
+        contracts = {
+            "singleton": SafeV141.deploy_contract(ethereum_client, deployer).contract_address,
+            "proxy_factory": ProxyFactoryV141.deploy_contract(ethereum_client, deployer).contract_address,
+            "multisend": MultiSend.deploy_contract(ethereum_client, deployer).contract_address,
+            "fallback_handler": Safe.deploy_compatibility_fallback_handler(ethereum_client, deployer).contract_address,
+            "simulate_tx_accessor": Safe.deploy_simulate_tx_accessor(ethereum_client, deployer).contract_address,
+            "deployer": deployer,
+        }
+
+        token_json = Path(safe_eth.__file__).parent / "eth/contracts/abis/ERC20TestToken.json"
+        token_artifact = json.loads(token_json.read_text())
+        token = self.w3.eth.contract(abi=token_artifact["abi"], bytecode=token_artifact["bytecode"])
+        tx_hash = token.constructor("Tether USD", "USDT", 6, deployer.address, 10**13).transact(
+            {"from": deployer.address}
+        )
+        contracts["usdt"] = self.w3.eth.get_transaction_receipt(tx_hash)["contractAddress"]
+        return contracts
+
+    @classmethod
+    def shared(cls, threshold: int = 1, owner_count: int = 3) -> "LocalChain":
+        """
+        按 (阈值, 所有者数) 复用同一条链，避免每个测试重新部署；配合isolated()使用，
+        保证各测试看到的链状态相同
+        """
+        key = (threshold, owner_count)
+        if key not in cls._shared:
+            cls._shared[key] = cls(threshold, owner_count)
+        return cls._shared[key]
+
+    # ---- 快照 ----
+
+    def snapshot(self) -> int:
+        """保存当前链状态，返回快照ID"""
+        return self.tester.take_snapshot()
+
+    def revert(self, snapshot_id: int):
+        """回滚到快照，之后的区块、余额和nonce全部撤销"""
+        self.tester.revert_to_snapshot(snapshot_id)
+
+    @contextmanager
+    def isolated(self):
+        """with块内的链上改动在退出时回滚"""
+        snapshot_id = self.snapshot()
+        try:
+            yield self
+        finally:
+            self.revert(snapshot_id)
+
+    # ---- 账户与合约 ----
+
+    def fund_safe(self, safe_address: str, amount: int):
+        """从部署账户向Safe转入测试USDT（基础单位）"""
+        fund_safe(self.ethereum_client, self.contracts, safe_address, amount)
+
+    def create_safe(self, owners: List[LocalAccount], threshold: int, funding: int = DEFAULT_SAFE_FUNDING) -> str:
+        """在已部署的合约上创建一个Safe，并转入测试USDT"""
+        return create_safe(self.ethereum_client, self.contracts, owners, threshold, funding)
+
+    def usdt_balance(self, address: str) -> int:
+        return get_erc20_contract(self.w3, self.contracts["usdt"]).functions.balanceOf(address).call()
+
+    def handler(self, owners: Optional[List[LocalAccount]] = None, execution_mode: str = "auto",
+                safe_address: Optional[str] = None) -> SafeTransactionHandler:
+        """
+        返回连接到本链的SafeTransactionHandler
+
+        Args:
+            owners: 持有私钥的所有者，默认全部所有者
+            safe_address: 默认为部署时创建的Safe
+        """
+        contracts = dict(self.contracts, safe=safe_address or self.contracts["safe"])
+        return make_handler(self.ethereum_client, contracts, self.owners if owners is None else owners,
+                            execution_mode)
+
+
+def build_local_chain(threshold: int, owner_count: int = 3):
+    """部署测试所需的合约，返回 (ethereum_client, 合约地址, 所有者账户)"""
+    chain = LocalChain(threshold, owner_count)
+    return chain.ethereum_client, chain.contracts, chain.owners
+
+
+def fund_safe(ethereum_client, contracts, safe_address, amount):
+    """从部署账户向Safe转入测试USDT（基础单位）"""
+    token = get_erc20_contract(ethereum_client.w3, contracts["usdt"])
+    token.functions.transfer(safe_address, amount).transact({"from": contracts["deployer"].address})
+
+
+def create_safe(ethereum_client, contracts, owners, threshold, funding=DEFAULT_SAFE_FUNDING):
+    """在已部署的合约上再创建一个Safe，并转入测试USDT"""
+    safe_address = Safe.create(
+        ethereum_client, contracts["deployer"], contracts["singleton"],
+        [owner.address for owner in owners], threshold,
+        fallback_handler=contracts["fallback_handler"],
+        proxy_factory_address=contracts["proxy_factory"],
+    ).contract_address
+    if funding:
+        fund_safe(ethereum_client, contracts, safe_address, funding)
+    return safe_address
+
+
+def make_handler(ethereum_client, contracts, owners, execution_mode="auto"):
+    handler = SafeTransactionHandler(
+        safe_address=contracts["safe"],
+        network="sepolia",
+        usdt_contract_address=contracts["usdt"],
+        private_keys=[owner.key.hex() for owner in owners],
+        multisend_address=contracts["multisend"],
+        execution_mode=execution_mode,
+        gas_estimation="rpc",
+        ethereum_client=ethereum_client,
+    )
+    handler.safe.simulate_tx_accessor_address = contracts["simulate_tx_accessor"]
+    # 测试中只在内存里缓存gas估算结果
+    handler.gas_estimator = SafeTxGasEstimator(handler, "rpc", cache_file="")
+    return handler
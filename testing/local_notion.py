@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地Notion API替身
+
+实现 `NotionClient` 用到的接口：databases.query（get_approved_transactions使用的筛选条件、
+start_cursor/has_more分页、page_size）、databases.retrieve、pages.retrieve和pages.update。
+数据库由合成数据集提供，每一行按 (种子, 行号) 确定地生成，10万行也不占内存，只有被
+pages.update修改过的属性保存在内存中。默认按Notion文档的速率（平均每秒3个请求）限流，
+超出时像真实API一样返回429和Retry-After：
+
+    python testing/local_notion.py --rows 100000 --port 8766
+    NOTION_BASE_URL=http://127.0.0.1:8766 NOTION_DATABASE_ID=<输出中的ID> python src/main.py plan plan.jsonl
+
+    # 直接测量NotionClient拉取10万行的吞吐
+    python testing/local_notion.py --rows 100000 --bench
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from web3 import Web3
+
+DEFAULT_DATABASE_ID = "5a4e0c1b-0000-4000-8000-000000000000"
+
+# Notion文档：每个集成平均每秒3个请求，允许少量突发
+NOTION_RATE_LIMIT = 3.0
+NOTION_BURST = 3
+
+MAX_PAGE_SIZE = 100
+
+# 数据集中的行从该时间开始，每行晚一分钟创建
+CREATED_START = datetime(2025, 2, 1, tzinfo=timezone.utc)
+
+_ROUTES = [
+    ("POST", re.compile(r"^/v1/databases/(?P<database_id>[^/]+)/query$"), "databases.query"),
+    ("GET", re.compile(r"^/v1/databases/(?P<database_id>[^/]+)$"), "databases.retrieve"),
+    ("GET", re.compile(r"^/v1/pages/(?P<page_id>[^/]+)$"), "pages.retrieve"),
+    ("PATCH", re.compile(r"^/v1/pages/(?P<page_id>[^/]+)$"), "pages.update"),
+]
+
+
+class NotionError(Exception):
+    """按Notion的错误格式返回：{"object": "error", "status", "code", "message"}"""
+
+    def __init__(self, status: int, code: str, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.headers = headers or {}
+
+    @property
+    def body(self) -> Dict:
+        return {"object": "error", "status": self.status, "code": self.code, "message": str(self)}
+
+
+def _validation_error(message: str) -> NotionError:
+    return NotionError(400, "validation_error", message)
+
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _parse_date(text: str) -> datetime:
+    # 没有时区的日期按UTC处理
+    moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def _rich_text(text: str) -> List[Dict]:
+    return [{"type": "text", "text": {"content": text, "link": None}, "plain_text": text}] if text else []
+
+
+def page_id(index: int) -> str:
+    return f"00000000-0000-4000-8000-{index:012x}"
+
+
+def page_index(value: str) -> Optional[int]:
+    """页面ID或游标对应的行号；Notion接受带或不带连字符的ID"""
+    compact = value.replace("-", "").lower()
+    if not re.fullmatch(r"0{12}40{3}80{3}[0-9a-f]{12}", compact):
+        return None
+    return int(compact[-12:], 16)
+
+
+class SyntheticDatabase:
+    """
+    合成的Notion数据库
+
+    属性与生产数据库一致（Created time、月份、审核完毕，Signer、地址、USDT、Safe、网络），
+    以及写回支付状态的列（Safe交易哈希、Nonce、状态、执行交易哈希）。
+    按比例生成不满足筛选条件的行（未审核、其他月份、2月之前创建）和格式错误的行，
+    便于同时检验服务端筛选和客户端解析
+    """
+
+    SCHEMA = {
+        "Created time": "created_time",
+        "月份": "select",
+        "审核完毕，Signer": "people",
+        "地址": "rich_text",
+        "USDT": "number",
+        "Safe": "rich_text",
+        "网络": "select",
+        "名称": "title",
+        "Safe交易哈希": "rich_text",
+        "Nonce": "number",
+        "状态": "select",
+        "执行交易哈希": "rich_text",
+    }
+
+    def __init__(self, rows: int, seed: int = 0, unapproved: float = 0.05, other_signer: float = 0.02,
+                 other_month: float = 0.05, early: float = 0.02, malformed: float = 0.01,
+                 database_id: str = DEFAULT_DATABASE_ID):
+        """
+        Args:
+            rows: 总行数
+            unapproved: 审核人为空的比例（服务端筛选掉）
+            other_signer: 审核人不是BigSong的比例（客户端解析时跳过）
+            other_month: 月份不是2025.2的比例
+            early: 创建时间在2025.2.1之前的比例
+            malformed: 地址或金额为空的比例
+        """
+        self.rows = rows
+        self.seed = seed
+        self.unapproved = unapproved
+        self.other_signer = other_signer
+        self.other_month = other_month
+        self.early = early
+        self.malformed = malformed
+        self.database_id = database_id
+        # pages.update写入的属性：{行号: {属性名: 属性值}}
+        self.updates: Dict[int, Dict[str, Dict]] = {}
+        self.edited: Dict[int, datetime] = {}
+        self._created_order: Optional[List[int]] = None
+        self._created_positions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def page(self, index: int) -> Dict:
+        """生成第index行，同一 (种子, 行号) 总是得到相同的页面"""
+        rng = random.Random(f"{self.seed}:{index}")
+        roll = rng.random()
+        created = CREATED_START + timedelta(minutes=index)
+        month = "2025.2"
+        people = [{"object": "user", "id": "00000000-0000-0000-0000-0000000b165e", "name": "BigSong"}]
+        if roll < self.unapproved:
+            people = []
+        elif roll < self.unapproved + self.other_signer:
+            people = [{"object": "user", "id": "00000000-0000-0000-0000-000000000001", "name": "Alice"}]
+        elif roll < self.unapproved + self.other_signer + self.other_month:
+            month = "2025.1"
+        elif roll < self.unapproved + self.other_signer + self.other_month + self.early:
+            created = CREATED_START - timedelta(days=1, minutes=index)
+
+        address = Web3.to_checksum_address(rng.getrandbits(160).to_bytes(20, "big"))
+        amount = round(rng.uniform(0.5, 5), 2)
+        if rng.random() < self.malformed:
+            if rng.random() < 0.5:
+                address = ""
+            else:
+                amount = None
+
+        properties = {
+            "Created time": {"id": "ctim", "type": "created_time", "created_time": _iso(created)},
+            "月份": {"id": "mnth", "type": "select", "select": {"name": month, "color": "default"}},
+            "审核完毕，Signer": {"id": "sign", "type": "people", "people": people},
+            "地址": {"id": "addr", "type": "rich_text", "rich_text": _rich_text(address)},
+            "USDT": {"id": "usdt", "type": "number", "number": amount},
+            "Safe": {"id": "safe", "type": "rich_text", "rich_text": []},
+            "网络": {"id": "netw", "type": "select", "select": None},
+            "名称": {"id": "title", "type": "title", "title": _rich_text(f"转账 {index}")},
+            "Safe交易哈希": {"id": "stxh", "type": "rich_text", "rich_text": []},
+            "Nonce": {"id": "nonc", "type": "number", "number": None},
+            "状态": {"id": "stat", "type": "select", "select": None},
+            "执行交易哈希": {"id": "extx", "type": "rich_text", "rich_text": []},
+        }
+        with self._lock:
+            for name, value in self.updates.get(index, {}).items():
+                properties[name] = {**properties[name], **value}
+            last_edited = self.edited.get(index, created)
+        return {
+            "object": "page",
+            "id": page_id(index),
+            "created_time": _iso(created),
+            "last_edited_time": _iso(last_edited),
+            "archived": False,
+            "parent": {"type": "database_id", "database_id": self.database_id},
+            "properties": properties,
+            "url": f"https://www.notion.so/{page_id(index).replace('-', '')}",
+        }
+
+    def created_order(self) -> List[int]:
+        """按创建时间升序排列的行号，首次调用时生成全部页面计算"""
+        if self._created_order is None:
+            order = sorted(range(self.rows), key=lambda i: self.page(i)["created_time"])
+            self._created_positions = {index: position for position, index in enumerate(order)}
+            self._created_order = order
+        return self._created_order
+
+    def created_position(self, index: int) -> int:
+        self.created_order()
+        return self._created_positions[index]
+
+    def retrieve(self) -> Dict:
+        return {
+            "object": "database",
+            "id": self.database_id,
+            "title": _rich_text(f"合成数据库 ({self.rows}行)"),
+            "created_time": _iso(CREATED_START),
+            "properties": {
+                name: {"id": name, "name": name, "type": kind, kind: {}} for name, kind in self.SCHEMA.items()
+            },
+        }
+
+    def update(self, index: int, properties: Dict) -> Dict:
+        """写入页面属性，属性名不存在或值的类型与列不符时返回validation_error"""
+        normalized = {}
+        for name, value in properties.items():
+            kind = self.SCHEMA.get(name)
+            if kind is None:
+                raise _validation_error(f"{name} is not a property that exists.")
+            if kind == "created_time":
+                raise _validation_error(f"{name} is a read-only property.")
+            if not isinstance(value, dict) or kind not in value:
+                raise _validation_error(f"{name} is expected to be {kind}.")
+            content = value[kind]
+            if kind in ("rich_text", "title"):
+                content = _rich_text("".join(part["text"]["content"] for part in content))
+            normalized[name] = {"type": kind, kind: content}
+        with self._lock:
+            self.updates.setdefault(index, {}).update(normalized)
+            self.edited[index] = datetime.now(timezone.utc)
+        return self.page(index)
+
+
+def _property_matches(prop: Dict, condition: Dict) -> bool:
+    """单个属性的筛选条件，覆盖NotionClient使用的date/people/select以及常用的文本和数字条件"""
+    kind = prop["type"]
+    value = prop[kind]
+    for filter_type, operators in condition.items():
+        if filter_type == "property":
+            continue
+        if not (filter_type == kind or (kind == "created_time" and filter_type == "date")):
+            raise _validation_error(f"{condition['property']} is a {kind} property, not {filter_type}.")
+        for operator, expected in operators.items():
+            if operator == "is_empty":
+                return not value
+            if operator == "is_not_empty":
+                return bool(value)
+            if kind == "created_time":
+                moment, expected = _parse_date(value), _parse_date(expected)
+                if len(operators[operator]) == 10:
+                    # 只给日期时按日期比较
+                    moment, expected = moment.date(), expected.date()
+                result = {"equals": moment == expected, "before": moment < expected, "after": moment > expected,
+                          "on_or_before": moment <= expected, "on_or_after": moment >= expected}
+            elif kind == "select":
+                name = value["name"] if value else None
+                result = {"equals": name == expected, "does_not_equal": name != expected}
+            elif kind == "people":
+                result = {"contains": any(person["id"] == expected for person in value),
+                          "does_not_contain": all(person["id"] != expected for person in value)}
+            elif kind in ("rich_text", "title"):
+                text = "".join(part["plain_text"] for part in value)
+                result = {"equals": text == expected, "does_not_equal": text != expected,
+                          "contains": expected in text, "does_not_contain": expected not in text,
+                          "starts_with": text.startswith(expected), "ends_with": text.endswith(expected)}
+            elif kind == "number":
+                result = {"equals": value == expected, "does_not_equal": value != expected,
+                          "greater_than": value is not None and value > expected,
+                          "less_than": value is not None and value < expected,
+                          "greater_than_or_equal_to": value is not None and value >= expected,
+                          "less_than_or_equal_to": value is not None and value <= expected}
+            else:
+                result = {}
+            if operator not in result:
+                raise _validation_error(f"Unsupported {filter_type} filter: {operator}.")
+            return result[operator]
+    raise _validation_error("Filter is missing a condition.")
+
+
+def matches(page: Dict, filter: Optional[Dict]) -> bool:
+    """按Notion的筛选语法判断页面是否匹配，支持and/or复合条件"""
+    if not filter:
+        return True
+    if "and" in filter:
+        return all(matches(page, part) for part in filter["and"])
+    if "or" in filter:
+        return any(matches(page, part) for part in filter["or"])
+    name = filter.get("property")
+    if name not in page["properties"]:
+        raise _validation_error(f"Could not find property with name or id: {name}")
+    return _property_matches(page["properties"][name], filter)
+
+
+class LocalNotion:
+    """Notion API的HTTP替身，限流使用令牌桶"""
+
+    def __init__(self, database: SyntheticDatabase, rate_limit: float = NOTION_RATE_LIMIT,
+                 burst: int = NOTION_BURST, latency: float = 0.0):
+        """
+        Args:
+            rate_limit: 每秒允许的平均请求数，0表示不限流
+            burst: 令牌桶容量
+            latency: 每个请求的固定延迟（秒）
+        """
+        self.database = database
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.latency = latency
+        # 请求记录：接口、状态码和耗时
+        self.requests: List[Dict] = []
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    # ---- 服务生命周期 ----
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """在后台线程中启动HTTP服务，返回base_url"""
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, payload, headers = service.handle(self.command, self.path, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = _dispatch
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="local-notion", daemon=True).start()
+        return self.url
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---- 限流 ----
+
+    def _throttle(self):
+        """令牌不足时抛出429，Retry-After为取得下一个令牌需要等待的整秒数"""
+        if not self.rate_limit:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            wait = (1 - self._tokens) / self.rate_limit
+        raise NotionError(429, "rate_limited", "You have been rate limited. Please try again in a few minutes.",
+                          {"Retry-After": str(max(1, math.ceil(wait)))})
+
+    # ---- 路由 ----
+
+    def handle(self, method: str, raw_path: str, body: bytes) -> Tuple[int, Dict, Dict[str, str]]:
+        started = time.perf_counter()
+        path = urlparse(raw_path).path
+        operation, status, payload, headers = None, 400, {}, {}
+        try:
+            for route_method, pattern, name in _ROUTES:
+                match = pattern.match(path)
+                if match and route_method == method:
+                    operation = name
+                    break
+            else:
+                raise NotionError(400, "invalid_request_url", "Invalid request URL.")
+            self._throttle()
+            if self.latency:
+                time.sleep(self.latency)
+            try:
+                data = json.loads(body) if body else {}
+            except json.JSONDecodeError:
+                raise NotionError(400, "invalid_json", "Error parsing JSON body.")
+            status, payload = 200, getattr(self, operation.replace(".", "_"))(data=data, **match.groupdict())
+        except NotionError as e:
+            status, payload, headers = e.status, e.body, e.headers
+        with self._lock:
+            self.requests.append({"operation": operation, "status": status,
+                                  "seconds": time.perf_counter() - started})
+        return status, payload, headers
+
+    def _check_database(self, database_id: str):
+        if database_id.replace("-", "") != self.database.database_id.replace("-", ""):
+            raise NotionError(404, "object_not_found",
+                              f"Could not find database with ID: {database_id}.")
+
+    def _index(self, value: str, what: str = "page") -> int:
+        index = page_index(value)
+        if index is None or index >= self.database.rows:
+            if what == "cursor":
+                raise _validation_error("start_cursor should be a valid uuid.")
+            raise NotionError(404, "object_not_found", f"Could not find page with ID: {value}.")
+        return index
+
+    # ---- 接口实现 ----
+
+    def databases_query(self, database_id: str, data: Dict) -> Dict:
+        """
+        从游标所在的行开始顺序扫描（按创建时间排序时按created_order的顺序），收集page_size个匹配的页面；
+        下一个匹配页面的ID作为next_cursor，因此多次分页的总扫描量与行数成正比
+        """
+        self._check_database(database_id)
+        page_size = data.get("page_size", MAX_PAGE_SIZE)
+        if not isinstance(page_size, int) or not 1 <= page_size <= MAX_PAGE_SIZE:
+            raise _validation_error(f"body.page_size should be a number between 1 and {MAX_PAGE_SIZE}.")
+        sorts = data.get("sorts")
+        if sorts and sorts != [{"timestamp": "created_time", "direction": "ascending"}]:
+            raise _validation_error("本地替身只支持按创建时间升序排序。")
+        # 按创建时间排序时，"2月之前创建"的行排在前面
+        order = self.database.created_order() if sorts else None
+        position = 0
+        if data.get("start_cursor"):
+            position = self._index(data["start_cursor"], "cursor")
+            if order:
+                position = self.database.created_position(position)
+
+        results, next_cursor = [], None
+        while position < self.database.rows:
+            page = self.database.page(order[position] if order else position)
+            position += 1
+            if not matches(page, data.get("filter")):
+                continue
+            if len(results) == page_size:
+                next_cursor = page["id"]
+                break
+            results.append(page)
+        return {"object": "list", "results": results, "next_cursor": next_cursor,
+                "has_more": next_cursor is not None, "type": "page_or_database", "page_or_database": {}}
+
+    def databases_retrieve(self, database_id: str, data: Dict) -> Dict:
+        self._check_database(database_id)
+        return self.database.retrieve()
+
+    def pages_retrieve(self, page_id: str, data: Dict) -> Dict:
+        return self.database.page(self._index(page_id))
+
+    def pages_update(self, page_id: str, data: Dict) -> Dict:
+        return self.database.update(self._index(page_id), data.get("properties") or {})
+
+    def stats(self) -> Dict:
+        """按接口汇总请求数、限流次数、错误数和延迟分位数"""
+        with self._lock:
+            requests_seen = list(self.requests)
+        report: Dict[str, Dict] = {}
+        for operation in sorted({request["operation"] or "unknown" for request in requests_seen}):
+            selected = [request for request in requests_seen if (request["operation"] or "unknown") == operation]
+            seconds = sorted(request["seconds"] for request in selected)
+            report[operation] = {
+                "count": len(selected),
+                "throttled": sum(1 for request in selected if request["status"] == 429),
+                "errors": sum(1 for request in selected if request["status"] >= 400 and request["status"] != 429),
+                "p50": seconds[len(seconds) // 2],
+                "p99": seconds[min(len(seconds) - 1, int(len(seconds) * 0.99))],
+            }
+        return report
+
+
+def bench(service: LocalNotion) -> Dict:
+    """用NotionClient从替身拉取全部已审核的行，返回行数、耗时和吞吐"""
+    os.environ["NOTION_BASE_URL"] = service.url
+    os.environ["NOTION_DATABASE_ID"] = service.database.database_id
+    from notion.client import NotionClient
+
+    started = time.perf_counter()
+    rows = pages = 0
+    for page_rows, _ in NotionClient().iter_approved_pages():
+        rows += len(page_rows)
+        pages += 1
+    seconds = time.perf_counter() - started
+    return {"rows": rows, "pages": pages, "seconds": seconds, "rows_per_second": rows / seconds if seconds else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地Notion API替身")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--rate-limit", type=float, default=NOTION_RATE_LIMIT, help="每秒平均请求数，0表示不限流")
+    parser.add_argument("--burst", type=int, default=NOTION_BURST)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--malformed", type=float, default=0.01, help="地址或金额为空的行比例")
+    parser.add_argument("--bench", action="store_true", help="启动后用NotionClient拉取全部行并报告吞吐")
+    args = parser.parse_args()
+
+    database = SyntheticDatabase(args.rows, seed=args.seed, malformed=args.malformed)
+    service = LocalNotion(database, rate_limit=args.rate_limit, burst=args.burst, latency=args.latency)
+    url = service.start(args.host, 0 if args.bench else args.port)
+    print(f"本地Notion: {url}, 数据库ID {database.database_id} ({args.rows}行)")
+    try:
+        if args.bench:
+            result = bench(service)
+            print(f"拉取 {result['rows']} 行 / {result['pages']} 页, 耗时 {result['seconds']:.2f}s, "
+                  f"吞吐 {result['rows_per_second']:.0f} 行/秒")
+        else:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        print(json.dumps(service.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,591 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地Safe Transaction Service替身
+
+路由从仓库自带的 `Safe Transaction Service.yaml` 生成：规范中的每个路径和方法都会被识别，
+本工具用到的接口（about、Safe信息、multisig交易的提议/查询/列表、确认、gas估算、转账和已执行交易历史）在内存中实现，
+其余接口返回501。提议时像真实服务一样重新计算EIP-712 Safe交易哈希、解析签名、校验签名者和
+发送者是Safe所有者、拒绝已执行的nonce；同一哈希再次提交或单独提交确认时合并签名，
+未执行的交易构成待处理队列。可以配置延迟和错误注入，用于离线压测提议吞吐和重试行为：
+
+    python testing/local_safe_service.py --rpc http://127.0.0.1:8545 --port 8000 --latency 0.05 --error-rate 0.02
+    SAFE_SERVICE_URL_SEPOLIA=http://127.0.0.1:8000 python src/main.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from eth_utils import is_address
+from hexbytes import HexBytes
+from safe_eth.eth import EthereumClient
+from safe_eth.safe import Safe, SafeTx
+from safe_eth.safe.safe_signature import SafeSignature, SafeSignatureType
+from web3 import Web3
+
+DEFAULT_SPEC = project_root / "Safe Transaction Service.yaml"
+
+# 转账接口最多返回最新的1000条
+TRANSFERS_LIMIT = 1000
+
+# 合成历史的起始区块和时间，之后每个区块12秒
+HISTORY_START_BLOCK = 7_000_000
+HISTORY_START_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+_PATH_LINE = re.compile(r"^  (/[^:\s]*):\s*$")
+_METHOD_LINE = re.compile(r"^    (get|post|put|patch|delete):\s*$")
+_OPERATION_LINE = re.compile(r"^      operationId:\s*(\S+)\s*$")
+
+
+def load_spec_routes(spec_path: Path = DEFAULT_SPEC) -> List[Tuple[str, re.Pattern, str]]:
+    """
+    从OpenAPI规范中读取全部路由，只按缩进解析 paths 部分，不需要YAML库
+
+    Returns:
+        [(方法, 路径正则, operationId)]
+    """
+    routes = []
+    path = method = None
+    in_paths = False
+    for line in Path(spec_path).read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        if not line.startswith(" "):
+            in_paths = line.startswith("paths:")
+            continue
+        if not in_paths:
+            continue
+        match = _PATH_LINE.match(line)
+        if match:
+            path, method = match.group(1), None
+            continue
+        match = _METHOD_LINE.match(line)
+        if match:
+            method = match.group(1).upper()
+            continue
+        match = _OPERATION_LINE.match(line)
+        if match and path and method:
+            pattern = re.sub(r"\\{(\w+)\\}", r"(?P<\1>[^/]+)", re.escape(path))
+            routes.append((method, re.compile(f"^{pattern}$"), match.group(1)))
+    return routes
+
+
+class ServiceError(Exception):
+    """按真实服务的格式返回的错误"""
+
+    def __init__(self, status: int, body):
+        super().__init__(str(body))
+        self.status = status
+        self.body = body
+
+
+def _validation_error(message: str) -> ServiceError:
+    # 序列化器校验失败时真实服务返回400和nonFieldErrors
+    return ServiceError(400, {"nonFieldErrors": [message]})
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class LocalSafeService:
+    """
+    内存中的交易服务
+
+    Safe的所有者、阈值、版本和nonce从ethereum_client读取（进程内EVM或本地节点）；
+    没有链时可以用safes参数直接给出 {地址: {"owners", "threshold", "nonce", "version"}}
+    """
+
+    def __init__(self, chain_id: Optional[int] = None, ethereum_client: Optional[EthereumClient] = None,
+                 safes: Optional[Dict[str, Dict]] = None, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, seed: int = 0,
+                 spec_path: Path = DEFAULT_SPEC):
+        """
+        Args:
+            latency: 每个请求的基础延迟（秒）
+            jitter: 在基础延迟上增加 [0, jitter) 的均匀随机延迟
+            error_rate: 随机返回error_status的概率
+        """
+        if chain_id is None and ethereum_client is None:
+            raise ValueError("需要chain_id或ethereum_client")
+        self.ethereum_client = ethereum_client
+        self.chain_id = chain_id or ethereum_client.get_chain_id()
+        self.safes = {Web3.to_checksum_address(address): dict(info) for address, info in (safes or {}).items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.routes = load_spec_routes(spec_path)
+        self.handlers = {
+            "about_retrieve": self.about,
+            "about_deployments_list": self.deployments,
+            "about_singletons_list": self.singletons,
+            "safes_retrieve": self.safe_info,
+            "safes_multisig_transactions_list": self.list_transactions,
+            "safes_multisig_transactions_create": self.create_transaction,
+            "safes_multisig_transactions_estimations_create": self.estimate,
+            "multisig_transactions_retrieve": self.get_transaction,
+            "multisig_transactions_confirmations_list": self.list_confirmations,
+            "multisig_transactions_confirmations_create": self.create_confirmation,
+            "safes_transfers_list": self.list_transfers,
+            "safes_all_transactions_list": self.list_all_transactions,
+        }
+        # 部署信息，用于网络注册表的发现：{版本: {合约名: 地址}}
+        self.deployment_info: Dict[str, Dict[str, str]] = {}
+        self.transactions: Dict[str, Dict] = {}
+        # 已执行的历史：{Safe地址: 转账记录}、{Safe地址: all-transactions条目}，由add_payouts生成
+        self.transfers: Dict[str, List[Dict]] = {}
+        self.history: Dict[str, List[Dict]] = {}
+        # 请求记录：方法、operationId、状态码和耗时
+        self.requests: List[Dict] = []
+        self._scripted_errors: List[Tuple[Optional[str], int]] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    # ---- 服务生命周期 ----
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """在后台线程中启动HTTP服务，返回base_url"""
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, payload = service.handle(self.command, self.path, body)
+                data = b"" if payload is None else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="local-safe-service", daemon=True).start()
+        return self.url
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---- 故障注入 ----
+
+    def fail_next(self, count: int = 1, status: int = 503, operation: Optional[str] = None):
+        """让接下来count个请求（只限operation时为该接口的请求）返回status"""
+        with self._lock:
+            self._scripted_errors += [(operation, status)] * count
+
+    def _injected_error(self, operation: str) -> Optional[int]:
+        """等待注入的延迟，返回要注入的错误状态码（没有时为None）"""
+        status = None
+        with self._lock:
+            for i, (target, scripted) in enumerate(self._scripted_errors):
+                if target is None or target == operation:
+                    del self._scripted_errors[i]
+                    status = scripted
+                    break
+            else:
+                if self.error_rate and self._random.random() < self.error_rate:
+                    status = self.error_status
+            delay = self.latency + (self._random.random() * self.jitter if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        return status
+
+    # ---- 路由 ----
+
+    def handle(self, method: str, raw_path: str, body: bytes) -> Tuple[int, Optional[object]]:
+        started = time.perf_counter()
+        parsed = urlparse(raw_path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        operation, status, payload = None, 404, {"detail": "Not found."}
+        for route_method, pattern, operation_id in self.routes:
+            match = pattern.match(parsed.path)
+            if match and route_method == method:
+                operation = operation_id
+                break
+        if operation:
+            injected = self._injected_error(operation)
+            handler = self.handlers.get(operation)
+            if injected:
+                status, payload = injected, {"detail": f"注入的错误 ({operation})"}
+            elif handler is None:
+                status, payload = 501, {"detail": f"本地替身未实现 {operation}"}
+            else:
+                try:
+                    data = json.loads(body) if body else {}
+                    status, payload = handler(query=query, data=data, **match.groupdict())
+                except ServiceError as e:
+                    status, payload = e.status, e.body
+                except json.JSONDecodeError:
+                    status, payload = 400, {"detail": "JSON parse error"}
+        with self._lock:
+            self.requests.append({"method": method, "operation": operation, "status": status,
+                                  "seconds": time.perf_counter() - started})
+        return status, payload
+
+    def _safe(self, address: str) -> Tuple[str, Dict]:
+        if not is_address(address):
+            raise ServiceError(422, {"code": 1, "message": "Checksum address validation failed",
+                                     "arguments": [address]})
+        address = Web3.to_checksum_address(address)
+        with self._lock:
+            info = self.safes.get(address)
+        if info is None:
+            if self.ethereum_client is None:
+                raise ServiceError(404, {"detail": "Not found."})
+            safe_info = Safe(address, self.ethereum_client).retrieve_all_info()
+            info = {"owners": list(safe_info.owners), "threshold": safe_info.threshold,
+                    "version": safe_info.version}
+            with self._lock:
+                self.safes[address] = info
+        info = dict(info)
+        if self.ethereum_client is not None:
+            info["nonce"] = Safe(address, self.ethereum_client).retrieve_nonce()
+        info.setdefault("nonce", 0)
+        return address, info
+
+    def _page(self, items: List[Dict], query: Dict, path: str) -> Dict:
+        limit = int(query.get("limit", 100))
+        offset = int(query.get("offset", 0))
+        page = items[offset:offset + limit]
+        has_next = offset + limit < len(items)
+        return {
+            "count": len(items),
+            "next": f"{self.url}{path}?{urlencode({**query, 'offset': offset + limit})}" if has_next else None,
+            "previous": None if offset == 0 else f"{self.url}{path}?{urlencode({**query, 'offset': max(0, offset - limit)})}",
+            "results": page,
+        }
+
+    # ---- 接口实现 ----
+
+    def about(self, query, data):
+        return 200, {"name": "Safe Transaction Service", "version": "local", "api_version": "v1",
+                     "secure": False, "settings": {}}
+
+    def deployments(self, query, data):
+        return 200, [
+            {"version": version, "contracts": [{"contractName": name, "address": address}
+                                               for name, address in contracts.items()]}
+            for version, contracts in self.deployment_info.items()
+        ]
+
+    def singletons(self, query, data):
+        return 200, []
+
+    def safe_info(self, query, data, address):
+        address, info = self._safe(address)
+        return 200, {"address": address, "nonce": str(info["nonce"]), "threshold": info["threshold"],
+                     "owners": info["owners"], "masterCopy": None, "modules": [], "fallbackHandler": None,
+                     "guard": None, "version": info["version"]}
+
+    def estimate(self, query, data, address):
+        self._safe(address)
+        # Safe v1.3+ 中safeTxGas为0表示使用全部可用gas，与真实服务对这些版本的返回一致
+        return 200, {"safeTxGas": "0"}
+
+    def _parse_confirmations(self, signature: str, safe_tx_hash: bytes, safe_address: str,
+                             owners: List[str]) -> List[Dict]:
+        try:
+            signatures = SafeSignature.parse_signature(HexBytes(signature), safe_tx_hash)
+        except Exception as e:
+            raise _validation_error(f"Signature={signature} is not valid: {e}")
+        if not signatures:
+            raise _validation_error("Signature is not valid")
+        confirmations, seen = [], set()
+        for safe_signature in signatures:
+            owner = safe_signature.owner
+            if safe_signature.signature_type in (SafeSignatureType.CONTRACT_SIGNATURE,
+                                                 SafeSignatureType.APPROVED_HASH) and self.ethereum_client is None:
+                raise _validation_error(f"Signature type {safe_signature.signature_type.name} requires a node")
+            if not safe_signature.is_valid(self.ethereum_client, safe_address):
+                raise _validation_error(f"Signature={safe_signature.signature.hex()} for owner={owner} is not valid")
+            if owner not in owners:
+                raise _validation_error(f"Signer={owner} is not an owner. Current owners={owners}")
+            if owner in seen:
+                raise _validation_error(f"Signature for owner={owner} is duplicated")
+            seen.add(owner)
+            confirmations.append({
+                "owner": owner,
+                "submissionDate": _now(),
+                "transactionHash": None,
+                "signature": HexBytes(safe_signature.export_signature()).hex(),
+                "signatureType": safe_signature.signature_type.name,
+            })
+        return confirmations
+
+    def _merge(self, record: Dict, confirmations: List[Dict]):
+        known = {confirmation["owner"] for confirmation in record["confirmations"]}
+        record["confirmations"] += [c for c in confirmations if c["owner"] not in known]
+        record["modified"] = _now()
+
+    def create_transaction(self, query, data, address):
+        address, info = self._safe(address)
+        try:
+            safe_tx = SafeTx(
+                None, address, Web3.to_checksum_address(data["to"]), int(data["value"]),
+                HexBytes(data.get("data") or b""), int(data["operation"]), int(data["safeTxGas"]),
+                int(data["baseGas"]), int(data["gasPrice"]), data.get("gasToken"), data.get("refundReceiver"),
+                safe_nonce=int(data["nonce"]), safe_version=info["version"], chain_id=self.chain_id,
+            )
+            provided = HexBytes(data["contractTransactionHash"])
+            sender = Web3.to_checksum_address(data["sender"])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ServiceError(400, {"detail": f"Invalid data: {e}"})
+
+        safe_tx_hash = safe_tx.safe_tx_hash
+        if safe_tx_hash != provided:
+            raise _validation_error(
+                f"Contract-transaction-hash={safe_tx_hash.hex()} does not match provided contract-tx-hash={provided.hex()}"
+            )
+        if safe_tx.safe_nonce < info["nonce"]:
+            raise _validation_error(f"Nonce={safe_tx.safe_nonce} too low for safe={address}")
+        if sender not in info["owners"]:
+            raise _validation_error(f"Sender={sender} is not an owner or delegate. Current owners={info['owners']}")
+
+        confirmations = []
+        if data.get("signature"):
+            confirmations = self._parse_confirmations(data["signature"], safe_tx_hash, address, info["owners"])
+            if sender not in {confirmation["owner"] for confirmation in confirmations}:
+                raise _validation_error(f"Signature does not match sender={sender}")
+
+        key = safe_tx_hash.hex()
+        with self._lock:
+            record = self.transactions.get(key)
+            if record is None:
+                record = {
+                    "safe": address, "to": safe_tx.to, "value": str(safe_tx.value),
+                    "data": HexBytes(safe_tx.data).hex() if safe_tx.data else None,
+                    "operation": safe_tx.operation, "gasToken": safe_tx.gas_token,
+                    "safeTxGas": str(safe_tx.safe_tx_gas), "baseGas": str(safe_tx.base_gas),
+                    "gasPrice": str(safe_tx.gas_price), "refundReceiver": safe_tx.refund_receiver,
+                    "nonce": str(safe_tx.safe_nonce), "safeTxHash": key, "proposer": sender,
+                    "submissionDate": _now(), "modified": _now(), "isExecuted": False, "isSuccessful": None,
+                    "executionDate": None, "transactionHash": None, "executor": None, "signatures": None,
+                    "confirmationsRequired": info["threshold"], "confirmations": [],
+                    "trusted": True, "origin": data.get("origin"),
+                }
+                self.transactions[key] = record
+            self._merge(record, confirmations)
+        return 201, None
+
+    def _transaction(self, safe_tx_hash: str) -> Dict:
+        record = self.transactions.get(HexBytes(safe_tx_hash).hex()) if re.fullmatch(r"0x[0-9a-fA-F]{64}", safe_tx_hash) else None
+        if record is None:
+            raise ServiceError(404, {"detail": "Not found."})
+        return record
+
+    def _refresh(self, record: Dict, nonce: int) -> Dict:
+        # 链上nonce已超过交易nonce时视为已执行（或被同nonce的其他交易替换）
+        if not record["isExecuted"] and int(record["nonce"]) < nonce:
+            record["isExecuted"] = True
+        return record
+
+    def get_transaction(self, query, data, safe_tx_hash):
+        with self._lock:
+            record = self._transaction(safe_tx_hash)
+        _, info = self._safe(record["safe"])
+        with self._lock:
+            return 200, dict(self._refresh(record, info["nonce"]))
+
+    def list_transactions(self, query, data, address):
+        address, info = self._safe(address)
+        with self._lock:
+            records = [self._refresh(record, info["nonce"]) for record in self.transactions.values()
+                       if record["safe"] == address]
+            if "nonce" in query:
+                records = [record for record in records if record["nonce"] == query["nonce"]]
+            if "executed" in query:
+                executed = query["executed"].lower() == "true"
+                records = [record for record in records if record["isExecuted"] == executed]
+            # 与真实服务一致：按nonce倒序，同nonce按提交时间倒序
+            records = sorted(records, key=lambda record: (int(record["nonce"]), record["submissionDate"]),
+                             reverse=True)
+            return 200, self._page([dict(record) for record in records], query,
+                                   f"/api/v1/safes/{address}/multisig-transactions/")
+
+    def list_transfers(self, query, data, address):
+        address, _ = self._safe(address)
+        with self._lock:
+            # 与真实服务一致：按区块倒序，最多返回最新的1000条
+            items = sorted(self.transfers.get(address, []), key=lambda t: (t["blockNumber"], t["transferId"]),
+                           reverse=True)
+        for name, field in (("to", "to"), ("_from", "from"), ("token_address", "tokenAddress"),
+                            ("transaction_hash", "transactionHash")):
+            if name in query:
+                items = [t for t in items if (t[field] or "").lower() == query[name].lower()]
+        for name, compare in (("block_number", lambda a, b: a == b), ("block_number__gt", lambda a, b: a > b),
+                              ("block_number__lt", lambda a, b: a < b)):
+            if name in query:
+                items = [t for t in items if compare(t["blockNumber"], int(query[name]))]
+        for name, compare in (("execution_date__gte", lambda a, b: a >= b), ("execution_date__lte", lambda a, b: a <= b),
+                              ("execution_date__gt", lambda a, b: a > b), ("execution_date__lt", lambda a, b: a < b)):
+            if name in query:
+                items = [t for t in items if compare(t["executionDate"], query[name])]
+        return 200, self._page(items[:TRANSFERS_LIMIT], query, f"/api/v1/safes/{address}/transfers/")
+
+    def list_all_transactions(self, query, data, address):
+        address, _ = self._safe(address)
+        ordering = query.get("ordering", "-timestamp")
+        if ordering not in ("timestamp", "-timestamp"):
+            raise ServiceError(400, {"code": 1, "message": "Ordering field is not valid", "arguments": [ordering]})
+        with self._lock:
+            items = list(self.history.get(address, []))
+        if ordering == "-timestamp":
+            items.reverse()
+        return 200, self._page(items, query, f"/api/v1/safes/{address}/all-transactions/")
+
+    def add_payouts(self, safe_address: str, token: str, payouts: List[Tuple[str, int]], per_tx: int = 10,
+                    blocks_between: int = 5, decimals: int = 6, not_before: Optional[datetime] = None) -> List[Dict]:
+        """
+        在历史中追加已执行的USDT批量转账：每per_tx笔转账为一笔MultiSend Safe交易，
+        区块和执行时间接在该Safe已有历史之后，指定not_before时不早于该时间。返回生成的转账记录
+        """
+        safe_address = Web3.to_checksum_address(safe_address)
+        token = Web3.to_checksum_address(token)
+        token_info = {"type": "ERC20", "address": token, "name": "Tether USD", "symbol": "USDT",
+                      "decimals": decimals, "logoUri": None, "trusted": True}
+        created = []
+        with self._lock:
+            self.safes.setdefault(safe_address, {"owners": [], "threshold": 1, "version": "1.4.1"})
+            history = self.history.setdefault(safe_address, [])
+            transfers = self.transfers.setdefault(safe_address, [])
+            block = history[-1]["blockNumber"] if history else HISTORY_START_BLOCK
+            if not_before is not None:
+                seconds = (not_before - HISTORY_START_TIME).total_seconds()
+                block = max(block, HISTORY_START_BLOCK + -int(-seconds // 12) - blocks_between)
+            nonce = sum(1 for tx in history if tx["txType"] == "MULTISIG_TRANSACTION")
+            for start in range(0, len(payouts), per_tx):
+                block += blocks_between
+                execution_date = (HISTORY_START_TIME + timedelta(seconds=12 * (block - HISTORY_START_BLOCK)))
+                execution_date = execution_date.isoformat().replace("+00:00", "Z")
+                tx_hash = "0x" + hashlib.sha256(f"{safe_address}:{nonce}:tx".encode()).hexdigest()
+                batch = [
+                    {"type": "ERC20_TRANSFER", "executionDate": execution_date, "blockNumber": block,
+                     "transactionHash": tx_hash, "to": Web3.to_checksum_address(to), "value": str(value),
+                     "tokenId": None, "tokenAddress": token, "transferId": f"e{tx_hash[2:]}{log_index}",
+                     "tokenInfo": token_info, "from": safe_address}
+                    for log_index, (to, value) in enumerate(payouts[start:start + per_tx])
+                ]
+                history.append({
+                    "txType": "MULTISIG_TRANSACTION", "safe": safe_address, "nonce": nonce,
+                    "safeTxHash": "0x" + hashlib.sha256(f"{safe_address}:{nonce}:safe".encode()).hexdigest(),
+                    "transactionHash": tx_hash, "blockNumber": block, "executionDate": execution_date,
+                    "isExecuted": True, "isSuccessful": True, "transfers": batch,
+                })
+                transfers.extend(batch)
+                created.extend(batch)
+                nonce += 1
+        return created
+
+    def pending(self, safe_address: str) -> List[Dict]:
+        """待处理队列：未执行的交易，按nonce升序"""
+        _, info = self._safe(safe_address)
+        with self._lock:
+            records = [self._refresh(record, info["nonce"]) for record in self.transactions.values()
+                       if record["safe"] == Web3.to_checksum_address(safe_address)]
+            return sorted((record for record in records if not record["isExecuted"]),
+                          key=lambda record: int(record["nonce"]))
+
+    def list_confirmations(self, query, data, safe_tx_hash):
+        with self._lock:
+            record = self._transaction(safe_tx_hash)
+            return 200, self._page(list(record["confirmations"]), query,
+                                   f"/api/v1/multisig-transactions/{safe_tx_hash}/confirmations/")
+
+    def create_confirmation(self, query, data, safe_tx_hash):
+        with self._lock:
+            record = self._transaction(safe_tx_hash)
+        _, info = self._safe(record["safe"])
+        if record["isExecuted"] or int(record["nonce"]) < info["nonce"]:
+            raise _validation_error(f"Transaction with safe-tx-hash={safe_tx_hash} was already executed")
+        if not data.get("signature"):
+            raise ServiceError(400, {"signature": ["This field is required."]})
+        confirmations = self._parse_confirmations(data["signature"], HexBytes(record["safeTxHash"]),
+                                                  record["safe"], info["owners"])
+        with self._lock:
+            self._merge(record, confirmations)
+        return 201, {"signature": data["signature"]}
+
+    def stats(self) -> Dict:
+        """按operationId汇总请求数、错误数和延迟分位数"""
+        with self._lock:
+            requests_seen = list(self.requests)
+        report: Dict[str, Dict] = {}
+        for operation in sorted({request["operation"] or "unknown" for request in requests_seen}):
+            seconds = sorted(request["seconds"] for request in requests_seen
+                             if (request["operation"] or "unknown") == operation)
+            errors = sum(1 for request in requests_seen
+                         if (request["operation"] or "unknown") == operation and request["status"] >= 400)
+            report[operation] = {
+                "count": len(seconds),
+                "errors": errors,
+                "p50": seconds[len(seconds) // 2],
+                "p99": seconds[min(len(seconds) - 1, int(len(seconds) * 0.99))],
+            }
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地Safe Transaction Service替身")
+    parser.add_argument("--rpc", required=True, help="读取Safe所有者、阈值和nonce的RPC地址")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="额外的均匀随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回错误的概率")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    service = LocalSafeService(ethereum_client=EthereumClient(args.rpc), latency=args.latency, jitter=args.jitter,
+                               error_rate=args.error_rate, error_status=args.error_status)
+    url = service.start(args.host, args.port)
+    print(f"本地交易服务: {url} (链ID {service.chain_id}, 规范中 {len(service.routes)} 个接口，实现 {len(service.handlers)} 个)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        service.stop()
+        print(json.dumps(service.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+以最小规模运行一遍微基准，保证基准脚本本身可用、结果结构完整
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from bench_hot_paths import run
+
+
+def test_benchmarks_run_offline():
+    result = run([10])
+    groups = {bench["group"] for bench in result["benchmarks"]}
+    assert groups == {"notion_extract", "checksum_address", "erc20_calldata",
+                      "multisend_pack", "safe_tx_hash", "safe_tx_sign"}
+    for bench in result["benchmarks"]:
+        assert bench["params"] == {"n": 10}
+        assert bench["stats"]["rounds"] >= 1 and bench["stats"]["median"] > 0
+
+
+if __name__ == "__main__":
+    test_benchmarks_run_offline()
+    print("微基准测试通过")
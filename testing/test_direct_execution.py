@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+在进程内EVM (eth-tester / py-evm) 上端到端测试直接执行路径：
+部署Safe v1.4.1、MultiSend和6位小数的USDT测试代币，
+由本地所有者私钥聚合签名后直接执行批量转账
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from eth_account import Account
+from hexbytes import HexBytes
+from safe_eth.eth.contracts import get_erc20_contract
+
+from local_chain import LocalChain
+from test_orchestrator import LocalOrchestrator, RecordingWriteback
+
+
+def test_direct_execution_with_aggregated_signatures():
+    chain = LocalChain.shared(threshold=2)
+    with chain.isolated():
+        # PRIVATE_KEY是不属于所有者的发送账户；所有者私钥故意倒序配置，验证签名按所有者地址排序
+        sender = chain.accounts[-1]
+        assert sender not in chain.owners
+        handler = chain.handler([sender] + list(reversed(chain.owners[:2])))
+        
+        recipients = [Account.create().address for _ in range(3)]
+        transactions = [{"address": address, "amount": 1.5} for address in recipients]
+        batch_tx = handler.prepare_batch_transfers(transactions)
+        
+        assert handler.should_execute_directly()
+        tx_hash = handler.execute_transaction(batch_tx)
+        
+        receipt = chain.w3.eth.get_transaction_receipt(tx_hash)
+        assert receipt["status"] == 1 and not handler.execution_failed(receipt)
+        # execTransaction由PRIVATE_KEY对应的账户发送并支付gas
+        assert receipt["from"] == sender.address
+        for address in recipients:
+            assert chain.usdt_balance(address) == 1_500_000
+        assert handler.safe.retrieve_nonce() == 1
+    
+    # 回滚后转账和nonce都被撤销
+    assert handler.safe.retrieve_nonce() == 0
+    assert all(chain.usdt_balance(address) == 0 for address in recipients)
+
+
+def test_execution_failure_is_reported():
+    chain = LocalChain.shared(threshold=1)
+    with chain.isolated():
+        handler = chain.handler()
+        # safeTxGas不为0时，超过余额的转账不会让execTransaction回滚，只发出ExecutionFailure
+        balance = chain.usdt_balance(chain.contracts["safe"])
+        transfer = handler.encode_transfer(Account.create().address, balance / 10**6 + 1)
+        batch_tx = handler._build_tx_data(handler.multisend.build_tx_data([transfer]), 0, safe_tx_gas=200_000)
+        
+        # 本地模拟已能发现失败
+        with pytest.raises(Exception):
+            handler.execute_transaction(batch_tx)
+        assert handler.safe.retrieve_nonce() == 0
+        
+        # 模拟之后状态变化时交易照样上链：receipt状态为1，但Safe发出ExecutionFailure并消耗nonce
+        safe_tx = handler._build_safe_tx(batch_tx)
+        safe_tx.sign(chain.owners[0].key.hex())
+        tx_hash, _ = safe_tx.execute(chain.owners[0].key.hex(), tx_gas=500_000)
+        receipt = chain.w3.eth.wait_for_transaction_receipt(tx_hash)
+        assert receipt["status"] == 1 and handler.execution_failed(receipt)
+        assert handler.safe.retrieve_nonce() == 1
+        assert chain.usdt_balance(chain.contracts["safe"]) == balance
+
+
+def allow_drain(chain, handler):
+    """由Safe授权部署账户转走USDT，测试中用来在本地模拟之后、交易上链之前清空余额"""
+    usdt = get_erc20_contract(chain.w3, chain.contracts["usdt"])
+    data = usdt.encodeABI(fn_name="approve", args=[chain.deployer.address, 2**256 - 1])
+    safe_tx = handler.safe.build_multisig_tx(usdt.address, 0, HexBytes(data), safe_nonce=handler.safe.retrieve_nonce())
+    safe_tx.sign(chain.owners[0].key.hex())
+    tx_hash, _ = safe_tx.execute(chain.owners[0].key.hex())
+    chain.w3.eth.wait_for_transaction_receipt(tx_hash)
+    
+    def drain():
+        safe = chain.contracts["safe"]
+        usdt.functions.transferFrom(safe, chain.deployer.address, chain.usdt_balance(safe)).transact(
+            {"from": chain.deployer.address}
+        )
+    return drain
+
+
+def drain_before_sending(handler, drain):
+    """prepare_execution完成本地模拟和签名后清空Safe余额，上链时MultiSend中的转账失败"""
+    prepare = handler.prepare_execution
+    
+    def prepare_then_drain(tx):
+        execution = prepare(tx)
+        drain()
+        return execution
+    handler.prepare_execution = prepare_then_drain
+
+
+def test_execution_failure_in_receipt_raises():
+    chain = LocalChain.shared(threshold=1)
+    with chain.isolated():
+        handler = chain.handler(chain.owners[:1])
+        drain_before_sending(handler, allow_drain(chain, handler))
+        recipients = [Account.create().address for _ in range(2)]
+        batch_tx = handler.prepare_batch_transfers([{"address": address, "amount": 1} for address in recipients])
+        assert int(batch_tx["safeTxGas"]) > 0
+        
+        # receipt状态为1，但Safe发出了ExecutionFailure
+        with pytest.raises(Exception, match="ExecutionFailure"):
+            handler.execute_transaction(batch_tx)
+        assert handler.safe.retrieve_nonce() == int(batch_tx["nonce"]) + 1
+        assert all(chain.usdt_balance(address) == 0 for address in recipients)
+
+
+def test_orchestrator_does_not_write_back_failed_execution():
+    chain = LocalChain.shared(threshold=1)
+    with chain.isolated():
+        drain = allow_drain(chain, chain.handler(chain.owners[:1]))
+        orchestrator = LocalOrchestrator(chain.ethereum_client, chain.contracts, chain.owners[:1])
+        orchestrator.writeback = RecordingWriteback()
+        create_handler = orchestrator.create_handler
+        
+        def draining_handler(network, safe_address):
+            handler = create_handler(network, safe_address)
+            drain_before_sending(handler, drain)
+            return handler
+        orchestrator.create_handler = draining_handler
+        
+        rows = [{"address": Account.create().address, "amount": 1, "page_id": f"page-{i}"} for i in range(2)]
+        results = orchestrator.run(rows)
+        # 组失败，行不写回为已执行
+        assert "ExecutionFailure" in results[0]["error"] and not results[0]["tx_hashes"]
+        assert not orchestrator.writeback.submitted
+        assert all(chain.usdt_balance(row["address"]) == 0 for row in rows)
+
+
+def test_execute_mode_requires_enough_keys():
+    chain = LocalChain.shared(threshold=2)
+    
+    # auto模式下私钥不足时回退到提议
+    handler = chain.handler(chain.owners[:1])
+    assert not handler.should_execute_directly()
+    
+    handler = chain.handler(chain.owners[:1], execution_mode="execute")
+    with pytest.raises(Exception, match="私钥不足"):
+        handler.should_execute_directly()
+    
+    handler = chain.handler(execution_mode="propose")
+    assert not handler.should_execute_directly()
+
+
+def test_snapshots_isolate_many_scenarios():
+    chain = LocalChain.shared(threshold=1)
+    block = chain.w3.eth.block_number
+    safe_balance = chain.usdt_balance(chain.contracts["safe"])
+    for i in range(25):
+        with chain.isolated():
+            # 每个场景都从相同的区块和余额开始
+            assert chain.w3.eth.block_number == block
+            chain.fund_safe(Account.create().address, i + 1)
+            assert chain.usdt_balance(chain.contracts["safe"]) == safe_balance
+    assert chain.w3.eth.block_number == block
+
+
+if __name__ == "__main__":
+    test_direct_execution_with_aggregated_signatures()
+    test_execution_failure_is_reported()
+    test_execution_failure_in_receipt_raises()
+    test_orchestrator_does_not_write_back_failed_execution()
+    test_execute_mode_requires_enough_keys()
+    test_snapshots_isolate_many_scenarios()
+    print("直接执行测试通过")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试故障注入代理：延迟与错误规则、Notion 429经代理后的客户端重试、
+RPC的超时、响应截断和批量请求中的部分失败
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fault_proxy import FaultProxySet, Scenario, sample_latency
+from local_notion import LocalNotion, SyntheticDatabase
+from local_safe_service import LocalSafeService
+from notion.client import NotionClient
+
+
+class EchoRPC:
+    """每个JSON-RPC调用都返回0x1的最小上游"""
+
+    def __enter__(self):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                calls = payload if isinstance(payload, list) else [payload]
+                results = [{"jsonrpc": "2.0", "id": call["id"], "result": "0x1"} for call in calls]
+                data = json.dumps(results if isinstance(payload, list) else results[0]).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_latency_distributions():
+    rng = random.Random(0)
+    assert sample_latency(0.2, rng) == 0.2
+    assert sample_latency({"distribution": "fixed", "value": 0.1}, rng) == 0.1
+    samples = sorted(sample_latency({"distribution": "lognormal", "median": 0.1, "sigma": 1}, rng)
+                     for _ in range(2000))
+    assert 0.08 < samples[1000] < 0.12 and samples[1980] > 0.5
+    assert all(sample_latency({"distribution": "pareto", "scale": 0.1, "cap": 1}, rng) <= 1 for _ in range(100))
+    with pytest.raises(ValueError):
+        Scenario({"rules": [{"upstream": "rpc", "fault": "explode"}]})
+
+
+def test_latency_and_status_rules_are_reported():
+    scenario = Scenario({"upstreams": {"safe_service": {}}, "rules": [
+        {"upstream": "safe_service", "path": "/about/$", "latency": 0.05},
+        {"upstream": "safe_service", "path": "/about/$", "count": 2, "fault": "status", "status": 503},
+    ]})
+    with LocalSafeService(chain_id=1) as service, FaultProxySet(scenario, {"safe_service": service.url}) as proxies:
+        url = proxies.urls["safe_service"]
+        statuses = [requests.get(f"{url}/api/v1/about/").status_code for _ in range(5)]
+        assert statuses == [503, 503, 200, 200, 200]
+        # 没有命中规则的请求原样转发
+        assert requests.get(f"{url}/api/v1/tokens/").status_code == 501
+        assert proxies.env("sepolia") == {"SAFE_SERVICE_URL_SEPOLIA": url}
+
+    stats = proxies.report()["safe_service"]["GET /api/v1/about/"]
+    assert stats["count"] == 5 and stats["errors"] == 2 and stats["faults"] == {"status": 2}
+    assert stats["p50"] >= 0.05 and stats["added_p50"] >= 0.05
+    # 注入的故障不经过上游，只有转发的请求计入上游
+    assert len(service.requests) == 4
+
+
+def test_notion_rate_limits_are_retried_through_proxy():
+    database = SyntheticDatabase(30, seed=4, unapproved=0, other_signer=0, other_month=0, early=0, malformed=0)
+    scenario = Scenario({"upstreams": {"notion": {}}, "rules": [
+        {"upstream": "notion", "method": "POST", "count": 2, "fault": "status", "status": 429,
+         "headers": {"Retry-After": "0"}},
+    ]})
+    with LocalNotion(database, rate_limit=0) as notion, FaultProxySet(scenario, {"notion": notion.url}) as proxies:
+        os.environ.update(proxies.env("sepolia"))
+        os.environ["NOTION_DATABASE_ID"] = database.database_id
+        try:
+            rows = NotionClient().get_approved_transactions()
+        finally:
+            os.environ.pop("NOTION_BASE_URL", None)
+            os.environ.pop("NOTION_DATABASE_ID", None)
+    assert len(rows) == 30
+    stats = proxies.report()["notion"]
+    query = next(stats[name] for name in stats if name.endswith("/query"))
+    assert query["faults"] == {"status": 2} and query["count"] == 3
+
+
+def test_rpc_timeouts_truncation_and_partial_batches():
+    scenario = Scenario({"upstreams": {"rpc": {}}, "rules": [
+        {"upstream": "rpc", "rpc_method": "eth_blockNumber", "fault": "timeout", "hang": 1},
+        {"upstream": "rpc", "rpc_method": "eth_chainId", "fault": "truncate"},
+        {"upstream": "rpc", "rpc_method": "eth_getBalance", "fault": "batch_errors", "fraction": 1},
+    ]})
+    with EchoRPC() as upstream, FaultProxySet(scenario, {"rpc": upstream}) as proxies:
+        url = proxies.urls["rpc"]
+        with pytest.raises(requests.Timeout):
+            requests.post(url, json={"jsonrpc": "2.0", "id": 1, "method": "eth_blockNumber"}, timeout=0.3)
+        with pytest.raises(requests.RequestException):
+            requests.post(url, json={"jsonrpc": "2.0", "id": 2, "method": "eth_chainId"}, timeout=5).json()
+
+        batch = [{"jsonrpc": "2.0", "id": i, "method": "eth_getBalance", "params": []} for i in range(3)]
+        results = requests.post(url, json=batch, timeout=5).json()
+        assert [result["id"] for result in results] == [0, 1, 2]
+        assert all("error" in result for result in results)
+        assert requests.post(url, json={"jsonrpc": "2.0", "id": 3, "method": "eth_gasPrice"}).json()["result"] == "0x1"
+
+    report = proxies.report()["rpc"]
+    assert report["eth_blockNumber"]["faults"] == {"timeout": 1} and report["eth_blockNumber"]["errors"] == 1
+    assert report["batch:eth_getBalance"]["faults"] == {"batch_errors": 1}
+    assert report["eth_gasPrice"]["errors"] == 0
+
+
+def test_bundled_scenario_is_valid():
+    scenario = Scenario.load(Path(__file__).parent / "scenarios" / "flaky_upstreams.json")
+    assert {rule.upstream for rule in scenario.rules} == {"rpc", "notion", "safe_service"}
+
+
+if __name__ == "__main__":
+    test_latency_distributions()
+    test_latency_and_status_rules_are_reported()
+    test_notion_rate_limits_are_retried_through_proxy()
+    test_rpc_timeouts_truncation_and_partial_batches()
+    test_bundled_scenario_is_valid()
+    print("✅ 故障注入代理测试通过")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+在进程内EVM上测试safeTxGas估算：拆分运行中的每笔Safe交易并行估算，
+结果按 (链ID, safe, to, data哈希, nonce) 缓存，重试时不重复估算；多个Safe共用同一个缓存文件
+"""
+
+import json
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from eth_account import Account
+
+from safe.gas import SafeTxGasEstimator
+from utils.files import write_json_atomic
+from local_chain import LocalChain
+
+
+def test_split_run_is_estimated_and_executed():
+    chain = LocalChain.shared(threshold=2)
+    with chain.isolated():
+        handler = chain.handler(chain.owners[:2])
+        
+        rows = [{"address": Account.create().address, "amount": 2} for _ in range(10)]
+        batch_txs = handler.prepare_split_batch_transfers(rows, max_transfers_per_tx=4)
+        
+        assert [int(tx["nonce"]) for tx in batch_txs] == [0, 1, 2]
+        assert all(int(tx["safeTxGas"]) > 0 for tx in batch_txs)
+        
+        for batch_tx in batch_txs:
+            handler.execute_transaction(batch_tx)
+        for row in rows:
+            assert chain.usdt_balance(row["address"]) == 2 * 10**6
+
+
+def test_estimates_are_cached_on_disk():
+    chain = LocalChain.shared(threshold=1)
+    handler = chain.handler(chain.owners[:1])
+    rows = [{"address": Account.create().address, "amount": 1} for _ in range(3)]
+    
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_file = str(Path(cache_dir) / "gas.json")
+        handler.gas_estimator = SafeTxGasEstimator(handler, "rpc", cache_file=cache_file)
+        first = handler.prepare_batch_transfers(rows)
+        
+        # 新的估算器从磁盘读取缓存，估算后端不应再被调用
+        estimator = SafeTxGasEstimator(handler, "rpc", cache_file=cache_file)
+        def fail(*args):
+            raise AssertionError("命中缓存时不应重新估算")
+        estimator._estimate = fail
+        handler.gas_estimator = estimator
+        second = handler.prepare_batch_transfers(rows)
+    
+    assert first["safeTxGas"] == second["safeTxGas"]
+    assert first["safe_tx_hash"] == second["safe_tx_hash"]
+
+
+def test_concurrent_safes_share_one_cache_file():
+    chain = LocalChain.shared(threshold=1)
+    with chain.isolated():
+        handlers = [chain.handler(chain.owners[:1])]
+        handlers.append(chain.handler(chain.owners[:1], safe_address=chain.create_safe(chain.owners[:1], 1)))
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_file = Path(cache_dir) / "gas.json"
+            # 编排器中每个Safe一个估算器，在不同线程中同时估算并写回同一个缓存文件
+            for handler in handlers:
+                handler.gas_estimator = SafeTxGasEstimator(handler, "rpc", cache_file=str(cache_file))
+            
+            def prepare(handler):
+                rows = [{"address": Account.create().address, "amount": 1} for _ in range(4)]
+                return handler.prepare_split_batch_transfers(rows, max_transfers_per_tx=1)
+            
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                list(pool.map(prepare, handlers))
+            
+            entries = json.loads(cache_file.read_text())
+            assert len(entries) == 8
+            # 缓存键包含链ID，同一地址的Safe在其他网络上不会复用估算结果
+            chain_id = str(chain.w3.eth.chain_id)
+            assert all(key.split(":")[0] == chain_id for key in entries)
+            assert {key.split(":")[1] for key in entries} == {handler.safe_address.lower() for handler in handlers}
+            assert not list(Path(cache_dir).glob("*.tmp"))
+
+
+def test_atomic_writes_do_not_share_a_temp_file():
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "data.json"
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda i: write_json_atomic(path, {"writer": i}), range(64)))
+        assert json.loads(path.read_text())["writer"] in range(64)
+        assert [p.name for p in Path(directory).iterdir()] == ["data.json"]
+
+
+if __name__ == "__main__":
+    test_split_run_is_estimated_and_executed()
+    test_estimates_are_cached_on_disk()
+    test_concurrent_safes_share_one_cache_file()
+    test_atomic_writes_do_not_share_a_temp_file()
+    print("gas估算测试通过")
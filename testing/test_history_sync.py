@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试Safe历史同步：超过转账接口1000条上限的分段拉取、按水位和游标的增量同步、
+中断后重新运行，以及本地账本的离线查询
+"""
+
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from local_safe_service import LocalSafeService
+from safe.history import PayoutLedger, SafeHistorySync, month_range
+
+SAFE = "0x" + "5a" * 20
+USDT = "0x" + "7e" * 20
+RECIPIENTS = ["0x" + f"{i:040x}" for i in range(1, 41)]
+
+
+def payouts(count, seed):
+    rng = random.Random(seed)
+    return [(rng.choice(RECIPIENTS), rng.randrange(1, 5000) * 10**6) for _ in range(count)]
+
+
+def syncer(service, ledger):
+    os.environ["SAFE_SERVICE_URL_SEPOLIA"] = service.url
+    try:
+        return SafeHistorySync("sepolia", SAFE, ledger, page_size=100, workers=4)
+    finally:
+        os.environ.pop("SAFE_SERVICE_URL_SEPOLIA", None)
+
+
+def test_incremental_sync_and_offline_lookups():
+    with LocalSafeService(chain_id=11155111) as service:
+        created = service.add_payouts(SAFE, USDT, payouts(2500, seed=1))
+        ledger = PayoutLedger(":memory:")
+        result = syncer(service, ledger).sync()
+        # 接口只返回最新的1000条，同步按区块向前分段取回全部转账
+        assert result["transfers"] >= 2500 and result["transactions"] == 250
+        assert ledger.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0] == 2500
+        assert result["watermark"] == max(transfer["blockNumber"] for transfer in created)
+
+        recipient = RECIPIENTS[3]
+        expected = sum(int(t["value"]) for t in created if t["to"].lower() == recipient)
+        assert ledger.total_paid(recipient, token=USDT) == expected
+        rows = ledger.payments(to=recipient.upper().replace("0X", "0x"))
+        assert rows and all(row["nonce"] is not None and row["safe_tx_hash"] for row in rows)
+
+        # 增量同步只拉取水位之后的转账和游标之后的交易
+        before = len(service.requests)
+        service.add_payouts(SAFE, USDT, payouts(30, seed=2))
+        result = syncer(service, ledger).sync()
+        # 交易从游标前一页开始取两页，转账一页
+        assert len(service.requests) - before == 3
+        assert result["transactions"] == 103 and result["cursor"] == 253
+        assert result["transfers"] == 30 + 10
+        assert ledger.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0] == 2530
+
+        # 查询不访问交易服务，并且在毫秒级完成
+        requests_before = len(service.requests)
+        since, until = month_range("2025.1")
+        started = time.perf_counter()
+        january = ledger.payments(safe=SAFE, since=since, until=until)
+        assert time.perf_counter() - started < 0.05
+        assert len(service.requests) == requests_before
+        assert january and all(row["execution_date"].startswith("2025-01") for row in january)
+
+
+def test_interrupted_sync_is_rerun_without_moving_the_watermark():
+    os.environ["SAFE_SERVICE_MAX_RETRIES"] = "0"
+    try:
+        with LocalSafeService(chain_id=11155111) as service:
+            service.add_payouts(SAFE, USDT, payouts(600, seed=3))
+            ledger = PayoutLedger(":memory:")
+            service.fail_next(1, 503, "safes_all_transactions_list")
+            with pytest.raises(requests.HTTPError):
+                syncer(service, ledger).sync()
+            assert ledger.state("sepolia", SAFE, "transfers") == (0, 0)
+
+            result = syncer(service, ledger).sync()
+            assert ledger.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0] == 600
+            assert ledger.state("sepolia", SAFE, "transfers")[1] == result["watermark"] > 0
+    finally:
+        os.environ.pop("SAFE_SERVICE_MAX_RETRIES", None)
+
+    with pytest.raises(ValueError):
+        month_range("2025-02")
+
+
+if __name__ == "__main__":
+    test_incremental_sync_and_offline_lookups()
+    test_interrupted_sync_is_rerun_without_moving_the_watermark()
+    print("✅ Safe历史同步测试通过")
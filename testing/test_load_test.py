@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+以小规模运行一遍端到端压测，保证本地替身和报告可用
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from load_test import generate_pages, run_load_test
+
+
+def test_generated_ratios():
+    pages, ens_names = generate_pages(1000, duplicates=0.1, ens=0.05, malformed=0.05, seed=1)
+    addresses = [page["properties"]["地址"]["rich_text"] for page in pages if "地址" in page["properties"]]
+    assert len(pages) == 1000
+    assert 20 <= len(ens_names) <= 80
+    assert any(not rich_text for rich_text in addresses)
+
+
+def test_load_test_executes_all_parsed_rows():
+    report = run_load_test(120, duplicates=0.1, ens=0.05, malformed=0.05,
+                           execution_mode="execute", max_transfers=50, seed=2)
+    assert not report["errors"]
+    assert report["parsed_rows"] + report["skipped_rows"] == 120 and report["skipped_rows"] > 0
+    assert report["safe_txs"] == -(-report["parsed_rows"] // 50)
+    assert report["notion_queries"] == 2
+    assert report["stages"]["encode"]["processed"] == report["parsed_rows"]
+    assert report["rows_per_second"] > 0 and report["peak_rss_mb"] > 0
+
+
+if __name__ == "__main__":
+    test_generated_ratios()
+    test_load_test_executes_all_parsed_rows()
+    print("压测测试通过")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试本地Notion替身：筛选与分页、限流和客户端重试、databases.retrieve和pages.update
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from notion_client import APIResponseError, Client
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from local_notion import LocalNotion, SyntheticDatabase
+from notion.client import NotionClient
+
+
+def notion_client(service, page_size=100):
+    os.environ["NOTION_BASE_URL"] = service.url
+    os.environ["NOTION_DATABASE_ID"] = service.database.database_id
+    os.environ["NOTION_PAGE_SIZE"] = str(page_size)
+    try:
+        return NotionClient()
+    finally:
+        for name in ("NOTION_BASE_URL", "NOTION_DATABASE_ID", "NOTION_PAGE_SIZE"):
+            os.environ.pop(name, None)
+
+
+def test_query_filters_and_pagination():
+    database = SyntheticDatabase(450, seed=3, unapproved=0.1, other_signer=0.05, other_month=0.1,
+                                 early=0.05, malformed=0.05)
+    expected = []
+    for index in range(database.rows):
+        page = database.page(index)
+        properties = page["properties"]
+        if (properties["审核完毕，Signer"]["people"] and properties["月份"]["select"]["name"] == "2025.2"
+                and properties["Created time"]["created_time"] >= "2025-02-01"):
+            expected.append(page["id"])
+
+    with LocalNotion(database, rate_limit=0) as service:
+        client = notion_client(service, page_size=50)
+        pages = list(client.iter_approved_pages())
+        # 服务端筛选后每页正好page_size行，最后一页的游标为None
+        assert service.stats()["databases.query"]["count"] == -(-len(expected) // 50)
+        assert pages[-1][1] is None and all(cursor for _, cursor in pages[:-1])
+
+        rows = [row for page_rows, _ in pages for row in page_rows]
+        page_ids = [row["page_id"] for row in rows]
+        assert len(page_ids) == len(set(page_ids))
+        assert set(page_ids) < set(expected)
+        # 审核人不是BigSong和格式错误的行在客户端解析时跳过
+        assert len(expected) - len(rows) > 0
+
+        # 从中间的游标续跑得到剩余的行
+        resumed = [row for page_rows, _ in client.iter_approved_pages(pages[2][1]) for row in page_rows]
+        assert resumed == rows[-len(resumed):]
+
+        raw = Client(base_url=service.url)
+        with pytest.raises(APIResponseError) as error:
+            raw.databases.query(database_id=database.database_id,
+                                filter={"property": "不存在", "select": {"equals": "x"}})
+        assert error.value.code == "validation_error"
+        with pytest.raises(APIResponseError) as error:
+            raw.databases.query(database_id=database.database_id, page_size=101)
+        assert error.value.code == "validation_error"
+
+
+def test_rate_limit_returns_429_and_client_retries():
+    database = SyntheticDatabase(60, seed=1, unapproved=0, other_signer=0, other_month=0, early=0, malformed=0)
+    with LocalNotion(database, rate_limit=5, burst=2) as service:
+        raw = Client(base_url=service.url)
+        statuses = []
+        for _ in range(4):
+            try:
+                raw.databases.retrieve(database_id=database.database_id)
+                statuses.append(200)
+            except APIResponseError as e:
+                statuses.append(e.status)
+                assert e.code == "rate_limited" and e.headers["Retry-After"] == "1"
+        assert statuses[:2] == [200, 200] and 429 in statuses
+
+        rows = notion_client(service, page_size=10).get_approved_transactions()
+        assert len(rows) == 60
+        assert service.stats()["databases.query"]["throttled"] > 0
+
+
+def test_retrieve_and_update_pages():
+    database = SyntheticDatabase(20, seed=2)
+    with LocalNotion(database, rate_limit=0) as service:
+        raw = Client(base_url=service.url)
+        schema = raw.databases.retrieve(database_id=database.database_id)["properties"]
+        assert schema["USDT"]["type"] == "number" and schema["Created time"]["type"] == "created_time"
+
+        page_id = database.page(7)["id"]
+        updated = raw.pages.update(page_id=page_id, properties={
+            "Safe": {"rich_text": [{"text": {"content": "0xabc"}}]},
+            "网络": {"select": {"name": "base"}},
+        })
+        assert updated["properties"]["Safe"]["rich_text"][0]["plain_text"] == "0xabc"
+        page = raw.pages.retrieve(page_id=page_id.replace("-", ""))
+        assert page["properties"]["网络"]["select"]["name"] == "base"
+        assert page["last_edited_time"] > page["created_time"]
+
+        with pytest.raises(APIResponseError) as error:
+            raw.pages.update(page_id=page_id, properties={"不存在": {"number": 1}})
+        assert error.value.code == "validation_error"
+        with pytest.raises(APIResponseError) as error:
+            raw.pages.update(page_id=database.page(0)["id"].replace("0000-4000", "0000-5000"), properties={})
+        assert error.value.code == "object_not_found"
+        with pytest.raises(APIResponseError) as error:
+            raw.databases.query(database_id="00000000-0000-0000-0000-000000000000")
+        assert error.value.code == "object_not_found"
+
+
+if __name__ == "__main__":
+    test_query_filters_and_pagination()
+    test_rate_limit_returns_429_and_client_retries()
+    test_retrieve_and_update_pages()
+    print("✅ 本地Notion替身测试通过")
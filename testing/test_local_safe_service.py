@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试本地交易服务替身：按规范生成的路由、EIP-712哈希和签名校验、待处理队列与确认、错误注入
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import requests
+from eth_account import Account
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from hexbytes import HexBytes
+
+from local_safe_service import LocalSafeService, load_spec_routes
+from local_chain import build_local_chain, fund_safe, make_handler
+
+
+def test_routes_are_generated_from_spec():
+    routes = {operation: (method, pattern) for method, pattern, operation in load_spec_routes()}
+    method, pattern = routes["safes_multisig_transactions_create"]
+    assert method == "POST"
+    match = pattern.match("/api/v1/safes/0xabc/multisig-transactions/")
+    assert match.groupdict() == {"address": "0xabc"}
+    assert len(routes) > 50
+
+    with LocalSafeService(chain_id=1) as service:
+        assert requests.get(f"{service.url}/api/v1/tokens/").status_code == 501
+        assert requests.get(f"{service.url}/api/v1/unknown/").status_code == 404
+
+
+def test_proposal_confirmation_and_validation():
+    ethereum_client, contracts, owners = build_local_chain(threshold=2)
+    fund_safe(ethereum_client, contracts, contracts["safe"], 100 * 10**6)
+    service = LocalSafeService(ethereum_client=ethereum_client)
+    os.environ["SAFE_SERVICE_URL_SEPOLIA"] = service.start()
+    try:
+        handler = make_handler(ethereum_client, contracts, owners[:1])
+        batch_tx = handler.prepare_batch_transfers([{"address": Account.create().address, "amount": 1.5}])
+        signature = handler.sign_transaction(batch_tx)
+        assert not handler.is_proposed(batch_tx)
+        assert handler.propose_transaction(batch_tx, signature) == batch_tx["safe_tx_hash"]
+        assert handler.is_proposed(batch_tx)
+
+        pending = service.pending(contracts["safe"])
+        assert [record["safeTxHash"] for record in pending] == [HexBytes(batch_tx["safe_tx_hash"]).hex()]
+        assert [c["owner"] for c in pending[0]["confirmations"]] == [owners[0].address]
+
+        # 第二个所有者单独提交确认
+        second_signature = make_handler(ethereum_client, contracts, owners[1:2]).sign_transaction(batch_tx)
+        handler.transaction_service_api.post_signatures(batch_tx["safe_tx_hash"], second_signature)
+        assert len(service.pending(contracts["safe"])[0]["confirmations"]) == 2
+
+        url = f"{service.url}/api/v1/safes/{contracts['safe']}/multisig-transactions/"
+        body = {key: batch_tx[key] for key in ("to", "value", "data", "operation", "safeTxGas", "baseGas",
+                                               "gasPrice", "gasToken", "refundReceiver", "nonce")}
+        body.update(contractTransactionHash=batch_tx["safe_tx_hash"], sender=owners[0].address,
+                    signature=HexBytes(signature).hex())
+
+        # 篡改的字段使哈希不一致
+        response = requests.post(url, json={**body, "value": 1})
+        assert response.status_code == 400 and "does not match" in response.json()["nonFieldErrors"][0]
+
+        # 非所有者的签名
+        stranger = Account.create()
+        stranger_signature = make_handler(ethereum_client, contracts, [stranger]).sign_transaction(batch_tx)
+        response = requests.post(url, json={**body, "sender": stranger.address,
+                                             "signature": HexBytes(stranger_signature).hex()})
+        assert response.status_code == 400 and "not an owner" in response.json()["nonFieldErrors"][0]
+
+        # 执行后同nonce的交易不再接受
+        handler.private_keys.append(owners[1].key.hex())
+        handler.execute_transaction(batch_tx)
+        response = requests.post(url, json=body)
+        assert response.status_code == 400 and "too low" in response.json()["nonFieldErrors"][0]
+        assert service.pending(contracts["safe"]) == []
+        assert requests.get(url, params={"executed": "true"}).json()["count"] == 1
+    finally:
+        service.stop()
+        os.environ.pop("SAFE_SERVICE_URL_SEPOLIA", None)
+
+
+def test_error_injection_and_latency():
+    service = LocalSafeService(chain_id=1, safes={"0x" + "11" * 20: {"owners": [], "threshold": 1, "version": "1.4.1"}},
+                               latency=0.02)
+    with service:
+        url = f"{service.url}/api/v1/safes/{'0x' + '11' * 20}/"
+        service.fail_next(2, status=429, operation="safes_retrieve")
+        assert [requests.get(url).status_code for _ in range(3)] == [429, 429, 200]
+        stats = service.stats()["safes_retrieve"]
+        assert stats["count"] == 3 and stats["errors"] == 2
+        assert stats["p50"] >= 0.02
+
+
+if __name__ == "__main__":
+    test_routes_are_generated_from_spec()
+    test_proposal_confirmation_and_validation()
+    test_error_injection_and_latency()
+    print("✅ 本地交易服务替身测试通过")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+在进程内EVM上测试转账日志索引：节点结果过多时拆分区块范围、并行查询、
+按水位增量索引和中断后续跑，以及按计划核对批量转账是否全部到账
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+from eth_account import Account
+from web3 import EthereumTesterProvider, Web3
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from local_chain import LocalChain
+from safe.history import PayoutLedger
+from safe.logs import LOGS_STREAM, TransferLogIndexer, confirm_batch
+from safe.plan import decode_transfers
+
+
+def limited_web3(chain, max_results, calls, fail_from=None):
+    """
+    连接到测试链的Web3：eth_getLogs结果超过max_results条时像Infura一样返回-32005，
+    起始区块不小于fail_from[0]时返回节点内部错误；eth-tester不是线程安全的，请求串行执行
+    """
+    lock = threading.RLock()
+
+    def factory(make_request, w3):
+        def middleware(method, params):
+            if method == "eth_getLogs":
+                start = int(params[0]["fromBlock"], 16)
+                calls.append(start)
+                if fail_from and fail_from[0] is not None and start >= fail_from[0]:
+                    return {"jsonrpc": "2.0", "id": 0, "error": {"code": -32000, "message": "internal error"}}
+            with lock:
+                response = make_request(method, params)
+            if method == "eth_getLogs" and len(response.get("result") or []) > max_results:
+                return {"jsonrpc": "2.0", "id": 0,
+                        "error": {"code": -32005, "message": f"query returned more than {max_results} results"}}
+            return response
+        return middleware
+
+    w3 = Web3(EthereumTesterProvider(chain.tester))
+    w3.middleware_onion.add(factory)
+    return w3
+
+
+def execute_batches(chain, handler, count, per_batch=3):
+    """执行count笔批量转账，每笔之间插入几个无关的区块，返回 [(safe_tx_hash, 解码出的转账)]"""
+    batches = []
+    for _ in range(count):
+        for _ in range(3):
+            chain.fund_safe(Account.create().address, 1)
+        batch_tx = handler.prepare_batch_transfers(
+            [{"address": Account.create().address, "amount": 1.5} for _ in range(per_batch)]
+        )
+        handler.execute_transaction(batch_tx)
+        batches.append((batch_tx["safe_tx_hash"], decode_transfers(batch_tx["data"])))
+    return batches
+
+
+def test_adaptive_ranges_incremental_index_and_confirmation():
+    chain = LocalChain.shared(threshold=1)
+    with chain.isolated():
+        safe, usdt = chain.contracts["safe"], chain.contracts["usdt"]
+        handler = chain.handler()
+        first_block = chain.w3.eth.block_number + 1
+        batches = execute_batches(chain, handler, 4)
+
+        calls = []
+        ledger = PayoutLedger(":memory:")
+        w3 = limited_web3(chain, 4, calls)
+        indexer = TransferLogIndexer(w3, "sepolia", safe, usdt, ledger, chunk=64, workers=3, confirmations=0,
+                                     start_block=first_block)
+        result = indexer.index()
+        # 两批以上的转账落在同一范围时被拒绝，拆分后全部取回
+        assert indexer.splits > 0 and indexer.chunk < 64
+        assert (result["transfers"], result["transactions"]) == (12, 4)
+        assert result["watermark"] == chain.w3.eth.block_number
+        rows = ledger.payments(safe=safe)
+        assert len(rows) == 12 and all(row["symbol"] == "USDT" and row["decimals"] == 6 for row in rows)
+        assert all(row["safe_tx_hash"] for row in rows)
+
+        for safe_tx_hash, transfers in batches:
+            confirmed = confirm_batch(ledger, "sepolia", safe, safe_tx_hash, transfers)
+            assert confirmed["status"] == "confirmed" and not confirmed["unexpected"]
+        safe_tx_hash, transfers = batches[0]
+        extra = transfers + [{"token": usdt, "to": Account.create().address, "amount": 1}]
+        assert confirm_batch(ledger, "sepolia", safe, safe_tx_hash, extra)["status"] == "incomplete"
+        assert confirm_batch(ledger, "sepolia", safe, "0x" + "00" * 32, transfers)["status"] == "pending"
+
+        # 增量索引只查询水位之后的区块
+        watermark = result["watermark"]
+        execute_batches(chain, handler, 1)
+        calls.clear()
+        result = indexer.index()
+        assert calls and min(calls) > watermark
+        assert (result["transfers"], result["transactions"]) == (3, 1)
+        assert ledger.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0] == 15
+
+
+def test_execution_failure_is_reported_as_failed():
+    chain = LocalChain.shared(threshold=1)
+    with chain.isolated():
+        safe, usdt = chain.contracts["safe"], chain.contracts["usdt"]
+        handler = chain.handler()
+        first_block = chain.w3.eth.block_number + 1
+        # safeTxGas不为0时超过余额的转账不回滚，Safe发出ExecutionFailure并消耗nonce
+        transfer = handler.encode_transfer(Account.create().address, chain.usdt_balance(safe) / 10**6 + 1)
+        batch_tx = handler._build_tx_data(handler.multisend.build_tx_data([transfer]), 0, safe_tx_gas=200_000)
+        safe_tx = handler._build_safe_tx(batch_tx)
+        safe_tx.sign(chain.owners[0].key.hex())
+        tx_hash, _ = safe_tx.execute(chain.owners[0].key.hex(), tx_gas=500_000)
+        chain.w3.eth.wait_for_transaction_receipt(tx_hash)
+        
+        ledger = PayoutLedger(":memory:")
+        TransferLogIndexer(chain.w3, "sepolia", safe, usdt, ledger, confirmations=0, start_block=first_block).index()
+        confirmed = confirm_batch(ledger, "sepolia", safe, batch_tx["safe_tx_hash"], decode_transfers(batch_tx["data"]))
+        assert confirmed["status"] == "failed" and confirmed["tx_hash"] == tx_hash.hex()
+        assert len(confirmed["missing"]) == 1
+
+
+def test_interrupted_index_resumes_from_checkpoint():
+    chain = LocalChain.shared(threshold=1)
+    with chain.isolated():
+        safe, usdt = chain.contracts["safe"], chain.contracts["usdt"]
+        first_block = chain.w3.eth.block_number + 1
+        execute_batches(chain, chain.handler(), 6, per_batch=2)
+        head = chain.w3.eth.block_number
+
+        calls, fail_from = [], [first_block + 12]
+        ledger = PayoutLedger(":memory:")
+        w3 = limited_web3(chain, 100, calls, fail_from)
+        indexer = TransferLogIndexer(w3, "sepolia", safe, usdt, ledger, chunk=4, workers=4, confirmations=0,
+                                     start_block=first_block)
+        with pytest.raises(ValueError):
+            indexer.index()
+        # 水位停在失败范围之前最后一个写入的范围末尾
+        _, watermark = ledger.state("sepolia", safe, LOGS_STREAM)
+        assert first_block + 3 <= watermark < first_block + 12
+
+        fail_from[0] = None
+        calls.clear()
+        result = indexer.index()
+        assert min(calls) == watermark + 1 and result["watermark"] == head
+        assert ledger.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0] == 12
+
+
+if __name__ == "__main__":
+    test_adaptive_ranges_incremental_index_and_confirmation()
+    test_execution_failure_is_reported_as_failed()
+    test_interrupted_index_resumes_from_checkpoint()
+    print("✅ 转账日志索引测试通过")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试SafeLogger：有界去重、时间窗口、惰性格式化和多线程写日志
+"""
+
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from utils.logger import JsonFormatter, _DeferredQueueHandler, logger
+from utils.pipeline import Pipeline, Stage
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.records = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+        self.records.append(record)
+
+
+class captured:
+    """在单例logger上临时挂一个处理器并设置去重参数，退出时恢复"""
+
+    def __init__(self, dedupe_size=100, dedupe_window=0.0, log_format="text"):
+        self.settings = {"dedupe_size": dedupe_size, "dedupe_window": dedupe_window, "log_format": log_format}
+
+    def __enter__(self):
+        self.saved = {key: getattr(logger, key) for key in self.settings}
+        self.saved_messages = logger.logged_messages.copy()
+        for key, value in self.settings.items():
+            setattr(logger, key, value)
+        logger.logged_messages.clear()
+        self.handler = ListHandler()
+        logger.logger.addHandler(self.handler)
+        return self.handler
+
+    def __exit__(self, *exc):
+        logger.logger.removeHandler(self.handler)
+        for key, value in self.saved.items():
+            setattr(logger, key, value)
+        logger.logged_messages.clear()
+        logger.logged_messages.update(self.saved_messages)
+
+
+class CountingArg:
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "arg"
+
+
+def test_dedupe_by_template_and_args():
+    with captured() as handler:
+        logger.info("已签名 %s", "0xaa")
+        logger.info("已签名 %s", "0xaa")
+        logger.info("已签名 %s", "0xbb")
+        logger.info("已签名 %s", "0xaa", repeat_ok=True)
+    assert handler.messages == ["已签名 0xaa", "已签名 0xbb", "已签名 0xaa"]
+
+
+def test_dedupe_is_bounded_lru():
+    with captured(dedupe_size=3) as handler:
+        for i in range(10):
+            logger.info("行 %d", i)
+        assert len(logger.logged_messages) == 3
+        # 最早的消息已被淘汰，可以再次输出；最近的仍然去重
+        logger.info("行 %d", 0)
+        logger.info("行 %d", 9)
+    assert handler.messages[-1] == "行 0"
+    assert handler.messages.count("行 9") == 1
+
+
+def test_dedupe_window_expires():
+    with captured(dedupe_window=0.05) as handler:
+        logger.info("余额不足")
+        logger.info("余额不足")
+        time.sleep(0.06)
+        logger.info("余额不足")
+    assert handler.messages == ["余额不足", "余额不足"]
+
+
+def test_disabled_level_does_not_format():
+    arg = CountingArg()
+    level = logger.logger.level
+    logger.logger.setLevel(logging.INFO)
+    try:
+        with captured() as handler:
+            logger.debug("调试 %s", arg)
+            assert arg.calls == 0
+            logger.info("信息 %s", arg)
+    finally:
+        logger.logger.setLevel(level)
+    assert handler.messages == ["信息 arg"]
+
+
+def test_concurrent_logging_keeps_bound():
+    with captured(dedupe_size=50) as handler:
+        def work(worker):
+            for i in range(200):
+                logger.info("线程 %d 消息 %d", worker, i % 20)
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(logger.logged_messages) <= 50
+    assert len(handler.messages) >= 8 * 20
+
+
+def test_progress_is_rate_limited():
+    interval = logger.progress_interval
+    logger.progress_interval = 60
+    logger._last_progress = float("-inf")
+    try:
+        with captured() as handler:
+            for step in range(1, 1001):
+                logger.progress(step, 1000, "行")
+            for step in range(1, 100):
+                logger.progress(step, None, "行")
+    finally:
+        logger.progress_interval = interval
+    # 第一步和最后一步输出，中间的被限频跳过；进度条宽度固定
+    assert handler.messages == ["[" + " " * 30 + "] 1/1000 行", "[" + "#" * 30 + "] 1000/1000 行"]
+
+
+def test_json_events_carry_correlation_fields():
+    formatter = JsonFormatter()
+    run_id = logger.fields["run_id"]
+    with captured(log_format="json") as handler:
+        logger.set_run_id("run-test")
+        try:
+            with logger.bind(safe="0xSafe", nonce=7):
+                with logger.bind(page_id="page-8412", nonce=None):
+                    logger.error("转账金额无效: %s", -1)
+                # JSON模式下同样的消息带不同字段不去重
+                logger.error("转账金额无效: %s", -1)
+            logger.section("处理结果")
+        finally:
+            logger.set_run_id(run_id)
+    events = [json.loads(formatter.format(record)) for record in handler.records]
+    assert events[0]["message"] == "转账金额无效: -1"
+    assert events[0]["level"] == "error"
+    assert events[0]["run_id"] == "run-test"
+    assert (events[0]["safe"], events[0]["nonce"], events[0]["page_id"]) == ("0xSafe", 7, "page-8412")
+    assert "page_id" not in events[1]
+    # 分节只输出一条事件，没有分隔线
+    assert len(events) == 3
+    assert events[2]["section"] == "处理结果"
+
+
+def test_queued_records_are_formatted_by_listener():
+    records = queue.Queue()
+    handler = _DeferredQueueHandler(records)
+    arg = CountingArg()
+    try:
+        raise ValueError("余额不足")
+    except ValueError:
+        record = logger.logger.makeRecord("safe_app", logging.ERROR, __file__, 1, "执行失败 %s", (arg,),
+                                          sys.exc_info(), extra={"fields": {"nonce": 3}})
+    handler.handle(record)
+    # 调用线程只入队，不格式化消息，参数和异常信息留给监听线程
+    assert arg.calls == 0
+    queued = records.get_nowait()
+    assert queued.args == (arg,) and queued.exc_info is not None
+    event = json.loads(JsonFormatter().format(queued))
+    assert event["message"] == "执行失败 arg" and event["nonce"] == 3
+    assert "ValueError: 余额不足" in event["exception"]
+
+
+def test_pipeline_binds_stage_field():
+    def encode(item):
+        logger.info("编码 %d", item)
+        return item
+
+    with captured() as handler:
+        pipeline = Pipeline([Stage("validate", lambda item: item), Stage("encode", encode, "thread", 4)])
+        assert pipeline.run(range(5)) == list(range(5))
+    assert {record.fields["stage"] for record in handler.records} == {"encode"}
+    assert len(handler.records) == 5
+
+
+if __name__ == "__main__":
+    test_dedupe_by_template_and_args()
+    test_dedupe_is_bounded_lru()
+    test_dedupe_window_expires()
+    test_disabled_level_does_not_format()
+    test_concurrent_logging_keeps_bound()
+    test_progress_is_rate_limited()
+    test_json_events_carry_correlation_fields()
+    test_queued_records_are_formatted_by_listener()
+    test_pipeline_binds_stage_field()
+    logger.flush()
+    print("✅ 日志测试通过")
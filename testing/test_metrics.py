@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试调用统计：端点归类、延迟直方图、运行报告和Prometheus textfile导出
+"""
+
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+
+from utils.metrics import Metrics, endpoint_name, instrument_notion, instrument_session, instrument_web3, metrics
+
+
+class FakeResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class FakeSession:
+    def request(self, method, url, *args, **kwargs):
+        return FakeResponse(404 if "missing" in url else 200, b'{"nonce": 3}')
+
+
+class FakeHttpMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeHttpClient:
+    def send(self, request):
+        return FakeHttpMessage(b'{"results":[],"has_more":false}')
+
+
+class FakeNotion:
+    """与notion_client.Client一样通过self.client (httpx) 发送请求"""
+    
+    def __init__(self):
+        self.client = FakeHttpClient()
+    
+    def request(self, path, method, query=None, body=None, auth=None):
+        self.client.send(FakeHttpMessage(json.dumps(body).encode()))
+        return {"results": [], "has_more": False}
+
+
+class FakeRPCProvider(JSONBaseProvider):
+    """像HTTPProvider一样编码请求、解码原始响应"""
+    
+    response = b'{"jsonrpc":"2.0","id":0,"result":"0xaa36a7"}'
+    
+    def make_request(self, method, params):
+        self.sent = self.encode_rpc_request(method, params)
+        return self.decode_rpc_response(self.response)
+
+
+def test_endpoint_names_collapse_ids():
+    safe = "0x" + "ab" * 20
+    assert endpoint_name("get", f"https://safe.example/api/v1/safes/{safe}/") == "GET /api/v1/safes/{id}/"
+    assert endpoint_name("POST", "/databases/0123456789abcdef0123456789abcdef/query") == "POST /databases/{id}/query"
+
+
+def test_histogram_and_exports():
+    m = Metrics()
+    for seconds in (0.001, 0.2, 0.2, 20):
+        m.record_call("rpc", "eth_call", seconds, bytes_sent=10, bytes_received=5)
+    with m.span("run"):
+        pass
+    m.record_stages({"encode": {"processed": 3, "busy_seconds": 0.5, "wall_seconds": 1.0}})
+    
+    report = m.report()
+    stats = report["calls"]["rpc"]["eth_call"]
+    assert stats["count"] == 4 and stats["bytes_sent"] == 40
+    assert stats["histogram"]["0.005"] == 1 and stats["histogram"]["0.25"] == 2 and stats["histogram"]["+Inf"] == 1
+    assert report["summary"]["rpc"]["count"] == 4
+    assert report["spans"][0]["name"] == "run"
+    
+    text = m.prometheus()
+    assert 'safe_call_duration_seconds_bucket{kind="rpc",name="eth_call",le="+Inf"} 4' in text
+    assert 'safe_stage_seconds{stage="encode",type="busy"} 0.5' in text
+    
+    with tempfile.TemporaryDirectory() as directory:
+        report_file = Path(directory) / "report.json"
+        prometheus_file = Path(directory) / "safe.prom"
+        m.export(str(report_file), str(prometheus_file))
+        assert json.loads(report_file.read_text())["calls"]["rpc"]["eth_call"]["count"] == 4
+        assert prometheus_file.read_text().splitlines()[:-1] == text.splitlines()[:-1]
+
+
+def test_wrapped_clients_record_calls():
+    metrics.reset()
+    session = instrument_session(FakeSession(), "safe_service")
+    session.request("GET", "https://safe.example/api/v1/safes/0x1234/")
+    session.request("GET", "https://safe.example/api/v1/missing/")
+    # 重复包装不会重复计数
+    instrument_session(session, "safe_service").request("GET", "https://safe.example/api/v1/safes/0x1234/")
+    
+    rpc = instrument_session(FakeSession(), "rpc_batch", rpc=True)
+    rpc.request("POST", "http://rpc", json=[{"method": "eth_call"}, {"method": "eth_getCode"}])
+    
+    notion = instrument_notion(FakeNotion())
+    notion.request(path="databases/0123456789abcdef0123456789abcdef/query", method="POST", body={"page_size": 100})
+    
+    provider = FakeRPCProvider()
+    w3 = instrument_web3(Web3(provider))
+    assert w3.eth.chain_id == 11155111
+    
+    calls = metrics.report()["calls"]
+    # web3调用的字节数取自provider编码后的请求和原始响应
+    assert calls["rpc"]["eth_chainId"]["bytes_sent"] == len(provider.sent)
+    assert calls["rpc"]["eth_chainId"]["bytes_received"] == len(FakeRPCProvider.response)
+    assert calls["safe_service"]["GET /api/v1/safes/{id}/"]["count"] == 2
+    assert calls["safe_service"]["GET /api/v1/missing/"]["errors"] == 1
+    assert calls["rpc_batch"]["batch:eth_call,eth_getCode"]["count"] == 1
+    assert calls["notion"]["POST /databases/{id}/query"]["bytes_sent"] == len('{"page_size": 100}')
+    assert calls["notion"]["POST /databases/{id}/query"]["bytes_received"] == 31
+
+
+if __name__ == "__main__":
+    test_endpoint_names_collapse_ids()
+    test_histogram_and_exports()
+    test_wrapped_clients_record_calls()
+    print("调用统计测试通过")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试网络注册表：首次从交易服务发现部署信息并校验合约代码，
+写入带版本的磁盘缓存，之后的运行不再访问交易服务
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from safe.networks import NetworkRegistry, REGISTRY_VERSION, select_multisend_call_only
+from local_chain import build_local_chain
+
+
+def serve_about(multisend_address: str):
+    """启动只实现 /about/deployments/ 和 /about/singletons/ 的本地交易服务，返回 (server, 请求记录)"""
+    requests_seen = []
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            if self.path == "/api/v1/about/deployments/":
+                body = [
+                    {"version": "1.3.0", "contracts": [{"contractName": "MultiSendCallOnly", "address": multisend_address}]},
+                    {"version": "1.4.1", "contracts": [{"contractName": "MultiSendCallOnly", "address": multisend_address},
+                                                       {"contractName": "SafeL2", "address": None}]},
+                ]
+            elif self.path == "/api/v1/about/singletons/":
+                body = [{"address": multisend_address, "version": "1.4.1", "deployer": "", "deployedBlockNumber": 0,
+                         "lastIndexedBlockNumber": 0, "l2": False}]
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, requests_seen
+
+
+def test_discovery_is_verified_and_cached():
+    ethereum_client, contracts, owners = build_local_chain(threshold=1)
+    w3 = ethereum_client.w3
+    server, requests_seen = serve_about(contracts["multisend"])
+    os.environ["SAFE_SERVICE_URL_LOCALNET"] = f"http://127.0.0.1:{server.server_port}"
+    
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_file = str(Path(cache_dir) / "networks.json")
+            info = NetworkRegistry(cache_file).get("localnet", w3)
+            assert info["chain_id"] == w3.eth.chain_id
+            assert info["source"] == "service"
+            assert select_multisend_call_only(info, "1.3.0") == contracts["multisend"]
+            assert len(requests_seen) == 2
+            
+            # 第二次运行只读磁盘缓存
+            server.shutdown()
+            info = NetworkRegistry(cache_file).get("localnet", w3)
+            assert info["multisend_call_only"]["1.4.1"] == contracts["multisend"]
+            assert len(requests_seen) == 2
+            
+            # 缓存版本变化时重新发现；服务不可用且无内置表时报错
+            cached = json.loads(Path(cache_file).read_text())
+            cached["version"] = REGISTRY_VERSION - 1
+            Path(cache_file).write_text(json.dumps(cached))
+            try:
+                NetworkRegistry(cache_file).get("localnet", w3)
+                raise AssertionError("缓存失效且服务不可用时应当报错")
+            except ValueError as e:
+                assert "不支持的网络" in str(e)
+    finally:
+        del os.environ["SAFE_SERVICE_URL_LOCALNET"]
+
+
+def test_bundled_fallback_requires_contract_code():
+    ethereum_client, contracts, owners = build_local_chain(threshold=1)
+    os.environ["SAFE_SERVICE_URL_SEPOLIA"] = "http://127.0.0.1:1"
+    try:
+        registry = NetworkRegistry(cache_file="")
+        # 不传w3时直接返回内置表，不产生网络I/O
+        assert registry.get("sepolia")["chain_id"] == 11155111
+        # 本地链上没有内置地址的合约代码，链ID也不一致，首次填充时校验失败
+        try:
+            registry.get("sepolia", ethereum_client.w3)
+            raise AssertionError("校验失败时应当报错")
+        except ValueError as e:
+            assert "不一致" in str(e)
+    finally:
+        del os.environ["SAFE_SERVICE_URL_SEPOLIA"]
+
+
+if __name__ == "__main__":
+    test_discovery_is_verified_and_cached()
+    test_bundled_fallback_requires_contract_code()
+    print("网络注册表测试通过")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试支付状态写回Notion：同一页面的更新合并、写出速率限制、429重试，
+以及中断后从日志恢复未写出的更新
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from local_notion import LocalNotion, SyntheticDatabase, page_id
+from notion.client import STATUS_EXECUTED, STATUS_PROPOSED, NotionClient
+from notion.writeback import NotionWriteback
+
+
+def notion_client(service):
+    os.environ["NOTION_BASE_URL"] = service.url
+    os.environ["NOTION_DATABASE_ID"] = service.database.database_id
+    try:
+        return NotionClient()
+    finally:
+        for name in ("NOTION_BASE_URL", "NOTION_DATABASE_ID"):
+            os.environ.pop(name, None)
+
+
+def written(database, index):
+    """页面上写回的 (safeTxHash, nonce, 状态, 执行交易哈希)"""
+    properties = database.page(index)["properties"]
+    text = lambda prop: "".join(part["plain_text"] for part in prop["rich_text"])
+    return (text(properties["Safe交易哈希"]), properties["Nonce"]["number"],
+            (properties["状态"]["select"] or {}).get("name"), text(properties["执行交易哈希"]))
+
+
+def updates(service):
+    return [request for request in service.requests if request["operation"] == "pages.update"]
+
+
+def test_updates_are_coalesced_and_rate_limited():
+    database = SyntheticDatabase(80, seed=2)
+    with LocalNotion(database, rate_limit=20, burst=5) as service, tempfile.TemporaryDirectory() as work_dir:
+        journal = Path(work_dir) / "writeback.jsonl"
+        writeback = NotionWriteback(notion_client(service), str(journal), workers=4, rate=15)
+        for index in range(40):
+            writeback.submit(page_id(index), safe_tx_hash=f"0x{index:064x}", nonce=index // 10,
+                             status=STATUS_PROPOSED)
+        # 执行后的状态与尚未写出的提议状态合并为一次更新
+        for index in range(20):
+            writeback.submit(page_id(index), status=STATUS_EXECUTED, tx_hash=f"0x{index + 1000:064x}")
+
+        started = time.perf_counter()
+        writeback.start().close()
+        assert time.perf_counter() - started >= 39 / 15
+        assert len(updates(service)) == 40 and all(request["status"] == 200 for request in updates(service))
+        assert written(database, 3) == (f"0x{3:064x}", 0, STATUS_EXECUTED, f"0x{1003:064x}")
+        assert written(database, 33) == (f"0x{33:064x}", 3, STATUS_PROPOSED, "")
+        assert written(database, 50) == ("", None, None, "")
+        assert not journal.exists()
+
+
+def test_interrupted_writeback_resumes_from_journal():
+    database = SyntheticDatabase(60, seed=4)
+    with LocalNotion(database, rate_limit=20, burst=2) as service, tempfile.TemporaryDirectory() as work_dir:
+        journal = str(Path(work_dir) / "writeback.jsonl")
+        client = notion_client(service)
+        writeback = NotionWriteback(client, journal, workers=2, rate=10).start()
+        for index in range(30):
+            writeback.submit(page_id(index), safe_tx_hash=f"0x{index:064x}", nonce=7, status=STATUS_PROPOSED)
+        time.sleep(0.5)
+        # 模拟中断：只等待在途的请求，剩余的更新留在日志中
+        writeback.close(wait=False)
+        done = writeback.written
+        assert 0 < done < 30
+
+        # 重新创建时恢复剩余的更新；不限写出速率时被限流的请求按Retry-After重试
+        resumed = NotionWriteback(client, journal, workers=4, rate=0)
+        resumed.submit(page_id(0), status=STATUS_EXECUTED, tx_hash="0x" + "ab" * 32)
+        resumed.submit("00000000-0000-4000-8000-00000000ffff", status=STATUS_EXECUTED)
+        resumed.start().close()
+        assert resumed.written == 30 - done + 1 and resumed.failed == 1
+        assert any(request["status"] == 429 for request in updates(service))
+        assert all(written(database, index)[:3] == (f"0x{index:064x}", 7, STATUS_PROPOSED) for index in range(1, 30))
+        assert written(database, 0) == (f"0x{0:064x}", 7, STATUS_EXECUTED, "0x" + "ab" * 32)
+        # 全部写出（包括无法写入而放弃的）后删除日志
+        assert not Path(journal).exists()
+
+
+if __name__ == "__main__":
+    test_updates_are_coalesced_and_rate_limited()
+    test_interrupted_writeback_resumes_from_journal()
+    print("✅ Notion写回测试通过")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+在进程内EVM上测试多Safe编排：拉取的交易按 (网络, Safe) 分组，
+以流水线方式处理，同一网络共用一个EthereumClient
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from eth_account import Account
+
+from notion.client import STATUS_EXECUTED
+from orchestrator import SafeOrchestrator
+from local_chain import build_local_chain, create_safe, make_handler
+
+
+class LocalOrchestrator(SafeOrchestrator):
+    """使用进程内EVM的编排器"""
+    
+    def __init__(self, ethereum_client, contracts, owners):
+        super().__init__(max_workers=4)
+        self.default_network = "sepolia"
+        self.default_safe = contracts["safe"]
+        self._clients["sepolia"] = ethereum_client
+        self.contracts = contracts
+        self.owners = owners
+    
+    def create_handler(self, network, safe_address):
+        return make_handler(
+            self.get_ethereum_client(network),
+            {**self.contracts, "safe": safe_address},
+            self.owners,
+        )
+
+
+class RecordingWriteback:
+    """记录提交给写回队列的更新"""
+    
+    def __init__(self):
+        self.submitted = {}
+    
+    def submit(self, page_id, **fields):
+        self.submitted[page_id] = fields
+
+
+def test_rows_are_routed_and_processed_per_safe():
+    ethereum_client, contracts, owners = build_local_chain(threshold=1)
+    other_safe = create_safe(ethereum_client, contracts, owners[:2], threshold=2)
+    orchestrator = LocalOrchestrator(ethereum_client, contracts, owners[:2])
+    orchestrator.writeback = RecordingWriteback()
+    
+    rows = []
+    for i in range(6):
+        row = {"address": Account.create().address, "amount": 1, "page_id": f"page-{i}"}
+        if i % 2:
+            row["safe"] = other_safe.lower()
+        rows.append(row)
+    rows.append({"address": Account.create().address, "amount": 1, "network": "mainnet"})
+    
+    groups = orchestrator.group_transactions(rows)
+    assert sorted(len(group) for group in groups.values()) == [1, 3, 3]
+    
+    results = {(result["network"], result["safe"]): result for result in orchestrator.run(rows)}
+    # mainnet未配置客户端，该组失败但不影响其他组
+    assert results[("mainnet", contracts["safe"])]["error"]
+    assert len(results[("sepolia", contracts["safe"])]["tx_hashes"]) == 1
+    assert len(results[("sepolia", other_safe)]["tx_hashes"]) == 1
+    
+    usdt = make_handler(ethereum_client, contracts, owners).usdt_contract
+    for row in rows[:6]:
+        assert usdt.functions.balanceOf(row["address"]).call() == 10**6
+    
+    # 执行成功的行提交写回：safeTxHash、nonce、状态和执行交易哈希
+    submitted = orchestrator.writeback.submitted
+    assert sorted(submitted) == [f"page-{i}" for i in range(6)]
+    assert all(fields["status"] == STATUS_EXECUTED and int(fields["nonce"]) == 0 and fields["tx_hash"]
+               for fields in submitted.values())
+    assert submitted["page-1"]["tx_hash"] in results[("sepolia", other_safe)]["tx_hashes"]
+
+
+def test_streamed_rows_are_split_with_consecutive_nonces():
+    ethereum_client, contracts, owners = build_local_chain(threshold=1)
+    orchestrator = LocalOrchestrator(ethereum_client, contracts, owners[:1])
+    create_handler = orchestrator.create_handler
+    
+    estimating = {"now": 0, "max": 0}
+    lock = threading.Lock()
+    
+    def split_handler(network, safe_address):
+        handler = create_handler(network, safe_address)
+        handler.max_transfers_per_tx = 1
+        estimate = handler.gas_estimator._estimate
+        
+        def slow_estimate(*args):
+            with lock:
+                estimating["now"] += 1
+                estimating["max"] = max(estimating["max"], estimating["now"])
+            time.sleep(0.2)
+            try:
+                return estimate(*args)
+            finally:
+                with lock:
+                    estimating["now"] -= 1
+        handler.gas_estimator._estimate = slow_estimate
+        return handler
+    orchestrator.create_handler = split_handler
+    
+    rows = [{"address": Account.create().address, "amount": 1} for _ in range(6)]
+    # 数据源是生成器，与Notion分页拉取一致；build/sign/propose在线程池中执行，同一Safe仍按nonce顺序
+    results = orchestrator.run(row for row in rows)
+    assert len(results) == 1 and results[0]["count"] == 6 and not results[0]["error"]
+    assert len(results[0]["tx_hashes"]) == 6
+    # 同一Safe的多笔交易并行估算safeTxGas
+    assert estimating["max"] > 1
+    
+    handler = make_handler(ethereum_client, contracts, owners)
+    assert handler.safe.retrieve_nonce() == 6
+    for row in rows:
+        assert handler.usdt_contract.functions.balanceOf(row["address"]).call() == 10**6
+
+
+if __name__ == "__main__":
+    test_rows_are_routed_and_processed_per_safe()
+    test_streamed_rows_are_split_with_consecutive_nonces()
+    print("多Safe编排测试通过")
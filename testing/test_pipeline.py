@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试流水线引擎：有界队列背压、保持顺序的并发执行器、错误传播，
+以及Notion分页拉取的续跑
+"""
+
+import asyncio
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+import main
+from utils.journal import RunJournal
+from utils.pipeline import Pipeline, PipelineError, Stage
+
+
+def test_executors_preserve_order():
+    async def double(x):
+        await asyncio.sleep(0.001 * (x % 3))
+        return x * 2
+    
+    def slow_inc(x):
+        time.sleep(0.001 * (x % 5))
+        return x + 1
+    
+    pipeline = Pipeline([
+        Stage("inc", slow_inc, executor="thread", workers=4),
+        Stage("double", double, executor="asyncio", workers=4),
+        Stage("odd", lambda x: x if x % 4 else None),
+        Stage("pairs", lambda items: (sum(pair) for pair in zip(items, items)), stream=True),
+    ], queue_size=2)
+    
+    expected = [x for x in ((i + 1) * 2 for i in range(100)) if x % 4]
+    expected = [a + b for a, b in zip(expected[::2], expected[1::2])]
+    assert pipeline.run(range(100)) == expected
+    assert pipeline.stats()["inc"]["processed"] == 100
+
+
+def test_keyed_stage_is_serial_per_key():
+    running, order = {}, {}
+    lock = threading.Lock()
+    
+    def nonce(item):
+        key, index = item
+        with lock:
+            # 同一键不会同时有两个元素在处理
+            assert not running.get(key)
+            running[key] = True
+        time.sleep(0.001 * (index % 3))
+        with lock:
+            order.setdefault(key, []).append(index)
+            running[key] = False
+        return item
+    
+    items = [(i % 3, i) for i in range(60)]
+    stage = Stage("build", nonce, executor="thread", workers=4, key=lambda item: item[0])
+    pipeline = Pipeline([stage], queue_size=2)
+    assert pipeline.run(items) == items
+    assert all(order[key] == [i for k, i in items if k == key] for key in range(3))
+    assert pipeline.stats()["build"]["processed"] == 60
+    
+    # 按键串行的阶段不能改用asyncio
+    try:
+        pipeline.configure("build=asyncio:4")
+        raise AssertionError("应该拒绝asyncio执行器")
+    except ValueError as e:
+        assert "build" in str(e)
+
+
+def test_asyncio_executor_runs_plain_functions():
+    pipeline = Pipeline([Stage("resolve", lambda x: x + 1)]).configure("resolve=asyncio:4")
+    assert pipeline.run(range(50)) == list(range(1, 51))
+    assert pipeline.stats()["resolve"]["processed"] == 50
+
+
+def test_bounded_queues_apply_back_pressure():
+    consumed = []
+    release = threading.Event()
+    
+    def source():
+        for i in range(1000):
+            consumed.append(i)
+            yield i
+    
+    def blocked(x):
+        release.wait()
+        return x
+    
+    pipeline = Pipeline([Stage("ingest", lambda items: items, stream=True), Stage("sink", blocked)], queue_size=4)
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(pipeline.run(source())))
+    thread.start()
+    time.sleep(0.3)
+    # 下游阻塞时上游最多领先队列深度
+    assert len(consumed) <= 4 + 2
+    release.set()
+    thread.join()
+    assert results == list(range(1000))
+
+
+def test_stage_error_stops_pipeline():
+    def fail(x):
+        if x == 50:
+            raise ValueError("坏数据")
+        return x
+    
+    pipeline = Pipeline([Stage("check", fail, executor="thread", workers=2), Stage("sink", lambda x: x)], queue_size=2)
+    try:
+        pipeline.run(range(10**6))
+        raise AssertionError("应该抛出PipelineError")
+    except PipelineError as e:
+        assert e.stage == "check" and "坏数据" in str(e)
+
+
+def test_executor_override():
+    pipeline = Pipeline([Stage("resolve", lambda x: x)]).configure("resolve=thread:3")
+    assert (pipeline.stages[0].executor, pipeline.stages[0].workers) == ("thread", 3)
+
+
+def test_fetch_resumes_from_last_recorded_page():
+    class FakeNotion:
+        def iter_approved_pages(self, cursor):
+            assert cursor == "cursor-1"
+            yield [{"address": "0x2", "amount": 2}], None
+    
+    original = main.NotionClient
+    main.NotionClient = FakeNotion
+    try:
+        with tempfile.TemporaryDirectory() as journal_dir:
+            journal = RunJournal.open(journal_dir)
+            journal.record("fetch", "page-0", {
+                "rows": [{"address": "0x1", "amount": 1}], "next_cursor": "cursor-1", "snapshot_hash": "a",
+            })
+            rows = list(main.fetch_transactions(RunJournal.open(journal_dir)))
+            assert [row["address"] for row in rows] == ["0x1", "0x2"]
+            
+            # 全部页都已记录时不再访问Notion
+            main.NotionClient = None
+            assert len(list(main.fetch_transactions(RunJournal.open(journal_dir)))) == 2
+    finally:
+        main.NotionClient = original
+
+
+if __name__ == "__main__":
+    test_executors_preserve_order()
+    test_keyed_stage_is_serial_per_key()
+    test_asyncio_executor_runs_plain_functions()
+    test_bounded_queues_apply_back_pressure()
+    test_stage_error_stops_pipeline()
+    test_executor_override()
+    test_fetch_resumes_from_last_recorded_page()
+    print("流水线测试通过")
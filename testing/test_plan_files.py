@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试计划文件：plan模式在进程内EVM上生成确定性的计划文件，
+离线签名后再提议，签名可以直接在链上执行
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from eth_account import Account
+from hexbytes import HexBytes
+
+from safe.plan import PlanFile, PlanWriter, load_signatures, sign_plan
+from local_chain import build_local_chain, make_handler
+from test_orchestrator import LocalOrchestrator
+
+
+def test_plan_sign_and_propose():
+    ethereum_client, contracts, owners = build_local_chain(threshold=2)
+    rows = [{"address": Account.create().address, "amount": 1 + i, "page_id": f"page-{i}"} for i in range(3)]
+    
+    with tempfile.TemporaryDirectory() as directory:
+        # 计划不需要私钥，两次生成的文件逐字节相同
+        paths = [Path(directory) / "plan.jsonl", Path(directory) / "again.jsonl"]
+        for path in paths:
+            orchestrator = LocalOrchestrator(ethereum_client, contracts, [])
+            writer = PlanWriter(path)
+            results = orchestrator.plan(iter(rows), writer)
+            writer.close()
+            assert not results[0]["error"] and len(results[0]["tx_hashes"]) == 1
+        assert paths[0].read_bytes() == paths[1].read_bytes()
+        
+        plan = PlanFile(paths[0])
+        plan.verify()
+        assert plan.end["rows"] == 3 and plan.end["safe_txs"] == 1
+        assert [row["amount_base"] for row in plan.rows()] == [1_000_000, 2_000_000, 3_000_000]
+        record = next(plan.safe_txs())
+        assert [transfer["to"] for transfer in record["transfers"]] == [row["address"] for row in rows]
+        
+        assert record["owners"] == [owner.address for owner in owners]
+        
+        # 离线签名，重复签名会跳过；不是所有者的私钥不签名
+        outsider = Account.create()
+        keys = [outsider.key.hex()] + [owner.key.hex() for owner in owners[:2]]
+        assert sign_plan(paths[0], keys) == 2
+        assert sign_plan(paths[0], keys) == 0
+        assert outsider.address not in load_signatures(paths[0])[record["tx"]["safe_tx_hash"]]
+        
+        # 提议时使用签名文件中的全部签名
+        proposed = []
+        orchestrator = LocalOrchestrator(ethereum_client, contracts, [])
+        create_handler = orchestrator.create_handler
+        
+        def recording_handler(network, safe_address):
+            handler = create_handler(network, safe_address)
+            handler.is_proposed = lambda tx: False
+            handler.propose_transaction = lambda tx, signature: proposed.append((tx, signature))
+            return handler
+        orchestrator.create_handler = recording_handler
+        
+        # 签名文件中混入的非所有者签名在提议时被过滤
+        signatures = load_signatures(paths[0])
+        safe_tx_hash = record["tx"]["safe_tx_hash"]
+        signatures[safe_tx_hash][outsider.address] = outsider.signHash(HexBytes(safe_tx_hash)).signature.hex()
+        results = orchestrator.propose_plan(plan, signatures)
+        assert not results[0]["error"] and len(proposed) == 1
+        assert len(HexBytes(proposed[0][1])) == 65 * 2
+        
+        # 提议的签名满足阈值，可以直接在链上执行
+        handler = make_handler(ethereum_client, contracts, owners[:1])
+        safe_tx = handler._build_safe_tx(proposed[0][0])
+        safe_tx.signatures = HexBytes(proposed[0][1])
+        tx_hash, _ = safe_tx.execute(owners[0].key.hex())
+        handler.w3.eth.wait_for_transaction_receipt(tx_hash)
+        for row in rows:
+            assert handler.usdt_contract.functions.balanceOf(row["address"]).call() == row["amount"] * 10**6
+        
+        # 被修改的计划无法通过校验
+        content = paths[0].read_bytes().replace(b'"amount":1,', b'"amount":9,')
+        paths[0].write_bytes(content)
+        try:
+            PlanFile(paths[0]).verify()
+            raise AssertionError("修改后的计划应该校验失败")
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    test_plan_sign_and_propose()
+    print("计划文件测试通过")
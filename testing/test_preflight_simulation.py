@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+在进程内EVM上测试预执行模拟：整批回滚时并行二分定位失败的行，
+按模拟模式报告或去掉这些行
+"""
+
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from eth_account import Account
+from hexbytes import HexBytes
+from safe_eth.safe.multi_send import MultiSendOperation, MultiSendTx
+
+from safe.simulation import BatchSimulator
+from local_chain import LocalChain
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+
+def make_rows(count: int, bad_rows: set):
+    """生成count行转账，bad_rows中的行转给零地址（ERC20会回滚）"""
+    return [
+        {
+            "address": ZERO_ADDRESS if i in bad_rows else Account.create().address,
+            "amount": 1,
+            "page_id": f"page-{i}",
+        }
+        for i in range(count)
+    ]
+
+
+def test_bisection_finds_failing_rows():
+    # 阈值为1时不需要state override，eth-tester也能模拟
+    chain = LocalChain.shared(threshold=1)
+    with chain.isolated():
+        handler = chain.handler(chain.owners[:1], execution_mode="propose")
+        
+        rows = make_rows(16, {3, 11})
+        try:
+            handler.prepare_batch_transfers(rows)
+            raise AssertionError("report模式下应当中止")
+        except Exception as e:
+            assert "2 行会导致整批交易回滚" in str(e)
+        
+        handler.simulation_mode = "drop"
+        batch_tx = handler.prepare_batch_transfers(rows)
+        handler.execution_mode = "auto"
+        handler.execute_transaction(batch_tx)
+        for i, row in enumerate(rows):
+            if i not in (3, 11):
+                assert chain.usdt_balance(row["address"]) == 10**6
+
+
+def test_combination_failure_uses_prefix_search():
+    handler = LocalChain.shared(threshold=1).handler()
+    
+    # Safe余额为100万USDT，每笔40万：任意一半都能成功，整批在第3笔时超出余额
+    transfer = handler.usdt_contract.functions.transfer
+    multi_send_txs = [
+        MultiSendTx(
+            MultiSendOperation.CALL,
+            handler.usdt_contract.address,
+            0,
+            HexBytes(transfer(Account.create().address, 400_000 * 10**6).build_transaction(
+                {"gas": 100000, "gasPrice": 0, "nonce": 0, "chainId": 1}
+            )["data"]),
+        )
+        for _ in range(4)
+    ]
+    
+    failures = BatchSimulator(handler, max_workers=4).find_failing_rows(multi_send_txs)
+    assert list(failures) == [2]
+    assert failures[2].startswith("组合失败")
+
+
+if __name__ == "__main__":
+    test_bisection_finds_failing_rows()
+    test_combination_failure_uses_prefix_search()
+    print("预执行模拟测试通过")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试采样分析器：按线程归类阶段的折叠栈输出，以及按阶段函数汇总的分配排行
+"""
+
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from utils.profiler import SamplingProfiler, profile, thread_stage
+
+
+def encode_rows(n):
+    # 保留分配结果，让峰值快照中能看到这个函数
+    return [f"{i:064x}".encode() * 4 for i in range(n)]
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    rows = []
+    while time.perf_counter() < deadline:
+        rows = encode_rows(2000)
+    return rows
+
+
+def test_thread_names_map_to_stages():
+    assert thread_stage("MainThread") == "main"
+    assert thread_stage("pipeline-resolve") == "resolve"
+    assert thread_stage("gas_3") == "gas"
+    assert thread_stage("Thread-7 (worker)") == "other"
+
+
+def test_profile_writes_collapsed_stacks_and_allocations():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        profiler = SamplingProfiler(interval=0.001, snapshot_interval=0.05,
+                                    stage_functions={"encode": encode_rows})
+        profiler.start()
+        kept = []
+        worker = threading.Thread(target=lambda: kept.append(busy(0.3)), name="pipeline-encode")
+        worker.start()
+        worker.join()
+        profiler.stop()
+        directory = profiler.write(temp_dir)
+
+        lines = (directory / "cpu.collapsed").read_text().splitlines()
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            assert int(count) > 0
+            assert ";" in stack
+        # 工作线程的采样归入encode阶段，并能看到调用的函数
+        encode_stacks = [line for line in lines if line.startswith("encode;")]
+        assert any("encode_rows (test_profiler.py:" in line for line in encode_stacks)
+        assert profiler.stage_samples()["encode"] > 0
+
+        allocations = profiler.top_allocations()
+        assert "encode" in allocations
+        assert any("test_profiler.py" in site for site, _, _ in allocations["encode"])
+        assert "[encode]" in (directory / "allocations.txt").read_text()
+
+
+def test_disabled_profile_does_nothing():
+    with profile(False) as profiler:
+        assert profiler is None
+
+
+if __name__ == "__main__":
+    test_thread_names_map_to_stages()
+    test_profile_writes_collapsed_stacks_and_allocations()
+    test_disabled_profile_does_nothing()
+    print("✅ 采样分析器测试通过")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试Notion行与链上转账的对账：匹配、缺失、重复、多付和少付的分类，
+以及多年历史一次扫描时窗口内存保持有界
+"""
+
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from local_notion import LocalNotion, SyntheticDatabase
+from local_safe_service import LocalSafeService
+from notion.client import NotionClient
+from safe.history import PayoutLedger, SafeHistorySync
+from safe.reconcile import Reconciler, parse_time, reconcile
+
+SAFE = "0x" + "5a" * 20
+USDT = "0x" + "7e" * 20
+ENV = {"USDT_CONTRACT": USDT, "NETWORK": "sepolia"}
+
+
+def set_env(values):
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    return previous
+
+
+def restore_env(previous):
+    for name, value in previous.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+def test_reconcile_notion_rows_against_synced_transfers():
+    database = SyntheticDatabase(300, seed=5, unapproved=0.05, other_signer=0, other_month=0.1,
+                                 early=0.05, malformed=0)
+    previous = set_env(ENV)
+    try:
+        with LocalNotion(database, rate_limit=0) as notion, LocalSafeService(chain_id=11155111) as service:
+            set_env({"NOTION_BASE_URL": notion.url, "NOTION_DATABASE_ID": database.database_id,
+                     "NOTION_PAGE_SIZE": "40", "SAFE_SERVICE_URL_SEPOLIA": service.url})
+            rows = list(NotionClient().iter_payout_rows())
+            # 所有月份的已审核行按创建时间升序返回，包括2月之前创建的
+            assert [row["created_time"] for row in rows] == sorted(row["created_time"] for row in rows)
+            assert len({row["created_time"][:7] for row in rows}) == 2
+
+            expected = {"matched": 0, "missing": 0, "duplicated": 0, "over_paid": 0, "unexpected": 1}
+            duplicates = []
+            for start in range(0, len(rows), 10):
+                batch = []
+                for index, row in enumerate(rows[start:start + 10], start):
+                    value = int(row["amount"] * 10**6)
+                    if index % 37 == 5:
+                        expected["missing"] += 1
+                        continue
+                    if index % 41 == 7:
+                        expected["over_paid"] += 1
+                        value += 10**6
+                    else:
+                        expected["matched"] += 1
+                        if index % 53 == 11:
+                            expected["duplicated"] += 1
+                            duplicates.append((row["address"], value))
+                    batch.append((row["address"], value))
+                not_before = parse_time(rows[min(start + 9, len(rows) - 1)]["created_time"]) + timedelta(minutes=1)
+                service.add_payouts(SAFE, USDT, batch, not_before=not_before)
+            service.add_payouts(SAFE, USDT, duplicates + [("0x" + "99" * 20, 10**6)])
+
+            with tempfile.TemporaryDirectory() as work_dir:
+                ledger = PayoutLedger(":memory:")
+                SafeHistorySync("sepolia", SAFE, ledger, page_size=100).sync()
+                output = Path(work_dir) / "reconcile.jsonl"
+                # 窗口结束后仍未支付的行为missing
+                result = reconcile(NotionClient().iter_payout_rows(), ledger.iter_payments(safe=SAFE, token=USDT),
+                                   output=str(output), as_of=datetime(2026, 1, 1, tzinfo=timezone.utc))
+                assert result["counts"] == expected
+                records = [json.loads(line) for line in output.read_text().splitlines()]
+                assert len(records) == sum(expected.values())
+                matched = next(record for record in records if record["category"] == "matched")
+                assert matched["page_id"] and matched["nonce"] is not None and matched["safe_tx_hash"]
+
+                # 窗口还没有结束的未支付行为pending
+                result = reconcile(NotionClient().iter_payout_rows(), ledger.iter_payments(safe=SAFE, token=USDT),
+                                   output=str(output))
+                assert result["counts"]["pending"] == expected["missing"] and "missing" not in result["counts"]
+    finally:
+        restore_env(previous)
+        for name in ("NOTION_BASE_URL", "NOTION_DATABASE_ID", "NOTION_PAGE_SIZE", "SAFE_SERVICE_URL_SEPOLIA"):
+            os.environ.pop(name, None)
+
+
+def test_years_of_history_in_bounded_window():
+    previous = set_env(ENV)
+    try:
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        count = 3 * 365 * 24
+
+        def recipient(index):
+            return "0x" + f"{index % 500:040x}"
+
+        def rows():
+            for index in range(count):
+                yield {"address": recipient(index), "amount": 1 + index % 7, "page_id": str(index),
+                       "created_time": (start + timedelta(hours=index)).isoformat()}
+
+        def transfers():
+            for index in range(count):
+                value = (1 + index % 7) * 10**6
+                if index == 10:
+                    value -= 1
+                yield {"network": "sepolia", "recipient": recipient(index), "token": USDT, "value": str(value),
+                       "execution_date": (start + timedelta(hours=index, minutes=30)).isoformat()}
+
+        categories = {}
+        reconciler = Reconciler(window=timedelta(days=7))
+        counts = reconciler.run(rows(), transfers(), lambda category, record: categories.setdefault(category, record))
+        assert counts == {"matched": count - 1, "under_paid": 1}
+        assert categories["under_paid"]["page_id"] == "10"
+        # 窗口内最多保留7天的行
+        assert reconciler.peak_window <= 7 * 24 + 1
+
+        # ENS名称没有解析函数时单独归类，提供解析函数后参与匹配
+        ens_rows = [{"address": "alice.eth", "amount": 2.5, "created_time": start.isoformat()}]
+        payment = [{"network": "sepolia", "recipient": recipient(1), "token": USDT, "value": "2500000",
+                    "execution_date": (start + timedelta(days=1)).isoformat()}]
+        assert Reconciler().run(ens_rows, payment, lambda *_: None) == {"unresolved": 1, "unexpected": 1}
+        resolved = Reconciler(resolve=lambda name: recipient(1)).run(ens_rows, payment, lambda *_: None)
+        assert resolved == {"matched": 1}
+    finally:
+        restore_env(previous)
+
+
+if __name__ == "__main__":
+    test_reconcile_notion_rows_against_synced_transfers()
+    test_years_of_history_in_bounded_window()
+    print("✅ 对账测试通过")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试RPC结果缓存：固定区块的读请求和已部署合约代码写入磁盘并在重新运行时复用，
+latest结果按TTL过期并在发送交易后失效，回滚的调用不缓存
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from web3 import EthereumTesterProvider, Web3
+from web3.exceptions import ContractLogicError
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from local_chain import LocalChain, revert_as_contract_logic_error
+from safe.rpc_cache import RPCCache, install_rpc_cache
+from safe_eth.eth.contracts import get_erc20_contract
+
+
+def cached_web3(chain: LocalChain, cache: RPCCache) -> Web3:
+    w3 = Web3(EthereumTesterProvider(chain.tester))
+    w3.middleware_onion.add(revert_as_contract_logic_error)
+    install_rpc_cache(w3, cache)
+    return w3
+
+
+def test_pinned_reads_and_code_persist_across_runs():
+    chain = LocalChain.shared()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = RPCCache(cache_dir, ttl=0)
+        w3 = cached_web3(chain, cache)
+        code = w3.eth.get_code(chain.contracts["singleton"])
+        assert w3.eth.get_code(chain.contracts["singleton"]) == code and len(code) > 0
+        token = get_erc20_contract(w3, chain.contracts["usdt"])
+        block = w3.eth.block_number
+        balance = token.functions.balanceOf(chain.contracts["safe"]).call(block_identifier=block)
+        assert token.functions.balanceOf(chain.contracts["safe"]).call(block_identifier=block) == balance
+        assert (cache.hits, cache.misses) == (2, 2)
+        # ttl为0时latest读请求直接发出，不计入缓存
+        token.functions.balanceOf(chain.contracts["safe"]).call()
+        assert (cache.hits, cache.misses) == (2, 2)
+        assert len(list(Path(cache_dir).glob("*/*.json"))) == 2
+
+        # 新进程（新的缓存对象）从磁盘读取
+        rerun = RPCCache(cache_dir, ttl=0)
+        w3 = cached_web3(chain, rerun)
+        assert w3.eth.get_code(chain.contracts["singleton"]) == code
+        token = get_erc20_contract(w3, chain.contracts["usdt"])
+        assert token.functions.balanceOf(chain.contracts["safe"]).call(block_identifier=block) == balance
+        assert (rerun.hits, rerun.misses) == (2, 0)
+
+        # 尚未部署代码的地址不永久缓存
+        empty = "0x" + "11" * 20
+        assert w3.eth.get_code(empty) == b""
+        assert w3.eth.get_code(empty) == b"" and rerun.misses == 2
+
+
+def test_latest_reads_expire_and_are_invalidated_by_writes():
+    chain = LocalChain.shared()
+    cache = RPCCache("", ttl=60)
+    w3 = cached_web3(chain, cache)
+    token = get_erc20_contract(w3, chain.contracts["usdt"])
+    recipient = "0x" + "22" * 20
+    with chain.isolated():
+        assert token.functions.balanceOf(recipient).call() == 0
+        assert token.functions.balanceOf(recipient).call() == 0 and cache.hits == 1
+        # 经过同一provider发送交易后，latest结果失效
+        token.functions.transfer(recipient, 5).transact({"from": chain.deployer.address})
+        assert token.functions.balanceOf(recipient).call() == 5
+
+    cache.ttl = 0.05
+    cache.invalidate()
+    token.functions.balanceOf(recipient).call()
+    time.sleep(0.1)
+    hits = cache.hits
+    assert token.functions.balanceOf(recipient).call() == 0 and cache.hits == hits
+
+    # 回滚的调用不缓存
+    misses = cache.misses
+    for _ in range(2):
+        try:
+            token.functions.transfer(recipient, 10**30).call({"from": chain.owners[0].address})
+        except ContractLogicError:
+            pass
+    assert cache.misses == misses + 2
+
+
+if __name__ == "__main__":
+    test_pinned_reads_and_code_persist_across_runs()
+    test_latest_reads_expire_and_are_invalidated_by_writes()
+    print("✅ RPC结果缓存测试通过")
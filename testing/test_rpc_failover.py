@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试多RPC端点：对冲读取取最快的结果、出错时故障转移、写请求固定端点并安全重试、
+链ID不一致时拒绝启动
+"""
+
+import sys
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import pytest
+from web3 import Web3
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fault_proxy import FaultProxySet, Scenario
+from safe.rpc import FailoverProvider, FailoverSession, create_ethereum_client
+from test_fault_proxy import EchoRPC
+
+RAW_TX = "0x" + "ab" * 40
+
+
+def endpoints(stack: ExitStack, *rules_per_endpoint):
+    """每组规则一个故障代理，都转发到同一个EchoRPC，返回代理URL列表"""
+    upstream = stack.enter_context(EchoRPC())
+    return [
+        stack.enter_context(
+            FaultProxySet(Scenario({"upstreams": {"rpc": {}}, "rules": rules}), {"rpc": upstream})
+        ).urls["rpc"]
+        for rules in rules_per_endpoint
+    ]
+
+
+def health(session):
+    """按端点顺序返回 (成功次数, 失败次数)；代理在回复之后才记录请求，因此以客户端的统计为准"""
+    return [(item["successes"], item["failures"]) for item in session.health()]
+
+
+def test_hedged_reads_take_the_fastest_answer():
+    with ExitStack() as stack:
+        urls = endpoints(stack, [{"upstream": "rpc", "latency": 0.5}], [])
+        session = FailoverSession(urls)
+        w3 = Web3(FailoverProvider(session))
+        started = time.perf_counter()
+        assert w3.eth.chain_id == 1
+        assert w3.eth.call({"to": "0x" + "00" * 20}) == b"\x01"
+        # 慢端点排在第一位，但对冲请求同时发给两个端点，不需要等它返回
+        assert time.perf_counter() - started < 0.5
+        slow, fast = session.health()
+        assert slow["hedge_wins"] == 0 and fast["hedge_wins"] >= 2
+        # 有了延迟数据后快端点排在前面
+        assert session.ordered()[0] is session.endpoints[1]
+
+
+def test_reads_fail_over_and_failing_endpoints_cool_down():
+    with ExitStack() as stack:
+        urls = endpoints(stack, [{"upstream": "rpc", "fault": "status", "status": 503}], [])
+        session = FailoverSession(urls, hedge=1)
+        w3 = Web3(FailoverProvider(session))
+        # 端点还没有延迟数据时按配置顺序尝试，503后切换到第二个端点
+        assert w3.eth.block_number == 1
+        # 失败的端点暂停使用，后续请求直接发往健康的端点
+        assert w3.eth.gas_price == 1
+        assert health(session) == [(0, 1), (2, 0)]
+
+
+def test_writes_are_pinned_and_retried_on_the_same_endpoint():
+    with ExitStack() as stack:
+        already_known = {"jsonrpc": "2.0", "id": 0, "error": {"code": -32000, "message": "already known"}}
+        urls = endpoints(stack, [
+            # 第一次发送超时，但节点已经收到了交易；重发时回复already known
+            {"upstream": "rpc", "rpc_method": "eth_sendRawTransaction", "count": 1, "fault": "timeout", "hang": 1},
+            {"upstream": "rpc", "rpc_method": "eth_sendRawTransaction", "fault": "status", "status": 200,
+             "body": already_known},
+        ], [])
+        session = FailoverSession(urls, hedge=1)
+        w3 = Web3(FailoverProvider(session, timeout=0.3))
+        assert w3.eth.send_raw_transaction(RAW_TX) == Web3.keccak(hexstr=RAW_TX)
+        # 超时后在同一端点重发，没有发往第二个端点
+        assert session.pinned is session.endpoints[0]
+        assert health(session) == [(1, 1), (0, 0)]
+
+
+def test_writes_move_to_another_endpoint_after_retries():
+    with ExitStack() as stack:
+        urls = endpoints(stack, [{"upstream": "rpc", "fault": "status", "status": 502}], [])
+        session = FailoverSession(urls, hedge=1, write_retries=1)
+        w3 = Web3(FailoverProvider(session))
+        assert w3.eth.send_raw_transaction(RAW_TX) == b"\x01"
+        assert health(session) == [(0, 2), (1, 0)]
+        assert session.pinned is session.endpoints[1]
+
+
+def test_ethereum_client_uses_all_endpoints_and_checks_chain_id():
+    with ExitStack() as stack:
+        urls = endpoints(stack, [{"upstream": "rpc", "fault": "reset"}], [])
+        ethereum_client = create_ethereum_client(",".join(urls))
+        assert ethereum_client.w3.eth.chain_id == 1
+        # safe-eth-py直接发出的批量请求同样经过故障转移
+        session = ethereum_client.batch_call_manager.http_session
+        assert session is ethereum_client.http_session is ethereum_client.erc20.http_session
+        results = session.post(
+            urls[0], json=[{"jsonrpc": "2.0", "id": 1, "method": "eth_getBalance", "params": []}], timeout=5
+        ).json()
+        assert results[0]["result"] == "0x1"
+        assert health(session)[0][0] == 0
+
+    with ExitStack() as stack:
+        other_chain = {"jsonrpc": "2.0", "id": 1, "result": "0x5"}
+        urls = endpoints(stack, [], [{"upstream": "rpc", "rpc_method": "eth_chainId", "fault": "status",
+                                      "status": 200, "body": other_chain}])
+        with pytest.raises(ValueError, match="链ID不一致"):
+            create_ethereum_client(",".join(urls))
+
+
+if __name__ == "__main__":
+    test_hedged_reads_take_the_fastest_answer()
+    test_reads_fail_over_and_failing_endpoints_cool_down()
+    test_writes_are_pinned_and_retried_on_the_same_endpoint()
+    test_writes_move_to_another_endpoint_after_retries()
+    test_ethereum_client_uses_all_endpoints_and_checks_chain_id()
+    print("✅ 多RPC端点故障转移测试通过")
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试运行日志：每个阶段落盘，进程中断后从最后完成的阶段继续，
+续跑时不会重新构建、重复提议或重复执行
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from eth_account import Account
+
+from main import fetch_transactions
+from utils.journal import RunJournal, snapshot_hash
+from local_chain import build_local_chain, make_handler
+from notion.client import STATUS_EXECUTED
+from test_orchestrator import LocalOrchestrator, RecordingWriteback
+
+
+class CrashingOrchestrator(LocalOrchestrator):
+    """
+    每笔Safe交易拆成两笔转账，并在calls中累计处理器成功完成的调用（跨多次运行共用）；
+    crash_at为 "sign"/"propose"/"posted"/"execute" 时在对应位置模拟进程中断，
+    "broadcast" 在execTransaction广播之后、等到receipt之前中断，
+    "replaced" 在发送前由另一笔Safe交易（拒绝交易）用掉了同一个nonce
+    """
+
+    def __init__(self, ethereum_client, contracts, owners, calls, crash_at=None):
+        super().__init__(ethereum_client, contracts, owners)
+        self.calls = calls
+        self.crash_at = crash_at
+
+    def create_handler(self, network, safe_address):
+        handler = super().create_handler(network, safe_address)
+        handler.max_transfers_per_tx = 2
+        build_batches, sign, send = handler.build_batches, handler.sign_transaction, handler.send_execution
+        calls = self.calls
+
+        def crash(stage):
+            if self.crash_at == stage:
+                raise RuntimeError(f"模拟在{stage}时中断")
+
+        def counted_build(*args, **kwargs):
+            batch_txs = build_batches(*args, **kwargs)
+            calls["build"] += 1
+            return batch_txs
+
+        def counted_sign(tx):
+            crash("sign")
+            signature = sign(tx)
+            calls["sign"] += 1
+            return signature
+
+        def post(tx, signature):
+            crash("propose")
+            # 交易服务按safeTxHash去重，记录每次被接受的提议和nonce
+            assert tx["safe_tx_hash"] not in calls["posts"], "不应重复提议"
+            calls["posts"][tx["safe_tx_hash"]] = int(tx["nonce"])
+            crash("posted")
+            return tx["safe_tx_hash"]
+
+        def counted_send(tx, execution):
+            if self.crash_at == "broadcast":
+                handler.w3.eth.send_raw_transaction(execution["raw"])
+                crash("broadcast")
+            if self.crash_at == "replaced":
+                reject(handler, int(tx["nonce"]), self.owners)
+                crash("replaced")
+            tx_hash = send(tx, execution)
+            calls["execute"] += 1
+            crash("execute")
+            return tx_hash
+
+        handler.build_batches = counted_build
+        handler.sign_transaction = counted_sign
+        handler.propose_transaction = post
+        handler.is_proposed = lambda tx: tx["safe_tx_hash"] in calls["posts"]
+        handler.send_execution = counted_send
+        return handler
+
+
+def reject(handler, nonce, owners):
+    """执行一笔同nonce的拒绝交易（向Safe自身转0 ETH），用掉该nonce"""
+    safe_tx = handler.safe.build_multisig_tx(handler.safe_address, 0, b"", safe_nonce=nonce)
+    for owner in owners:
+        safe_tx.sign(owner.key.hex())
+    tx_hash, _ = safe_tx.execute(owners[0].key.hex())
+    handler.w3.eth.wait_for_transaction_receipt(tx_hash)
+
+
+def new_calls():
+    return {"build": 0, "sign": 0, "posts": {}, "execute": 0}
+
+
+def record_pages(journal, rows, page_size=2):
+    """把行按页写入运行日志，与逐页拉取Notion时的记录相同"""
+    digest = ""
+    for page, start in enumerate(range(0, len(rows), page_size)):
+        digest = snapshot_hash([digest, rows[start:start + page_size]])
+        journal.record("fetch", f"page-{page}", {
+            "rows": rows[start:start + page_size],
+            "next_cursor": None if start + page_size >= len(rows) else f"cursor-{page + 1}",
+            "snapshot_hash": digest,
+        })
+
+
+def prepared(journal, group_key):
+    """运行日志中已准备的Safe交易 {safeTxHash: nonce}"""
+    batches, index = {}, 0
+    while journal.get("prepare", f"{group_key}:{index}") is not None:
+        for batch_tx in journal.get("prepare", f"{group_key}:{index}"):
+            batches[batch_tx["safe_tx_hash"]] = int(batch_tx["nonce"])
+        index += 1
+    return batches
+
+
+def test_incomplete_run_is_resumed():
+    with tempfile.TemporaryDirectory() as journal_dir:
+        journal = RunJournal.open(journal_dir)
+        rows = [{"address": "0x0000000000000000000000000000000000000001", "amount": 1}]
+        journal.record("fetch", "notion", {"snapshot_hash": snapshot_hash(rows), "transactions": rows})
+        # 模拟写到一半时崩溃
+        with open(journal.path, "a") as f:
+            f.write('{"type": "stage", "stage": "prep')
+
+        resumed = RunJournal.open(journal_dir)
+        assert resumed.resumed and resumed.path == journal.path
+        assert resumed.get("fetch", "notion")["transactions"] == rows
+        assert not resumed.has_irreversible()
+        resumed.close("complete")
+
+        fresh = RunJournal.open(journal_dir)
+        assert not fresh.resumed and fresh.path != journal.path
+
+        # RESUME=false 时放弃未结束的运行
+        assert RunJournal.open(journal_dir, resume=False).path != fresh.path
+        assert RunJournal(fresh.path).status == "abandoned"
+
+
+def test_resumed_proposals_reuse_prepared_transactions():
+    ethereum_client, contracts, owners = build_local_chain(threshold=2)
+    rows = [{"address": Account.create().address, "amount": 1, "page_id": f"page-{i}"} for i in range(4)]
+    group_key = f"sepolia:{contracts['safe']}"
+
+    # 依次在准备之后、签名之后、提交被交易服务接受之后中断
+    for crash_at in ("sign", "propose", "posted"):
+        calls = new_calls()
+        with tempfile.TemporaryDirectory() as journal_dir:
+            journal = RunJournal.open(journal_dir)
+            record_pages(journal, rows)
+            orchestrator = CrashingOrchestrator(ethereum_client, contracts, owners[:1], calls, crash_at)
+            assert orchestrator.run(fetch_transactions(journal), journal)[0]["error"]
+            first = prepared(RunJournal(journal.path), group_key)
+            assert first
+
+            # 续跑：行从运行日志重放，不访问Notion
+            resumed = RunJournal.open(journal_dir)
+            assert resumed.resumed
+            orchestrator = CrashingOrchestrator(ethereum_client, contracts, owners[:1], calls)
+            results = orchestrator.run(fetch_transactions(resumed), resumed)
+            assert not results[0]["error"] and results[0]["count"] == 4
+
+            # 已准备的Safe交易不重新构建，签名和提议各只有一次，nonce与第一次运行分配的一致
+            batches = prepared(resumed, group_key)
+            assert all(batches[safe_tx_hash] == nonce for safe_tx_hash, nonce in first.items())
+            assert sorted(batches.values()) == [0, 1]
+            assert (calls["build"], calls["sign"]) == (2, 2)
+            assert calls["posts"] == batches
+            assert results[0]["tx_hashes"] == sorted(batches, key=batches.get)
+            assert all(resumed.get("propose", safe_tx_hash) for safe_tx_hash in batches)
+
+
+def test_resumed_execution_is_not_repeated():
+    ethereum_client, contracts, owners = build_local_chain(threshold=1)
+    rows = [{"address": Account.create().address, "amount": 1} for _ in range(4)]
+    calls = new_calls()
+
+    with tempfile.TemporaryDirectory() as journal_dir:
+        journal = RunJournal.open(journal_dir)
+        record_pages(journal, rows)
+        # 第一笔交易已上链，但进程在写入execute记录前中断
+        orchestrator = CrashingOrchestrator(ethereum_client, contracts, owners[:1], calls, "execute")
+        assert orchestrator.run(fetch_transactions(journal), journal)[0]["error"]
+        handler = make_handler(ethereum_client, contracts, owners)
+        assert handler.safe.retrieve_nonce() == 1
+
+        resumed = RunJournal.open(journal_dir)
+        orchestrator = CrashingOrchestrator(ethereum_client, contracts, owners[:1], calls)
+        results = orchestrator.run(fetch_transactions(resumed), resumed)
+        assert not results[0]["error"]
+        # 第一笔的nonce已使用，续跑时跳过，只执行第二笔
+        assert (calls["build"], calls["execute"]) == (2, 2)
+        assert handler.safe.retrieve_nonce() == 2
+        for row in rows:
+            assert handler.usdt_contract.functions.balanceOf(row["address"]).call() == 10**6
+
+
+def test_execution_interrupted_after_broadcast_is_reconciled():
+    ethereum_client, contracts, owners = build_local_chain(threshold=1)
+    rows = [{"address": Account.create().address, "amount": 1} for _ in range(2)]
+    calls = new_calls()
+    
+    with tempfile.TemporaryDirectory() as journal_dir:
+        journal = RunJournal.open(journal_dir)
+        record_pages(journal, rows)
+        # execTransaction已广播并上链，但进程在等到receipt之前中断
+        orchestrator = CrashingOrchestrator(ethereum_client, contracts, owners[:1], calls, "broadcast")
+        assert orchestrator.run(fetch_transactions(journal), journal)[0]["error"]
+        handler = make_handler(ethereum_client, contracts, owners)
+        assert handler.safe.retrieve_nonce() == 1
+        # 发送前写入的execute-intent使这次运行不会被放弃，下次运行续跑而不是重新开始
+        assert journal.has_irreversible()
+        
+        resumed = RunJournal.open(journal_dir)
+        assert resumed.resumed
+        orchestrator = CrashingOrchestrator(ethereum_client, contracts, owners[:1], calls)
+        orchestrator.writeback = RecordingWriteback()
+        results = orchestrator.run(fetch_transactions(resumed), resumed)
+        assert not results[0]["error"]
+        # 按execute-intent中的交易哈希在链上确认ExecutionSuccess，不重新执行
+        assert calls["execute"] == 0 and handler.safe.retrieve_nonce() == 1
+        assert results[0]["tx_hashes"] == [resumed.get("execute-intent", tx)["tx_hash"]
+                                           for tx in prepared(resumed, f"sepolia:{contracts['safe']}")]
+        assert all(fields["status"] == STATUS_EXECUTED for fields in orchestrator.writeback.submitted.values())
+        for row in rows:
+            assert handler.usdt_contract.functions.balanceOf(row["address"]).call() == 10**6
+
+
+def test_nonce_used_by_another_safe_tx_is_not_marked_executed():
+    ethereum_client, contracts, owners = build_local_chain(threshold=1)
+    rows = [{"address": Account.create().address, "amount": 1, "page_id": f"page-{i}"} for i in range(2)]
+    calls = new_calls()
+    
+    with tempfile.TemporaryDirectory() as journal_dir:
+        journal = RunJournal.open(journal_dir)
+        record_pages(journal, rows)
+        # 发送之前同一nonce被拒绝交易用掉，进程随后中断
+        orchestrator = CrashingOrchestrator(ethereum_client, contracts, owners[:1], calls, "replaced")
+        assert orchestrator.run(fetch_transactions(journal), journal)[0]["error"]
+        handler = make_handler(ethereum_client, contracts, owners)
+        assert handler.safe.retrieve_nonce() == 1
+        
+        resumed = RunJournal.open(journal_dir)
+        orchestrator = CrashingOrchestrator(ethereum_client, contracts, owners[:1], calls)
+        orchestrator.writeback = RecordingWriteback()
+        results = orchestrator.run(fetch_transactions(resumed), resumed)
+        # 链上没有该Safe交易的ExecutionSuccess，组失败，行不写回为已执行
+        assert "已被其他Safe交易使用" in results[0]["error"]
+        assert calls["execute"] == 0 and not orchestrator.writeback.submitted
+        for row in rows:
+            assert handler.usdt_contract.functions.balanceOf(row["address"]).call() == 0
+
+
+if __name__ == "__main__":
+    test_incomplete_run_is_resumed()
+    test_resumed_proposals_reuse_prepared_transactions()
+    test_resumed_execution_is_not_repeated()
+    test_execution_interrupted_after_broadcast_is_reconciled()
+    test_nonce_used_by_another_safe_tx_is_not_marked_executed()
+    print("运行日志测试通过")
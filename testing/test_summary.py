@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试转账汇总：精确合计、前N笔、逐行明细文件
+"""
+
+import json
+import sys
+import tempfile
+import threading
+from decimal import Decimal
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from utils.summary import TransferSummary
+
+
+def test_totals_and_top_n():
+    summary = TransferSummary(top_n=3, detail_file="")
+    amounts = [0.1, 0.2, 5, 1.5, 7.25, 3]
+    for i, amount in enumerate(amounts):
+        summary.add(f"0x{i:040x}", amount, network="sepolia", page_id=f"page-{i}")
+    summary.add("0x" + "f" * 40, 2, network="mainnet")
+
+    assert summary.count == 7
+    # 十进制累加，没有浮点误差
+    assert summary.totals[("sepolia", "USDT")] == Decimal("17.05")
+    assert summary.counts[("mainnet", "USDT")] == 1
+    assert [entry["amount"] for entry in summary.top()] == [7.25, 5, 3]
+    assert summary.top()[0]["page_id"] == "page-4"
+
+
+def test_concurrent_adds():
+    summary = TransferSummary(top_n=5, detail_file="")
+
+    def work():
+        for _ in range(500):
+            summary.add("0x" + "1" * 40, 1)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert summary.count == 4000
+    assert summary.totals[("", "USDT")] == 4000
+    assert len(summary.top()) == 5
+
+
+def test_detail_file_only_when_requested():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        detail_file = Path(temp_dir) / "details" / "transfers.jsonl"
+        summary = TransferSummary(detail_file=str(detail_file))
+        summary.add("0x" + "a" * 40, 1.5, network="sepolia", safe="0xSafe", page_id="page-1", address="alice.eth")
+        summary.add("0x" + "b" * 40, 2, page_id="page-2")
+        summary.log()
+
+        rows = [json.loads(line) for line in detail_file.read_text().splitlines()]
+        assert rows[0] == {"page_id": "page-1", "address": "alice.eth", "to": "0x" + "a" * 40, "amount": 1.5,
+                           "token": "USDT", "network": "sepolia", "safe": "0xSafe"}
+        assert rows[1]["address"] == rows[1]["to"]
+
+        quiet = TransferSummary(detail_file="")
+        quiet.add("0x" + "a" * 40, 1)
+        quiet.log()
+        assert sorted(path.name for path in detail_file.parent.iterdir()) == ["transfers.jsonl"]
+
+
+if __name__ == "__main__":
+    test_totals_and_top_n()
+    test_concurrent_adds()
+    test_detail_file_only_when_requested()
+    print("✅ 转账汇总测试通过")